@@ -2,7 +2,7 @@
 import os as _os
 from flask_migrate import migrate
 
-from app.payments.pricing import number_to_words, price_cents_for
+from app.payments.pricing import number_to_words, price_cents_for, price_table_for
 from app.bootstrap.subjects import ensure_core_subjects
 try:
     from dotenv import load_dotenv
@@ -29,7 +29,9 @@ from os import getenv
 import os  # sqlite3 no longer needed
 import click
 from hashlib import sha256
-from app.models.visit import VisitLog
+from app.models import visit as _visit_models  # noqa: F401  (registers visit_log for db.create_all)
+from app.services.hit_buffer import hit_buffer
+from app.services.pdf_render_pool import pdf_render_pool
 from app.models.payment import Payment, Subscription
 from werkzeug.middleware.proxy_fix import ProxyFix
 from dotenv import load_dotenv, find_dotenv
@@ -66,6 +68,8 @@ def create_app():
     mail.init_app(app)
     login_manager.init_app(app)
     login_manager.login_view = "auth_bp.login"
+    hit_buffer.init_app(app)
+    pdf_render_pool.init_app(app)
 
     # ⬇ add this near the end of create_app, before `return app`
     with app.app_context():
@@ -120,22 +124,12 @@ def create_app():
 
         ua = (request.headers.get("User-Agent") or "")[:255]
 
-        try:
-            db.session.execute(
-                sa_text("""
-                    INSERT INTO site_hit (path, user_id, is_auth, user_agent)
-                    VALUES (:path, :uid, :authd, :ua)
-                """),
-                {"path": request.path, "uid": uid, "authd": authd, "ua": ua},
-            )
-            db.session.commit()
-        except Exception:
-            # don’t break the site if logging fails
-            db.session.rollback()
+        # buffered: flushed in batches by the hit_buffer thread
+        hit_buffer.enqueue("site_hit", {"path": request.path, "uid": uid, "authd": authd, "ua": ua})
 
     @app.context_processor
     def _inject_helpers():
-        return dict(price_cents_for=price_cents_for)
+        return dict(price_cents_for=price_cents_for, price_table_for=price_table_for)
 
     @login_manager.user_loader
     def load_user(user_id: str):
@@ -261,6 +255,20 @@ def create_app():
         print("OK: fx_to_zar column ensured on ref_country_currency")
 
 
+    @app.cli.command("fx-refresh")
+    @click.option("--provider", default=None, help="Rate provider name (default: FX_PROVIDER).")
+    def fx_refresh_cmd(provider):
+        """Fetch all FX rates in one call and update ref_country_currency.fx_to_zar (cron)."""
+        from app.services.fx_rates import PROVIDERS, refresh_fx_rates
+
+        if provider and provider not in PROVIDERS:
+            raise click.BadParameter(f"unknown provider; choose from {', '.join(PROVIDERS)}")
+        stats = refresh_fx_rates(PROVIDERS[provider]() if provider else None)
+        click.echo(f"OK: {stats['updated']} currencies updated")
+        if stats["missing"]:
+            click.echo("No rate for: " + ", ".join(stats["missing"]))
+
+
     @app.before_request
     def _trace_in():
         g.reqid = str(uuid.uuid4())[:8]
@@ -295,10 +303,9 @@ def create_app():
             ua = (request.user_agent.string or "")[:250]
             uid = getattr(current_user, "id", None)
             path = (request.path or "")[:250]
-            db.session.add(VisitLog(path=path, user_id=uid, ip_hash=ip_hash, ua=ua))
-            db.session.commit()
+            hit_buffer.enqueue("visit_log", {"path": path, "user_id": uid, "ip_hash": ip_hash, "ua": ua})
         except Exception:
-            db.session.rollback()
+            pass
        
     def _flag_welcome_redirect(resp):
         # Keep this merged with the other after_request if you prefer; I’m separating for clarity.
@@ -428,6 +435,38 @@ def create_app():
         db.session.execute(sa_text(sql))
         db.session.commit()
 
+        # reading index + month list on databases that predate them (consumption index: check only)
+        from app.utils.consumption_engine import ensure_consumption_schema
+        ensure_consumption_schema()
+
+        # one lca_response row per (run, question) for batched answer upserts (check only)
+        from app.subject_loss.answer_capture import ensure_response_schema
+        ensure_response_schema()
+
+        # SMS cashbook totals on databases that predate sms_fin_agg
+        from app.subject_sms.finance_agg import ensure_fin_agg
+        ensure_fin_agg()
+
+        # SMS sequence-audit book index
+        from app.subject_sms.audit_engine import ensure_audit_schema
+        ensure_audit_schema()
+
+        # tenant ledger (tenant_id, txn_date, id) index + balance checkpoints
+        from app.utils.ledger_engine import ensure_ledger_schema
+        ensure_ledger_schema()
+
+        # one auto-posted rent / recurring row per (tenant, month, ref)
+        from app.jobs.month_posting import ensure_posting_schema
+        ensure_posting_schema()
+
+        # muni reconciliation: persisted unmatched set per session
+        from app.utils.recon_engine import ensure_recon_schema
+        ensure_recon_schema()
+
+        # LOSS report content, loaded once per worker
+        from app.admin.loss.content_store import preload_loss_content
+        preload_loss_content()
+
     @app.route("/__routes")
     def __routes():
         return "<br>".join(sorted(f"{r.endpoint} → {r.rule}" for r in app.url_map.iter_rules()))
@@ -471,6 +510,248 @@ def create_app():
         """Run BudgetCash daily jobs (purge/reminders)."""
         run_budgetcash_daily_jobs()
         click.echo("OK: budgetcash-daily done")
+
+    @app.cli.command("loss-response-index")
+    def loss_response_index_cmd():
+        """One-off: collapse duplicate lca_response rows and build the (run_id, question_id) index."""
+        from app.subject_loss.answer_capture import build_response_index, has_response_index
+
+        if has_response_index():
+            click.echo("OK: ux_lca_response_run_question already present")
+            return
+        n = build_response_index()
+        click.echo(f"OK: {n} duplicate lca_response rows removed, ux_lca_response_run_question built")
+
+    @app.cli.command("consumption-index")
+    @click.option("--dry-run", is_flag=True, help="List the duplicate (meter, month) rows; delete nothing.")
+    def consumption_index_cmd(dry_run):
+        """One-off: collapse duplicate bil_consumption rows and build the (meter_id, month) index."""
+        from app.utils.consumption_engine import build_consumption_index, has_consumption_index
+
+        if has_consumption_index():
+            click.echo("OK: uq_bil_consumption_meter_month already present")
+            return
+        dupes = build_consumption_index(dry_run=dry_run)
+        verb = "would be removed" if dry_run else "removed"
+        for d in dupes:
+            click.echo(f"  meter {d['meter_id']} {d['month']}: {d['n'] - 1} older row(s) {verb}, kept id {d['keep_id']}")
+        removed = sum(d["n"] - 1 for d in dupes)
+        if dry_run:
+            click.echo(f"DRY RUN: {removed} duplicate bil_consumption rows would be removed")
+        else:
+            click.echo(f"OK: {removed} duplicate bil_consumption rows removed, uq_bil_consumption_meter_month built")
+
+    @app.cli.command("loss-rebuild")
+    @click.option("--user-id", type=int, default=None, help="Only runs of this user.")
+    @click.option("--status", default=None, help="Only runs with this lca_run.status (e.g. finished).")
+    @click.option("--from-id", type=int, default=None, help="Lowest run id.")
+    @click.option("--to-id", type=int, default=None, help="Highest run id.")
+    @click.option("--existing-only", is_flag=True, help="Only runs that already have an lca_result row.")
+    @click.option("--chunk", type=int, default=500, show_default=True, help="Runs per chunk/transaction.")
+    @click.option("--resume", "resume_id", type=int, default=None, help="Resume this job id.")
+    @click.option("--resume-last", is_flag=True, help="Resume the latest unfinished job.")
+    def loss_rebuild_cmd(user_id, status, from_id, to_id, existing_only, chunk, resume_id, resume_last):
+        """Recompute lca_result in chunks (resumable)."""
+        from app.jobs.loss_rebuild import create_job, latest_unfinished_job, run_job
+
+        if resume_last and not resume_id:
+            job = latest_unfinished_job()
+            if not job:
+                click.echo("No unfinished loss-rebuild job.")
+                return
+            resume_id = job.id
+
+        job_id = resume_id or create_job(
+            {"user_id": user_id, "status": status, "from_id": from_id,
+             "to_id": to_id, "existing_only": existing_only},
+            chunk_size=chunk,
+        )
+        click.echo(f"loss-rebuild job {job_id}")
+
+        def _progress(st, rate):
+            click.echo(f"  {st['done']}/{st['total']} runs ({st['pct']}%), "
+                       f"{st['written']} written, last run {st['last_run_id']}, {rate:.0f} runs/s")
+
+        st = run_job(job_id, progress=_progress)
+        click.echo(f"OK: job {job_id} {st['status']} – {st['done']} runs, {st['written']} results written")
+
+    @app.cli.command("loss-content")
+    @click.option("--reload", "do_reload", is_flag=True, help="Rebuild the snapshot from the database first.")
+    def loss_content_cmd(do_reload):
+        """Show (or reload) the in-memory LOSS report content snapshot."""
+        from app.admin.loss.content_store import get_loss_content, loss_content_info, reload_loss_content
+
+        reload_loss_content() if do_reload else get_loss_content()
+        for k, v in loss_content_info().items():
+            click.echo(f"  {k}: {v}")
+
+    @app.cli.command("sms-fin-agg")
+    @click.option("--school-id", type=int, default=None, help="Only this school (default: all).")
+    def sms_fin_agg_cmd(school_id):
+        """Rebuild the SMS cashbook totals (sms_fin_agg) from sms_fin_txn."""
+        from app.subject_sms.finance_agg import rebuild_fin_agg
+
+        n = rebuild_fin_agg(school_id)
+        click.echo(f"OK: {n} sms_fin_agg rows")
+
+    @app.cli.command("reading-transcode")
+    @click.option("--force", is_flag=True, help="Re-encode even when renditions are current.")
+    @click.argument("files", nargs=-1)
+    def reading_transcode_cmd(force, files):
+        """Faststart MP4 + HLS renditions for the reading lesson videos (needs ffmpeg)."""
+        import os
+        from app.scripts.transcode_hls import transcode_folder
+
+        folder = os.path.join(app.static_folder, "reading_videos")
+        written = transcode_folder(folder, list(files) or None, force=force)
+        click.echo(f"OK: {len(written)} lesson(s) transcoded")
+
+    @app.cli.command("sms-audit")
+    @click.option("--school-id", type=int, default=None, help="Only this school (default: all).")
+    @click.option("--full", is_flag=True, help="Ignore checkpoints and re-audit every book from the start.")
+    def sms_audit_cmd(school_id, full):
+        """Bring the SMS receipt / voucher / EFT sequence audit up to date."""
+        from app.models.sms import SmsSchool
+        from app.subject_sms.audit_engine import run_audit
+
+        ids = [school_id] if school_id else [s.id for s in SmsSchool.query.order_by(SmsSchool.id).all()]
+        for sid in ids:
+            stats = run_audit(sid, full=full)
+            found = sum(b["new_findings"] for b in stats.values())
+            click.echo(f"school {sid}: {found} new findings")
+
+    @app.cli.command("ledger-checkpoints")
+    @click.option("--tenant-id", type=int, default=None, help="Only this tenant (default: all).")
+    def ledger_checkpoints_cmd(tenant_id):
+        """Drop and rebuild the tenant ledger balance checkpoints."""
+        from app.utils.ledger_engine import rebuild_checkpoints
+
+        n = rebuild_checkpoints(tenant_id)
+        click.echo(f"OK: {n} bil_ledger_checkpoint rows")
+
+    @app.cli.command("month-post")
+    @click.option("--month", required=True, help="Month to post, YYYY-MM.")
+    @click.option("--tenant-id", "tenant_ids", type=int, multiple=True, help="Only these tenants (repeatable).")
+    @click.option("--dry-run", is_flag=True, help="List the rows that would be posted; write nothing.")
+    def month_post_cmd(month, tenant_ids, dry_run):
+        """Post rent and recurring charges for every tenant of a month."""
+        from app.jobs.month_posting import post_month
+
+        res = post_month(month[:7], tenant_ids=list(tenant_ids) or None, dry_run=dry_run)
+        for r in res.get("rows", ()):
+            click.echo(f"  {r['source']:<9} tenant {r['tenant_id']} {r['txn_date']} "
+                       f"{r['description']}: {float(r['amount'] or 0):.2f}")
+        click.echo(f"{'DRY RUN' if dry_run else 'OK'}: {res['month']} – rent {res.get('rent', 0)}, "
+                   f"recurring {res.get('recurring', 0)}, {res['posted']} rows")
+
+    @app.cli.command("muni-recon")
+    @click.option("--from", "start", required=True, help="First month, YYYY-MM.")
+    @click.option("--to", "end", default=None, help="Last month, YYYY-MM (default: --from).")
+    @click.option("--days", type=int, default=3, show_default=True, help="Date window for amount / split rules.")
+    @click.option("--rule", "rules", multiple=True, type=click.Choice(["ref", "window", "split", "amount"]),
+                  help="Rules to run, in order (repeatable; default: all).")
+    @click.option("--dry-run", is_flag=True, help="List the matches; write nothing.")
+    def muni_recon_cmd(start, end, days, rules, dry_run):
+        """Reconcile bank lines against receipts for one or many months in one pass."""
+        from app.utils.recon_engine import DEFAULT_RULES, make_rules, month_bounds, reconcile
+
+        date_from, date_to = month_bounds(start[:7])[0], month_bounds((end or start)[:7])[1]
+        res = reconcile(date_from, date_to, rules=make_rules(rules or DEFAULT_RULES, days), dry_run=dry_run)
+        for m in res.get("matches", ()):
+            click.echo(f"  {m.rule:<22} {m.left.txn_date} #{m.left.id} <-> {m.right.txn_date} #{m.right.id}: "
+                       f"{m.cents / 100:.2f}")
+        for rule, n in res["by_rule"].items():
+            click.echo(f"  {rule}: {n}")
+        click.echo(f"{'DRY RUN' if dry_run else 'OK'}: {date_from}..{date_to} – {res['sessions']} sessions, "
+                   f"{res['matched']} match rows ({res['dropped']} refused by muni_recon_match); unmatched {res['unmatched_left']} left, "
+                   f"{res['unmatched_right']} right")
+
+    @app.cli.command("metsoa-batch")
+    @click.option("--month", required=True, help="Statement month, YYYY-MM.")
+    @click.option("--tenant-id", "tenant_ids", type=int, multiple=True, help="Only these tenants (repeatable).")
+    @click.option("--dry-run", is_flag=True, help="Compute and diff against stored statements; write nothing.")
+    @click.option("--workers", type=int, default=1, show_default=True, help="Processes for the compute step.")
+    @click.option("--batch", "batch_size", type=int, default=200, show_default=True, help="Tenants per transaction.")
+    @click.option("--post-ledger", is_flag=True, help="Also upsert the 'Due to Metro' ledger charge.")
+    @click.option("--breakdown", is_flag=True, help="Also rewrite bil_metsoa_breakdown lines.")
+    def metsoa_batch_cmd(month, tenant_ids, dry_run, workers, batch_size, post_ledger, breakdown):
+        """Build METSOA statements for every tenant of a month."""
+        from app.jobs.metsoa_batch import run_month
+
+        def _progress(done, total):
+            click.echo(f"  {done}/{total} tenants")
+
+        res = run_month(month[:7], tenant_ids=list(tenant_ids) or None, dry_run=dry_run,
+                        workers=workers, batch_size=batch_size, post_ledger=post_ledger,
+                        breakdown=breakdown, progress=None if dry_run else _progress)
+        if dry_run:
+            for d in res["diff"]:
+                click.echo(f"  {d['status']:<7} tenant {d['tenant_id']} meter {d['meter_id']} "
+                           f"{d['field']}: {d['old']} -> {d['new']}")
+        click.echo(f"{'DRY RUN' if dry_run else 'OK'}: {res['month']} – {res['tenants']} tenants, "
+                   f"{res['meters']} meters, due to Metro {res['due_to_metro']:.2f} "
+                   f"(load {res['load_s']}s, compute {res['compute_s']}s, total {res['total_s']}s)"
+                   + (f", {len(res['diff'])} differences" if dry_run else ""))
+
+    @app.cli.command("consumption-build")
+    @click.option("--month", "months", required=True, multiple=True, help="YYYY-MM (repeatable).")
+    def consumption_build_cmd(months):
+        """Rebuild bil_consumption for the given month(s) from meter readings."""
+        from app.utils.consumption_engine import populate_consumption, refresh_reading_months
+
+        for m in months:
+            n = populate_consumption(m[:7])
+            click.echo(f"  {m[:7]}: {n} meters")
+        click.echo(f"OK: bil_consumption rebuilt; {refresh_reading_months()} reading months listed")
+
+    @app.cli.command("consumption-backfill")
+    @click.option("--month", "months", multiple=True, help="YYYY-MM (repeatable).")
+    @click.option("--from", "start", default=None, help="First month of a range, YYYY-MM.")
+    @click.option("--to", "end", default=None, help="Last month of a range, YYYY-MM (default: --from).")
+    @click.option("--dry-run", is_flag=True, help="Report only; write nothing.")
+    def consumption_backfill_cmd(months, start, end, dry_run):
+        """Pair meter readings (LAG) into bil_consumption for one or many months and list anomalies."""
+        from app.utils.consumption_engine import build_consumption, month_span
+
+        wanted = set(m[:7] for m in months)
+        if start:
+            wanted.update(month_span(start[:7], (end or start)[:7]))
+        if not wanted:
+            raise click.UsageError("Give --month and/or --from [--to].")
+
+        res = build_consumption(sorted(wanted), dry_run=dry_run)
+        for a in res["anomalies"]:
+            if a["type"] != "no_reading":
+                click.echo(f"  {a['month']} meter {a['meter_number'] or a['meter_id']}: {a['type']}")
+        missing = sum(1 for a in res["anomalies"] if a["type"] == "no_reading")
+        for m, n in res["written"].items():
+            click.echo(f"  {m}: {n} meters")
+        click.echo(f"{'DRY RUN' if dry_run else 'OK'}: {len(res['rows'])} consumption rows, "
+                   f"{len(res['anomalies']) - missing} anomalies, {missing} meter-months without a reading")
+
+    @app.cli.command("tier-bench")
+    @click.option("--meters", type=int, default=10000, show_default=True, help="Random meters to allocate.")
+    @click.option("--repeat", type=int, default=5, show_default=True, help="Best of N runs.")
+    def tier_bench_cmd(meters, repeat):
+        """Benchmark the vectorized tier kernel against the per-meter loop."""
+        from app.utils.tier_kernel import benchmark
+
+        r = benchmark(meters, repeat)
+        click.echo(f"{r['meters']} meters: loop {r['loop_ms']} ms, kernel {r['kernel_ms']} ms "
+                   f"({r['speedup']}x), max |diff| {r['max_abs_diff']:.2e}")
+
+    @app.cli.command("pdf-worker")
+    @click.option("--workers", type=int, default=None, help="Override PDF_RENDER_WORKERS.")
+    def pdf_worker_cmd(workers):
+        """Render queued report PDFs (use with PDF_RENDER_POOL=external)."""
+        if workers:
+            pdf_render_pool.workers = max(1, workers)
+        click.echo(f"pdf-worker: {pdf_render_pool.workers} workers on {pdf_render_pool.root} (Ctrl+C to stop)")
+        try:
+            pdf_render_pool.run_forever()
+        except KeyboardInterrupt:
+            pdf_render_pool.stop()
+        click.echo("OK: pdf-worker stopped")
                         
     return app
 
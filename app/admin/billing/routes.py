@@ -3,14 +3,14 @@
 from flask import (
     Blueprint, render_template_string, send_file, current_app, render_template, 
     request, redirect, session, url_for, flash, 
-    Response, abort, 
-    make_response)
+    abort, 
+    make_response, jsonify)
 from app.extensions import db
 from app.models.billing import (
     BilLease, BilMeterFixedCharge, BilTenant, BilMeter, BilMeterReading,
     BilSectionalUnit)
 from datetime import datetime, date, timedelta
-from sqlalchemy import and_, func, select, text, or_
+from sqlalchemy import and_, select, text, or_
 from app.auth.forms import LoginForm
 from app.admin.billing.water import (
     get_consumption_rows_for_month,_month_bounds,
@@ -22,13 +22,16 @@ from app.utils.billing_map import compute_electricity_due
 from app.utils.billing_metsoa import build_metsoa_page2_groups
 from app.utils.billing_metsoa_builder import build_metsoa_payload
 from app.utils.billing_persist import commit_metsoa_for_month
+from app.utils.consumption_engine import month_consumption, reading_months
+from app.utils.export_stream import CHUNK_ROWS, csv_response, iter_csv, iter_query, zip_response
+from app.utils.recon_engine import DEFAULT_DAYS, month_bounds, reconcile, unmatched
+from app.utils.tariff_index import get_tariff_index, invalidate_tariffs, tariff_index_info
 from .. import admin_bp
-import calendar
 from sqlalchemy.exc import SQLAlchemyError, IntegrityError, OperationalError
-import io, csv, zipfile, re
+import io, csv, re
 from decimal import Decimal, InvalidOperation
 from app.admin.billing.electric import upsert_electricity_line  # <- the helper above
-from sqlalchemy.orm import joinedload
+from sqlalchemy.orm import contains_eager, joinedload
 from io import BytesIO
 #from weasyprint import HTML
 
@@ -49,6 +52,14 @@ def billing_meters():
 def billing_tariffs():
     return render_template("admin/billing/tariffs.html")
 
+@admin_bp.get("/billing/tariffs/index", endpoint="billing_tariff_index")
+def billing_tariff_index():
+    """State of the cached tariff index (this worker); ?reload=1 forces a reload."""
+    if request.args.get("reload"):
+        invalidate_tariffs()
+        get_tariff_index(force=True)
+    return jsonify(tariff_index_info())
+
 @admin_bp.route("/billing/invoices", endpoint="billing_invoices")
 def billing_invoices():
     return render_template("admin/billing/invoices.html")
@@ -89,12 +100,8 @@ def readings_create():
 def readings_view():
     tenants = BilTenant.query.order_by(BilTenant.name).all()
 
-    # Distinct months present in readings, newest first (SQLite strftime)
-    month_rows = (db.session.query(func.strftime('%Y-%m', BilMeterReading.reading_date))
-                  .distinct()
-                  .order_by(func.strftime('%Y-%m', BilMeterReading.reading_date).desc())
-                  .all())
-    months = [m[0] for m in month_rows]
+    # Months present in readings, newest first
+    months = reading_months()
 
     tenant_id = request.args.get("tenant_id", type=int)
     month = request.args.get("month")  # "YYYY-MM"
@@ -155,20 +162,22 @@ def readings_export():
     if to_date:
         q = q.filter(BilMeterReading.reading_date <= to_date)
 
-    rows = q.order_by(BilMeterReading.meter_id, BilMeterReading.reading_date).all()
+    q = q.order_by(BilMeterReading.meter_id, BilMeterReading.reading_date)
 
     if 'csv' in formats:
-        import csv, io
-        buf = io.StringIO()
-        w = csv.writer(buf)
-        w.writerow(['meter_id','meter_name','reading_date','reading_value'])
-        for r in rows:
-            w.writerow([r.meter_id, r.meter.display_name or f"Meter #{r.meter_id}",
-                        r.reading_date.isoformat(), r.reading_value])
-        return Response(buf.getvalue(),
-                        mimetype='text/csv',
-                        headers={'Content-Disposition': 'attachment; filename=readings.csv'})
+        # meter label comes from the join (no per-row r.meter load), rows are
+        # fetched in chunks and written out as they arrive
+        rows = (q.with_entities(BilMeterReading.meter_id, BilMeter.meter_number,
+                                BilMeterReading.reading_date, BilMeterReading.reading_value)
+                 .execution_options(stream_results=True)
+                 .yield_per(CHUNK_ROWS))
+        return csv_response(
+            iter_csv(((mid, num or f"Meter #{mid}", d.isoformat(), v) for mid, num, d, v in rows),
+                     ['meter_id', 'meter_name', 'reading_date', 'reading_value']),
+            "readings.csv",
+        )
 
+    rows = q.options(contains_eager(BilMeterReading.meter)).all()
     return render_template("aadmin_bp/billing/readings_export.html", rows=rows)
 
 # --- Overview: just 4 buttons ---
@@ -268,9 +277,7 @@ def readings_enter():
 def readings_consumption():
     # Dropdown data
     tenants = BilTenant.query.order_by(BilTenant.name).all()
-    # Build YYYY-MM list from existing readings without needing sqlalchemy.func
-    month_rows = db.session.query(BilMeterReading.reading_date).distinct().all()
-    months = sorted({d[0].strftime("%Y-%m") for d in month_rows if d[0]}, reverse=True)
+    months = reading_months()
 
     tenant_id = request.args.get("tenant_id", type=int)
     month = request.args.get("month")  # "YYYY-MM"
@@ -278,60 +285,9 @@ def readings_consumption():
     rows = []
     tenant = BilTenant.query.get(tenant_id) if tenant_id else None
 
-    def _month_range(ym):
-        y, m = map(int, ym.split("-"))
-        first = date(y, m, 1)
-        # next month first
-        next_first = date(y + (m == 12), (m % 12) + 1, 1)
-        last = next_first - timedelta(days=1)
-        return first, last
-
-    def _latest_in_range(meter_id, start_dt, end_dt):
-        return (BilMeterReading.query
-                .filter(BilMeterReading.meter_id == meter_id,
-                        BilMeterReading.reading_date >= start_dt,
-                        BilMeterReading.reading_date <= end_dt)
-                .order_by(BilMeterReading.reading_date.desc())
-                .first())
-
     if tenant and month:
-        curr_first, curr_last = _month_range(month)
-        # previous month
-        prev_last_day = curr_first - timedelta(days=1)
-        prev_first = prev_last_day.replace(day=1)
-
-        # Meters for tenant (supports tenant_id OR sectional_unit_id schema)
-        if hasattr(BilMeter, "tenant_id"):
-            meters = (BilMeter.query
-                      .filter_by(tenant_id=tenant.id)
-                      .order_by(BilMeter.id).all())
-        elif hasattr(BilMeter, "sectional_unit_id") and hasattr(tenant, "sectional_unit_id"):
-            meters = (BilMeter.query
-                      .filter_by(sectional_unit_id=tenant.sectional_unit_id)
-                      .order_by(BilMeter.id).all())
-        else:
-            meters = []
-
-        for m in meters:
-            curr = _latest_in_range(m.id, curr_first, curr_last)
-            prev = _latest_in_range(m.id, prev_first, prev_last_day)
-
-            if curr and prev:
-                cons = int(curr.reading_value) - int(prev.reading_value)
-                days = (curr.reading_date - prev.reading_date).days
-            else:
-                cons = None
-                days = None
-
-            rows.append({
-                "meter_label": (m.meter_number or getattr(m, "display_name", None) or f"Meter #{m.id}"),
-                "prev_date": prev.reading_date if prev else None,
-                "prev_value": int(prev.reading_value) if prev else None,
-                "curr_date": curr.reading_date if curr else None,
-                "curr_value": int(curr.reading_value) if curr else None,
-                "days": days,
-                "consumption": cons,
-            })
+        # all meters of the tenant's unit in one window query
+        rows = month_consumption(month, tenant_id=tenant.id)
 
     return render_template(
     "admin/billing/readings_consumption.html",
@@ -768,42 +724,26 @@ def tenant_soa():
 
     tenant = db.session.get(BilTenant, tenant_id)
 
-    # Pull ledger rows
-    if start and end:
-        rows = db.session.execute(text("""
-          SELECT txn_date, month, description, kind, amount, ref
-          FROM bil_tenant_ledger
-          WHERE tenant_id=:t AND date(txn_date) BETWEEN date(:s) AND date(:e)
-          ORDER BY date(txn_date), id
-        """), {"t": tenant_id, "s": start, "e": end}).mappings().all()
-    else:
-        rows = db.session.execute(text("""
-          SELECT txn_date, month, description, kind, amount, ref
-          FROM bil_tenant_ledger
-          WHERE tenant_id=:t
-          ORDER BY date(txn_date), id
-        """), {"t": tenant_id}).mappings().all()
-
-    # Running balance in Python (charges +, payments -)
-    running = 0.0
-    out = []
-    for r in rows:
-        amt = float(r["amount"] or 0.0)
-        running += amt
-        out.append({
-            "date": r["txn_date"],
-            "month": r["month"],
-            "description": r["description"],
-            "kind": r["kind"],
-            "amount": amt,
-            "ref": r["ref"],
-            "balance": round(running, 2),
-        })
+    # One keyset page; balances carry on from the ledger checkpoints (charges +, payments -)
+    from app.utils.ledger_engine import SOA_PAGE_SIZE, ledger_page
+    page = ledger_page(tenant_id, start=start, end=end,
+                       after=request.args.get("after"), before=request.args.get("before"),
+                       limit=SOA_PAGE_SIZE)
+    out = [{
+        "date": r["txn_date"],
+        "month": r["month"],
+        "description": r["description"],
+        "kind": r["kind"],
+        "amount": r["amount"],
+        "ref": r["ref"],
+        "balance": r["balance"],
+    } for r in page.rows]
 
     return render_template(
         "admin/billing/tenant_soa.html",
         tenant=tenant,
         rows=out,
+        page=page,
         start=start,
         end=end,
         month=month,          # <-- add this
@@ -922,92 +862,34 @@ def _first_of(month_str: str) -> str:
 def _ensure_month_charges(tenant_id: int, month: str):
     """
     Auto-posts rent (if scheduled) and any active recurring items for this month.
-    Idempotent: uses NOT EXISTS/UNIQUE so you won’t get duplicates.
+    Idempotent: the month-end posting engine skips rows already posted.
     """
+    from app.jobs.month_posting import post_month
+    return post_month(month, tenant_ids=[tenant_id])
 
-    # 1) Rent (from bil_rent_schedule if present)
-    db.session.execute(text("""
-        INSERT INTO bil_tenant_ledger
-          (tenant_id, month, txn_date, description, kind, amount, created_at)
-        SELECT
-          :tid, :mon, date(:mon || '-01'), 'Rent', 'charge', rs.amount, datetime('now')
-        FROM bil_rent_schedule rs
-        WHERE rs.tenant_id = :tid
-          AND rs.month     = :mon
-          AND rs.amount    > 0
-          AND NOT EXISTS (
-                SELECT 1 FROM bil_tenant_ledger
-                WHERE tenant_id=:tid AND month=:mon
-                  AND description='Rent' AND kind='charge'
-          );
-    """), {"tid": tenant_id, "mon": month})
-
-    # Optional: mark the plan as posted
-    db.session.execute(text("""
-        UPDATE bil_rent_schedule
-        SET is_posted = 1
-        WHERE tenant_id=:tid AND month=:mon;
-    """), {"tid": tenant_id, "mon": month})
-
-    # 2) Recurring / Sundry active items windowed to this month
-    db.session.execute(text("""
-        INSERT INTO bil_tenant_ledger
-          (tenant_id, month, txn_date, description, kind, amount, created_at)
-        SELECT
-          :tid,
-          :mon,
-          date(:mon || '-' || printf('%02d', COALESCE(NULLIF(ri.day_of_month,0),1))),
-          ri.description,
-          ri.kind,
-          CASE WHEN ri.kind='credit' THEN -ABS(ri.amount) ELSE ABS(ri.amount) END,
-          datetime('now')
-        FROM bil_recurring_item ri
-        WHERE ri.tenant_id = :tid
-          AND ri.is_active = 1
-          AND ri.start_month <= :mon
-          AND (ri.end_month IS NULL OR ri.end_month >= :mon)
-          AND NOT EXISTS (
-              SELECT 1 FROM bil_tenant_ledger l
-              WHERE l.tenant_id=:tid AND l.month=:mon
-                AND l.description = ri.description
-                AND l.kind        = ri.kind
-          );
-    """), {"tid": tenant_id, "mon": month})
-
-    db.session.commit()
 
+def _fetch_ledger_view(tenant_id: int, after: str | None = None, before: str | None = None):
+    # One page of rows already transformed for the template (newest page by default),
+    # the closing balance and the page (cursors for the pager)
+    from app.utils.ledger_engine import closing_balance, ledger_page
 
-def _fetch_ledger_view(tenant_id: int):
-    # Return rows already transformed for the template
-    q = db.session.execute(text("""
-        SELECT
-          id,
-          txn_date,
-          description,
-          kind,
-          amount,
-          ref
-        FROM bil_tenant_ledger
-        WHERE tenant_id = :tid
-        ORDER BY txn_date, id
-    """), {"tid": tenant_id}).mappings().all()
-
+    page = ledger_page(tenant_id, after=after, before=before, newest=True)
     items = []
-    bal = 0.0
-    for r in q:
-        amt = float(r["amount"] or 0)
-        bal += amt
+    for r in page.rows:
+        amt = r["amount"]
         items.append({
             "id": r["id"],
             "txn_date": r["txn_date"],
             "description": r["description"],
             "kind": r["kind"],
+            "ref": r["ref"],
+            "auto": (r["ref"] or "").startswith("AUTO:REC:"),
             "charge": amt if amt > 0 else None,
             "payment": (-amt) if amt < 0 else None,
-            "ref": r["ref"],
-            "balance": round(bal, 2),
+            "balance": r["balance"],
         })
-    return items, round(bal, 2)
+    balance = page.closing if not page.next_cursor else closing_balance(tenant_id)
+    return items, balance, page
 
 
 # --- ledger page (unchanged URL), now auto-applies rent/recurring ----------
@@ -1019,45 +901,15 @@ def tenant_ledger():
     if not tenant_id or not month:
         abort(400)
 
-    # optional: ensure recurring rent auto-posts for this month
-    try:
-        from app.utils.billing_helpers import ensure_recurring_materialized
-        ensure_recurring_materialized(tenant_id, month)
-    except Exception:
-        pass  # don't crash the page
-
+    # read-only: rent / recurring rows are posted by `flask month-post` (app/jobs/month_posting.py)
     tenant = db.session.execute(
         text("SELECT id, name, unit_label FROM bil_tenant WHERE id=:tid"),
         {"tid": tenant_id}
     ).mappings().first() or abort(404)
 
-    rows = db.session.execute(
-        text("""
-          SELECT id, tenant_id, txn_date, description, kind, ref, amount
-          FROM bil_tenant_ledger
-          WHERE tenant_id = :tid
-          ORDER BY date(txn_date), id
-        """),
-        {"tid": tenant_id},
-    ).mappings().all()
-
-    balance = 0.0
-    items = []
-    for r in rows:
-        amt = float(r["amount"] or 0.0)
-        balance += amt
-        items.append({
-            "id": r["id"],
-            "txn_date": r["txn_date"],
-            "description": r["description"],
-            "kind": r["kind"],
-            "ref": r["ref"],
-            "auto": (r["ref"] or "").startswith("AUTO:REC:"),
-            "charge": amt if amt > 0 else None,
-            "payment": (-amt) if amt < 0 else None,
-            "balance": balance,
-        })
-
+    items, balance, page = _fetch_ledger_view(
+        tenant_id, after=request.args.get("after"), before=request.args.get("before"),
+    )
 
     # 🔑 This powers the right-hand Recurring panel
     recurring = db.session.execute(
@@ -1076,7 +928,7 @@ def tenant_ledger():
     return render_template(
         "admin/billing/tenant_ledger.html",
         tenant=tenant, month=month,
-        items=items, balance=balance,
+        items=items, balance=balance, page=page,
         recurring=recurring,
         today=today_str,
     )
@@ -1276,77 +1128,13 @@ def tenant_ledger_item_edit(item_id):
     return render_template("admin/billing/tenant_item_edit.html", row=row, tenant_id=tenant_id, month=month)
 
 
-def _month_bounds(ym: str):
-    y, m = [int(x) for x in ym.split("-")]
-    start = date(y, m, 1)
-    last = calendar.monthrange(y, m)[1]
-    end = date(y, m, last)
-    return start, end
-
-def _clamp_dom(y: int, m: int, d: int) -> date:
-    last = calendar.monthrange(y, m)[1]
-    return date(y, m, min(max(1, d), last))
-
 def materialize_recurring_for_month_sql(tenant_id: int, month_ym: str):
     """
-    Insert one ledger row per active recurring item for the given month (YYYY-MM),
-    using a deterministic ref 'AUTO:REC:<rec_id>:YYYY-MM' to avoid duplicates.
-    Pure SQL; no ORM models required.
+    Post one ledger row per active recurring item for the given month (YYYY-MM),
+    ref 'AUTO:REC:<rec_id>:YYYY-MM'; rows already posted are skipped.
     """
-    start_d, end_d = _month_bounds(month_ym)
-    y, m = start_d.year, start_d.month
-
-    recurs = db.session.execute(
-        text("""
-            SELECT id, description, kind, amount, day_of_month, is_active
-            FROM bil_tenant_recurring
-            WHERE tenant_id = :tid AND is_active = 1
-        """),
-        {"tid": tenant_id},
-    ).mappings().all()
-
-    for r in recurs:
-        rec_id = r["id"]
-        auto_ref = f"AUTO:REC:{rec_id}:{month_ym}"
-
-        # already posted for this month?
-        exists = db.session.execute(
-            text("""
-                SELECT id FROM bil_tenant_ledger
-                WHERE tenant_id = :tid
-                  AND ref = :ref
-                  AND date(txn_date) BETWEEN date(:start_d) AND date(:end_d)
-                LIMIT 1
-            """),
-            {"tid": tenant_id, "ref": auto_ref,
-             "start_d": start_d.isoformat(), "end_d": end_d.isoformat()},
-        ).first()
-        if exists:
-            continue
-
-        post_dt = _clamp_dom(y, m, int(r["day_of_month"] or 1)).isoformat()
-        kind = r["kind"]                     # 'charge' or 'credit' (or 'payment')
-        amt  = float(r["amount"] or 0.0)
-        signed_amount = amt if kind == "charge" else -amt
-
-        db.session.execute(
-            text("""
-                INSERT INTO bil_tenant_ledger
-                    (tenant_id, txn_date, description, kind, ref, amount)
-                VALUES
-                    (:tid, :txn_date, :desc, :kind, :ref, :amount)
-            """),
-            {
-                "tid": tenant_id,
-                "txn_date": post_dt,
-                "desc": r["description"],
-                "kind": kind,
-                "ref": auto_ref,          # used to mark row as auto/locked in UI
-                "amount": signed_amount,
-            },
-        )
-
-    db.session.commit()
+    from app.jobs.month_posting import post_month
+    return post_month(month_ym, tenant_ids=[tenant_id], sources=("recurring",))
 
 @admin_bp.route("/billing/ledger/item/add", methods=["POST"])
 def tenant_ledger_item_add():
@@ -1753,84 +1541,15 @@ def recurring_delete(rec_id: int):
     flash("Recurring item deleted.", "success")
     return redirect(url_for("admin_bp.recurring_index", tenant_id=tenant_id, month=month))
 
-def _first_valid_post_date(period_month: str, day_of_month: int | None) -> str:
-    y, m = map(int, period_month.split("-"))
-    dom = max(1, min(day_of_month or 1, calendar.monthrange(y, m)[1]))
-    return date(y, m, dom).isoformat()
-
 def apply_recurring_to_ledger(tenant_id: int, period_month: str) -> None:
     """
     Make ledger for (tenant, month) match Recurring table exactly.
     - Remove any previous auto recurring rows for that month.
-    - Insert rows for ALL active recurring entries that are in-range.
-    We tag auto rows with ref like 'AUTO:REC:<rec_id>'.
+    - Insert rows for ALL active recurring entries that are in-range (one INSERT .. SELECT).
+    We tag auto rows with ref like 'AUTO:REC:<rec_id>:<YYYY-MM>'.
     """
-    # wipe old auto rows for that month
-    db.session.execute(
-        text("""
-            DELETE FROM bil_tenant_ledger
-            WHERE tenant_id = :tid AND month = :mon AND ref LIKE 'AUTO:REC:%'
-        """),
-        {"tid": tenant_id, "mon": period_month},
-    )
-
-    # load recurring
-    recs = db.session.execute(
-        text("""
-          SELECT id, description, kind, amount, day_of_month, is_active,
-                 COALESCE(start_month,'') AS start_month,
-                 COALESCE(end_month,'')   AS end_month
-          FROM bil_tenant_recurring
-          WHERE tenant_id = :tid
-        """),
-        {"tid": tenant_id},
-    ).mappings().all()
-
-    for r in recs:
-        if not r["is_active"]:
-            continue
-        # month inclusion
-        sm = r["start_month"] or None
-        em = r["end_month"] or None
-        if sm and period_month < sm:
-            continue
-        if em and period_month > em:
-            continue
-
-        amt = float(r["amount"] or 0.0)
-        if (r["kind"] or "").lower() in ("payment", "credit"):
-            amt = -abs(amt)  # credits negative
-            kind = "payment"
-        else:
-            amt = abs(amt)   # charges positive
-            kind = "charge"
-
-        post_date = _first_valid_post_date(period_month, r["day_of_month"])
-        ref = f"AUTO:REC:{r['id']}"
-
-        db.session.execute(
-            text("""
-                INSERT INTO bil_tenant_ledger
-                (tenant_id, month, description, kind, amount,
-                 debit, credit, txn_date, ref, created_at)
-                VALUES
-                (:tid, :mon, :desc, :kind, :amt,
-                 CASE WHEN :amt > 0 THEN :amt ELSE 0 END,
-                 CASE WHEN :amt < 0 THEN ABS(:amt) ELSE 0 END,
-                 :d, :ref, datetime('now'))
-            """),
-            {
-                "tid": tenant_id,
-                "mon": period_month,
-                "desc": r["description"],
-                "kind": kind,
-                "amt": amt,
-                "d": post_date,
-                "ref": ref,
-            },
-        )
-
-    db.session.commit()
+    from app.jobs.month_posting import repost_recurring
+    repost_recurring(tenant_id, period_month)
 
 @admin_bp.route("/billing/recurring/apply", methods=["POST"])
 def recurring_apply():
@@ -1862,38 +1581,6 @@ def _get_or_create_session(label: str) -> int:
         {"lbl": label},
     ).fetchone()[0]
 
-def _unmatched_query(side: str, session_id: int, date_from: str, date_to: str):
-    # side = 'left' or 'right', join against matches + exclusions
-    if side == "left":
-        base = "v_recon_left"
-        side_col = "left"
-        src_name = "left_src"
-        id_name  = "left_id"
-    else:
-        base = "v_recon_right"
-        side_col = "right"
-        src_name = "right_src"
-        id_name  = "right_id"
-
-    sql = f"""
-    SELECT s.id, s.txn_date, s.description, s.amount
-    FROM {base} s
-    WHERE date(s.txn_date) BETWEEN date(:d1) AND date(:d2)
-      AND NOT EXISTS (
-        SELECT 1 FROM muni_recon_match m
-        WHERE m.session_id=:sid AND m.{src_name}=:src AND m.{id_name}=s.id
-      )
-      AND NOT EXISTS (
-        SELECT 1 FROM muni_recon_exclusion e
-        WHERE e.session_id=:sid AND e.side=:side AND e.src=:src AND e.src_id=s.id
-      )
-    ORDER BY date(s.txn_date), s.id
-    """
-    return db.session.execute(text(sql), {
-        "sid": session_id, "d1": date_from, "d2": date_to,
-        "src": base, "side": side_col
-    }).mappings().all()
-
 def _abs(x): return abs(float(x or 0.0))
 
 # ---------- UI: dashboard ----------
@@ -1904,19 +1591,8 @@ def muni_recon():
     if not label:
         abort(400)  # require month
 
-    session_id = _get_or_create_session(label)
-
-    # month bounds
-    y, m = [int(x) for x in label.split("-")]
-    d1 = datetime(y, m, 1)
-    if m == 12:
-        d2 = datetime(y+1, 1, 1) - timedelta(days=1)
-    else:
-        d2 = datetime(y, m+1, 1) - timedelta(days=1)
-    date_from, date_to = d1.date().isoformat(), d2.date().isoformat()
-
-    left  = _unmatched_query("left",  session_id, date_from, date_to)
-    right = _unmatched_query("right", session_id, date_from, date_to)
+    # unmatched rows come from the per-session index, rebuilt only when its inputs changed
+    session_id, left, right = unmatched(label)
 
     # gather matches for this month
     matches = db.session.execute(
@@ -1933,7 +1609,7 @@ def muni_recon():
     ).mappings().all()
 
     return render_template(
-        "admin/muni/recon.html",
+        "admin/billing/muni/recon.html",
         label=label, session_id=session_id,
         left=left, right=right, matches=matches
     )
@@ -1944,51 +1620,13 @@ def muni_recon_auto():
     label = request.form.get("month")
     if not label:
         abort(400)
-    session_id = _get_or_create_session(label)
-
-    # month bounds
-    y, m = [int(x) for x in label.split("-")]
-    d1 = datetime(y, m, 1)
-    d2 = (datetime(y+1,1,1) - timedelta(days=1)) if m==12 else (datetime(y,m+1,1)-timedelta(days=1))
-    date_from, date_to = d1.date().isoformat(), d2.date().isoformat()
-
-    left  = _unmatched_query("left",  session_id, date_from, date_to)
-    right = _unmatched_query("right", session_id, date_from, date_to)
-
-    # index right by amount within ±3 days
-    by_amount = {}
-    for r in right:
-        key = round(_abs(r["amount"]), 2)
-        by_amount.setdefault(key, []).append(r)
-
-    matched = 0
-    for L in left:
-        key = round(_abs(L["amount"]), 2)
-        if key not in by_amount:
-            continue
-        # pick a right within ±3 days if possible
-        ldt = datetime.fromisoformat(L["txn_date"])
-        pick = None
-        for idx, R in enumerate(by_amount[key]):
-            rdt = datetime.fromisoformat(R["txn_date"])
-            if abs((rdt - ldt).days) <= 3:
-                pick = by_amount[key].pop(idx)
-                break
-        if not pick and by_amount[key]:
-            pick = by_amount[key].pop(0)  # fallback same amount
-        if not pick:
-            continue
-
-        db.session.execute(text("""
-            INSERT OR IGNORE INTO muni_recon_match
-              (session_id, left_src, left_id, right_src, right_id, amount, rule)
-            VALUES
-              (:sid, 'v_recon_left', :lid, 'v_recon_right', :rid, :amt, 'auto:amount+date±3d')
-        """), {"sid": session_id, "lid": L["id"], "rid": pick["id"], "amt": round(_abs(L["amount"]),2)})
-        matched += 1
+    days = request.form.get("days", DEFAULT_DAYS, type=int)
 
-    db.session.commit()
-    flash(f"Auto-matched {matched} pairs.", "success")
+    res = reconcile(*month_bounds(label), days=days)
+    detail = ", ".join(f"{rule} {n}" for rule, n in res["by_rule"].items())
+    flash(f"Auto-matched {res['matched']} rows" + (f" ({detail})." if detail else "."), "success")
+    if res["dropped"]:
+        flash(f"{res['dropped']} proposed match rows were refused by the match table and left unmatched.", "warning")
     return redirect(url_for("admin_bp.muni_recon", month=label))
 
 # ---------- Manual match ----------
@@ -2135,17 +1773,6 @@ def _get_aid(accno: str):
     r = db.session.execute(text("SELECT id FROM bil_muni_account WHERE account_number=:a"), {"a": accno}).fetchone()
     return r[0] if r else None
 
-# --- Export bundle (ZIP) ---
-def _rows_to_csv(rows, headers=None):
-    import csv, io
-    s = io.StringIO()
-    hdrs = list(rows[0].keys()) if rows else (headers or [])
-    w = csv.DictWriter(s, fieldnames=hdrs, extrasaction="ignore")
-    w.writeheader()
-    for r in rows:
-        w.writerow(dict(r))
-    return s.getvalue()
-
 # --- Legacy redirect so old links stop showing the old screen ---
 @admin_bp.route("/billing/export")
 def legacy_export_redirect():
@@ -2163,61 +1790,44 @@ PERIOD_RE = re.compile(r"^\d{4}-(0[1-9]|1[0-2])$")
 # ---------- ALL ACCOUNTS ZIP (you already have similar) ----------
 @admin_bp.route("/billing/muni/export/all.zip", methods=["GET"], endpoint="muni_export_all")
 def muni_export_all():
-    zbuf = io.BytesIO()
-    with zipfile.ZipFile(zbuf, "w", compression=zipfile.ZIP_DEFLATED) as zf:
-        # accounts
-        rows = db.session.execute(text("""
+    return zip_response([
+        ("accounts.csv", iter_csv(iter_query("""
             SELECT a.account_number, o.name AS owner_name, a.email_electric,
                    a.muni_water_meter_no, a.muni_water_ref,
                    a.muni_elec_meter_no,  a.muni_elec_ref
             FROM bil_muni_account a
             LEFT JOIN ref_muni_owner o ON o.id=a.owner_id
             ORDER BY a.account_number
-        """)).mappings().all()
-        zf.writestr("accounts.csv", _rows_to_csv(rows, [
+        """), [
             "account_number","owner_name","email_electric",
             "muni_water_meter_no","muni_water_ref","muni_elec_meter_no","muni_elec_ref"
-        ]))
+        ])),
         # monthly totals
-        rows = db.session.execute(text("""
+        ("cycle_totals.csv", iter_csv(iter_query("""
             SELECT a.account_number, t.period, t.balance, t.due, t.paid, t.arrears
             FROM bil_muni_cycle_totals t
             JOIN bil_muni_account a ON a.id=t.account_id
             ORDER BY a.account_number, t.period
-        """)).mappings().all()
-        zf.writestr("cycle_totals.csv", _rows_to_csv(rows, [
-            "account_number","period","balance","due","paid","arrears"
-        ]))
+        """), ["account_number","period","balance","due","paid","arrears"])),
         # metsoa
-        rows = db.session.execute(text("""
+        ("metsoa_cycle.csv", iter_csv(iter_query("""
             SELECT a.account_number, m.period, m.metsoa_due
             FROM bil_metsoa_cycle m
             JOIN bil_muni_account a ON a.id=m.account_id
             ORDER BY a.account_number, m.period
-        """)).mappings().all()
-        zf.writestr("metsoa_cycle.csv", _rows_to_csv(rows, [
-            "account_number","period","metsoa_due"
-        ]))
+        """), ["account_number","period","metsoa_due"])),
         # views
-        rows = db.session.execute(text("""
+        ("ledger_view.csv", iter_csv(iter_query("""
             SELECT account_number, period, balance, due, paid, arrears
             FROM v_admin_muni_ledger
             ORDER BY account_number, period
-        """)).mappings().all()
-        zf.writestr("ledger_view.csv", _rows_to_csv(rows, [
-            "account_number","period","balance","due","paid","arrears"
-        ]))
-        rows = db.session.execute(text("""
+        """), ["account_number","period","balance","due","paid","arrears"])),
+        ("recon_view.csv", iter_csv(iter_query("""
             SELECT account_number, period, system_due, metro_due, diff
             FROM v_muni_due_vs_metsoa
             ORDER BY account_number, period
-        """)).mappings().all()
-        zf.writestr("recon_view.csv", _rows_to_csv(rows, [
-            "account_number","period","system_due","metro_due","diff"
-        ]))
-    zbuf.seek(0)
-    return send_file(zbuf, mimetype="application/zip", as_attachment=True,
-                     download_name="muni_export_all.zip")
+        """), ["account_number","period","system_due","metro_due","diff"])),
+    ], "muni_export_all.zip")
 
 # ---------- PER-ACCOUNT ZIP ----------
 @admin_bp.route("/billing/muni/export/account/<account_number>.zip", methods=["GET"], endpoint="muni_export_account")
@@ -2228,29 +1838,23 @@ def muni_export_account(account_number):
         {"a": account_number}
     ).fetchone()
     if not row: abort(404)
-    zbuf = io.BytesIO()
-    with zipfile.ZipFile(zbuf, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+    p = {"a": account_number}
+    return zip_response([
         # ledger (captured)
-        rows = db.session.execute(text("""
+        (f"{account_number}_ledger.csv", iter_csv(iter_query("""
             SELECT period, balance, due, paid, arrears
             FROM v_admin_muni_ledger
             WHERE account_number=:a
             ORDER BY period
-        """), {"a": account_number}).mappings().all()
-        zf.writestr(f"{account_number}_ledger.csv",
-                    _rows_to_csv(rows, ["period","balance","due","paid","arrears"]))
+        """, p), ["period","balance","due","paid","arrears"])),
         # recon
-        rows = db.session.execute(text("""
+        (f"{account_number}_recon.csv", iter_csv(iter_query("""
             SELECT period, system_due, metro_due, diff
             FROM v_muni_due_vs_metsoa
             WHERE account_number=:a
             ORDER BY period
-        """), {"a": account_number}).mappings().all()
-        zf.writestr(f"{account_number}_recon.csv",
-                    _rows_to_csv(rows, ["period","system_due","metro_due","diff"]))
-    zbuf.seek(0)
-    return send_file(zbuf, mimetype="application/zip", as_attachment=True,
-                     download_name=f"{account_number}_muni_export.zip")
+        """, p), ["period","system_due","metro_due","diff"])),
+    ], f"{account_number}_muni_export.zip")
 
 # ---------- DATE-RANGE ZIP (YYYY-MM to YYYY-MM) ----------
 @admin_bp.route("/billing/muni/export/range.zip", methods=["GET"], endpoint="muni_export_range")
@@ -2259,27 +1863,21 @@ def muni_export_range():
     end   = request.args.get("end","").strip()
     if not (PERIOD_RE.match(start) and PERIOD_RE.match(end)):
         abort(400, "start/end must be YYYY-MM")
-    zbuf = io.BytesIO()
-    with zipfile.ZipFile(zbuf, "w", compression=zipfile.ZIP_DEFLATED) as zf:
-        rows = db.session.execute(text("""
+    p = {"s": start, "e": end}
+    return zip_response([
+        (f"ledger_{start}_to_{end}.csv", iter_csv(iter_query("""
             SELECT account_number, period, balance, due, paid, arrears
             FROM v_admin_muni_ledger
             WHERE period BETWEEN :s AND :e
             ORDER BY account_number, period
-        """), {"s": start, "e": end}).mappings().all()
-        zf.writestr(f"ledger_{start}_to_{end}.csv",
-                    _rows_to_csv(rows, ["account_number","period","balance","due","paid","arrears"]))
-        rows = db.session.execute(text("""
+        """, p), ["account_number","period","balance","due","paid","arrears"])),
+        (f"recon_{start}_to_{end}.csv", iter_csv(iter_query("""
             SELECT account_number, period, system_due, metro_due, diff
             FROM v_muni_due_vs_metsoa
             WHERE period BETWEEN :s AND :e
             ORDER BY account_number, period
-        """), {"s": start, "e": end}).mappings().all()
-        zf.writestr(f"recon_{start}_to_{end}.csv",
-                    _rows_to_csv(rows, ["account_number","period","system_due","metro_due","diff"]))
-    zbuf.seek(0)
-    return send_file(zbuf, mimetype="application/zip", as_attachment=True,
-                     download_name=f"muni_export_{start}_to_{end}.zip")
+        """, p), ["account_number","period","system_due","metro_due","diff"])),
+    ], f"muni_export_{start}_to_{end}.zip")
 
 # ---------- PRINT-FRIENDLY LEDGER (browser print) ----------
 @admin_bp.route("/billing/muni/print/ledger/<account_number>", methods=["GET"], endpoint="muni_print_ledger")
@@ -4,6 +4,8 @@ from decimal import Decimal, ROUND_HALF_UP, getcontext
 from datetime import datetime, date
 from sqlalchemy import text
 from app.extensions import db
+from app.utils.tariff_index import get_tariff_index, month_last
+from app.utils.tier_kernel import TierTable, allocate
 
 from calendar import monthrange
 
@@ -46,21 +48,10 @@ def _side_from_utility(u: str | None) -> str:
 
 def _tariff_latest_by_code(code: str) -> dict:
     """Return newest tariff row for a code: {rate, rf, unit}. Missing -> zeros."""
-    row = db.session.execute(
-        text("""
-            SELECT rate,
-                   COALESCE(reduction_factor,1.0) AS rf,
-                   COALESCE(unit,'') AS unit
-            FROM bil_tariff
-            WHERE code = :c
-            ORDER BY date(effective_date) DESC
-            LIMIT 1
-        """),
-        {"c": code},
-    ).mappings().first()
+    row = get_tariff_index().resolve(code)
     if not row:
         return {"rate": Decimal("0"), "rf": Decimal("1"), "unit": ""}
-    return {"rate": _D(row["rate"]), "rf": _D(row["rf"]), "unit": (row["unit"] or "")}
+    return {"rate": _D(row["rate"]), "rf": _D(row["reduction_factor"]), "unit": (row["unit"] or "")}
 
 def _is_per_kl(unit: str) -> bool:
     return "kl" in (unit or "").lower()
@@ -88,17 +79,8 @@ def _enabled_map_rows(meter_id: int, month_str: str) -> list[dict]:
 
 def t_label(code: str) -> str:
     """Friendly label from bil_tariff.description fallback to code."""
-    m = db.session.execute(
-        text("""
-            SELECT COALESCE(description, :c) AS d
-            FROM bil_tariff
-            WHERE code=:c
-            ORDER BY date(effective_date) DESC
-            LIMIT 1
-        """),
-        {"c": code},
-    ).mappings().first()
-    return (m["d"] if m else code)
+    m = get_tariff_index().resolve(code)
+    return (m["description"] or code) if m else code
 
 # -------------------------------------------------
 # PUBLIC: core calculator used by Page 2 and Page 1
@@ -360,11 +342,11 @@ def calc_ws_sd_for_meter(meter_id: int, kL: float, days: int, month_str: str):
 
     # 1) Tiers
     ws_break = _apply_tiers(kL, ws_tiers)
-    sd_break = _apply_tiers_sd(kL, sd_tiers)
+    sd_break = _apply_tiers(kL, sd_tiers, reduce=True)
 
     ws_lines = []
     ws_total = 0.0
-    for vol, rate, cost in ws_break:
+    for vol, rate, _red, cost in ws_break:
         ws_total += cost
         if vol > 0:
             ws_lines.append({"label": f"Tier @ {rate:.2f}", "cons": vol, "rate": rate, "due": cost})
@@ -414,26 +396,21 @@ def calc_ws_sd_for_meter(meter_id: int, kL: float, days: int, month_str: str):
 def _fmt_money(x):
     return None if x is None else round(float(x), 2)
 
+def _is_tier_code(code: str, suffix: str) -> bool:
+    # code LIKE 'Tier%_<suffix>'
+    c = (code or "").lower()
+    return c.startswith("tier") and c.endswith(suffix.lower()) and len(c) > 4 + len(suffix)
+
+
 def get_water_tiers(month_str: str):
-    """Return ordered tiers for WS and SD with reduction factors."""
-    start, end = _month_bounds(month_str)
-    ws = db.session.execute(text("""
-        SELECT block_start, block_end, rate
-        FROM bil_tariff
-        WHERE utility_type='water'
-          AND code LIKE 'Tier%_W&S'
-          AND date(effective_date) <= :end
-        ORDER BY block_start
-    """), {"end": end}).mappings().all()
-    sd = db.session.execute(text("""
-        SELECT block_start, block_end, rate, COALESCE(reduction_factor,1.0) AS red
-        FROM bil_tariff
-        WHERE utility_type='sanitation'
-          AND code LIKE 'Tier%_SD'
-          AND date(effective_date) <= :end
-        ORDER BY block_start
-    """), {"end": end}).mappings().all()
-    return [dict(r) for r in ws], [dict(r) for r in sd]
+    """Return ordered tiers for WS and SD (versions effective during the month) with reduction factors."""
+    idx, end = get_tariff_index(), month_last(month_str)
+    ws = [{"block_start": t["block_start"], "block_end": t["block_end"], "rate": t["rate"]}
+          for t in idx.tiers("water", end) if _is_tier_code(t["code"], "W&S")]
+    sd = [{"block_start": t["block_start"], "block_end": t["block_end"], "rate": t["rate"],
+           "red": t["reduction_factor"]}
+          for t in idx.tiers("sanitation", end) if _is_tier_code(t["code"], "SD")]
+    return ws, sd
 
 def get_fixed_map_for_meter(meter_id: int, month_str: str):
     """
@@ -441,7 +418,7 @@ def get_fixed_map_for_meter(meter_id: int, month_str: str):
     Expected columns: (meter_id, charge_code, utility_type, is_enabled, effective_start, effective_end)
     If your table names/columns differ, adjust here only.
     """
-    start, end = _month_bounds(month_str)
+    start, end, _next = _month_bounds(month_str)
     sql = """
       SELECT charge_code, utility_type, COALESCE(is_enabled,1) AS is_enabled
       FROM bil_meter_charge_map
@@ -459,15 +436,13 @@ def get_fixed_map_for_meter(meter_id: int, month_str: str):
 
 
 def get_fixed_tariffs(month_str: str):
-    """Lookup fixed/surcharge tariff rates (code -> rate)."""
-    start, end = _month_bounds(month_str)
-    rows = db.session.execute(text("""
-        SELECT code, rate
-        FROM bil_tariff
-        WHERE utility_type IN ('water','sanitation','refuse','management')
-          AND date(effective_date) <= :end
-    """), {"end": end}).mappings().all()
-    ret = {r["code"]: float(r["rate"]) for r in rows}
+    """Lookup fixed/surcharge tariff rates (code -> rate) effective during the month."""
+    idx, end = get_tariff_index(), month_last(month_str)
+    ret = {}
+    for utility in ("water", "sanitation", "refuse", "management"):
+        for t in idx.tiers(utility, end, prefix=None):
+            if t["rate"] is not None:
+                ret[t["code"]] = float(t["rate"])
     # Consider legacy codes you shared:
     # WaterLossLevy, WSSurcharge, SDSurcharge, RefuseBin, MgmtFee
     return ret
@@ -485,53 +460,30 @@ def _month_bounds(month_str):
     last = date(y, m, monthrange(y, m)[1])
     return first, last, nxt
 
-def _apply_tiers(kL: float, tiers):
-    """Return list of (vol, rate, cost) per tier for a consumption in kL."""
-    rem = float(kL)
-    out = []
-    for t in tiers:
-        lo = float(t["block_start"])
-        hi = float(t["block_end"])
-        span = max(0.0, hi - lo + 1.0) if hi and hi >= lo else max(0.0, rem)  # forgiving
-        take = min(rem, span) if span > 0 else rem
-        if take <= 0:
-            out.append((0.0, float(t["rate"]), 0.0))
-            continue
-        cost = take * float(t["rate"])
-        out.append((take, float(t["rate"]), cost))
-        rem -= take
-        if rem <= 0:
-            break
-    if rem > 0 and tiers:
-        # spill remainder at last tier rate
-        last_rate = float(tiers[-1]["rate"])
-        out.append((rem, last_rate, rem * last_rate))
-    return out
-
-def _apply_tiers_sd(kL: float, tiers_sd):
-    """Same as above, but include reduction_factor per tier."""
-    rem = float(kL)
-    out = []
-    for t in tiers_sd:
-        lo = float(t["block_start"])
-        hi = float(t["block_end"])
-        red = float(t.get("red", 1.0))
-        span = max(0.0, hi - lo + 1.0) if hi and hi >= lo else max(0.0, rem)
-        take = min(rem, span) if span > 0 else rem
-        if take <= 0:
-            out.append((0.0, float(t["rate"]), red, 0.0))
-            continue
-        eff_vol = take * red
-        cost = eff_vol * float(t["rate"])
-        out.append((take, float(t["rate"]), red, cost))
-        rem -= take
-        if rem <= 0:
-            break
-    if rem > 0 and tiers_sd:
-        last_rate = float(tiers_sd[-1]["rate"])
-        red = float(tiers_sd[-1].get("red", 1.0))
-        eff_vol = rem * red
-        out.append((rem, last_rate, red, eff_vol * last_rate))
+def _apply_tiers(kL: float, tiers, reduce: bool = False):
+    """
+    Return list of (vol, rate, red, cost) per tier for a consumption in kL.
+    Blocks are inclusive kL ranges (hi - lo + 1); a missing/inverted hi is open
+    and any remainder spills at the last tier rate. reduce=True applies the
+    per-tier reduction factor ("red") to the billed volume (SD).
+    """
+    table = TierTable(
+        widths=[(float(t["block_end"]) - float(t["block_start"]) + 1.0)
+                if t["block_end"] and float(t["block_end"]) >= float(t["block_start"]) else None
+                for t in tiers],
+        rates=[t["rate"] for t in tiers],
+        reductions=[t.get("red", 1.0) for t in tiers],
+    )
+    alloc = allocate(kL, 1, table, per_day=False, reduce=reduce)
+    out = [
+        (float(alloc.qty[0, j]), float(table.rates[j]), float(table.reductions[j]) if reduce else 1.0,
+         float(alloc.amount[0, j]))
+        for j in range(table.k)
+        if alloc.qty[0, j] > 0
+    ]
+    if alloc.over_qty[0] > 0:
+        out.append((float(alloc.over_qty[0]), float(table.rates[-1]),
+                    float(table.reductions[-1]) if reduce else 1.0, float(alloc.over_amount[0])))
     return out
 
 def get_water_totals_from_db(tenant_id: int, month: str) -> tuple[float, float, float]:
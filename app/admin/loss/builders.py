@@ -1,5 +1,5 @@
 # app/admin/loss/builders.py
-from sqlalchemy import text
+from app.admin.loss.content_store import get_loss_content
 
 LOW, MID, HIGH = 1, 2, 3
 
@@ -28,27 +28,14 @@ def range_label(band:int) -> str:
     return "Low" if band==LOW else ("Medium" if band==MID else "High")
 
 def _phase_items_for_comments(db, phase:int, how_many:int):
-    # Pull top N active items by phase + ordinal
-    rows = db.session.execute(text("""
-        SELECT body
-        FROM phase_item
-        WHERE active=1 AND phase_id=:p
-        ORDER BY ordinal ASC
-        LIMIT :n
-    """), {"p": phase, "n": how_many}).mappings().all()
-    return [r["body"] for r in rows]
+    # Top N active items by phase + ordinal (content store; `db` kept for callers)
+    return list(get_loss_content().items_for(phase, how_many))
 
 def _progress_items_for_band(db, phase:int, band:int):
-    # Dump entire group for that phase+band ordered by ordinal
+    # Entire group for that phase+band ordered by ordinal
     # band column stores textual: 'low' | 'mid' | 'high'
     band_txt = "low" if band==LOW else ("mid" if band==MID else "high")
-    rows = db.session.execute(text("""
-        SELECT body
-        FROM progress_item
-        WHERE active=1 AND phase_id=:p AND band=:b
-        ORDER BY ordinal ASC
-    """), {"p": phase, "b": band_txt}).mappings().all()
-    return [r["body"] for r in rows]
+    return [n.body for n in get_loss_content().notes_for(phase, band_txt)]
 
 def _comment_count_for_phase(phase:int, p:int) -> int:
     # Phases 1–2: 11.1% per item; Phases 3–4: 12.5% per item
@@ -0,0 +1,427 @@
+# app/admin/loss/content_store.py
+"""
+In-memory LOSS report content.
+
+Phase items, progress notes, overall-assessment items, phase maxima, the
+instruction / explain / pause cards and the question texts only change when they are re-seeded, yet
+every report render used to query them again (and probe up to eight schema
+variants for the maxima). They now live in one immutable snapshot per process:
+
+    phase_items[phase]            (body, ...)            active, by ordinal, id
+    progress[(phase, band)]       (ProgressNote, ...)    band lower/trimmed
+    overall[(band, type)]         (OverallItem, ...)     by ordinal, id
+    maxima / maxima_table         resolved once, see _resolve_maxima()
+    cards[kind][id]               Card(title, caption, content)
+    questions[number]             Question(id, number, title, caption, text)
+
+Admin and subject report builders read it through get_loss_content(); a report
+render issues no content queries. Seed importers call reload_loss_content(),
+which builds the new snapshot first and then swaps the module reference, so
+readers see either the old content or the new, never a mix. ORM edits of the
+content models mark the snapshot stale after commit and the next reader
+rebuilds it the same way; other workers notice a re-seed through a signature
+- a hash of every row of the content tables, so same-length text edits and
+columns such as card captions count - re-read at most every LOSS_CONTENT_TTL
+seconds.
+"""
+from __future__ import annotations
+
+import threading
+import time
+from types import MappingProxyType
+from typing import NamedTuple
+
+from flask import current_app, has_app_context
+from sqlalchemy import event, inspect, text
+from sqlalchemy.orm import Session
+
+from app.extensions import db
+from app.utils.row_digest import rows_digest
+
+PHASES = (1, 2, 3, 4)
+BANDS = ("low", "mid", "high")
+DEFAULT_MAXIMA = {1: 18, 2: 18, 3: 32, 4: 32}
+
+# tables whose rows feed the change signature
+_CONTENT_TABLES = (
+    "lca_phase_item",
+    "lca_progress_item",
+    "lca_overall_item",
+    "lca_instruction",
+    "lca_explain",
+    "lca_pause",
+    "lca_question",
+    "lca_phase_maxima",
+)
+
+CONTENT_TABLES = frozenset(_CONTENT_TABLES)
+CARD_TABLES = {"instruction": "lca_instruction", "explain": "lca_explain", "pause": "lca_pause"}
+
+
+class ProgressNote(NamedTuple):
+    tone: str | None
+    body: str
+
+
+class OverallItem(NamedTuple):
+    label: str | None
+    key_need: str | None
+    body: str | None
+    tone: str | None
+
+
+class Card(NamedTuple):
+    id: int
+    title: str | None
+    caption: str | None
+    content: str | None
+
+
+class Question(NamedTuple):
+    id: int
+    number: int
+    title: str
+    caption: str
+    text: str
+
+
+def _norm(s) -> str:
+    return ("" if s is None else str(s)).strip().lower()
+
+
+class _Schema:
+    """Which content tables/columns exist; probed once per snapshot, not per report."""
+
+    def __init__(self):
+        insp = inspect(db.engine)
+        names = set(insp.get_table_names()) | set(insp.get_view_names())
+        self.columns: dict[str, set[str]] = {}
+        for t in set(_CONTENT_TABLES) | {"lca_scoring_map", "lca_question_phase_map",
+                                         "lca_scorecard_v", "lca_result"}:
+            if t in names:
+                self.columns[t] = {c["name"] for c in insp.get_columns(t)}
+
+    def has(self, table: str, *cols: str) -> bool:
+        have = self.columns.get(table)
+        return have is not None and all(c in have for c in cols)
+
+    def active_sql(self, table: str) -> str:
+        return "COALESCE(CAST(active AS INTEGER), 1) = 1" if self.has(table, "active") else "1=1"
+
+    def order_sql(self, table: str) -> str:
+        cols = [c for c in ("ordinal", "id") if self.has(table, c)]
+        return ", ".join(f"COALESCE({c}, 0)" for c in cols) or "1"
+
+    def signature_sql(self) -> tuple[str, ...]:
+        """One full-row SELECT per existing content table, in a stable order, for rows_digest()."""
+        out = []
+        for t in _CONTENT_TABLES:
+            cols = sorted(self.columns.get(t, ()))
+            if not cols:
+                continue
+            order = "id" if "id" in cols else ", ".join(cols)
+            out.append(f"SELECT {', '.join(cols)} FROM {t} ORDER BY {order}")
+        return tuple(out)
+
+
+class LossContent:
+    """Immutable snapshot of the LOSS report content tables."""
+
+    __slots__ = ("version", "signature", "signature_sql", "phase_items", "progress", "overall",
+                 "maxima", "maxima_table", "result_has_maxima", "cards", "questions", "loaded_at")
+
+    def __init__(self, version: int, signature: str, schema: _Schema):
+        self.version = version
+        self.signature = signature
+        self.signature_sql = schema.signature_sql()
+        self.phase_items = MappingProxyType(_load_phase_items(schema))
+        self.progress = MappingProxyType(_load_progress(schema))
+        self.overall = MappingProxyType(_load_overall(schema))
+        self.maxima_table = MappingProxyType(_load_maxima_table(schema))
+        self.maxima = MappingProxyType(_resolve_maxima(schema, dict(self.maxima_table)))
+        self.result_has_maxima = schema.has("lca_result", *(f"max_phase_{p}" for p in PHASES))
+        self.cards = MappingProxyType({
+            kind: MappingProxyType(_load_cards(schema, table)) for kind, table in CARD_TABLES.items()
+        })
+        self.questions = MappingProxyType(_load_questions(schema))
+        self.loaded_at = time.monotonic()
+
+    # ---- lookups (all return immutable values) ----
+    def items_for(self, phase: int, n: int | None = None) -> tuple[str, ...]:
+        items = self.phase_items.get(int(phase), ())
+        return items if n is None else items[:max(0, int(n))]
+
+    def notes_for(self, phase: int, band) -> tuple[ProgressNote, ...]:
+        return self.progress.get((int(phase), _norm(band)), ())
+
+    def overall_for(self, band, typ: str = "summary") -> tuple[OverallItem, ...]:
+        return self.overall.get((_norm(band), _norm(typ)), ())
+
+    def card(self, kind: str, content_id) -> Card | None:
+        try:
+            return self.cards[kind].get(int(content_id))
+        except (KeyError, TypeError, ValueError):
+            return None
+
+    def question(self, number) -> Question | None:
+        try:
+            return self.questions.get(int(number))
+        except (TypeError, ValueError):
+            return None
+
+    def counts(self) -> dict:
+        return {
+            "phase_items": sum(len(v) for v in self.phase_items.values()),
+            "progress_items": sum(len(v) for v in self.progress.values()),
+            "overall_items": sum(len(v) for v in self.overall.values()),
+            **{f"{k}_cards": len(v) for k, v in self.cards.items()},
+            "questions": len(self.questions),
+        }
+
+
+# ---- loaders -----------------------------------------------------------------
+def _load_phase_items(schema: _Schema) -> dict[int, tuple[str, ...]]:
+    t = "lca_phase_item"
+    if not schema.has(t, "phase_id", "body"):
+        return {}
+    rows = db.session.execute(text(f"""
+        SELECT phase_id, body FROM {t}
+        WHERE {schema.active_sql(t)}
+        ORDER BY phase_id, {schema.order_sql(t)}
+    """)).all()
+    out: dict[int, list[str]] = {}
+    for ph, body in rows:
+        out.setdefault(int(ph), []).append(body)
+    return {k: tuple(v) for k, v in out.items()}
+
+
+def _load_progress(schema: _Schema) -> dict[tuple[int, str], tuple[ProgressNote, ...]]:
+    t = "lca_progress_item"
+    if not schema.has(t, "phase_id", "band", "body"):
+        return {}
+    tone = "tone" if schema.has(t, "tone") else "NULL"
+    rows = db.session.execute(text(f"""
+        SELECT phase_id, band, {tone} AS tone, body FROM {t}
+        WHERE {schema.active_sql(t)}
+        ORDER BY phase_id, {schema.order_sql(t)}
+    """)).all()
+    out: dict[tuple[int, str], list[ProgressNote]] = {}
+    for ph, band, tone_, body in rows:
+        out.setdefault((int(ph), _norm(band)), []).append(ProgressNote(tone_, body))
+    return {k: tuple(v) for k, v in out.items()}
+
+
+def _load_overall(schema: _Schema) -> dict[tuple[str, str], tuple[OverallItem, ...]]:
+    t = "lca_overall_item"
+    if not schema.has(t, "band"):
+        return {}
+    col = lambda c: c if schema.has(t, c) else "NULL"  # noqa: E731
+    typ = "type" if schema.has(t, "type") else "'summary'"
+    rows = db.session.execute(text(f"""
+        SELECT band, {typ} AS typ, {col('label')} AS label, {col('key_need')} AS key_need,
+               {col('body')} AS body, {col('tone')} AS tone
+        FROM {t}
+        WHERE {schema.active_sql(t)}
+        ORDER BY {schema.order_sql(t)}
+    """)).all()
+    out: dict[tuple[str, str], list[OverallItem]] = {}
+    for band, typ_, label, key_need, body, tone in rows:
+        out.setdefault((_norm(band), _norm(typ_)), []).append(OverallItem(label, key_need, body, tone))
+    return {k: tuple(v) for k, v in out.items()}
+
+
+def _load_cards(schema: _Schema, table: str) -> dict[int, Card]:
+    if not schema.has(table, "id"):
+        return {}
+    col = lambda c: c if schema.has(table, c) else "NULL"  # noqa: E731
+    rows = db.session.execute(text(f"""
+        SELECT id, {col('title')}, {col('caption')}, {col('content')} FROM {table}
+    """)).all()
+    return {int(r[0]): Card(int(r[0]), r[1], r[2], r[3]) for r in rows}
+
+
+# question text lives in different columns depending on how the table was seeded
+_QUESTION_TEXT_COLS = ("content", "question_text", "text", "body", "body_text", "caption")
+
+
+def _load_questions(schema: _Schema) -> dict[int, Question]:
+    t = "lca_question"
+    if not schema.has(t, "number"):
+        return {}
+    out: dict[int, Question] = {}
+    for r in db.session.execute(text(f"SELECT * FROM {t} ORDER BY number, id")).mappings():
+        n = r.get("number")
+        if n is None or int(n) in out:
+            continue
+        n = int(n)
+        body = next((r.get(c) for c in _QUESTION_TEXT_COLS if r.get(c)), "")
+        out[n] = Question(int(r.get("id") or n), n, r.get("title") or f"Question {n}",
+                          r.get("caption") or "", body)
+    return out
+
+
+def _phase_rows(sql: str) -> dict[int, int]:
+    return {int(r[0]): int(r[1] or 0) for r in db.session.execute(text(sql)).all() if r[0] is not None}
+
+
+def _load_maxima_table(schema: _Schema) -> dict[int, int]:
+    if not schema.has("lca_phase_maxima", "phase", "max_score"):
+        return {}
+    return _phase_rows("SELECT phase, max_score FROM lca_phase_maxima")
+
+
+def _resolve_maxima(schema: _Schema, table: dict[int, int]) -> dict[int, int]:
+    """
+    Per-phase maxima, first non-empty of:
+      1) lca_phase_maxima(phase, max_score)
+      2) lca_scoring_map / lca_question_phase_map SUM(max_score|score_max) by phase
+      3) observed peak per phase from lca_scorecard_v (as of this snapshot)
+      4) DEFAULT_MAXIMA
+    Only tables/columns that exist are queried. lca_result.max_phase_* is per
+    run and stays with the caller (report._phase_maxima_fallbacks).
+    """
+    if sum(table.values()) > 0:
+        return table
+    for t in ("lca_scoring_map", "lca_question_phase_map"):
+        for c in ("max_score", "score_max"):
+            if schema.has(t, "phase", c):
+                m = _phase_rows(f"SELECT phase, SUM({c}) FROM {t} GROUP BY phase")
+                if sum(m.values()) > 0:
+                    return m
+    if schema.has("lca_scorecard_v", "run_id", "phase", "score"):
+        m = _phase_rows("""
+            SELECT phase, MAX(total_phase) AS peak
+            FROM (
+              SELECT run_id, phase, SUM(score) AS total_phase
+              FROM lca_scorecard_v
+              GROUP BY run_id, phase
+            ) x
+            GROUP BY phase
+        """)
+        if sum(m.values()) > 0:
+            return m
+    return dict(DEFAULT_MAXIMA)
+
+
+# ---- process-wide cache ------------------------------------------------------
+_lock = threading.Lock()
+_current: LossContent | None = None
+_version = 0
+_checked_at = 0.0
+_stale = False
+
+
+def _ttl() -> float:
+    if has_app_context():
+        return float(current_app.config.get("LOSS_CONTENT_TTL", 60))
+    return 60.0
+
+
+def _signature(queries: tuple[str, ...]) -> str:
+    def rows():
+        for sql in queries:
+            yield (sql,)
+            yield from db.session.execute(text(sql))
+    return rows_digest(rows())
+
+
+def _build() -> LossContent:
+    global _version
+    schema = _Schema()
+    sig = _signature(schema.signature_sql())
+    _version += 1
+    return LossContent(_version, sig, schema)
+
+
+def reload_loss_content() -> LossContent:
+    """Build a fresh snapshot from committed data, then swap it in."""
+    global _current, _checked_at, _stale
+    with _lock:
+        snap = _build()
+        _current = snap
+        _checked_at = time.monotonic()
+        _stale = False
+        return snap
+
+
+def invalidate_loss_content() -> None:
+    """Mark the snapshot stale; the next reader rebuilds it while others keep the old one."""
+    global _stale
+    _stale = True
+
+
+def get_loss_content(force: bool = False) -> LossContent:
+    global _current, _checked_at, _stale
+    snap = _current
+    if snap is not None and not force and not _stale and (time.monotonic() - _checked_at) < _ttl():
+        return snap
+
+    with _lock:
+        snap = _current
+        if snap is not None and not force and not _stale:
+            if (time.monotonic() - _checked_at) < _ttl():
+                return snap            # another thread just checked
+            sig = _signature(snap.signature_sql)
+            _checked_at = time.monotonic()
+            if sig == snap.signature:
+                return snap
+        _stale = False
+        snap = _build()
+        _current = snap
+        _checked_at = time.monotonic()
+        return snap
+
+
+def preload_loss_content() -> None:
+    """Warm the snapshot at startup so the first report doesn't pay for it."""
+    try:
+        reload_loss_content()
+    except Exception as e:              # fresh database, content tables not there yet
+        db.session.rollback()
+        current_app.logger.warning("LOSS content not preloaded: %s", e)
+
+
+def loss_content_info() -> dict:
+    snap = _current
+    if snap is None:
+        return {"loaded": False}
+    return {
+        "loaded": True,
+        "version": snap.version,
+        "stale": _stale,
+        "maxima": dict(snap.maxima),
+        **snap.counts(),
+        "age_s": round(time.monotonic() - snap.loaded_at, 1),
+    }
+
+
+# ---- invalidation on ORM edits -----------------------------------------------
+def _mark_dirty(mapper, connection, target):
+    from sqlalchemy.orm import object_session
+    sess = object_session(target)
+    if sess is not None:
+        sess.info["loss_content_dirty"] = True
+
+
+def _after_commit(session):
+    if session.info.pop("loss_content_dirty", False):
+        invalidate_loss_content()
+
+
+def _after_rollback(session):
+    session.info.pop("loss_content_dirty", None)
+
+
+def _register_listeners():
+    from app.models.loss import (
+        LcaExplain, LcaInstruction, LcaOverallItem, LcaPause, LcaPhaseItem, LcaProgressItem, LcaQuestion,
+    )
+    for model in (LcaPhaseItem, LcaProgressItem, LcaOverallItem, LcaInstruction, LcaExplain, LcaPause,
+                  LcaQuestion):
+        for ev in ("after_insert", "after_update", "after_delete"):
+            event.listen(model, ev, _mark_dirty)
+    event.listen(Session, "after_commit", _after_commit)
+    event.listen(Session, "after_soft_rollback", lambda s, prev: _after_rollback(s))
+
+
+_register_listeners()
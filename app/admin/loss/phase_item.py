@@ -1,9 +1,7 @@
 # app/admin/loss/phase_item.py
 from decimal import Decimal, ROUND_FLOOR
-from sqlalchemy import text
-from app.extensions import db
 from typing import Dict, List, Tuple
-from app.models import LcaOverallItem
+from app.admin.loss.content_store import get_loss_content
 
 
 # ------------------------------------------------------------
@@ -49,16 +47,7 @@ def fetch_phase_items(phase_no: int, pct: float | int | str) -> List[str]:
     n = phase_item_count_for_percent(phase_no, pct)
     if n <= 0:
         return []
-
-    sql = text("""
-        SELECT body
-        FROM lca_phase_item
-        WHERE phase_id = :ph AND active = 1
-        ORDER BY ordinal ASC, id ASC
-        LIMIT :n
-    """)
-    rows = db.session.execute(sql, {"ph": phase_no, "n": n}).fetchall()
-    return [r[0] for r in rows]
+    return list(get_loss_content().items_for(phase_no, n))
 
 def band_for_pct(pct: float | int | str) -> int:
     """
@@ -79,14 +68,7 @@ def fetch_progress_items(phase_no: int, pct: float | int | str) -> List[str]:
     Expects table: lca_progress_item(phase_id, band, ordinal, body, active)
     """
     b = band_for_pct(pct)
-    sql = text("""
-        SELECT body
-        FROM lca_progress_item
-        WHERE phase_id = :ph AND band = :b AND active = 1
-        ORDER BY ordinal ASC, id ASC
-    """)
-    rows = db.session.execute(sql, {"ph": phase_no, "b": b}).fetchall()
-    return [r[0] for r in rows]
+    return [n.body for n in get_loss_content().notes_for(phase_no, b)]
 
 def build_phase_blocks(phase_1_pct, phase_2_pct, phase_3_pct, phase_4_pct) -> List[Dict]:
     items = [(1, phase_1_pct), (2, phase_2_pct), (3, phase_3_pct), (4, phase_4_pct)]
@@ -145,18 +127,7 @@ def phase_item_count_for_percent(phase_no: int, pct) -> int:
     return int(_safe_pct(pct) // step)
 
 def fetch_phase_items(phase_no: int, n: int = 9) -> list[str]:
-    rows = db.session.execute(
-        text("""
-            SELECT body
-            FROM lca_phase_item
-            WHERE phase_id = :ph
-              AND COALESCE(active, TRUE) = TRUE
-            ORDER BY ordinal ASC, id ASC
-            LIMIT :n
-        """),
-        {"ph": phase_no, "n": n},
-    ).fetchall()
-    return [r[0] for r in rows]
+    return list(get_loss_content().items_for(phase_no, n))
 
 # -------- Progress: notes by (phase, band_label) --------
 # Table you provided: lca_progress_item(id, phase_id, band, tone, body, ordinal, active)
@@ -169,27 +140,13 @@ TONE_CHIP = {
 def fetch_progress_notes(phase_no: int, pct) -> Dict:
     band_label = band_label_for_pct(_safe_pct(pct))  # "low" | "mid" | "high"
 
-    rows = db.session.execute(
-        text("""
-            SELECT tone, body
-            FROM lca_progress_item
-            WHERE phase_id = :ph
-            AND band = :band
-            AND COALESCE(active, TRUE) = TRUE
-            ORDER BY ordinal ASC, id ASC
-        """),
-        {"ph": phase_no, "band": band_label},
-    ).fetchall()
-
-
-
-    if not rows:
+    notes = get_loss_content().notes_for(phase_no, band_label)
+    if not notes:
         return {"band": band_label, "tone": None, "chip_class": "", "notes": []}
 
-    tone = rows[0][0] or ""
+    tone = notes[0].tone or ""
     chip = TONE_CHIP.get(tone, "bg-slate-50 text-slate-700 border-slate-200")
-    notes = [r[1] for r in rows]
-    return {"band": band_label, "tone": tone, "chip_class": chip, "notes": notes}
+    return {"band": band_label, "tone": tone, "chip_class": chip, "notes": [n.body for n in notes]}
 
 # -------- Colors for phase bars/chips (orientation-aware) --------
 def level_from_band(band: int) -> str:
@@ -327,17 +284,9 @@ def overall_assessment_from_p1(p1_pct) -> dict:
         "high": "bg-rose-50 text-rose-700 border-rose-200",
     }
 
-    # ---- Fetch from DB
-    q_base = (db.session.query(LcaOverallItem)
-              .filter(LcaOverallItem.band == band,
-                      LcaOverallItem.active.is_(True)))
-
-    summary = (q_base.filter(LcaOverallItem.type == "summary")
-                     .order_by(LcaOverallItem.ordinal.asc())
-                     .first())
-    bullets = (q_base.filter(LcaOverallItem.type == "bullet")
-                     .order_by(LcaOverallItem.ordinal.asc())
-                     .all())
+    # ---- From the content store
+    summary = next(iter(get_loss_content().overall_for(band, "summary")), None)
+    bullets = get_loss_content().overall_for(band, "bullet")
 
     if summary:
         return {
@@ -3,19 +3,11 @@ from flask import request, render_template, abort
 from sqlalchemy import text
 from datetime import datetime
 from app.extensions import db
+from app.admin.loss.content_store import get_loss_content
 
 def _phase_maxima():
-    # If you have lca_phase_maxima(phase, max_score), use it.
-    try:
-        rows = db.session.execute(
-            text("SELECT phase, max_score FROM lca_phase_maxima")
-        ).fetchall()
-        if rows:
-            return {int(r[0]): int(r[1] or 0) for r in rows}
-    except Exception:
-        pass
-    # Fallback: unknown maxima -> None (percents omitted)
-    return {}
+    # lca_phase_maxima(phase, max_score) from the content store; {} -> percents omitted
+    return dict(get_loss_content().maxima_table)
 
 def _classify_adaptive_vector(pcts: list[int]) -> str:
     # Simple, editable thresholds
@@ -44,20 +36,19 @@ def _get_result_for_run(run_id: int):
     ).mappings().first()
 
 def _try_maxima_from_lca_result(run_id: int) -> dict[int, int] | None:
-    """Try to read max_phase_* from lca_result if those columns exist."""
-    try:
-        row = db.session.execute(
-            text("""
-              SELECT max_phase_1, max_phase_2, max_phase_3, max_phase_4
-              FROM lca_result
-              WHERE run_id = :rid
-            """),
-            {"rid": run_id}
-        ).first()
-        if row and all(row[i] is not None for i in range(4)):
-            return {1: int(row[0] or 0), 2: int(row[1] or 0), 3: int(row[2] or 0), 4: int(row[3] or 0)}
-    except Exception:
-        pass
+    """Read max_phase_* from lca_result if those columns exist (known from the content store)."""
+    if not get_loss_content().result_has_maxima:
+        return None
+    row = db.session.execute(
+        text("""
+          SELECT max_phase_1, max_phase_2, max_phase_3, max_phase_4
+          FROM lca_result
+          WHERE run_id = :rid
+        """),
+        {"rid": run_id}
+    ).first()
+    if row and all(row[i] is not None for i in range(4)):
+        return {1: int(row[0] or 0), 2: int(row[1] or 0), 3: int(row[2] or 0), 4: int(row[3] or 0)}
     return None
 
 def _phase_maxima_fallbacks(run_id: int) -> dict[int, int]:
@@ -65,90 +56,26 @@ def _phase_maxima_fallbacks(run_id: int) -> dict[int, int]:
     Resolve per-phase maxima without assuming schema.
     Order:
       1) lca_result.max_phase_*
-      2) lca_phase_maxima(phase,max_score)
-      3) lca_scoring_map / lca_question_phase_map summed
-      4) observed peak from lca_scorecard_v
-      5) constants matching your example: 18,18,32,32
+      2..5) lca_phase_maxima, scoring/question map sums, observed peak,
+            constants 18,18,32,32 -- resolved once per content snapshot
+            (content_store._resolve_maxima), not per report
     """
-    # 1) from lca_result if columns exist
     m = _try_maxima_from_lca_result(run_id)
     if m and sum(m.values()) > 0:
         return m
-
-    # 2) explicit maxima table
-    try:
-        rows = db.session.execute(text("SELECT phase, max_score FROM lca_phase_maxima")).fetchall()
-        if rows:
-            m = {int(r[0]): int(r[1] or 0) for r in rows}
-            if sum(m.values()) > 0:
-                return m
-    except Exception:
-        pass
-
-    # 3) scoring map / question map (common variants)
-    for sql in [
-        "SELECT phase, SUM(max_score) FROM lca_scoring_map GROUP BY phase",
-        "SELECT phase, SUM(score_max) FROM lca_scoring_map GROUP BY phase",
-        "SELECT phase, SUM(max_score) FROM lca_question_phase_map GROUP BY phase",
-        "SELECT phase, SUM(score_max) FROM lca_question_phase_map GROUP BY phase",
-    ]:
-        try:
-            rows = db.session.execute(text(sql)).fetchall()
-            if rows:
-                m = {int(r[0]): int(r[1] or 0) for r in rows}
-                if sum(m.values()) > 0:
-                    return m
-        except Exception:
-            continue
-
-    # 4) observed peak per phase from scorecard view
-    try:
-        rows = db.session.execute(text("""
-            SELECT phase, MAX(total_phase) AS peak
-            FROM (
-              SELECT run_id, phase, SUM(score) AS total_phase
-              FROM lca_scorecard_v
-              GROUP BY run_id, phase
-            ) x
-            GROUP BY phase
-        """)).fetchall()
-        if rows:
-            m = {int(r[0]): int(r[1] or 0) for r in rows}
-            if sum(m.values()) > 0:
-                return m
-    except Exception:
-        pass
-
-    # 5) constants (your sample row): 18 + 18 + 32 + 32 = 100
-    return {1: 18, 2: 18, 3: 32, 4: 32}
+    return dict(get_loss_content().maxima)
 
 # ---------- content sources ----------
 def _load_phase_items() -> dict[int, list[str]]:
     """Phase items (no band): {phase_id: [body…]} ordered by ordinal."""
-    rows = db.session.execute(text("""
-        SELECT phase_id, body
-        FROM lca_phase_item
-        WHERE COALESCE(active,1)=1
-        ORDER BY phase_id, COALESCE(ordinal,1)
-    """)).mappings().all()
-    out: dict[int, list[str]] = {}
-    for r in rows:
-        out.setdefault(int(r["phase_id"]), []).append(r["body"])
-    return out
+    return {ph: list(items) for ph, items in get_loss_content().phase_items.items()}
 
 def _load_progress_banded() -> dict[int, dict[str, str]]:
     """Progress items (banded): {phase_id: {low|mid|high: body}}."""
-    rows = db.session.execute(text("""
-        SELECT phase_id, LOWER(TRIM(band)) AS band, body
-        FROM lca_progress_item
-        WHERE COALESCE(active,1)=1
-        ORDER BY phase_id, band, COALESCE(ordinal,1)
-    """)).mappings().all()
     out: dict[int, dict[str, str]] = {}
-    for r in rows:
-        ph = int(r["phase_id"])
-        out.setdefault(ph, {})
-        out[ph].setdefault(r["band"], r["body"])  # first per band wins
+    for (ph, band), notes in get_loss_content().progress.items():
+        if notes:
+            out.setdefault(ph, {})[band] = notes[0].body  # first per band wins
     return out
 
 # ---------- rules ----------
@@ -1,6 +1,6 @@
 from flask import (
     Response, abort, json, request, redirect, url_for, 
-    render_template, session,send_file, current_app, flash)
+    render_template, session,send_file, current_app, flash, jsonify)
 from flask_login import current_user
 from app.admin import admin_bp
 from flask_login import logout_user
@@ -65,6 +65,9 @@ from decimal import Decimal, ROUND_FLOOR
 from werkzeug.routing import BuildError
 import math, shutil
 #from weasyprint import HTML
+from .scoring_engine import compute_run_result, get_scoring_map
+from .content_store import CONTENT_TABLES, get_loss_content, reload_loss_content
+from app.services.pdf_render_pool import pdf_render_pool
 from .phase_item import (
     build_phase_blocks,
     adaptive_vector_from_phases,
@@ -77,8 +80,9 @@ from pathlib import Path
 from sqlalchemy import text, inspect
 from app.admin.seed_utils import (
     SEED_TABLES, canon_seed, preview_rows,
-    import_csv_stream
+    import_csv_stream, import_csv_stats,
 )
+from app.admin.seed_bulk import import_csv as import_bulk_csv, spec_for_model
 from app.admin.seed_helper import (
     SEED_CFG,
     fetch_rows as fetch_rows_db,
@@ -88,7 +92,7 @@ from app.seed.seed_simple import SEEDS as SEED_CFG, fetch_rows  # existing helpe
 from app.seed.seed_simple import SEEDS, fetch_rows   # make sure this import exists
 from flask_wtf.csrf import generate_csrf  # import once at top
 
-import io, csv
+import io
 
 from app.admin.seed_utils import (
     SEED_TABLES,        # {"questions": {"model": ModelClass, "columns": [...]}, ...}
@@ -151,25 +155,7 @@ def _phase_totals_for_user(user_id):
 
 def _phase_maxima_from_map():
     # Derive maxima from the map: for each question take MAX per phase across answers, then sum.
-    sql = """
-    SELECT
-      SUM(max_p1) AS max1,
-      SUM(max_p2) AS max2,
-      SUM(max_p3) AS max3,
-      SUM(max_p4) AS max4
-    FROM (
-      SELECT
-        question_id,
-        MAX(phase_1) AS max_p1,
-        MAX(phase_2) AS max_p2,
-        MAX(phase_3) AS max_p3,
-        MAX(phase_4) AS max_p4
-      FROM lca_scoring_map
-      GROUP BY question_id
-    ) t
-    """
-    row = db.session.execute(text(sql)).mappings().first()
-    return (row["max1"] or 0, row["max2"] or 0, row["max3"] or 0, row["max4"] or 0)
+    return get_scoring_map().maxima
 
 def _percent(raw, mx):
     return int(round((raw * 100.0) / mx)) if mx else 0
@@ -542,6 +528,9 @@ def _render_report_html(row):
 def _make_pdf(html_str: str) -> bytes | None:
     if not WEASYPRINT_AVAILABLE:
         return None
+    if pdf_render_pool.enabled:
+        # one bounded wait on the pool (PDF_RENDER_WAIT); no second inline render after it
+        return pdf_render_pool.render_html(html_str)
     pdf_bytes = HTML(string=html_str).write_pdf()
     return pdf_bytes
 
@@ -642,58 +631,11 @@ def _safe_commit(retries: int = 3, base_sleep: float = 0.2):
 
 def _compute_result_from_run(rid: int):
     """
-    Compute phase totals from lca_response LEFT JOIN lca_scoring_map for a run.
-    Normalizes answers to 'yes'/'no'. Returns dict or None if no responses.
+    Compute phase totals for a run from its responses and the cached
+    lca_scoring_map snapshot (see scoring_engine). Normalizes answers to
+    'yes'/'no'. Returns dict or None if no responses.
     """
-    sql = """
-        WITH resp AS (
-          SELECT
-            r.user_id,
-            r.question_id,
-            r.created_at,
-            CASE
-              WHEN LOWER(TRIM(r.answer)) IN ('1','y','yes','true','t') THEN 'yes'
-              WHEN LOWER(TRIM(r.answer)) IN ('0','n','no','false','f','') THEN 'no'
-              ELSE LOWER(TRIM(r.answer))
-            END AS norm_answer
-          FROM lca_response r
-          WHERE r.run_id = :rid
-        )
-        SELECT
-          MAX(resp.user_id)                                       AS user_id,
-          MAX(resp.created_at)                                    AS latest_ts,
-          COUNT(*)                                                AS n_responses,
-          COALESCE(SUM(COALESCE(m.phase_1,0)), 0)                 AS p1,
-          COALESCE(SUM(COALESCE(m.phase_2,0)), 0)                 AS p2,
-          COALESCE(SUM(COALESCE(m.phase_3,0)), 0)                 AS p3,
-          COALESCE(SUM(COALESCE(m.phase_4,0)), 0)                 AS p4
-        FROM resp
-        LEFT JOIN lca_scoring_map m
-               ON m.question_id = resp.question_id
-              AND m.answer_type = resp.norm_answer
-    """
-    row = db.session.execute(text(sql), {"rid": rid}).mappings().first()
-
-    if not row or int(row["n_responses"] or 0) == 0:
-        return None
-
-    p1 = int(row["p1"] or 0)
-    p2 = int(row["p2"] or 0)
-    p3 = int(row["p3"] or 0)
-    p4 = int(row["p4"] or 0)
-    total = p1 + p2 + p3 + p4
-
-    return {
-        "run_id": rid,
-        "user_id": int(row["user_id"]) if row["user_id"] is not None else None,
-        "subject": "LOSS",
-        "phase_1": p1,
-        "phase_2": p2,
-        "phase_3": p3,
-        "phase_4": p4,
-        "total": total,
-        "created_at": row["latest_ts"],
-    }
+    return compute_run_result(rid)
 
 
 def _upsert_lca_result(res: dict):
@@ -757,72 +699,30 @@ def recompute_and_save(run_id: int) -> bool:
                             int(row["p3"] or 0), int(row["p4"] or 0), row["latest_ts"])
             return True
 
-    # Fallback: join responses to scoring map (normalize yes/no)
-    row2 = db.session.execute(text("""
-        WITH resp AS (
-          SELECT r.run_id, r.user_id, r.question_id, r.created_at,
-                 CASE
-                   WHEN LOWER(TRIM(r.answer)) IN ('1','y','yes','true','t') THEN 'yes'
-                   WHEN LOWER(TRIM(r.answer)) IN ('0','n','no','false','f','') THEN 'no'
-                   ELSE LOWER(TRIM(r.answer))
-                 END AS norm_answer
-          FROM lca_response r
-          WHERE r.run_id=:run_id
-        )
-        SELECT MAX(resp.user_id) AS user_id, MAX(resp.created_at) AS latest_ts, COUNT(*) AS n_responses,
-               COALESCE(SUM(COALESCE(m.phase_1,0)),0) AS p1,
-               COALESCE(SUM(COALESCE(m.phase_2,0)),0) AS p2,
-               COALESCE(SUM(COALESCE(m.phase_3,0)),0) AS p3,
-               COALESCE(SUM(COALESCE(m.phase_4,0)),0) AS p4
-        FROM resp
-        LEFT JOIN lca_scoring_map m
-               ON m.question_id = resp.question_id
-              AND m.answer_type = resp.norm_answer
-    """), {"run_id": run_id}).mappings().first()
-
-    if not row2 or int(row2["n_responses"] or 0) == 0:
+    # Fallback: score responses against the cached scoring map
+    res = compute_run_result(run_id)
+    if not res:
         return False
 
-    save_result_row(run_id, int(row2["user_id"]), int(row2["p1"] or 0), int(row2["p2"] or 0),
-                    int(row2["p3"] or 0), int(row2["p4"] or 0), row2["latest_ts"])
+    save_result_row(run_id, res["user_id"], res["phase_1"], res["phase_2"],
+                    res["phase_3"], res["phase_4"], res["created_at"])
     return True
 
 def recompute_and_save_from_responses(run_id: int) -> bool:
-    row = db.session.execute(text("""
-        WITH resp AS (
-          SELECT
-            r.run_id,
-            r.user_id,
-            r.question_id,
-            r.created_at,
-            CASE
-              WHEN LOWER(TRIM(r.answer)) IN ('1','y','yes','true','t') THEN 'yes'
-              WHEN LOWER(TRIM(r.answer)) IN ('0','n','no','false','f','') THEN 'no'
-              ELSE LOWER(TRIM(r.answer))
-            END AS norm_answer
-          FROM lca_response r
-          WHERE r.run_id = :run_id
-        )
-        SELECT
-          MAX(resp.user_id)                                  AS user_id,
-          MAX(resp.created_at)                               AS latest_ts,
-          COUNT(*)                                           AS n_responses,
-          COALESCE(SUM(COALESCE(m.phase_1,0)), 0)            AS p1,
-          COALESCE(SUM(COALESCE(m.phase_2,0)), 0)            AS p2,
-          COALESCE(SUM(COALESCE(m.phase_3,0)), 0)            AS p3,
-          COALESCE(SUM(COALESCE(m.phase_4,0)), 0)            AS p4
-        FROM resp
-        LEFT JOIN lca_scoring_map m
-               ON m.question_id = resp.question_id
-              AND m.answer_type = resp.norm_answer
-    """), {"run_id": run_id}).mappings().first()
-
-    if not row or int(row["n_responses"] or 0) == 0:
+    res = compute_run_result(run_id)
+    if not res:
         return False
 
     save_result_row(
         run_id=run_id,
-        user_id=int)
+        user_id=res["user_id"],
+        p1=res["phase_1"],
+        p2=res["phase_2"],
+        p3=res["phase_3"],
+        p4=res["phase_4"],
+        latest_ts=res["created_at"],
+    )
+    return True
 
 
 def upsert_result_from_scorecard(run_id: int) -> bool:
@@ -1229,15 +1129,10 @@ body { font-family: system-ui, -apple-system, Segoe UI, Roboto, Arial; color:#0f
 
 def _phase_library(phase_number: int):
     """
-    Pull comments for a phase from lca_phase_item using your schema.
+    Pull comments for a phase from lca_phase_item (content store).
     """
-    rows = db.session.execute(text("""
-        SELECT body
-        FROM lca_phase_item
-        WHERE active = 1 AND phase_id = :pid
-        ORDER BY ordinal, id
-    """), {"pid": int(phase_number)}).fetchall()
-    return [str(r.body).strip() for r in rows if (getattr(r, "body", None) or "").strip()]
+    lib = get_loss_content().items_for(phase_number)
+    return [str(b).strip() for b in lib if (b or "").strip()]
 
 def _count_comments_for_phase(phase_number: int, percent_int: int) -> int:
     """
@@ -1301,15 +1196,7 @@ def _progress_lines_from_db(phase_percents: dict, limit_per_phase: int = 1):
         pct = int(phase_percents.get(pid, 0))
         band = _band_for_percent(pct)
 
-        rows = db.session.execute(text("""
-            SELECT body, tone
-            FROM lca_progress_item
-            WHERE phase_id = :pid
-              AND band     = :band
-              AND active   = 1
-            ORDER BY ordinal
-            LIMIT :n
-        """), {"pid": pid, "band": band, "n": limit_per_phase}).fetchall()
+        rows = get_loss_content().notes_for(pid, band)[:limit_per_phase]
 
         prefix = f"Phase {pid} ({pct}%): "
         for r in rows:
@@ -1775,6 +1662,43 @@ def loss_archive_now():
     flash(f"Archived {moved} finished run(s) older than {days} day(s).", "success")
     return redirect(url_for("admin_bp.loss_home"))
 
+@admin_bp.post("/loss/rebuild-all")
+def loss_rebuild_all():
+    """Start (or resume) a background bulk rebuild of lca_result."""
+    from app.jobs.loss_rebuild import create_job, latest_unfinished_job, start_background
+    job = latest_unfinished_job() if request.form.get("resume") else None
+    job_id = job.id if job else create_job(
+        {
+            "user_id": request.form.get("user_id", type=int),
+            "status": (request.form.get("status") or "").strip() or None,
+            "from_id": request.form.get("from_id", type=int),
+            "to_id": request.form.get("to_id", type=int),
+            "existing_only": bool(request.form.get("existing_only")),
+        },
+        chunk_size=request.form.get("chunk", type=int) or 500,
+    )
+    started = start_background(job_id)
+    if request.accept_mimetypes.best == "application/json":
+        return jsonify({"job_id": job_id, "started": started})
+    flash(f"LOSS rebuild job {job_id} {'started' if started else 'already running'}.", "success")
+    return redirect(url_for("admin_bp.loss_rebuild_status", job_id=job_id))
+
+@admin_bp.get("/loss/rebuild-all/<int:job_id>")
+def loss_rebuild_status(job_id: int):
+    from app.jobs.loss_rebuild import job_status
+    st = job_status(job_id)
+    if not st:
+        abort(404)
+    return jsonify(st)
+
+@admin_bp.get("/loss/pdf-cache")
+def loss_pdf_cache_stats():
+    """Hit/miss/eviction counters of the rendered-PDF cache and render pool (this worker)."""
+    from app.utils.pdf_cache import loss_pdf_cache
+    if request.args.get("clear"):
+        loss_pdf_cache.clear()
+    return jsonify({**loss_pdf_cache.stats(), "render_pool": pdf_render_pool.stats()})
+
 @admin_bp.get("/test-email")
 def admin_test_email():
     # ensure your admin gate here
@@ -1933,7 +1857,10 @@ def loss_email_pdf():
 
     # Make a PDF (WeasyPrint if available; fallback to HTML attachment)
     pdf_bytes = None
-    if HAVE_WEASY:
+    if pdf_render_pool.enabled:
+        # one bounded wait on the pool; None falls back to the HTML attachment
+        pdf_bytes = pdf_render_pool.render_html(html, base_url=request.host_url)
+    elif HAVE_WEASY:
         pdf_bytes = HTML(string=html).write_pdf()
 
     # Send via SMTP (simple, no dependency on Flask-Mail)
@@ -2016,6 +1943,14 @@ def loss_archive():
         )
         db.session.commit()
 
+    # keep a copy of the already-rendered report next to the archive (no re-render)
+    try:
+        from app.utils.pdf_cache import loss_pdf_cache
+        uid = db.session.execute(text("SELECT user_id FROM lca_run WHERE id=:rid"), {"rid": run_id}).scalar()
+        loss_pdf_cache.copy_to(run_id, uid, ARCHIVE_DIR, f"loss-report-run{run_id}{('-u'+str(uid)) if uid else ''}.pdf")
+    except Exception as e:
+        current_app.logger.warning("archive: cached PDF copy failed for run %s: %s", run_id, e)
+
     flash(f"Run {run_id} archived.", "success")
     # Send back to the dashboard (or wherever you want)
     return redirect(url_for("admin_bp.loss_index"))
@@ -2640,7 +2575,20 @@ def _html_to_pdf_response(html: str, filename: str = "report.pdf") -> Response:
     Renders HTML to PDF. Tries WeasyPrint first, then pdfkit.
     Returns a Flask Response with application/pdf. If no PDF engine
     is available, returns the HTML (so you at least see something).
+    With the render pool on, the PDF comes from the pool only (503 when it is
+    not ready within PDF_RENDER_WAIT) - never a second inline render.
     """
+    if pdf_render_pool.enabled:
+        pdf_bytes = pdf_render_pool.render_html(html, base_url=request.host_url)
+        if pdf_bytes:
+            return Response(
+                pdf_bytes,
+                mimetype="application/pdf",
+                headers={"Content-Disposition": f'inline; filename="{filename}"'}
+            )
+        return Response("The PDF is still being rendered. Please try again shortly.",
+                        status=503, mimetype="text/plain", headers={"Retry-After": "5"})
+
     # Try WeasyPrint
     try:
         # AFTER
@@ -2978,8 +2926,11 @@ def _build_context(rid: int, uid: int | None):
     return ctx, (p1, p2, p3, p4), row
 
 
-def _render_pdf_bytes(ctx: dict) -> bytes:
+def _render_pdf_bytes(ctx: dict) -> bytes | None:
     html = render_template("admin/loss/report.html", **ctx, pdf_mode=True)
+    if pdf_render_pool.enabled:
+        # None when the pool failed or did not finish within PDF_RENDER_WAIT
+        return pdf_render_pool.render_html(html, base_url=request.host_url)
     pdf_io = BytesIO()
     HTML(string=html, base_url=request.host_url).write_pdf(pdf_io)
     return pdf_io.getvalue()
@@ -3109,11 +3060,24 @@ def seed_upload(seed: str):
     if not f or not f.filename.lower().endswith(".csv"):
         flash("Please upload a .csv file.", "warning")
         return redirect(url_for("admin_bp.seed_hub", tab=seed))
-    count = import_csv_stream(seed, f)
-    flash(f"Imported {count} rows into {seed}.", "success")
+    st = import_csv_stats(seed, f)
+    flash(f"Imported {st['rows']} rows into {seed}: {st['inserted']} new, {st['updated']} updated, "
+          f"{st['unchanged']} unchanged, {st['deleted']} removed.", "success")
     return redirect(url_for("admin_bp.seed_preview", seed=seed))
 
 
+@admin_bp.post("/loss/seeds/<seed>/diff", endpoint="seed_diff")
+def seed_diff(seed: str):
+    """Pre-import diff of an uploaded CSV against the table; nothing is written."""
+    f = request.files.get("file")
+    if not f or not f.filename.lower().endswith(".csv"):
+        return jsonify({"error": "Please upload a .csv file."}), 400
+    try:
+        return jsonify(import_csv_stats(seed, f, dry_run=True))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+
 @admin_bp.post("/loss/seeds/<seed>/upload-json", endpoint="seed_upload_json")
 def seed_upload_json(seed: str):
     seed = canon_seed(seed)
@@ -3143,16 +3107,11 @@ def seed_import_csv(seed: str):
     path = seed_csv_path(seed)
     f.save(path)
 
-    cols = meta["cols"]
-    with db.session.begin():
-        db.session.execute(text(f"DELETE FROM {meta['table']}"))
-        with open(path, encoding="utf-8-sig", newline="") as fh:
-            reader = csv.DictReader(fh)
-            for row in reader:
-                insert_cols = [c for c in cols if not (c == "id" and (row.get("id") in (None, "", "NULL")))]
-                placeholders = ", ".join([f":{c}" for c in insert_cols])
-                sql = text(f"INSERT INTO {meta['table']} ({', '.join(insert_cols)}) VALUES ({placeholders})")
-                db.session.execute(sql, {c: row.get(c, None) for c in insert_cols})
+    spec = spec_for_model(meta["model"], cols=meta["cols"], key=("id",))
+    with open(path, encoding="utf-8-sig", newline="") as fh:
+        import_bulk_csv(spec, fh, replace=True, strict=False)
+    if spec.table in CONTENT_TABLES:
+        reload_loss_content()   # this worker now; others via the content signature
 
     flash(f"Imported {meta['title']} from {path.name}", "success")
     return redirect(url_for("admin_bp.seed_hub", tab=seed))
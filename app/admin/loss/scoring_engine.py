@@ -0,0 +1,244 @@
+# app/admin/loss/scoring_engine.py
+"""
+In-memory LOSS scoring engine.
+
+lca_scoring_map is tiny (two rows per question) and changes only when it is
+re-seeded, so instead of LEFT JOINing it in SQL for every run we keep one
+immutable snapshot per process:
+
+    (question_id, answer) -> row index into a (n + 1, 4) int array
+
+The extra last row is all zeros and is where unmapped answers land, which
+reproduces the LEFT JOIN / COALESCE(.., 0) semantics of the old CTE.
+
+The snapshot is versioned. Seed importers call invalidate_scoring_map() in
+their own process; other workers re-read the map at most every
+LOSS_SCORING_MAP_TTL seconds and rebuild only when the hash of its rows
+(rows_digest) differs, so edits that cancel out in a sum still count.
+"""
+from __future__ import annotations
+
+import threading
+import time
+from typing import Iterable
+
+import numpy as np
+from flask import current_app, has_app_context
+from sqlalchemy import bindparam, text
+
+from app.extensions import db
+from app.utils.row_digest import rows_digest
+
+PHASES = (1, 2, 3, 4)
+
+_YES = {"1", "y", "yes", "true", "t"}
+_NO = {"0", "n", "no", "false", "f", ""}
+
+_SQL_MAP = text("""
+    SELECT question_id, answer_type, phase_1, phase_2, phase_3, phase_4
+    FROM lca_scoring_map
+    ORDER BY question_id, answer_type
+""")
+
+_SQL_RESPONSES = """
+    SELECT r.run_id, r.user_id, r.question_id, r.answer, r.created_at
+    FROM lca_response r
+"""
+
+
+def normalize_answer(ans) -> str:
+    """Same rules as the old SQL CASE: 1/y/true -> yes, 0/n/false/'' -> no."""
+    s = ("" if ans is None else str(ans)).strip().lower()
+    if s in _YES:
+        return "yes"
+    if s in _NO:
+        return "no"
+    return s
+
+
+class ScoringMap:
+    """Immutable snapshot of lca_scoring_map."""
+
+    __slots__ = ("version", "signature", "index", "weights", "maxima", "loaded_at")
+
+    def __init__(self, rows: Iterable, version: int, signature: str):
+        index: dict[tuple[int, str], int] = {}
+        vecs: list[tuple[int, int, int, int]] = []
+        per_q: dict[int, list[int]] = {}
+        for r in rows:
+            qid = int(r[0])
+            ans = normalize_answer(r[1])
+            vec = tuple(int(r[i] or 0) for i in range(2, 6))
+            index[(qid, ans)] = len(vecs)
+            vecs.append(vec)
+            cur = per_q.setdefault(qid, [0, 0, 0, 0])
+            for i in range(4):
+                cur[i] = max(cur[i], vec[i])
+
+        # last row = "no mapping" -> zeros
+        self.weights = np.zeros((len(vecs) + 1, 4), dtype=np.int64)
+        if vecs:
+            self.weights[:-1] = np.asarray(vecs, dtype=np.int64)
+        self.weights.setflags(write=False)
+        self.index = index
+        # per phase: sum over questions of the best answer's weight
+        m = np.asarray(list(per_q.values()) or [[0, 0, 0, 0]], dtype=np.int64).sum(axis=0)
+        self.maxima = tuple(int(x) for x in m)
+        self.version = version
+        self.signature = signature
+        self.loaded_at = time.monotonic()
+
+    @property
+    def miss(self) -> int:
+        return self.weights.shape[0] - 1
+
+    def lookup(self, question_ids, answers) -> np.ndarray:
+        """Row indices for parallel sequences of question ids and raw answers."""
+        idx = self.index
+        miss = self.miss
+        return np.fromiter(
+            (idx.get((int(q), normalize_answer(a)), miss) for q, a in zip(question_ids, answers)),
+            dtype=np.int64,
+        )
+
+    def score(self, question_ids, answers) -> tuple[int, int, int, int]:
+        """Phase totals for one run's responses."""
+        rows = self.lookup(question_ids, answers)
+        if rows.size == 0:
+            return (0, 0, 0, 0)
+        tot = self.weights[rows].sum(axis=0)
+        return tuple(int(x) for x in tot)
+
+
+# ---- process-wide cache ------------------------------------------------------
+_lock = threading.Lock()
+_current: ScoringMap | None = None
+_version = 0
+_checked_at = 0.0
+
+
+def _ttl() -> float:
+    if has_app_context():
+        return float(current_app.config.get("LOSS_SCORING_MAP_TTL", 60))
+    return 60.0
+
+
+def invalidate_scoring_map() -> None:
+    """Drop the cached snapshot; the next caller reloads it."""
+    global _current
+    with _lock:
+        _current = None
+
+
+def get_scoring_map(force: bool = False) -> ScoringMap:
+    global _current, _version, _checked_at
+    snap = _current
+    now = time.monotonic()
+    if snap is not None and not force and (now - _checked_at) < _ttl():
+        return snap
+
+    with _lock:
+        snap = _current
+        rows = db.session.execute(_SQL_MAP).all()
+        sig = rows_digest(rows)
+        _checked_at = time.monotonic()
+        if snap is not None and not force and snap.signature == sig:
+            return snap
+        _version += 1
+        snap = ScoringMap(rows, _version, sig)
+        _current = snap
+        return snap
+
+
+# ---- run scoring -------------------------------------------------------------
+def _result_dict(run_id, user_id, totals, latest_ts) -> dict:
+    p1, p2, p3, p4 = totals
+    return {
+        "run_id": int(run_id),
+        "user_id": int(user_id) if user_id is not None else None,
+        "subject": "LOSS",
+        "phase_1": p1,
+        "phase_2": p2,
+        "phase_3": p3,
+        "phase_4": p4,
+        "total": p1 + p2 + p3 + p4,
+        "created_at": latest_ts,
+    }
+
+
+def compute_run_result(run_id: int) -> dict | None:
+    """
+    Phase totals for one run, shaped like the old _compute_result_from_run().
+    Returns None when the run has no responses.
+    """
+    rows = db.session.execute(
+        text(_SQL_RESPONSES + " WHERE r.run_id = :rid"), {"rid": run_id}
+    ).all()
+    if not rows:
+        return None
+    smap = get_scoring_map()
+    totals = smap.score([r[2] for r in rows], [r[3] for r in rows])
+    user_id = max((r[1] for r in rows if r[1] is not None), default=None)
+    latest = max((r[4] for r in rows if r[4] is not None), default=None)
+    return _result_dict(run_id, user_id, totals, latest)
+
+
+def score_runs(run_ids: Iterable[int] | None = None) -> dict[int, dict]:
+    """
+    Bulk mode: score many runs from a single lca_response scan.
+    run_ids=None scores every run that has responses.
+    Returns {run_id: result dict}.
+    """
+    if run_ids is None:
+        rows = db.session.execute(text(_SQL_RESPONSES)).all()
+    else:
+        ids = sorted({int(r) for r in run_ids})
+        if not ids:
+            return {}
+        stmt = text(_SQL_RESPONSES + " WHERE r.run_id IN :ids").bindparams(
+            bindparam("ids", expanding=True)
+        )
+        rows = db.session.execute(stmt, {"ids": ids}).all()
+    return score_rows(rows)
+
+
+def score_rows(rows) -> dict[int, dict]:
+    """Score pre-fetched (run_id, user_id, question_id, answer, created_at) rows."""
+    if not rows:
+        return {}
+    smap = get_scoring_map()
+
+    run_col = np.fromiter((int(r[0]) for r in rows), dtype=np.int64, count=len(rows))
+    map_rows = smap.lookup((r[2] for r in rows), (r[3] for r in rows))
+    runs, inv = np.unique(run_col, return_inverse=True)
+
+    # (n_runs, 4) totals: sum weight vectors grouped by run
+    totals = np.zeros((runs.size, 4), dtype=np.int64)
+    np.add.at(totals, inv, smap.weights[map_rows])
+
+    users: dict[int, int] = {}
+    latest: dict[int, object] = {}
+    for r in rows:
+        rid = int(r[0])
+        if r[1] is not None and (rid not in users or r[1] > users[rid]):
+            users[rid] = r[1]
+        if r[4] is not None and (rid not in latest or r[4] > latest[rid]):
+            latest[rid] = r[4]
+
+    out: dict[int, dict] = {}
+    for i, rid in enumerate(runs.tolist()):
+        out[rid] = _result_dict(rid, users.get(rid), tuple(int(x) for x in totals[i]), latest.get(rid))
+    return out
+
+
+def scoring_map_info() -> dict:
+    snap = _current
+    if snap is None:
+        return {"loaded": False}
+    return {
+        "loaded": True,
+        "version": snap.version,
+        "rows": snap.miss,
+        "maxima": snap.maxima,
+        "age_s": round(time.monotonic() - snap.loaded_at, 1),
+    }
@@ -5,6 +5,8 @@ from flask import (
 from app.utils import reading_utils
 #from app.utils.role_utils import is_admin  # reuse your helper
 from app.extensions import db
+from app.subject_reading.lesson_state import invalidate_lesson_catalog
+from app.subject_reading.media import media_url
 from app.models.reading import RdpLesson,RdpLearnerProgress
 from app.utils.roles import is_admin
 from .. import admin_bp
@@ -57,6 +59,7 @@ def api_reorder_lessons(subject: str):
     for idx, lid in enumerate(ids, start=1):
         db.session.query(RdpLesson).filter_by(id=lid).update({"order": idx})
     db.session.commit()
+    invalidate_lesson_catalog()   # bulk update: no ORM events
     return jsonify(ok=True)
 
 # ... existing admin_bp and routes ...
@@ -262,6 +265,7 @@ def preview_lesson(lesson_id: int):
         "admin/reading/lesson_preview.html",
         lesson=lesson,
         media_relpath=media,
+        media_src=media_url(media) if media else None,
     )
 
 @admin_bp.route("/<subject>/lesson/<int:lesson_id>/edit", methods=["GET", "POST"], endpoint="edit_lesson")
@@ -6,6 +6,7 @@ from app.models.loss import LcaResult
 from app.utils import reading_utils
 from app.utils.role_utils import is_admin  # reuse your helper
 from app.extensions import db
+from app.subject_reading.lesson_state import invalidate_lesson_catalog
 from app.models.reading import RdpLesson
 from .. import admin_bp
 #admin_bp = Blueprint("admin_bp", __name__, url_prefix="/admin")
@@ -61,6 +62,7 @@ def api_reorder_lessons(subject: str):
     for idx, lid in enumerate(ids, start=1):
         db.session.query(RdpLesson).filter_by(id=lid).update({"order": idx})
     db.session.commit()
+    invalidate_lesson_catalog()   # bulk update: no ORM events
     return jsonify(ok=True)
 
 # ... existing admin_bp and routes ...
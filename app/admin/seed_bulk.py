@@ -0,0 +1,352 @@
+# app/admin/seed_bulk.py
+"""
+Bulk CSV seed loader shared by the seed importers.
+
+The importers used to run one INSERT .. ON CONFLICT (or one ORM get + setattr)
+per CSV row. Here a CSV is read in chunks of SEED_IMPORT_CHUNK rows, each
+chunk is coerced column by column, and written with one executemany:
+
+  SQLite / others  changed rows only: INSERT .. ON CONFLICT (key) DO UPDATE
+  PostgreSQL       all keyed rows into a temp staging table, then one
+                   INSERT .. SELECT .. ON CONFLICT DO UPDATE .. WHERE IS
+                   DISTINCT FROM merge
+  replace          the existing keys missing from the CSV deleted by key
+
+Before writing, the table's current rows are read once and every CSV row is
+classified against them, which gives the stats returned by import_csv() and,
+with dry_run=True, a diff preview without touching the table:
+
+  {"rows", "inserted", "updated", "unchanged", "deleted", "skipped", "duplicates"}
+
+A key that appears more than once in the CSV is written once, from its last
+row (as the old row-by-row upserts left it); the earlier rows are counted in
+"duplicates" instead of inserted / updated / unchanged. PostgreSQL rejects an
+INSERT .. ON CONFLICT that touches the same row twice, so this also keeps the
+executemany and the staged merge valid.
+
+A SeedSpec describes the table: its columns, the key rows are matched on and
+per-column types ("int", "float", "bool", "flag" = 0/1 int, "lower"; anything
+else is stripped text). Tables whose key has no unique constraint
+(upsert=False) are always replaced: one DELETE, then the rows in chunks.
+"""
+from __future__ import annotations
+
+import csv
+from typing import Iterable, Iterator, Mapping, NamedTuple
+
+from flask import current_app, has_app_context
+from sqlalchemy import text
+
+from app.extensions import db
+
+DEFAULT_CHUNK = 1000
+
+_TRUE = {"1", "true", "t", "yes", "y", "on"}
+_FALSE = {"0", "false", "f", "no", "n", "off"}
+
+
+class SeedSpec(NamedTuple):
+    table: str
+    cols: tuple[str, ...]
+    key: tuple[str, ...] = ("id",)
+    types: Mapping[str, str] = {}
+    upsert: bool = True           # key is unique in the table (ON CONFLICT target)
+    required: tuple[str, ...] = ()  # rows with any of these empty are skipped
+
+
+def spec_for_model(model, cols: Iterable[str] | None = None, key: tuple[str, ...] | None = None) -> SeedSpec:
+    """SeedSpec from a SQLAlchemy model: types from the column types, key from the primary key."""
+    table = model.__table__
+    cols = tuple(cols or (c.name for c in table.columns))
+    types = {}
+    for name in cols:
+        col = table.columns.get(name)
+        if col is None:
+            continue
+        try:
+            py = col.type.python_type
+        except NotImplementedError:
+            continue
+        types[name] = {int: "int", float: "float", bool: "bool"}.get(py, "text")
+    return SeedSpec(
+        table=table.name,
+        cols=cols,
+        key=key or tuple(c.name for c in table.primary_key.columns),
+        types=types,
+    )
+
+
+# ---- coercion ----------------------------------------------------------------
+def _text(v):
+    if v is None:
+        return None
+    return str(v).replace("\ufeff", "").strip()
+
+
+def _int(v):
+    if v is None or v == "":
+        return None
+    if isinstance(v, (int, float)):
+        return int(v)
+    try:
+        return int(str(v).strip())
+    except ValueError:
+        try:
+            return int(float(str(v).strip()))
+        except ValueError:
+            return None
+
+
+def _float(v):
+    if v is None or v == "":
+        return None
+    try:
+        return float(str(v).strip())
+    except ValueError:
+        return None
+
+
+def _bool(v):
+    if v is None or v == "":
+        return None
+    if isinstance(v, bool):
+        return v
+    return str(v).strip().lower() in _TRUE
+
+
+def _flag(v):
+    s = "" if v is None else str(v).strip().lower()
+    if s in _TRUE:
+        return 1
+    if s in _FALSE:
+        return 0
+    try:
+        return 1 if int(s) != 0 else 0
+    except ValueError:
+        return 1
+
+
+def _lower(v):
+    s = _text(v)
+    return s.lower() if s is not None else None
+
+
+_CONVERTERS = {"int": _int, "float": _float, "bool": _bool, "flag": _flag, "lower": _lower}
+
+
+def coerce_rows(spec: SeedSpec, raw: list[Mapping]) -> list[dict]:
+    """Coerce a chunk column by column (one converter pass per column)."""
+    columns = {}
+    for c in spec.cols:
+        conv = _CONVERTERS.get(spec.types.get(c, "text"), _text)
+        columns[c] = list(map(conv, (r.get(c) for r in raw)))
+    return [dict(zip(spec.cols, vals)) for vals in zip(*(columns[c] for c in spec.cols))] if raw else []
+
+
+def iter_chunks(spec: SeedSpec, fh, chunk: int | None = None, strict: bool = True) -> Iterator[list[dict]]:
+    """
+    Coerced rows from a CSV text stream, `chunk` at a time. Header names are
+    stripped; with strict=True a missing column raises ValueError, otherwise
+    it reads as empty.
+    """
+    chunk = chunk or _chunk_size()
+    reader = csv.DictReader(fh)
+    headers = [(h or "").replace("\ufeff", "").strip() for h in (reader.fieldnames or [])]
+    reader.fieldnames = headers
+    missing = [c for c in spec.cols if c not in headers]
+    if strict and missing:
+        raise ValueError(f"CSV for {spec.table} is missing columns: {missing}. Found: {headers}")
+
+    buf: list[Mapping] = []
+    for raw in reader:
+        if not raw or not any((v or "").strip() for v in raw.values() if isinstance(v, str)):
+            continue
+        buf.append(raw)
+        if len(buf) >= chunk:
+            yield coerce_rows(spec, buf)
+            buf = []
+    if buf:
+        yield coerce_rows(spec, buf)
+
+
+def _chunk_size() -> int:
+    if has_app_context():
+        return int(current_app.config.get("SEED_IMPORT_CHUNK", DEFAULT_CHUNK))
+    return DEFAULT_CHUNK
+
+
+# ---- SQL ---------------------------------------------------------------------
+def _q(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _col_list(cols: Iterable[str]) -> str:
+    return ", ".join(_q(c) for c in cols)
+
+
+def _insert_sql(table: str, cols: tuple[str, ...]) -> str:
+    return f"INSERT INTO {_q(table)} ({_col_list(cols)}) VALUES ({', '.join(':' + c for c in cols)})"
+
+
+def _upsert_sql(spec: SeedSpec) -> str:
+    updates = ", ".join(f"{_q(c)} = excluded.{_q(c)}" for c in spec.cols if c not in spec.key)
+    action = f"DO UPDATE SET {updates}" if updates else "DO NOTHING"
+    return f"{_insert_sql(spec.table, spec.cols)} ON CONFLICT ({_col_list(spec.key)}) {action}"
+
+
+def _existing(spec: SeedSpec) -> dict[tuple, tuple]:
+    """Current rows keyed like the CSV rows, values coerced the same way."""
+    rows = db.session.execute(text(f"SELECT {_col_list(spec.cols)} FROM {_q(spec.table)}")).mappings().all()
+    out = {}
+    for r in coerce_rows(spec, [dict(m) for m in rows]):
+        out[_key_of(spec, r)] = tuple(r[c] for c in spec.cols)
+    return out
+
+
+def _key_of(spec: SeedSpec, row: Mapping) -> tuple:
+    return tuple(row[k] for k in spec.key) if spec.key else tuple(row[c] for c in spec.cols)
+
+
+def _is_pg() -> bool:
+    return db.session.get_bind().dialect.name == "postgresql"
+
+
+# ---- import ------------------------------------------------------------------
+def import_csv(spec: SeedSpec, fh, *, replace: bool = False, dry_run: bool = False,
+               chunk: int | None = None, strict: bool = True, commit: bool = True) -> dict:
+    """
+    Load a CSV text stream into spec.table and return the diff stats.
+    replace=True also deletes table rows whose key is not in the CSV.
+    dry_run=True only computes the stats (pre-import diff).
+    """
+    return load_chunks(spec, iter_chunks(spec, fh, chunk, strict),
+                       replace=replace, dry_run=dry_run, commit=commit)
+
+
+def import_rows(spec: SeedSpec, rows: Iterable[Mapping], *, chunk: int | None = None, **kw) -> dict:
+    """import_csv() for rows already parsed into dicts (values may still be strings)."""
+    chunk = chunk or _chunk_size()
+
+    def chunks():
+        buf = []
+        for r in rows:
+            buf.append(r)
+            if len(buf) >= chunk:
+                yield coerce_rows(spec, buf)
+                buf = []
+        if buf:
+            yield coerce_rows(spec, buf)
+
+    return load_chunks(spec, chunks(), **kw)
+
+
+def preview_csv(spec: SeedSpec, fh, *, replace: bool = False, strict: bool = True) -> dict:
+    """Diff stats for loading `fh` into spec.table; nothing is written."""
+    return import_csv(spec, fh, replace=replace, dry_run=True, strict=strict)
+
+
+def load_chunks(spec: SeedSpec, chunks: Iterable[list[dict]], *, replace: bool = False,
+                dry_run: bool = False, commit: bool = True) -> dict:
+    """Classify and write coerced row chunks; see the module docstring."""
+    stats = {"rows": 0, "inserted": 0, "updated": 0, "unchanged": 0, "deleted": 0, "skipped": 0,
+             "duplicates": 0}
+    existing = _existing(spec)
+    seen: dict[tuple, str] = {}   # key -> how its latest row was counted
+    replace = replace or not spec.upsert
+    pg = not dry_run and spec.upsert and _is_pg()
+    staged = False
+    rest = tuple(c for c in spec.cols if c not in spec.key)
+
+    try:
+        if not dry_run and not spec.upsert:
+            db.session.execute(text(f"DELETE FROM {_q(spec.table)}"))
+
+        for rows in chunks:
+            # keyed / changed by key, so a repeated key keeps only its last row;
+            # keys without a unique constraint (upsert=False) may repeat
+            keyed, unkeyed, changed = {}, [], {}
+            restage = []
+            for r in rows:
+                if any(r[c] in (None, "") for c in spec.required):
+                    stats["skipped"] += 1
+                    continue
+                stats["rows"] += 1
+                k = _key_of(spec, r)
+                if spec.key and any(v is None for v in k):
+                    # no key: always a new row, the table assigns the id
+                    unkeyed.append({c: r[c] for c in rest})
+                    stats["inserted"] += 1
+                    continue
+                dup = spec.upsert and k in seen
+                if dup:
+                    # the earlier row is superseded; an earlier chunk may have written or staged it
+                    stats["duplicates"] += 1
+                    stats[seen[k]] -= 1
+                    if k not in keyed:
+                        restage.append(k)
+                old = existing.get(k)
+                if old is None:
+                    state = "inserted"
+                elif old != tuple(r[c] for c in spec.cols):
+                    state = "updated"
+                else:
+                    state = "unchanged"
+                stats[state] += 1
+                seen[k] = state
+                slot = k if spec.upsert else stats["rows"]
+                keyed[slot] = r
+                if state != "unchanged" or dup:
+                    changed[slot] = r
+            if dry_run:
+                continue
+
+            if not spec.upsert:
+                # table was emptied: every row goes back in
+                if keyed:
+                    db.session.execute(text(_insert_sql(spec.table, spec.cols)), list(keyed.values()))
+            elif pg:
+                if keyed:
+                    if not staged:
+                        db.session.execute(text("DROP TABLE IF EXISTS _seed_stage"))
+                        db.session.execute(text(
+                            f"CREATE TEMP TABLE _seed_stage (LIKE {_q(spec.table)} INCLUDING DEFAULTS) ON COMMIT DROP"
+                        ))
+                        staged = True
+                    if restage:
+                        where = " AND ".join(f"{_q(c)} = :{c}" for c in spec.key)
+                        db.session.execute(text(f"DELETE FROM _seed_stage WHERE {where}"),
+                                           [dict(zip(spec.key, k)) for k in restage])
+                    db.session.execute(text(_insert_sql("_seed_stage", spec.cols)), list(keyed.values()))
+            elif changed:
+                db.session.execute(text(_upsert_sql(spec)), list(changed.values()))
+            if unkeyed:
+                db.session.execute(text(_insert_sql(spec.table, rest)), unkeyed)
+
+        gone = [k for k in existing if k not in seen] if replace else []
+        stats["deleted"] = len(gone)
+        if dry_run:
+            return stats
+
+        if staged:
+            cols = _col_list(spec.cols)
+            if rest:
+                updates = ", ".join(f"{_q(c)} = excluded.{_q(c)}" for c in rest)
+                action = (f"DO UPDATE SET {updates} WHERE ({', '.join('t.' + _q(c) for c in rest)}) "
+                          f"IS DISTINCT FROM ({', '.join('excluded.' + _q(c) for c in rest)})")
+            else:
+                action = "DO NOTHING"
+            db.session.execute(text(
+                f"INSERT INTO {_q(spec.table)} AS t ({cols}) SELECT {cols} FROM _seed_stage "
+                f"ON CONFLICT ({_col_list(spec.key)}) {action}"
+            ))
+        if gone and spec.upsert:
+            # only the keys missing from the CSV: unkeyed rows inserted above stay
+            where = " AND ".join(f"{_q(k)} = :{k}" for k in spec.key)
+            db.session.execute(text(f"DELETE FROM {_q(spec.table)} WHERE {where}"),
+                               [dict(zip(spec.key, k)) for k in gone])
+        if commit:
+            db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return stats
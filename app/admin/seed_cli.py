@@ -5,12 +5,36 @@ from pathlib import Path
 from flask import current_app
 from sqlalchemy import text
 from app.extensions import db
+from app.admin.seed_bulk import SeedSpec, import_rows
 
 SEED_DIR = Path(__file__).resolve().parent / "seed"
 PHASES_CSV        = SEED_DIR / "lca_phase.csv"
 PHASE_ITEMS_CSV   = SEED_DIR / "lca_phase_item.csv"
 SCORING_MAP_CSV   = SEED_DIR / "lca_scoring_map.csv"
 
+PHASES_SPEC = SeedSpec(
+    table="lca_phase",
+    cols=("id", "order_index", "name", "max_points", "points_per_item", "high_is_positive", "neutral_line", "active"),
+    types={"id": "int", "order_index": "int", "max_points": "int", "points_per_item": "int",
+           "high_is_positive": "flag", "active": "flag"},
+)
+# lca_phase_item has no natural unique key in the CSV: always replaced
+PHASE_ITEMS_SPEC = SeedSpec(
+    table="lca_phase_item",
+    cols=("phase_id", "ordinal", "body", "active"),
+    key=("phase_id", "ordinal"),
+    types={"phase_id": "int", "ordinal": "int", "active": "flag"},
+    upsert=False,
+    required=("phase_id", "ordinal"),
+)
+SCORING_MAP_SPEC = SeedSpec(
+    table="lca_scoring_map",
+    cols=("question_id", "answer_type", "phase_1", "phase_2", "phase_3", "phase_4"),
+    key=("question_id", "answer_type"),
+    types={"question_id": "int", "answer_type": "lower",
+           "phase_1": "int", "phase_2": "int", "phase_3": "int", "phase_4": "int"},
+)
+
 def _truthy(v) -> int:
     s = str(v).strip().lower()
     if s in {"1","true","t","yes","y","on"}:  return 1
@@ -40,7 +64,6 @@ def import_phases_from_csv(csv_path: str | Path = PHASES_CSV) -> int:
         )
     """))
 
-    n = 0
     with path.open(newline="", encoding="utf-8-sig") as f:
         rdr = csv.DictReader(f)
         need = {"id","order_index","name","max_points","points_per_item",
@@ -51,32 +74,14 @@ def import_phases_from_csv(csv_path: str | Path = PHASES_CSV) -> int:
             current_app.logger.error("Phases CSV missing headers: %s. Found: %s", missing, list(found))
             return 0
 
-        for row in rdr:
-            db.session.execute(text("""
-                INSERT INTO lca_phase
-                (id, order_index, name, max_points, points_per_item, high_is_positive, neutral_line, active)
-                VALUES (:id,:oi,:name,:max,:ppi,:hip,:nl,:act)
-                ON CONFLICT(id) DO UPDATE SET
-                  order_index=excluded.order_index,
-                  name=excluded.name,
-                  max_points=excluded.max_points,
-                  points_per_item=excluded.points_per_item,
-                  high_is_positive=excluded.high_is_positive,
-                  neutral_line=excluded.neutral_line,
-                  active=excluded.active
-            """), {
-                "id":   int(row["id"]),
-                "oi":   int(row["order_index"]),
-                "name": (row["name"] or "").strip(),
-                "max":  int(row["max_points"]),
-                "ppi":  int(row["points_per_item"]),
-                "hip":  _truthy(row["high_is_positive"]),
-                "nl":   (row.get("neutral_line") or "No notable markers in this phase.").strip(),
-                "act":  _truthy(row["active"]),
-            })
-            n += 1
+        default_line = "No notable markers in this phase."
+        stats = import_rows(PHASES_SPEC, (
+            {**row, "neutral_line": (row.get("neutral_line") or "").strip() or default_line} for row in rdr
+        ), commit=False)
+        n = stats["rows"]
     db.session.commit()
-    current_app.logger.info("Imported/updated %s lca_phase rows.", n)
+    current_app.logger.info("Imported/updated %s lca_phase rows (%s inserted, %s updated, %s unchanged).",
+                            n, stats["inserted"], stats["updated"], stats["unchanged"])
     return n
 
 def import_phase_items_from_csv(csv_path: str | Path = PHASE_ITEMS_CSV) -> tuple[int,int]:
@@ -94,8 +99,6 @@ def import_phase_items_from_csv(csv_path: str | Path = PHASE_ITEMS_CSV) -> tuple
         )
     """))
 
-    imported, skipped = 0, 0
-    rows = []
     with path.open(newline="", encoding="utf-8-sig") as f:
         rdr = csv.DictReader(f)
         need = {"phase_id","ordinal","body","active"}
@@ -105,27 +108,13 @@ def import_phase_items_from_csv(csv_path: str | Path = PHASE_ITEMS_CSV) -> tuple
             current_app.logger.error("Phase items CSV missing headers: %s. Found: %s", missing, list(found))
             return (0,0)
 
-        for r in rdr:
-            pid = (r.get("phase_id") or "").strip()
-            ord_ = (r.get("ordinal") or "").strip()
-            if not pid.isdigit() or not ord_.isdigit():
-                skipped += 1
-                continue
-            rows.append({
-                "phase_id": int(pid),
-                "ordinal":  int(ord_),
-                "body":     (r.get("body") or "").strip(),
-                "active":   _truthy(r.get("active", 1)),
-            })
-            imported += 1
-
-    db.session.execute(text("DELETE FROM lca_phase_item"))
-    for r in rows:
-        db.session.execute(text("""
-            INSERT INTO lca_phase_item (phase_id, ordinal, body, active)
-            VALUES (:phase_id, :ordinal, :body, :active)
-        """), r)
+        # non-numeric phase_id / ordinal coerce to NULL and are skipped
+        stats = import_rows(PHASE_ITEMS_SPEC, rdr, commit=False)
+    imported, skipped = stats["rows"], stats["skipped"]
+
     db.session.commit()
+    from app.admin.loss.content_store import reload_loss_content  # late import avoids circulars
+    reload_loss_content()
     current_app.logger.info("Imported %s lca_phase_item rows (skipped %s).", imported, skipped)
     return (imported, skipped)
 
@@ -137,12 +126,13 @@ def import_scoring_map_from_csv(csv_path: str | Path = SCORING_MAP_CSV) -> int:
 
     db.session.execute(text("""
         CREATE TABLE IF NOT EXISTS lca_scoring_map (
-          question_id INTEGER PRIMARY KEY,
+          question_id INTEGER NOT NULL,
           answer_type TEXT    NOT NULL,
           phase_1     INTEGER NOT NULL,
           phase_2     INTEGER NOT NULL,
           phase_3     INTEGER NOT NULL,
-          phase_4     INTEGER NOT NULL
+          phase_4     INTEGER NOT NULL,
+          PRIMARY KEY (question_id, answer_type)
         )
     """))
 
@@ -155,24 +145,14 @@ def import_scoring_map_from_csv(csv_path: str | Path = SCORING_MAP_CSV) -> int:
             current_app.logger.error("Scoring CSV missing headers: %s. Found: %s", missing, list(found))
             return 0
 
-        db.session.execute(text("DELETE FROM lca_scoring_map"))
-        n = 0
-        for row in rdr:
-            db.session.execute(text("""
-                INSERT INTO lca_scoring_map
-                (question_id, answer_type, phase_1, phase_2, phase_3, phase_4)
-                VALUES (:q, :a, :p1, :p2, :p3, :p4)
-            """), {
-                "q":  int(row["question_id"]),
-                "a":  (row["answer_type"] or "").strip().lower(),
-                "p1": int(row["phase_1"]),
-                "p2": int(row["phase_2"]),
-                "p3": int(row["phase_3"]),
-                "p4": int(row["phase_4"]),
-            })
-            n += 1
+        # replace: rows not in the CSV are deleted, unchanged rows are left alone
+        stats = import_rows(SCORING_MAP_SPEC, rdr, replace=True, commit=False)
+        n = stats["rows"]
     db.session.commit()
-    current_app.logger.info("Imported %s lca_scoring_map rows.", n)
+    from app.admin.loss.scoring_engine import invalidate_scoring_map  # late import avoids circulars
+    invalidate_scoring_map()
+    current_app.logger.info("Imported %s lca_scoring_map rows (%s inserted, %s updated, %s deleted).",
+                            n, stats["inserted"], stats["updated"], stats["deleted"])
     return n
 '''
 def recompute_phase_maxima_sql() -> dict[int,int]:
@@ -19,6 +19,7 @@ from app.models.loss import (
     LcaPause,
 )
 from app.seed.seed_simple import SEEDS
+from app.admin.seed_bulk import import_rows, spec_for_model
 
 # -------- generic utils --------
 def columns_for(model) -> List[str]:
@@ -74,48 +75,34 @@ def seed_export_csv_response(model, filename: str):
     resp.headers["Content-Disposition"] = f'attachment; filename="{filename}"'
     return resp
 
+def _ids_from_code(model, rows):
+    """Fill a missing id from an existing row with the same 'code' (one lookup query)."""
+    ids = {str(c): i for c, i in db.session.execute(select(model.code, model.id)).all()}
+    for r in rows:
+        if not (r.get("id") or "").strip() and r.get("code") in ids:
+            r = {**r, "id": ids[r["code"]]}
+        yield r
+
 def seed_import_csv_stream(model, file_storage) -> Tuple[int, int, int]:
     """
-    Upsert rows from a CSV FileStorage into model by id (or 'code' if present).
-    Returns (added, updated, skipped).
+    Upsert rows from a CSV FileStorage into model by id (or 'code' if present),
+    in bulk chunks. Only columns present in the CSV are written.
+    Returns (added, updated, skipped); unchanged rows count as skipped.
     """
     if not file_storage or not file_storage.filename.lower().endswith(".csv"):
         abort(400, description="Please upload a .csv file.")
 
-    cols = set(columns_for(model))
-    data = file_storage.stream.read().decode("utf-8", errors="ignore")
-    reader = csv.DictReader(StringIO(data))
-    added = updated = skipped = 0
-
-    for r in reader:
-        obj = None
-        # lookup by id first
-        if r.get("id"):
-            try:
-                obj = db.session.get(model, int(r["id"]))
-            except Exception:
-                obj = None
-        # fallback: by 'code' if that column exists
-        if obj is None and "code" in cols and r.get("code"):
-            obj = db.session.execute(select(model).where(getattr(model, "code") == r["code"])).scalars().first()
-
-        created = False
-        if obj is None:
-            obj = model()
-            created = True
-
-        # set only known columns
-        for k, v in r.items():
-            if k not in cols:
-                continue
-            setattr(obj, k, _coerce(model, k, v))
-
-        db.session.add(obj)
-        added += 1 if created else 0
-        updated += 0 if created else 1
-
-    db.session.commit()
-    return added, updated, skipped
+    fh = io.TextIOWrapper(file_storage.stream, encoding="utf-8", errors="ignore", newline="")
+    reader = csv.DictReader(fh)
+    headers = [(h or "").strip() for h in (reader.fieldnames or [])]
+    reader.fieldnames = headers
+    model_cols = columns_for(model)
+    cols = [c for c in model_cols if c in headers or c == "id"]
+    spec = spec_for_model(model, cols=cols, key=("id",))
+
+    rows = _ids_from_code(model, reader) if "code" in model_cols else reader
+    stats = import_rows(spec, rows)
+    return stats["inserted"], stats["updated"], stats["skipped"] + stats["unchanged"]
 
 def registry_meta(registry: Dict[str, Type]):
     """Return list of dicts with seed key, title, and columns for UI."""
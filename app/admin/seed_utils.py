@@ -10,6 +10,7 @@ from sqlalchemy.exc import SQLAlchemyError
 from io import StringIO
 from sqlalchemy import text, inspect
 from app.extensions import db   # <-- not `from app import db`
+from app.admin.seed_bulk import SeedSpec, import_csv, import_rows, preview_csv
 
 # --- Canonical registry of seeds -------------------------------------------
 from pathlib import Path
@@ -164,52 +165,21 @@ def normalize_row(seed_key: str, row: dict) -> dict:
         out[col] = val
     return out
 
-def import_csv_stream(seed_key: str, file_like) -> int:
-    if seed_key not in SEED_TABLES:
-        raise ValueError(f"Unknown seed '{seed_key}'")
-    meta = SEED_TABLES[seed_key]
-    if not db_has_table(meta["table"]):
-        return 0
-
-    cols = meta["cols"]; pk = meta["pk"]; table = meta["table"]
-
-    reader = csv.DictReader(file_like)
-    if reader.fieldnames:
-        reader.fieldnames = [fn.strip() for fn in reader.fieldnames]
-
-    # Header check
-    missing, extra = validate_csv_headers(seed_key, reader.fieldnames or [])
-    if missing or extra:
-        raise ValueError(
-            f"Header mismatch. Missing: {missing or '—'}; Extra: {extra or '—'}; "
-            f"Expected exactly: {cols}"
-        )
-
-    insert_cols  = ", ".join(cols)
-    placeholders = ", ".join(f":{c}" for c in cols)
-    update_set   = ", ".join(f"{c}=excluded.{c}" for c in cols if c != pk)
-
-    sql = text(f"""
-        INSERT INTO {table} ({insert_cols})
-        VALUES ({placeholders})
-        ON CONFLICT({pk}) DO UPDATE SET {update_set}
-    """)
-
-    written = 0
-    try:
-        for raw in reader:
-            if not raw:
-                continue
-            row = { (k or "").strip(): v for k, v in raw.items() }
-            row = normalize_row(seed_key, row)
-            db.session.execute(sql, row)
-            written += 1
-        db.session.commit()
-    except Exception:
-        db.session.rollback()
-        raise
-    return written
-
+def resolve_seed(seed: str) -> str:
+    """SEED_TABLES key for a seed name (canon_seed() spells keys with hyphens)."""
+    for k in (seed, canon_seed(seed), canon_seed(seed).replace("-", "_")):
+        k = SEED_ALIASES.get(k, k)
+        if k in SEED_TABLES:
+            return k
+    raise ValueError(f"Unknown seed '{seed}'")
+
+def seed_spec(seed: str) -> SeedSpec:
+    """Bulk-loader spec for a SEED_TABLES entry (same coercions as normalize_row)."""
+    meta = SEED_TABLES[resolve_seed(seed)]
+    types = {c: "int" for c in meta["cols"] if c in ("id", "phase_id", "ordinal", "number")}
+    if "active" in meta["cols"]:
+        types["active"] = "bool"
+    return SeedSpec(table=meta["table"], cols=tuple(meta["cols"]), key=(meta["pk"],), types=types)
 
 # add near the top
 from typing import List, Tuple
@@ -391,38 +361,48 @@ def validate_csv_headers(seed: str, hdrs: Iterable[str]) -> Tuple[List[str], Lis
 
 # ---------------- Import -----------------------------------------------------
 
+def _reload_content(table: str) -> None:
+    from app.admin.loss.content_store import CONTENT_TABLES, reload_loss_content  # late import avoids circulars
+    if table in CONTENT_TABLES:
+        reload_loss_content()
+
 def _import_rows(seed: str, rows: List[Dict]) -> int:
     """Replace table contents with given rows (simple + deterministic)."""
-    seed = canon_seed(seed)
-    meta = SEED_TABLES[seed]
-    table = meta["table"]
-    cols = meta["cols"]
-
     if not rows:
         return 0
-
-    # Normalize rows to expected columns
-    norm = [{c: r.get(c, None) for c in cols} for r in rows]
-
-    col_list = ", ".join(f'"{c}"' for c in cols)
-    val_list = ", ".join(f":{c}" for c in cols)
-    insert_sql = text(f'INSERT INTO "{table}" ({col_list}) VALUES ({val_list})')
-
-    with db.session.begin():
-        db.session.execute(text(f'DELETE FROM "{table}"'))
-        db.session.execute(insert_sql, norm)
-
-    return len(norm)
+    spec = seed_spec(seed)
+    stats = import_rows(spec, rows, replace=True)
+    _reload_content(spec.table)
+    return stats["rows"]
+
+def _text_stream(file_storage):
+    """Text reader over an uploaded FileStorage, its .stream, or an open text file."""
+    stream = getattr(file_storage, "stream", file_storage)
+    if isinstance(stream, io.TextIOBase):
+        return stream
+    return io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+
+def import_csv_stats(seed: str, file_like, dry_run: bool = False) -> dict:
+    """
+    Bulk import (replace) of a seed CSV; returns the inserted / updated /
+    unchanged / deleted counts. dry_run=True only computes them.
+    """
+    spec = seed_spec(seed)
+    if not db_has_table(spec.table):
+        return {"rows": 0, "inserted": 0, "updated": 0, "unchanged": 0, "deleted": 0, "skipped": 0,
+                "duplicates": 0}
+    fh = _text_stream(file_like)
+    if dry_run:
+        return preview_csv(spec, fh, replace=True, strict=False)
+    stats = import_csv(spec, fh, replace=True, strict=False)
+    _reload_content(spec.table)
+    return stats
 
 def import_csv_stream(seed: str, file_storage) -> int:
     """
     Import directly from an uploaded FileStorage (used if you want one-step import).
     """
-    seed = canon_seed(seed)
-    text_stream = io.TextIOWrapper(file_storage.stream, encoding="utf-8-sig", newline="")
-    reader = csv.DictReader(text_stream)
-    rows = list(reader)
-    return _import_rows(seed, rows)
+    return import_csv_stats(seed, file_storage)["rows"]
 
 def import_from_instance_file(seed: str) -> int:
     """
@@ -434,9 +414,7 @@ def import_from_instance_file(seed: str) -> int:
     if not path.exists():
         raise FileNotFoundError(path)
     with path.open("r", encoding="utf-8-sig", newline="") as f:
-        reader = csv.DictReader(f)
-        rows = list(reader)
-    return _import_rows(seed, rows)
+        return import_csv_stats(seed, f)["rows"]
 
 # ---------------- UI meta ----------------------------------------------------
 
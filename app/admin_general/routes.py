@@ -9,6 +9,7 @@ from sqlalchemy import text, text as sa_text
 from app.models.auth import AuthPricing, AuthSubject
 from app.extensions import db
 from app.payments.pricing import price_for_country
+from app.services.hit_buffer import hit_buffer
 from . import general_bp
 import io, asyncio, time
 import edge_tts
@@ -562,4 +563,11 @@ def traffic():
         """)
     ).all()
 
-    return render_template("admin_general/traffic.html", rows=rows)
+    return render_template("admin_general/traffic.html", rows=rows, buffer=hit_buffer.stats())
+
+
+@general_bp.route("/traffic/buffer")
+@login_required
+def traffic_buffer():
+    """Queued / flushed / dropped counters of the hit logging buffer."""
+    return jsonify(hit_buffer.stats())
@@ -0,0 +1,213 @@
+# app/jobs/loss_rebuild.py
+"""
+Bulk, resumable rebuild of lca_result.
+
+Runs are walked in keyset order (lca_run.id) in chunks. Per chunk:
+  - one lca_response scan scored in memory (scoring_engine.score_runs)
+  - one SELECT of the run_ids already in lca_result
+  - one executemany UPDATE + one executemany INSERT
+  - the job checkpoint (lca_rebuild_job.last_run_id) is advanced in the
+    same transaction, so an interrupted job resumes after the last
+    committed chunk.
+"""
+from __future__ import annotations
+
+import json
+import threading
+import time
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import bindparam, text
+
+from app.extensions import db
+from app.models.loss import LcaRebuildJob
+from app.admin.loss.scoring_engine import score_runs
+
+DEFAULT_CHUNK = 500
+
+_SQL_UPDATE = text("""
+    UPDATE lca_result
+       SET user_id=:user_id, phase_1=:phase_1, phase_2=:phase_2, phase_3=:phase_3, phase_4=:phase_4,
+           total=:total, created_at=:created_at, subject=:subject
+     WHERE run_id=:run_id
+""")
+
+_SQL_INSERT = text("""
+    INSERT INTO lca_result (user_id, phase_1, phase_2, phase_3, phase_4, total, created_at, run_id, subject)
+    VALUES (:user_id, :phase_1, :phase_2, :phase_3, :phase_4, :total, :created_at, :run_id, :subject)
+""")
+
+_SQL_EXISTING = text(
+    "SELECT DISTINCT run_id FROM lca_result WHERE run_id IN :ids"
+).bindparams(bindparam("ids", expanding=True))
+
+# threads started from the admin UI, keyed by job id (per process)
+_threads: dict[int, threading.Thread] = {}
+
+
+def _where(filters: dict) -> tuple[str, dict]:
+    clauses, params = [], {}
+    if filters.get("user_id"):
+        clauses.append("ru.user_id = :f_uid")
+        params["f_uid"] = int(filters["user_id"])
+    if filters.get("status"):
+        clauses.append("ru.status = :f_status")
+        params["f_status"] = str(filters["status"])
+    if filters.get("from_id"):
+        clauses.append("ru.id >= :f_from")
+        params["f_from"] = int(filters["from_id"])
+    if filters.get("to_id"):
+        clauses.append("ru.id <= :f_to")
+        params["f_to"] = int(filters["to_id"])
+    if filters.get("existing_only"):
+        clauses.append("EXISTS (SELECT 1 FROM lca_result x WHERE x.run_id = ru.id)")
+    return (" AND " + " AND ".join(clauses)) if clauses else "", params
+
+
+def create_job(filters: dict | None = None, chunk_size: int = DEFAULT_CHUNK) -> int:
+    filters = {k: v for k, v in (filters or {}).items() if v not in (None, "", False)}
+    where, params = _where(filters)
+    total = db.session.execute(
+        text(f"SELECT COUNT(*) FROM lca_run ru WHERE 1=1{where}"), params
+    ).scalar() or 0
+    job = LcaRebuildJob(
+        status="pending",
+        filters=json.dumps(filters, sort_keys=True),
+        chunk_size=max(1, int(chunk_size or DEFAULT_CHUNK)),
+        total=int(total),
+        updated_at=datetime.utcnow(),
+    )
+    db.session.add(job)
+    db.session.commit()
+    return job.id
+
+
+def latest_unfinished_job() -> LcaRebuildJob | None:
+    return (LcaRebuildJob.query
+            .filter(LcaRebuildJob.status.in_(("pending", "running", "failed")))
+            .order_by(LcaRebuildJob.id.desc())
+            .first())
+
+
+def job_status(job_id: int) -> dict | None:
+    job = db.session.get(LcaRebuildJob, job_id)
+    if not job:
+        return None
+    return {
+        "id": job.id,
+        "status": job.status,
+        "filters": json.loads(job.filters or "{}"),
+        "total": job.total,
+        "done": job.done,
+        "written": job.written,
+        "last_run_id": job.last_run_id,
+        "pct": round(100.0 * job.done / job.total, 1) if job.total else 100.0,
+        "error": job.error,
+        "updated_at": job.updated_at.isoformat() if job.updated_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+        "running_here": bool(_threads.get(job.id) and _threads[job.id].is_alive()),
+    }
+
+
+def _write_chunk(results: dict[int, dict]) -> int:
+    rows = [r for r in results.values() if r.get("user_id") is not None]
+    if not rows:
+        return 0
+    existing = {int(r[0]) for r in db.session.execute(_SQL_EXISTING, {"ids": [r["run_id"] for r in rows]})}
+    updates = [r for r in rows if r["run_id"] in existing]
+    inserts = [r for r in rows if r["run_id"] not in existing]
+    if updates:
+        db.session.execute(_SQL_UPDATE, updates)
+    if inserts:
+        db.session.execute(_SQL_INSERT, inserts)
+    return len(rows)
+
+
+def run_job(job_id: int, progress=None) -> dict:
+    """
+    Process job_id from its checkpoint to the end.
+    progress(status_dict, runs_per_sec) is called after every committed chunk.
+    """
+    job = db.session.get(LcaRebuildJob, job_id)
+    if job is None:
+        raise ValueError(f"No lca_rebuild_job with id {job_id}")
+    if job.status == "done":
+        return job_status(job_id)
+
+    filters = json.loads(job.filters or "{}")
+    where, params = _where(filters)
+    chunk = job.chunk_size or DEFAULT_CHUNK
+    sel = text(f"""
+        SELECT ru.id FROM lca_run ru
+        WHERE ru.id > :after{where}
+        ORDER BY ru.id
+        LIMIT :lim
+    """)
+
+    job.status = "running"
+    job.error = None
+    job.updated_at = datetime.utcnow()
+    db.session.commit()
+
+    t0 = time.monotonic()
+    processed = 0
+    try:
+        while True:
+            ids = [int(r[0]) for r in db.session.execute(
+                sel, {**params, "after": job.last_run_id, "lim": chunk})]
+            if not ids:
+                break
+
+            written = _write_chunk(score_runs(ids))
+
+            job.last_run_id = ids[-1]
+            job.done = (job.done or 0) + len(ids)
+            job.written = (job.written or 0) + written
+            job.updated_at = datetime.utcnow()
+            db.session.commit()                         # chunk + checkpoint together
+
+            processed += len(ids)
+            if progress:
+                rate = processed / max(time.monotonic() - t0, 1e-6)
+                progress(job_status(job_id), rate)
+
+        job.status = "done"
+        job.finished_at = datetime.utcnow()
+        job.updated_at = job.finished_at
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        job = db.session.get(LcaRebuildJob, job_id)
+        job.status = "failed"
+        job.error = str(e)[:2000]
+        job.updated_at = datetime.utcnow()
+        db.session.commit()
+        raise
+
+    return job_status(job_id)
+
+
+def start_background(job_id: int) -> bool:
+    """Run job_id on a daemon thread of this process. False if already running here."""
+    t = _threads.get(job_id)
+    if t and t.is_alive():
+        return False
+    app = current_app._get_current_object()
+
+    def _task():
+        with app.app_context():
+            def _log(st, rate):
+                app.logger.info("[loss-rebuild] job %s: %s/%s runs (%.0f runs/s)",
+                                st["id"], st["done"], st["total"], rate)
+            try:
+                run_job(job_id, progress=_log)
+            except Exception as e:
+                app.logger.exception("[loss-rebuild] job %s failed: %s", job_id, e)
+            finally:
+                db.session.remove()
+
+    t = threading.Thread(target=_task, name=f"loss-rebuild-{job_id}", daemon=True)
+    _threads[job_id] = t
+    t.start()
+    return True
@@ -0,0 +1,372 @@
+# app/jobs/metsoa_batch.py
+"""
+Month-end METSOA batch: statements for every tenant of a month.
+
+Loading is a fixed number of set queries regardless of tenant count:
+  - one bil_consumption scan joined to meter/unit/tenant for the month
+  - one bil_meter_charge_map scan for the month
+  - tariffs from the cached tariff index (app/utils/tariff_index.py)
+
+Each tenant's statement is computed by the same pure function the per-tenant
+Page 1/2 view uses (billing_metsoa_builder.assemble_metsoa_payload), either
+in-process or over a process pool. Results are persisted per batch of
+tenants in one transaction with executemany upserts:
+  - bil_metsoa_meter_month   one row per (tenant, meter, month)
+  - bil_metsoa_tenant_month  WS/SD/water totals per tenant
+  - bil_tenant_ledger        "Due to Metro" charge   (post_ledger=True)
+  - bil_metsoa_breakdown     tier/fixed lines        (breakdown=True)
+
+dry_run=True computes everything and returns a diff against what is stored,
+without writing.
+"""
+from __future__ import annotations
+
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from sqlalchemy import bindparam, text
+
+from app.extensions import db
+from app.utils.billing_metsoa_builder import (
+    _MAP_ROWS_SQL, _first_of_month, _tariffs_by_code, assemble_metsoa_payload,
+)
+
+DEFAULT_BATCH = 200
+_EPS = 0.005
+
+_SQL_CONSUMPTION = """
+  SELECT
+    t.id                               AS tenant_id,
+    c.meter_id                         AS meter_id,
+    COALESCE(m.meter_number, CAST(m.id AS TEXT)) AS meter_label,
+    LOWER(m.utility_type)              AS utility_type,
+    c.last_date                        AS prev_date,
+    c.last_read                        AS prev_value,
+    c.new_date                         AS curr_date,
+    c.new_read                         AS curr_value,
+    c.days                             AS days,
+    c.consumption                      AS consumption
+  FROM bil_consumption c
+  JOIN bil_meter m ON m.id = c.meter_id
+  JOIN bil_sectional_unit su ON su.id = m.sectional_unit_id
+  JOIN bil_tenant t ON t.sectional_unit_id = su.id
+  WHERE c.month = :m
+"""
+_SQL_CONSUMPTION_ORDER = """
+  ORDER BY t.id,
+           CASE WHEN LOWER(m.utility_type) LIKE 'elec%%' THEN 0 ELSE 1 END,
+           m.meter_number
+"""
+
+_SQL_UPSERT_METER = text("""
+    INSERT INTO bil_metsoa_meter_month
+        (tenant_id, meter_id, month, utility_type,
+         prev_date, prev_read, curr_date, curr_read, days, consumption,
+         elec_rate, elec_due, ws_total, sd_total, water_cost, total_due, updated_at)
+    VALUES (:tenant_id, :meter_id, :month, :utility_type,
+            :prev_date, :prev_read, :curr_date, :curr_read, :days, :consumption,
+            :elec_rate, :elec_due, :ws_total, :sd_total, :water_cost, :total_due, CURRENT_TIMESTAMP)
+    ON CONFLICT (tenant_id, meter_id, month)
+    DO UPDATE SET
+        utility_type = excluded.utility_type,
+        prev_date    = excluded.prev_date,
+        prev_read    = excluded.prev_read,
+        curr_date    = excluded.curr_date,
+        curr_read    = excluded.curr_read,
+        days         = excluded.days,
+        consumption  = excluded.consumption,
+        elec_rate    = excluded.elec_rate,
+        elec_due     = excluded.elec_due,
+        ws_total     = excluded.ws_total,
+        sd_total     = excluded.sd_total,
+        water_cost   = excluded.water_cost,
+        total_due    = excluded.total_due,
+        updated_at   = CURRENT_TIMESTAMP
+""")
+
+_SQL_UPSERT_TENANT = text("""
+    INSERT INTO bil_metsoa_tenant_month
+        (tenant_id, month, ws_total, sd_total, water_total, updated_at)
+    VALUES (:tenant_id, :month, :ws_total, :sd_total, :water_total, CURRENT_TIMESTAMP)
+    ON CONFLICT (tenant_id, month)
+    DO UPDATE SET
+        ws_total    = excluded.ws_total,
+        sd_total    = excluded.sd_total,
+        water_total = excluded.water_total,
+        updated_at  = CURRENT_TIMESTAMP
+""")
+
+# same row the per-tenant metsoa_commit view posts
+_SQL_UPSERT_LEDGER = text("""
+    INSERT INTO bil_tenant_ledger
+      (tenant_id, month, description, kind, amount, debit, credit, txn_date, created_at)
+    VALUES
+      (:tenant_id, :month, 'Due to Metro', 'charge', :amount, :amount, 0, date(:month || '-01'), CURRENT_TIMESTAMP)
+    ON CONFLICT(tenant_id, month, kind, description)
+    DO UPDATE SET amount=excluded.amount, debit=excluded.debit, credit=excluded.credit, txn_date=excluded.txn_date
+""")
+
+_SQL_METSOA_IDS = text("""
+    SELECT id, tenant_id, meter_id FROM bil_metsoa_meter_month
+    WHERE month = :month AND tenant_id IN :tids
+""").bindparams(bindparam("tids", expanding=True))
+
+_SQL_DELETE_BREAKDOWN = text(
+    "DELETE FROM bil_metsoa_breakdown WHERE metsoa_id IN :ids"
+).bindparams(bindparam("ids", expanding=True))
+
+_SQL_INSERT_BREAKDOWN = text("""
+    INSERT INTO bil_metsoa_breakdown (metsoa_id, bucket, cons, rate, amount, sort_order)
+    VALUES (:metsoa_id, :bucket, :cons, :rate, :amount, :sort_order)
+""")
+
+_SQL_EXISTING_METERS = text("""
+    SELECT tenant_id, meter_id, elec_due, ws_total, sd_total, water_cost, total_due
+    FROM bil_metsoa_meter_month
+    WHERE month = :month AND tenant_id IN :tids
+""").bindparams(bindparam("tids", expanding=True))
+
+_SQL_EXISTING_LEDGER = text("""
+    SELECT tenant_id, amount FROM bil_tenant_ledger
+    WHERE month = :month AND kind = 'charge' AND description = 'Due to Metro'
+      AND tenant_id IN :tids
+""").bindparams(bindparam("tids", expanding=True))
+
+
+# ---- load --------------------------------------------------------------------
+def load_month(month_str: str, tenant_ids=None) -> dict:
+    """All inputs for the month in three set queries (+ cached tariffs)."""
+    params = {"m": month_str}
+    sql = _SQL_CONSUMPTION
+    if tenant_ids:
+        sql += " AND t.id IN :tids"
+        params["tids"] = sorted({int(t) for t in tenant_ids})
+    stmt = text(sql + _SQL_CONSUMPTION_ORDER)
+    if tenant_ids:
+        stmt = stmt.bindparams(bindparam("tids", expanding=True))
+
+    by_tenant: dict[int, list[dict]] = {}
+    for r in db.session.execute(stmt, params).mappings():
+        by_tenant.setdefault(int(r["tenant_id"]), []).append(dict(r))
+
+    meter_ids = {r["meter_id"] for rows in by_tenant.values() for r in rows}
+    maps: dict[int, list[dict]] = {}
+    if meter_ids:
+        rows = db.session.execute(
+            text(_MAP_ROWS_SQL + " ORDER BY meter_id, charge_code"),
+            {"md": _first_of_month(month_str)},
+        ).mappings()
+        for r in rows:
+            if r["meter_id"] in meter_ids:
+                maps.setdefault(r["meter_id"], []).append(dict(r))
+
+    return {
+        "month": month_str,
+        "tenants": by_tenant,
+        "maps": maps,
+        "tariffs": _tariffs_by_code(month_str),
+    }
+
+
+# ---- compute -----------------------------------------------------------------
+def _compute_chunk(args):
+    """Pool worker: pure computation, no DB access."""
+    month_str, chunk, tariffs = args
+    out = {}
+    for tid, base, maps in chunk:
+        out[tid] = assemble_metsoa_payload(month_str, base, tariffs, maps)
+    return out
+
+
+def compute_month(data: dict, workers: int = 1) -> dict[int, tuple[dict, dict]]:
+    """{tenant_id: (page1, page2)} for every tenant in `data`."""
+    month_str, tariffs, maps = data["month"], data["tariffs"], data["maps"]
+    items = [
+        (tid, base, {r["meter_id"]: maps.get(r["meter_id"], []) for r in base})
+        for tid, base in data["tenants"].items()
+    ]
+    if workers <= 1 or len(items) < 2 * workers:
+        return _compute_chunk((month_str, items, tariffs))
+
+    size = -(-len(items) // (workers * 4))      # ~4 chunks per worker
+    chunks = [items[i:i + size] for i in range(0, len(items), size)]
+    out: dict = {}
+    with ProcessPoolExecutor(max_workers=workers) as ex:
+        for part in ex.map(_compute_chunk, [(month_str, c, tariffs) for c in chunks]):
+            out.update(part)
+    return out
+
+
+def _statement_rows(month_str: str, tenant_id: int, base: list[dict], payload) -> dict:
+    """Flatten one tenant's payload into the rows we persist."""
+    page1, page2 = payload
+    by_meter = {r["meter_id"]: r for r in base}
+    meters, lines = [], []
+
+    for e in page1["elec_rows"]:
+        b = by_meter.get(e["meter_id"], {})
+        meters.append({
+            "tenant_id": tenant_id, "meter_id": e["meter_id"], "month": month_str,
+            "utility_type": "electricity",
+            "prev_date": b.get("prev_date"), "prev_read": b.get("prev_value"),
+            "curr_date": b.get("curr_date"), "curr_read": b.get("curr_value"),
+            "days": e["days"], "consumption": e["consumption"],
+            "elec_rate": e["rate"], "elec_due": e["due"],
+            "ws_total": None, "sd_total": None, "water_cost": None,
+            "total_due": e["due"],
+        })
+        lines.append((e["meter_id"], [{
+            "bucket": "elec", "cons": float(e["consumption"] or 0), "rate": float(e["rate"] or 0),
+            "amount": float(e["due"] or 0), "sort_order": 10,
+        }]))
+
+    ws_sum = sd_sum = 0.0
+    for s in page2["sections"]:
+        b = by_meter.get(s["meter_id"], {})
+        ws_sum += s["ws_total"] or 0.0
+        sd_sum += s["sd_total"] or 0.0
+        meters.append({
+            "tenant_id": tenant_id, "meter_id": s["meter_id"], "month": month_str,
+            "utility_type": b.get("utility_type") or "water",
+            "prev_date": b.get("prev_date"), "prev_read": b.get("prev_value"),
+            "curr_date": b.get("curr_date"), "curr_read": b.get("curr_value"),
+            "days": s["days"], "consumption": s["cons_kl"],
+            "elec_rate": None, "elec_due": None,
+            "ws_total": s["ws_total"], "sd_total": s["sd_total"], "water_cost": s["grand"],
+            "total_due": s["grand"],
+        })
+        bl = []
+        for side, base_order, keys in (("ws", 100, ("ws_tiers", "ws_fixed")), ("sd", 200, ("sd_tiers", "sd_fixed"))):
+            i = 0
+            for k in keys:
+                for ln in s.get(k) or []:
+                    if not ln.get("due") and not ln.get("cons_kl"):
+                        continue
+                    i += 1
+                    bl.append({
+                        "bucket": f"{side}_{ln.get('label')}", "cons": float(ln.get("cons_kl") or 0),
+                        "rate": float(ln.get("rate") or 0), "amount": float(ln.get("due") or 0),
+                        "sort_order": base_order + i,
+                    })
+        lines.append((s["meter_id"], bl))
+
+    return {
+        "meters": meters,
+        "lines": lines,
+        "tenant": {"tenant_id": tenant_id, "month": month_str, "ws_total": round(ws_sum, 2),
+                   "sd_total": round(sd_sum, 2), "water_total": round(ws_sum + sd_sum, 2)},
+        "ledger": {"tenant_id": tenant_id, "month": month_str, "amount": page1["due_to_metro"]},
+    }
+
+
+# ---- persist / diff ----------------------------------------------------------
+def _persist_batch(month_str: str, stmts: list[dict], post_ledger: bool, breakdown: bool) -> None:
+    meters = [m for st in stmts for m in st["meters"]]
+    if meters:
+        db.session.execute(_SQL_UPSERT_METER, meters)
+    db.session.execute(_SQL_UPSERT_TENANT, [st["tenant"] for st in stmts])
+    if post_ledger:
+        db.session.execute(_SQL_UPSERT_LEDGER, [st["ledger"] for st in stmts])
+    if breakdown and meters:
+        tids = [st["tenant"]["tenant_id"] for st in stmts]
+        ids = {(r.tenant_id, r.meter_id): r.id
+               for r in db.session.execute(_SQL_METSOA_IDS, {"month": month_str, "tids": tids})}
+        if ids:
+            db.session.execute(_SQL_DELETE_BREAKDOWN, {"ids": list(ids.values())})
+        rows = []
+        for st in stmts:
+            tid = st["tenant"]["tenant_id"]
+            for meter_id, bl in st["lines"]:
+                mid = ids.get((tid, meter_id))
+                if mid is not None:
+                    rows.extend({"metsoa_id": mid, **ln} for ln in bl)
+        if rows:
+            db.session.execute(_SQL_INSERT_BREAKDOWN, rows)
+
+
+def _changed(old, new) -> bool:
+    if old is None or new is None:
+        return (old is None) != (new is None)
+    return abs(float(old) - float(new)) > _EPS
+
+
+def _diff_batch(month_str: str, stmts: list[dict], post_ledger: bool) -> list[dict]:
+    tids = [st["tenant"]["tenant_id"] for st in stmts]
+    existing = {(r["tenant_id"], r["meter_id"]): r
+                for r in db.session.execute(_SQL_EXISTING_METERS, {"month": month_str, "tids": tids}).mappings()}
+    out = []
+    for st in stmts:
+        for m in st["meters"]:
+            key = (m["tenant_id"], m["meter_id"])
+            old = existing.pop(key, None)
+            if old is None:
+                out.append({"tenant_id": key[0], "meter_id": key[1], "status": "new",
+                            "field": "total_due", "old": None, "new": m["total_due"]})
+                continue
+            for f in ("elec_due", "ws_total", "sd_total", "water_cost", "total_due"):
+                if _changed(old[f], m[f]):
+                    out.append({"tenant_id": key[0], "meter_id": key[1], "status": "changed",
+                                "field": f, "old": old[f], "new": m[f]})
+    for (tid, mid), old in existing.items():
+        # stored row without consumption this month: reported, never deleted
+        out.append({"tenant_id": tid, "meter_id": mid, "status": "orphan",
+                    "field": "total_due", "old": old["total_due"], "new": None})
+    if post_ledger:
+        ledger = {r.tenant_id: r.amount
+                  for r in db.session.execute(_SQL_EXISTING_LEDGER, {"month": month_str, "tids": tids})}
+        for st in stmts:
+            tid, amt = st["ledger"]["tenant_id"], st["ledger"]["amount"]
+            old = ledger.get(tid)
+            if _changed(old, amt):
+                out.append({"tenant_id": tid, "meter_id": None, "status": "new" if old is None else "changed",
+                            "field": "ledger:Due to Metro", "old": old, "new": amt})
+    return out
+
+
+def run_month(month_str: str, *, tenant_ids=None, dry_run: bool = False, workers: int = 1,
+              batch_size: int = DEFAULT_BATCH, post_ledger: bool = False, breakdown: bool = False,
+              progress=None) -> dict:
+    """
+    Build (and unless dry_run, persist) METSOA statements for the month.
+    progress(done_tenants, total_tenants) is called after every batch.
+    """
+    t0 = time.monotonic()
+    data = load_month(month_str, tenant_ids)
+    t_load = time.monotonic() - t0
+
+    payloads = compute_month(data, workers=workers)
+    t_calc = time.monotonic() - t0 - t_load
+
+    tids = sorted(payloads)
+    batch_size = max(1, int(batch_size or DEFAULT_BATCH))
+    diffs: list[dict] = []
+    due_total = 0.0
+    meters = 0
+    for i in range(0, len(tids), batch_size):
+        part = tids[i:i + batch_size]
+        stmts = [_statement_rows(month_str, t, data["tenants"][t], payloads[t]) for t in part]
+        due_total += sum(float(st["ledger"]["amount"] or 0) for st in stmts)
+        meters += sum(len(st["meters"]) for st in stmts)
+        if dry_run:
+            diffs.extend(_diff_batch(month_str, stmts, post_ledger))
+        else:
+            try:
+                _persist_batch(month_str, stmts, post_ledger, breakdown)
+                db.session.commit()                  # one transaction per batch
+            except Exception:
+                db.session.rollback()
+                raise
+        if progress:
+            progress(min(i + batch_size, len(tids)), len(tids))
+
+    return {
+        "month": month_str,
+        "dry_run": dry_run,
+        "tenants": len(tids),
+        "meters": meters,
+        "due_to_metro": round(due_total, 2),
+        "load_s": round(t_load, 3),
+        "compute_s": round(t_calc, 3),
+        "total_s": round(time.monotonic() - t0, 3),
+        "diff": diffs if dry_run else None,
+    }
@@ -0,0 +1,189 @@
+# app/jobs/month_posting.py
+"""
+Month-end posting of rent and recurring charges into bil_tenant_ledger.
+
+Rent (bil_rent_schedule) and recurring items (bil_tenant_recurring) used to be
+posted per tenant - _ensure_month_charges, apply_recurring_to_ledger and two
+copies of the recurring materializer, each looping over items and checking
+for an existing row first - and the ledger page ran one on every GET. Now
+each source is a single INSERT .. SELECT for every tenant of the month:
+
+    rent        'Rent' charge on the 1st, ref AUTO:RENT:<YYYY-MM>
+    recurring   one row per active item whose start/end window covers the
+                month, on its day_of_month (clamped to the month), ref
+                AUTO:REC:<item id>:<YYYY-MM>; payment / credit items negative
+
+uq_bil_tenant_ledger_auto - unique (tenant_id, month, ref) over AUTO: rows -
+makes a re-run (or two overlapping runs) post nothing twice; the NOT EXISTS
+in each SELECT covers databases where the index could not be built and rent
+rows posted before refs were used.
+
+    flask month-post --month YYYY-MM [--tenant-id N ...] [--dry-run]
+
+post_month() returns rows posted per source (dry_run: the rows it would
+post). Ledger pages only read.
+"""
+from __future__ import annotations
+
+import calendar
+
+from flask import current_app
+from sqlalchemy import bindparam, inspect, text
+
+from app.extensions import db
+
+SOURCES = ("rent", "recurring")
+
+_PAD2 = {
+    "postgresql": "LPAD(CAST({x} AS TEXT), 2, '0')",
+    "default": "printf('%02d', {x})",
+}
+
+_SQL_UNIQUE = """
+    CREATE UNIQUE INDEX IF NOT EXISTS uq_bil_tenant_ledger_auto
+    ON bil_tenant_ledger (tenant_id, month, ref)
+    WHERE ref LIKE 'AUTO:%'
+"""
+
+# rows posted before the unique index: give auto rows a month, and the
+# month-less 'AUTO:REC:<id>' refs of apply_recurring_to_ledger their month
+_SQL_LEGACY = (
+    """UPDATE bil_tenant_ledger SET month = substr(CAST(txn_date AS TEXT), 1, 7)
+       WHERE month IS NULL AND ref LIKE 'AUTO:%' AND txn_date IS NOT NULL""",
+    """UPDATE bil_tenant_ledger SET ref = ref || ':' || month
+       WHERE ref LIKE 'AUTO:REC:%' AND ref NOT LIKE 'AUTO:REC:%:%' AND month IS NOT NULL""",
+)
+
+_COLUMNS = "tenant_id, month, txn_date, description, kind, amount, debit, credit, ref, created_at"
+
+_SELECT_RENT = """
+    SELECT rs.tenant_id AS tenant_id, :mon AS month, :first AS txn_date,
+           'Rent' AS description, 'charge' AS kind,
+           rs.amount AS amount, rs.amount AS debit, 0 AS credit,
+           'AUTO:RENT:' || :mon AS ref, CURRENT_TIMESTAMP AS created_at
+    FROM bil_rent_schedule rs
+    WHERE rs.month = :mon
+      AND rs.amount > 0
+      {tenants}
+      AND NOT EXISTS (
+          SELECT 1 FROM bil_tenant_ledger l
+          WHERE l.tenant_id = rs.tenant_id AND l.month = :mon
+            AND (l.ref = 'AUTO:RENT:' || :mon OR (l.description = 'Rent' AND l.kind = 'charge'))
+      )
+"""
+
+_SQL_MARK_RENT = """
+    UPDATE bil_rent_schedule SET is_posted = 1
+    WHERE month = :mon AND amount > 0 {tenants}
+"""
+
+_CREDIT = "LOWER(COALESCE(ri.kind, '')) IN ('payment', 'credit')"
+_DOM = "CASE WHEN COALESCE(ri.day_of_month, 1) < 1 THEN 1 WHEN ri.day_of_month > :last THEN :last ELSE ri.day_of_month END"
+_REC_REF = "'AUTO:REC:' || CAST(ri.id AS TEXT) || ':' || :mon"
+
+_SELECT_RECURRING = f"""
+    SELECT ri.tenant_id AS tenant_id, :mon AS month, :mon || '-' || {{dom}} AS txn_date,
+           ri.description AS description,
+           CASE WHEN {_CREDIT} THEN 'payment' ELSE 'charge' END AS kind,
+           CASE WHEN {_CREDIT} THEN -ABS(ri.amount) ELSE ABS(ri.amount) END AS amount,
+           CASE WHEN {_CREDIT} THEN 0 ELSE ABS(ri.amount) END AS debit,
+           CASE WHEN {_CREDIT} THEN ABS(ri.amount) ELSE 0 END AS credit,
+           {_REC_REF} AS ref, CURRENT_TIMESTAMP AS created_at
+    FROM bil_tenant_recurring ri
+    WHERE ri.is_active = 1
+      AND COALESCE(ri.amount, 0) <> 0
+      AND (COALESCE(ri.start_month, '') = '' OR substr(ri.start_month, 1, 7) <= :mon)
+      AND (COALESCE(ri.end_month, '') = '' OR substr(ri.end_month, 1, 7) >= :mon)
+      {{tenants}}
+      AND NOT EXISTS (
+          SELECT 1 FROM bil_tenant_ledger l
+          WHERE l.tenant_id = ri.tenant_id AND l.month = :mon AND l.ref = {_REC_REF}
+      )
+"""
+
+_SOURCE_TABLES = {"rent": "bil_rent_schedule", "recurring": "bil_tenant_recurring"}
+
+
+def ensure_posting_schema() -> None:
+    """Unique index over auto-posted ledger rows (legacy refs normalised first)."""
+    insp = inspect(db.engine)
+    if not insp.has_table("bil_tenant_ledger"):
+        return
+    if any(ix["name"] == "uq_bil_tenant_ledger_auto" for ix in insp.get_indexes("bil_tenant_ledger")):
+        return
+    try:
+        for stmt in _SQL_LEGACY:
+            db.session.execute(text(stmt))
+        db.session.execute(text(_SQL_UNIQUE))
+        db.session.commit()
+    except Exception as exc:
+        db.session.rollback()  # duplicate auto rows: posting still guarded by NOT EXISTS
+        current_app.logger.warning("uq_bil_tenant_ledger_auto not created: %s", exc)
+
+
+def _sql(source: str, tenants: str) -> str:
+    if source == "rent":
+        return _SELECT_RENT.format(tenants=tenants.format(col="rs.tenant_id"))
+    pad = _PAD2.get(db.session.get_bind().dialect.name, _PAD2["default"])
+    return _SELECT_RECURRING.format(dom=pad.format(x=_DOM), tenants=tenants.format(col="ri.tenant_id"))
+
+
+def _stmt(sql: str, tenant_ids):
+    stmt = text(sql)
+    return stmt.bindparams(bindparam("tids", expanding=True)) if tenant_ids else stmt
+
+
+def post_month(month: str, tenant_ids=None, sources=SOURCES, dry_run: bool = False) -> dict:
+    """
+    Post `sources` for `month` ('YYYY-MM') for every tenant (or only `tenant_ids`).
+    Returns {"month", "<source>": rows posted, ..., "posted": total}; with
+    dry_run=True nothing is written and "rows" lists what would be posted.
+    """
+    month = month[:7]
+    y, m = int(month[:4]), int(month[5:7])
+    tenant_ids = [int(t) for t in tenant_ids or ()]
+    params = {"mon": month, "first": f"{month}-01", "last": calendar.monthrange(y, m)[1]}
+    if tenant_ids:
+        params["tids"] = tenant_ids
+    tenants = "AND {col} IN :tids" if tenant_ids else ""
+
+    insp = inspect(db.session.connection())
+    report: dict = {"month": month, "posted": 0}
+    if dry_run:
+        report["rows"] = []
+    try:
+        for source in sources:
+            if not insp.has_table(_SOURCE_TABLES[source]):
+                report[source] = 0
+                continue
+            select = _sql(source, tenants)
+            if dry_run:
+                rows = [dict(r) for r in db.session.execute(_stmt(select, tenant_ids), params).mappings()]
+                report["rows"].extend({"source": source, **r} for r in rows)
+                n = len(rows)
+            else:
+                res = db.session.execute(
+                    _stmt(f"INSERT INTO bil_tenant_ledger ({_COLUMNS}) {select} ON CONFLICT DO NOTHING", tenant_ids),
+                    params,
+                )
+                n = max(res.rowcount or 0, 0)
+                if source == "rent":
+                    db.session.execute(_stmt(_SQL_MARK_RENT.format(tenants=tenants.format(col="tenant_id")),
+                                             tenant_ids), params)
+            report[source] = n
+            report["posted"] += n
+        if not dry_run:
+            db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return report
+
+
+def repost_recurring(tenant_id: int, month: str) -> dict:
+    """Replace one tenant's auto recurring rows for `month` with the current items."""
+    db.session.execute(
+        text("DELETE FROM bil_tenant_ledger WHERE tenant_id = :tid AND month = :mon AND ref LIKE 'AUTO:REC:%'"),
+        {"tid": int(tenant_id), "mon": month[:7]},
+    )
+    return post_month(month, tenant_ids=[tenant_id], sources=("recurring",))
@@ -53,6 +53,10 @@ class BilMeter(db.Model):
 
 class BilMeterReading(db.Model):
     __tablename__ = 'bil_meter_reading'
+    __table_args__ = (
+        # "latest reading of meter M in [d1, d2]" and the consumption window query
+        Index("ix_bil_meter_reading_meter_date", "meter_id", "reading_date"),
+    )
     id = db.Column(db.Integer, primary_key=True)
     meter_id = db.Column(db.Integer, db.ForeignKey('bil_meter.id'), nullable=False)
     reading_date = db.Column(db.Date, nullable=False)
@@ -60,6 +64,11 @@ class BilMeterReading(db.Model):
 
     meter = db.relationship('BilMeter', backref='readings')
 
+class BilReadingMonth(db.Model):
+    """Months (YYYY-MM) that have readings; kept current by app/utils/consumption_engine.py."""
+    __tablename__ = 'bil_reading_month'
+    month = db.Column(db.String(7), primary_key=True)
+
 class BilTariff(db.Model):
     __tablename__ = 'bil_tariff'
 
@@ -112,6 +121,10 @@ class BilPayment(db.Model):
 
 class BilConsumption(db.Model):
     __tablename__ = 'bil_consumption'
+    __table_args__ = (
+        # one row per meter and month; upsert target of app/utils/consumption_engine.py
+        Index("uq_bil_consumption_meter_month", "meter_id", "month", unique=True),
+    )
     id = Column(Integer, primary_key=True)
     meter_id = Column(Integer, ForeignKey('bil_meter.id'), nullable=False)
     meter_number = db.Column(db.String, nullable=False)  # ✅ Add this
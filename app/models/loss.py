@@ -157,6 +157,23 @@ class LcaResult(db.Model):
     run_id     = db.Column(db.Integer, db.ForeignKey("lca_run.id"), index=True)
     subject    = db.Column(db.String)
 
+class LcaRebuildJob(db.Model):
+    """Checkpoint for bulk lca_result rebuilds (app/jobs/loss_rebuild.py)."""
+    __tablename__ = "lca_rebuild_job"
+
+    id          = db.Column(db.Integer, primary_key=True)
+    status      = db.Column(db.String(20), nullable=False, default="pending", index=True)  # pending|running|done|failed
+    filters     = db.Column(db.Text)                                 # JSON of the selection
+    chunk_size  = db.Column(db.Integer, nullable=False, default=500)
+    last_run_id = db.Column(db.Integer, nullable=False, default=0)   # keyset cursor; resume from here
+    total       = db.Column(db.Integer, nullable=False, default=0)
+    done        = db.Column(db.Integer, nullable=False, default=0)
+    written     = db.Column(db.Integer, nullable=False, default=0)
+    error       = db.Column(db.Text)
+    started_at  = db.Column(db.DateTime, server_default=db.func.now())
+    updated_at  = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
 class LcaProgressItem(db.Model):
     __tablename__ = "lca_progress_item"
     id       = db.Column(db.Integer, primary_key=True)
@@ -200,6 +217,11 @@ class LcaResponse(db.Model):
     created_at = db.Column(db.DateTime, server_default=db.func.now())
     run_id = db.Column(db.Integer, db.ForeignKey("lca_run.id"), nullable=False)
 
+    __table_args__ = (
+        # one answer per question per run; batched upserts conflict on this
+        db.Index("ux_lca_response_run_question", "run_id", "question_id", unique=True),
+    )
+
 class LcaRun(db.Model):
     __tablename__ = "lca_run"
 
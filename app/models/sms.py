@@ -255,6 +255,62 @@ class SmsFinTxn(db.Model):
 
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        # receipt / voucher books walked in capture order (app/subject_sms/audit_engine.py)
+        db.Index("ix_sms_fin_txn_book", "school_id", "method", "date", "id"),
+    )
+
+class SmsFinAgg(db.Model):
+    """Per school / month / category / direction totals of sms_fin_txn (app/subject_sms/finance_agg.py)."""
+    __tablename__ = "sms_fin_agg"
+
+    school_id = db.Column(db.Integer, primary_key=True)
+    year = db.Column(db.Integer, primary_key=True)
+    month = db.Column(db.Integer, primary_key=True)          # 1..12
+    category_id = db.Column(db.Integer, primary_key=True)
+    direction = db.Column(db.String(10), primary_key=True)   # "in" or "out"
+
+    amount_cents = db.Column(db.BigInteger, nullable=False, default=0)
+    txn_count = db.Column(db.Integer, nullable=False, default=0)
+
+class SmsAuditCheckpoint(db.Model):
+    """How far each receipt / voucher book of a school has been audited (app/subject_sms/audit_engine.py)."""
+    __tablename__ = "sms_audit_checkpoint"
+
+    school_id = db.Column(db.Integer, primary_key=True)
+    book = db.Column(db.String(32), primary_key=True)       # "cash", "petty_cash", "eft", ...
+    methods = db.Column(db.String(255), nullable=False)     # sorted, comma separated
+
+    last_date = db.Column(db.Date)                          # position of the last audited txn
+    last_txn_id = db.Column(db.Integer, nullable=False, default=0)
+    last_ref = db.Column(db.BigInteger)
+
+    count = db.Column(db.Integer, nullable=False, default=0)
+    first_ref = db.Column(db.BigInteger)
+    gaps = db.Column(db.Integer, nullable=False, default=0)
+    reversals = db.Column(db.Integer, nullable=False, default=0)
+
+    checked_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class SmsAuditFinding(db.Model):
+    __tablename__ = "sms_audit_finding"
+
+    id = db.Column(db.Integer, primary_key=True)
+    school_id = db.Column(db.Integer, nullable=False)
+    book = db.Column(db.String(32), nullable=False)
+    type = db.Column(db.String(10), nullable=False)         # "gap" or "reversal"
+
+    from_ref = db.Column(db.BigInteger)
+    to_ref = db.Column(db.BigInteger)
+    txn_id = db.Column(db.Integer, nullable=False)
+    prev_txn_id = db.Column(db.Integer)
+    date = db.Column(db.Date)
+
+    __table_args__ = (
+        db.UniqueConstraint("school_id", "book", "txn_id", name="uq_sms_audit_finding_txn"),
+        db.Index("ix_sms_audit_finding_page", "school_id", "date", "txn_id"),
+    )
+
 class SmsFinBankLine(db.Model):
     __tablename__ = "sms_fin_bank_line"
 
@@ -0,0 +1,312 @@
+# app/payments/price_snapshot.py
+"""
+In-memory pricing snapshot.
+
+price_cents_for() is exposed to every template and ran a join per call, so a
+page listing several subjects / currencies issued a query per cell; the
+checkout helpers (price_for_country, subject_id_for, currency_for_country_code,
+get_subject_price) each queried as well. The pricing tables are tiny and
+change only through the admin pricing screens, so they are held per process:
+
+    subjects[slug]                     subject id
+    anchors[(subject_id, currency)]    (AnchorPrice, ...) newest active_from first
+    country[(subject_id, country)]     CountryPrice(local, zar, currency)
+    currencies[country]                currency (ref_country_currency)
+
+Only is_active rows are loaded, including ones that start or end later: the
+active_from / active_to window is checked against the current time on every
+lookup, so a scheduled price takes over at its start without a reload.
+
+The snapshot is rebuilt after a commit that touched AuthPricing /
+RefCountryCurrency through the ORM, when invalidate_pricing() is called (the
+raw-SQL admin edits in app/payments/routes.py do), and when the hash of the
+pricing tables' rows (rows_digest) changes - checked at most every
+PRICING_SNAPSHOT_TTL seconds, so other workers see edits too, including
+swapped amounts and a country's currency change.
+"""
+from __future__ import annotations
+
+import threading
+import time
+from datetime import datetime, timezone
+from typing import NamedTuple
+
+from flask import current_app, has_app_context
+from sqlalchemy import event, inspect, text
+from sqlalchemy.orm import Session
+
+from app.extensions import db
+from app.utils.row_digest import rows_digest
+
+FALLBACK_COUNTRY = "ZA"
+
+_SQL_SUBJECTS = text("SELECT id, slug, name FROM auth_subject")
+
+_SQL_ANCHORS = text("""
+    SELECT id, subject_id, role, plan, currency, amount_cents, active_from, active_to, updated_at
+    FROM auth_pricing
+    WHERE is_active = 1
+""")
+
+_SQL_COUNTRY = """
+    SELECT p.subject_id, p.country_code, p.local_amount_cents, p.zar_amount_cents, c.currency
+    FROM subject_country_price p
+    JOIN ref_country_currency c ON c.alpha2 = p.country_code {active}
+    WHERE p.is_active = 1
+"""
+
+_SQL_CURRENCIES = text("SELECT alpha2, currency FROM ref_country_currency")
+
+# every row of every table the snapshot is built from, in key order
+_SQL_SIGNATURE = tuple(text(s) for s in (
+    "SELECT * FROM auth_pricing ORDER BY id",
+    "SELECT * FROM subject_country_price ORDER BY subject_id, country_code",
+    "SELECT * FROM ref_country_currency ORDER BY alpha2",
+    "SELECT * FROM auth_subject ORDER BY id",
+))
+
+
+class AnchorPrice(NamedTuple):
+    id: int
+    subject_id: int
+    role: str | None
+    plan: str
+    currency: str
+    amount_cents: int
+    active_from: datetime | None
+    active_to: datetime | None
+    updated_at: datetime | None
+
+    def live(self, now: datetime, open_start: bool = True) -> bool:
+        if self.active_from is None:
+            if not open_start:
+                return False
+        elif self.active_from > now:
+            return False
+        return self.active_to is None or self.active_to > now
+
+
+class CountryPrice(NamedTuple):
+    local_cents: int
+    zar_cents: int
+    currency: str
+
+
+def _ts(v) -> datetime | None:
+    """Naive UTC datetime from a driver value (SQLite returns text)."""
+    if v is None or v == "":
+        return None
+    if isinstance(v, str):
+        try:
+            v = datetime.fromisoformat(v.replace("Z", "+00:00"))
+        except ValueError:
+            return None
+    if v.tzinfo is not None:
+        v = v.astimezone(timezone.utc).replace(tzinfo=None)
+    return v
+
+
+def _utcnow() -> datetime:
+    return datetime.utcnow()
+
+
+class PriceSnapshot:
+    __slots__ = ("version", "signature", "loaded_at", "subjects", "subject_names", "anchors",
+                 "country", "currencies")
+
+    def __init__(self, version: int, signature: str):
+        self.version = version
+        self.signature = signature
+        self.loaded_at = time.monotonic()
+
+        self.subjects: dict[str, int] = {}
+        self.subject_names: dict[int, str] = {}
+        for r in db.session.execute(_SQL_SUBJECTS).mappings():
+            if r["slug"]:
+                self.subjects[str(r["slug"]).strip().lower()] = int(r["id"])
+            self.subject_names[int(r["id"])] = r["name"] or r["slug"]
+
+        anchors: dict[tuple[int, str], list[AnchorPrice]] = {}
+        for r in db.session.execute(_SQL_ANCHORS).mappings():
+            a = AnchorPrice(
+                id=int(r["id"]), subject_id=int(r["subject_id"]), role=r["role"], plan=r["plan"] or "enrollment",
+                currency=(r["currency"] or "ZAR").upper(), amount_cents=int(r["amount_cents"] or 0),
+                active_from=_ts(r["active_from"]), active_to=_ts(r["active_to"]), updated_at=_ts(r["updated_at"]),
+            )
+            anchors.setdefault((a.subject_id, a.currency), []).append(a)
+        # newest active_from first (NULL last), then updated_at, then id - the queries' ORDER BY
+        for rows in anchors.values():
+            rows.sort(key=lambda a: (a.active_from is not None, a.active_from or datetime.min,
+                                     a.updated_at or datetime.min, a.id), reverse=True)
+        self.anchors = {k: tuple(v) for k, v in anchors.items()}
+
+        cols = {c["name"] for c in inspect(db.engine).get_columns("ref_country_currency")}
+        active = "AND c.is_active = true" if "is_active" in cols else ""
+        self.country: dict[tuple[int, str], CountryPrice] = {}
+        for r in db.session.execute(text(_SQL_COUNTRY.format(active=active))).mappings():
+            self.country[(int(r["subject_id"]), str(r["country_code"]).upper())] = CountryPrice(
+                int(r["local_amount_cents"] or 0), int(r["zar_amount_cents"] or 0), r["currency"] or "ZAR",
+            )
+
+        self.currencies = {str(r["alpha2"]).upper(): r["currency"]
+                           for r in db.session.execute(_SQL_CURRENCIES).mappings()}
+
+    # ---- lookups -------------------------------------------------------------
+    def subject_id(self, slug: str) -> int | None:
+        return self.subjects.get((slug or "").strip().lower())
+
+    def anchor(self, subject_id: int, currency: str = "ZAR", *, role=None, plan: str | None = None,
+               any_role: bool = True, open_start: bool = True, now: datetime | None = None) -> AnchorPrice | None:
+        """Live price row for (subject, currency), newest first; role / plan filter when given."""
+        now = now or _utcnow()
+        for a in self.anchors.get((int(subject_id), (currency or "ZAR").upper()), ()):
+            if plan is not None and a.plan != plan:
+                continue
+            if not any_role and a.role != role:
+                continue
+            if a.live(now, open_start):
+                return a
+        return None
+
+    def anchor_any_currency(self, subject_id: int, plan: str = "enrollment", *, role=None, any_role: bool = True,
+                            open_start: bool = True, now: datetime | None = None) -> AnchorPrice | None:
+        now = now or _utcnow()
+        best = None
+        for sid, cur in self.anchors:
+            if sid != int(subject_id):
+                continue
+            a = self.anchor(sid, cur, role=role, plan=plan, any_role=any_role, open_start=open_start, now=now)
+            if a and (best is None or (a.active_from or datetime.min, a.updated_at or datetime.min, a.id)
+                      > (best.active_from or datetime.min, best.updated_at or datetime.min, best.id)):
+                best = a
+        return best
+
+    def country_price(self, subject_id: int, country_code: str) -> CountryPrice | None:
+        cc = (country_code or "").strip().upper() or FALLBACK_COUNTRY
+        return (self.country.get((int(subject_id), cc))
+                or self.country.get((int(subject_id), FALLBACK_COUNTRY)))
+
+    def currency_for(self, country_code: str) -> str | None:
+        return self.currencies.get((country_code or "").strip().upper())
+
+    def price_table(self, country_code: str, now: datetime | None = None) -> list[dict]:
+        """Every subject priced for one country: local / ZAR tier plus the live ZAR anchor."""
+        now = now or _utcnow()
+        cc = (country_code or "").strip().upper() or FALLBACK_COUNTRY
+        out = []
+        for slug, sid in sorted(self.subjects.items()):
+            cp = self.country_price(sid, cc)
+            anchor = self.anchor_any_currency(sid, "enrollment", now=now)
+            if cp is None and anchor is None:
+                continue
+            out.append({
+                "subject_id": sid,
+                "slug": slug,
+                "name": self.subject_names.get(sid),
+                "country_code": cc,
+                "currency": cp.currency if cp else (self.currency_for(cc) or "ZAR"),
+                "local_cents": cp.local_cents if cp else None,
+                "zar_cents": cp.zar_cents if cp else None,
+                "anchor_currency": anchor.currency if anchor else None,
+                "anchor_cents": anchor.amount_cents if anchor else None,
+            })
+        return out
+
+    def counts(self) -> dict:
+        return {"subjects": len(self.subjects), "anchors": sum(len(v) for v in self.anchors.values()),
+                "country_prices": len(self.country), "currencies": len(self.currencies)}
+
+
+# ---- process-wide cache ------------------------------------------------------
+_lock = threading.Lock()
+_current: PriceSnapshot | None = None
+_version = 0
+_checked_at = 0.0
+_stale = False
+
+
+def _ttl() -> float:
+    if has_app_context():
+        return float(current_app.config.get("PRICING_SNAPSHOT_TTL", 60))
+    return 60.0
+
+
+def _signature() -> str:
+    def rows():
+        for stmt in _SQL_SIGNATURE:
+            yield (stmt.text,)
+            yield from db.session.execute(stmt)
+    return rows_digest(rows())
+
+
+def _build() -> PriceSnapshot:
+    global _version
+    sig = _signature()
+    _version += 1
+    return PriceSnapshot(_version, sig)
+
+
+def invalidate_pricing() -> None:
+    """Mark the snapshot stale; the next reader rebuilds it."""
+    global _stale
+    _stale = True
+
+
+def get_price_snapshot(force: bool = False) -> PriceSnapshot:
+    global _current, _checked_at, _stale
+    snap = _current
+    if snap is not None and not force and not _stale and (time.monotonic() - _checked_at) < _ttl():
+        return snap
+
+    with _lock:
+        snap = _current
+        if snap is not None and not force and not _stale:
+            if (time.monotonic() - _checked_at) < _ttl():
+                return snap
+            sig = _signature()
+            _checked_at = time.monotonic()
+            if sig == snap.signature:
+                return snap
+        _stale = False
+        snap = _build()
+        _current = snap
+        _checked_at = time.monotonic()
+        return snap
+
+
+def pricing_info() -> dict:
+    snap = _current
+    if snap is None:
+        return {"loaded": False}
+    return {"loaded": True, "version": snap.version, "stale": _stale, **snap.counts(),
+            "age_s": round(time.monotonic() - snap.loaded_at, 1)}
+
+
+# ---- invalidation on ORM edits -----------------------------------------------
+def _mark_dirty(mapper, connection, target):
+    from sqlalchemy.orm import object_session
+    sess = object_session(target)
+    if sess is not None:
+        sess.info["pricing_dirty"] = True
+
+
+def _after_commit(session):
+    if session.info.pop("pricing_dirty", False):
+        invalidate_pricing()
+
+
+def _after_rollback(session):
+    session.info.pop("pricing_dirty", None)
+
+
+def _register_listeners():
+    from app.models.auth import AuthPricing, AuthSubject
+    from app.models.payment import RefCountryCurrency
+    for model in (AuthPricing, AuthSubject, RefCountryCurrency):
+        for ev in ("after_insert", "after_update", "after_delete"):
+            event.listen(model, ev, _mark_dirty)
+    event.listen(Session, "after_commit", _after_commit)
+    event.listen(Session, "after_soft_rollback", lambda s, prev: _after_rollback(s))
+
+
+_register_listeners()
@@ -1,12 +1,12 @@
 # payments/AuthPricing.py
 from decimal import ROUND_HALF_UP, Decimal
-import requests
-from sqlalchemy import select, and_, or_, func, text
+from sqlalchemy import func
 from app.extensions import db
-from flask import current_app, g, redirect, request, session, url_for
+from flask import g, redirect, request, session, url_for
 from datetime import datetime, timezone
-from app.models.auth import AuthSubject, AuthPricing
 from app.models.payment import RefCountryCurrency
+from app.payments.price_snapshot import get_price_snapshot
+from app.services.fx_rates import fx_to_zar
 from app.subject_reading.routes import _ensure_enrollment_row
 import sqlalchemy as sa
 from sqlalchemy.exc import OperationalError
@@ -15,29 +15,12 @@ VAT_RATE = 0.15  # SA VAT
 
 def get_subject_price(subject_slug: str, role: str = "learner", plan: str = "enrollment"):
     """Return the active price row for a subject slug, with VAT-inclusive display."""
-    now = datetime.utcnow()
-
-    subj = db.session.execute(
-        select(AuthSubject.id).where(AuthSubject.slug == subject_slug)
-    ).scalar_one_or_none()
+    snap = get_price_snapshot()
+    subj = snap.subject_id(subject_slug)
     if not subj:
         return None  # unknown subject
 
-    row = db.session.execute(
-        select(AuthPricing)
-        .where(
-            and_(
-                AuthPricing.subject_id == subj,
-                AuthPricing.role == role,
-                AuthPricing.plan == plan,
-                AuthPricing.is_active == True,
-                or_(AuthPricing.active_from == None, AuthPricing.active_from <= now),
-                or_(AuthPricing.active_to == None, AuthPricing.active_to > now),
-            )
-        )
-        .order_by(AuthPricing.active_from.desc().nulls_last())
-        .limit(1)
-    ).scalar_one_or_none()
+    row = snap.anchor_any_currency(subj, plan, role=role, any_role=False)
 
     if not row:
         return None
@@ -97,28 +80,24 @@ def detect_country(request) -> str | None:
     return None
 
 
-__all__ = ["price_cents_for", "price_dict_for"]
+__all__ = ["price_cents_for", "price_dict_for", "price_table_for"]
 
 def price_cents_for(subject_slug: str, currency: str = "ZAR") -> int | None:
     """
     Return the active price (in cents) for a subject + currency, or None if none found.
+    Served from the pricing snapshot (no query per call).
     """
-    row = db.session.execute(
-        """
-        SELECT p.amount_cents
-        FROM auth_pricing p
-        JOIN auth_subject s ON s.id = p.subject_id
-        WHERE s.slug = :slug
-          AND p.currency = :cur
-          AND p.is_active = 1
-          AND (p.active_from IS NULL OR p.active_from <= CURRENT_TIMESTAMP)
-          AND (p.active_to   IS NULL OR p.active_to   >  CURRENT_TIMESTAMP)
-        ORDER BY p.active_from DESC
-        LIMIT 1
-        """,
-        {"slug": subject_slug, "cur": currency},
-    ).fetchone()
-    return int(row[0]) if row else None
+    snap = get_price_snapshot()
+    sid = snap.subject_id(subject_slug)
+    if sid is None:
+        return None
+    row = snap.anchor(sid, currency)
+    return int(row.amount_cents) if row else None
+
+
+def price_table_for(country_code: str) -> list[dict]:
+    """All subjects priced for one country in a single call (pricing pages, checkout lists)."""
+    return get_price_snapshot().price_table(country_code)
 
 
 def price_dict_for(subject_slug: str, currency: str = "ZAR") -> dict | None:
@@ -171,20 +150,7 @@ def _list_currency_for(code: str) -> str | None:
 
 # 1) Read active anchor from auth_pricing (in cents)
 def get_parity_anchor_cents(subject_id: int) -> int:
-    row = db.session.execute(
-        db.text("""
-            SELECT amount_cents
-            FROM auth_pricing
-            WHERE subject_id = :sid
-              AND plan = 'enrollment'
-              AND is_active = 1
-              AND active_from <= CURRENT_TIMESTAMP
-              AND (active_to IS NULL OR active_to > CURRENT_TIMESTAMP)
-            ORDER BY active_from DESC, updated_at DESC
-            LIMIT 1
-        """),
-        {"sid": subject_id},
-    ).first()
+    row = get_price_snapshot().anchor_any_currency(subject_id, "enrollment", open_start=False)
     return int(row.amount_cents or 0) if row else 0
 
 # 2) Country → (name, code) using your utils.country_list
@@ -218,11 +184,7 @@ def lock_country_and_price(session, user_input_country: str, subject_id: int):
 # Subject id from slug (e.g., "loss")
 # Subject id from slug (e.g., "loss")
 def subject_id_for(slug: str) -> int | None:
-    row = db.session.execute(
-        db.text("SELECT id FROM auth_subject WHERE slug = :s LIMIT 1"),
-        {"s": slug},
-    ).first()
-    return int(row.id) if row else None
+    return get_price_snapshot().subject_id(slug)
 
 # Table-driven parity price for a country (returns currency, amount_cents, source)
 
@@ -291,97 +253,18 @@ def currency_for_country_code(code: str) -> str | None:
     """
     Returns 3-letter currency code for a 2-letter country code, e.g. 'AU' -> 'AUD'.
     """
-    row = db.session.execute(
-        text("SELECT currency FROM ref_country_currency WHERE alpha2 = :c"),
-        {"c": code},
-    ).fetchone()
-    return row[0] if row else None
-
-# Make sure this module imports: datetime, requests, text from sqlalchemy
-
-FX_MAX_AGE_HOURS = 24
+    return get_price_snapshot().currency_for(code)
 
 def fx_rate_local_to_zar(country_code: str) -> float | None:
     """
     Returns fx such that: 1 unit of local currency * fx = N ZAR.
-    Uses ref_country_currency.fx_to_zar as a cache.
-    Falls back to live API if missing/stale.
-    Returns None if we cannot get any rate at all.
+    Cache read only (app/services/fx_rates.py): a stale rate is still returned
+    and refreshed in the background; `flask fx-refresh` keeps the table current.
+    Returns None if there is no rate for the country's currency yet.
     """
-    # 1) Get currency for country (e.g. 'AE' -> 'AED')
-    cur = currency_for_country_code(country_code) or "ZAR"
-    if cur.upper() == "ZAR":
+    if (currency_for_country_code(country_code) or "ZAR").upper() == "ZAR":
         return 1.0
-
-    # 2) Try cached value
-    row = db.session.execute(
-        text("""
-            SELECT fx_to_zar, updated_at
-            FROM ref_country_currency
-            WHERE alpha2 = :c
-            LIMIT 1
-        """),
-        {"c": country_code},
-    ).mappings().first()
-
-    now = datetime.utcnow()
-
-    def _age_hours(ts) -> float | None:
-        if not ts:
-            return None
-        try:
-            # Postgres gives datetime, SQLite gives string
-            if isinstance(ts, str):
-                ts = datetime.fromisoformat(ts)
-            return (now - ts).total_seconds() / 3600.0
-        except Exception:
-            return None
-
-    if row and row["fx_to_zar"] is not None:
-        age = _age_hours(row["updated_at"])
-        if age is not None and age <= FX_MAX_AGE_HOURS:
-            # Fresh enough
-            try:
-                return float(row["fx_to_zar"])
-            except (TypeError, ValueError):
-                pass  # fall through to live fetch
-
-    # 3) Live fetch via ExchangeRate API
-    try:
-        url = f"https://api.exchangerate-api.com/v4/latest/{cur}"
-        resp = requests.get(url, timeout=5)
-        if resp.status_code == 200:
-            data = resp.json() or {}
-            rates = data.get("rates") or {}
-            fx = rates.get("ZAR")
-            if fx:
-                fx_val = float(fx)
-
-                # upsert cache
-                db.session.execute(
-                    text("""
-                        INSERT INTO ref_country_currency (alpha2, currency, fx_to_zar, updated_at)
-                        VALUES (:a2, :ccy, :fx, CURRENT_TIMESTAMP)
-                        ON CONFLICT(alpha2) DO UPDATE SET
-                            fx_to_zar = excluded.fx_to_zar,
-                            updated_at = CURRENT_TIMESTAMP
-                    """),
-                    {"a2": country_code, "ccy": cur.upper(), "fx": fx_val},
-                )
-                db.session.commit()
-                return fx_val
-    except Exception as exc:
-        current_app.logger.warning(f"Live FX fetch failed for {country_code}/{cur}: {exc}")
-
-    # 4) Live failed; if we had *any* cached value, use that as a last resort
-    if row and row["fx_to_zar"] is not None:
-        try:
-            return float(row["fx_to_zar"])
-        except (TypeError, ValueError):
-            pass
-
-    # 5) No rate at all
-    return None
+    return fx_to_zar(country_code)
 
 def _resolve_subject_from_request() -> tuple[int, str]:
     """
@@ -408,47 +291,11 @@ def price_for_country(subject_id, country_code):
         zar_cents    – subject_country_price.zar_amount_cents
         currency     – ref_country_currency.currency
 
-    No FX maths, no ref_subject_parity_price, no COALESCE tricks.
+    No FX maths, no ref_subject_parity_price, no COALESCE tricks. Falls back
+    to the subject's ZA row; served from the pricing snapshot.
     """
-    cc = (country_code or "").strip().upper()
-    if not cc:
-        cc = "ZA"
-
-    row = db.session.execute(
-        text("""
-            SELECT p.local_amount_cents, p.zar_amount_cents, c.currency
-            FROM subject_country_price p
-            JOIN ref_country_currency c
-              ON c.alpha2 = p.country_code
-             AND c.is_active = true
-           WHERE p.subject_id   = :sid
-             AND p.country_code = :cc
-             AND p.is_active    = 1
-           LIMIT 1
-        """),
-        {"sid": subject_id, "cc": cc},
-    ).first()
-
-    if not row:
-        # Fallback: same subject, ZA row (still table-driven, no FX)
-        row = db.session.execute(
-            text("""
-                SELECT p.local_amount_cents, p.zar_amount_cents, c.currency
-                FROM subject_country_price p
-                JOIN ref_country_currency c
-                  ON c.alpha2 = p.country_code
-                 AND c.is_active = true
-               WHERE p.subject_id   = :sid
-                 AND p.country_code = 'ZA'
-                 AND p.is_active    = 1
-               LIMIT 1
-            """),
-            {"sid": subject_id},
-        ).first()
-
-    if not row:
+    cp = get_price_snapshot().country_price(subject_id, country_code) if subject_id else None
+    if cp is None:
         # last-resort safe default
         return 0, 0, "ZAR"
-
-    local_cents, zar_cents, cur = row
-    return int(local_cents or 0), int(zar_cents or 0), (cur or "ZAR")
+    return cp.local_cents, cp.zar_cents, cp.currency
@@ -1,11 +1,10 @@
 # app/payments/quote.py
 from datetime import datetime
-from flask import current_app
 from app.extensions import db
 from app.models.auth import UserEnrollment
 from app.payments.pricing import get_parity_anchor_cents, price_cents_for, price_for_country
+from app.services.fx_rates import fx_to_zar_decimal
 from decimal import Decimal
-from sqlalchemy import text
 from decimal import Decimal, ROUND_HALF_UP
 
 def detect_country(request) -> str:
@@ -33,33 +32,10 @@ def lock_enrollment_quote(enrollment_id: int, subject_slug: str, request, price_
 
 def fx_for_country_code(code: str) -> Decimal | None:
     """
-    Returns fx_to_zar if available.
-    Returns None if:
-      - row missing
-      - fx_to_zar NULL or <= 0
-      - table errors
+    Returns fx_to_zar (active countries only) from the FX cache.
+    Returns None if the row is missing / inactive or has no positive rate.
     """
-    try:
-        row = db.session.execute(
-            text("""
-                SELECT fx_to_zar
-                FROM ref_country_currency
-                WHERE alpha2 = :cc AND is_active = true
-                LIMIT 1
-            """),
-            {"cc": code},
-        ).first()
-    except Exception as exc:
-        current_app.logger.warning(
-            "fx_for_country_code error for %s: %s", code, exc
-        )
-        return None
-
-    if not row or row.fx_to_zar is None:
-        return None
-
-    fx = Decimal(str(row.fx_to_zar))
-    return fx if fx > 0 else None
+    return fx_to_zar_decimal(code, active_only=True)
 
 
 
@@ -3,6 +3,7 @@ from sqlalchemy import text
 
 from app.extensions import db
 from app.models.auth import AuthSubject
+from app.payments.price_snapshot import invalidate_pricing
 from . import payment_bp
 
 
@@ -147,6 +148,7 @@ def pricing_index():
             },
         )
         db.session.commit()
+        invalidate_pricing()   # raw SQL: no ORM events
         return redirect(url_for("payment_bp.pricing_index", subject=subject.slug))
 
     rows = db.session.execute(
@@ -4,7 +4,7 @@ from flask import current_app
 from datetime import datetime, timedelta
 # Models (clean and complete)
 from app.models.billing import (
-    BilProperty, BilTenant, BilMeter, BilMeterReading,
+    BilProperty, BilTenant, BilMeter,
     BilConsumption, BilTariff, BilSectionalUnit, 
     BilMeterFixedCharge, PropertyForm
     )
@@ -219,62 +219,25 @@ def onboard_property():
 
 def generate_consumption_records_from_readings(month):
     """
-    Regenerates consumption records for the given month by:
-    - Deleting previous BilConsumption records for the month
-    - Creating one consumption entry per meter based on consecutive readings
+    Regenerates consumption records for the given month:
+    - one entry per meter, pairing its first reading in the month with the reading before it
+    - upserted into bil_consumption; rows of meters without a pair are removed
+    Returns the consumption rows written as dicts (month, meter_id, meter_number,
+    last_date, new_date, last_read, new_read, days, consumption) - no longer
+    BilConsumption objects; query BilConsumption if model instances are needed.
     """
-    # 🚫 Clear existing records for the month
-    BilConsumption.query.filter_by(month=month).delete()
-    db.session.commit()
+    from app.utils.consumption_engine import build_consumption
+
+    result = build_consumption([month])
+    for a in result["anomalies"]:
+        if a["type"] != "no_reading":
+            print(f"⚠️ Meter {a['meter_number']} ({month}): {a['type']}")
 
-    records = []
-    meters = BilMeter.query.all()
-
-    if not meters:
-        print("No meters found — skipping generation.")
-        return records
-
-    for meter in meters:
-        # 🔍 Fetch all readings ordered by date for this meter
-        readings = BilMeterReading.query.filter_by(meter_id=meter.id).order_by(BilMeterReading.reading_date).all()
-
-        # ✅ Look for the first valid reading pair in the target month
-        for i in range(1, len(readings)):
-            prev = readings[i - 1]
-            curr = readings[i]
-
-            if curr.reading_date.strftime('%Y-%m') != month:
-                continue
-
-            try:
-                days = (curr.reading_date - prev.reading_date).days
-                usage = curr.reading_value - prev.reading_value
-
-                record = BilConsumption(
-                    meter_id=meter.id,
-                    meter_number=meter.meter_number,
-                    last_date=prev.reading_date,
-                    new_date=curr.reading_date,
-                    last_read=prev.reading_value,
-                    new_read=curr.reading_value,
-                    days=days,
-                    consumption=int(round(usage)),
-                    month=month
-                )
-                records.append(record)
-            except Exception as e:
-                print(f"⚠️ Error processing meter {meter.meter_number}: {e}")
-
-            break  # Only generate one record per meter per month
-
-    # 💾 Commit all new records
+    records = result["rows"]
     if records:
-        db.session.add_all(records)
-        db.session.commit()
         print(f"✅ {len(records)} consumption records generated for {month}")
     else:
         print(f"⚠️ No valid consumption records generated for {month}")
-
     return records
 
 def build_meter_charge_block(meter_id, month):
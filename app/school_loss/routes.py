@@ -8,13 +8,8 @@ from flask import flash, send_file
 from app.subject_loss.charts import phase_scores_bar
 from xhtml2pdf import pisa
 from datetime import datetime
-import matplotlib.dates as mdates
 from flask import render_template_string
 from reportlab.lib.pagesizes import letter
-import matplotlib.pyplot as plt
-import matplotlib
-matplotlib.use('Agg')  # ✅ prevents Tkinter errors
-from matplotlib import pyplot as plt
 from flask_login import  current_user
 import sqlite3
 from flask import current_app
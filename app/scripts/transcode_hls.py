@@ -0,0 +1,234 @@
+# app/scripts/transcode_hls.py
+"""
+Offline transcoding of reading lesson videos into HLS renditions.
+
+Extends the MKV -> H.264 conversion of `_mkv _mp4.py` / convert-mkv-h264.ps1:
+for every lesson video in a folder (default static/reading_videos)
+
+  1. .mkv sources are converted to <stem>.mp4 (H.264 + AAC); every MP4 gets
+     its moov atom moved to the front (+faststart) so range requests can
+     start playback and seek without downloading the file
+  2. each rung of LADDER not taller than the source is encoded to HLS
+     (6 s segments, fixed GOP so segments line up across rungs) under
+         hls/<stem>/<tag>/<height>p/index.m3u8 + seg_NNNN.ts
+     where <tag> is the source's mtime + size, so a re-transcode never
+     rewrites a segment URL a browser may have cached
+  3. hls/<stem>/master.m3u8 lists the rungs with BANDWIDTH / RESOLUTION; it
+     is written last. Older <tag> directories are removed only once the
+     master is older than MASTER_MAX_AGE (its Cache-Control max-age), so a
+     player holding the cached previous master never loses its segments -
+     the next run (up to date or not) prunes them
+
+Players with HLS support pick the rung per network; the lesson page falls
+back to the MP4 (served with byte ranges by app/subject_reading/media.py).
+
+    python app/scripts/transcode_hls.py [--dir static/reading_videos] [--force] [files...]
+    flask reading-transcode [--force]
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import shutil
+import struct
+import subprocess
+import time
+from typing import NamedTuple
+
+SOURCE_EXTS = (".mp4", ".mkv", ".webm")
+SEGMENT_SECONDS = 6
+MASTER_PLAYLIST = "master.m3u8"
+MASTER_MAX_AGE = 60     # keep in step with app/subject_reading/media.py PLAYLIST_MAX_AGE
+
+
+class Rung(NamedTuple):
+    height: int
+    video_kbps: int
+    audio_kbps: int
+
+
+LADDER = (
+    Rung(720, 2800, 128),
+    Rung(480, 1400, 96),
+    Rung(360, 800, 96),
+    Rung(240, 400, 64),
+)
+
+
+def _run(command: list[str]) -> None:
+    subprocess.run(command, check=True, stdout=subprocess.DEVNULL)
+
+
+def probe(path: str) -> dict:
+    """Width, height and frame rate of the first video stream (ffprobe)."""
+    out = subprocess.run(
+        ["ffprobe", "-v", "error", "-select_streams", "v:0",
+         "-show_entries", "stream=width,height,r_frame_rate", "-of", "json", path],
+        check=True, capture_output=True, text=True,
+    ).stdout
+    stream = (json.loads(out).get("streams") or [{}])[0]
+    num, _, den = (stream.get("r_frame_rate") or "25/1").partition("/")
+    fps = float(num) / float(den or 1) if float(den or 1) else 25.0
+    return {"width": int(stream.get("width") or 0), "height": int(stream.get("height") or 0),
+            "fps": fps or 25.0}
+
+
+def source_tag(path: str) -> str:
+    st = os.stat(path)
+    return f"{int(st.st_mtime):x}{st.st_size:x}"
+
+
+def to_faststart_mp4(input_file: str) -> str:
+    """H.264/AAC MP4 with +faststart next to the source; returns its path."""
+    stem, ext = os.path.splitext(input_file)
+    output_file = stem + ".mp4"
+    tmp = stem + ".faststart.tmp.mp4"
+    if ext.lower() == ".mp4":
+        # remux only: move moov to the front
+        command = ["ffmpeg", "-y", "-i", input_file, "-c", "copy", "-movflags", "+faststart", tmp]
+    elif os.path.exists(output_file):
+        return output_file
+    else:
+        command = ["ffmpeg", "-y", "-i", input_file, "-c:v", "libx264", "-preset", "slow", "-crf", "23",
+                   "-c:a", "aac", "-b:a", "128k", "-movflags", "+faststart", tmp]
+    _run(command)
+    os.replace(tmp, output_file)
+    return output_file
+
+
+def is_faststart(path: str) -> bool:
+    """True when the MP4's moov box comes before mdat (playable from the first bytes)."""
+    with open(path, "rb") as fh:
+        while True:
+            head = fh.read(8)
+            if len(head) < 8:
+                return False
+            size, box = struct.unpack(">I4s", head)
+            if box == b"moov":
+                return True
+            if box == b"mdat" or size == 0:
+                return False
+            if size == 1:
+                size = struct.unpack(">Q", fh.read(8))[0] - 8
+            if size < 8:        # malformed box: seeking by size - 8 would never advance
+                return False
+            fh.seek(size - 8, os.SEEK_CUR)
+
+
+def _even(n: float) -> int:
+    return max(2, int(round(n / 2)) * 2)
+
+
+def encode_rung(input_file: str, out_dir: str, rung: Rung, fps: float) -> None:
+    os.makedirs(out_dir, exist_ok=True)
+    gop = max(1, int(round(fps * SEGMENT_SECONDS)))
+    _run([
+        "ffmpeg", "-y", "-i", input_file,
+        "-vf", f"scale=-2:{rung.height}",
+        "-c:v", "libx264", "-preset", "slow", "-profile:v", "main",
+        "-b:v", f"{rung.video_kbps}k", "-maxrate", f"{int(rung.video_kbps * 1.07)}k",
+        "-bufsize", f"{rung.video_kbps * 2}k",
+        "-g", str(gop), "-keyint_min", str(gop), "-sc_threshold", "0",
+        "-c:a", "aac", "-b:a", f"{rung.audio_kbps}k", "-ac", "2",
+        "-f", "hls", "-hls_time", str(SEGMENT_SECONDS), "-hls_playlist_type", "vod",
+        "-hls_segment_filename", os.path.join(out_dir, "seg_%04d.ts"),
+        os.path.join(out_dir, "index.m3u8"),
+    ])
+
+
+def write_master(path: str, tag: str, rungs: list[Rung], src_w: int, src_h: int) -> None:
+    lines = ["#EXTM3U", "#EXT-X-VERSION:3"]
+    for r in rungs:
+        width = _even(src_w * r.height / src_h) if src_h else _even(r.height * 16 / 9)
+        bandwidth = int((r.video_kbps * 1.07 + r.audio_kbps) * 1000)
+        lines.append(f'#EXT-X-STREAM-INF:BANDWIDTH={bandwidth},RESOLUTION={width}x{r.height},'
+                     f'CODECS="avc1.4d401f,mp4a.40.2"')
+        lines.append(f"{tag}/{r.height}p/index.m3u8")
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as fh:
+        fh.write("\n".join(lines) + "\n")
+    os.replace(tmp, path)
+
+
+def prune_old_tags(base: str, tag: str) -> int:
+    """Remove <tag> directories other than `tag` once every cached master has expired."""
+    try:
+        age = time.time() - os.path.getmtime(os.path.join(base, MASTER_PLAYLIST))
+    except OSError:
+        return 0
+    if age < MASTER_MAX_AGE:
+        return 0
+    n = 0
+    for old in os.listdir(base):
+        full = os.path.join(base, old)
+        if old != tag and os.path.isdir(full):
+            shutil.rmtree(full, ignore_errors=True)
+            n += 1
+    return n
+
+
+def transcode_video(input_file: str, force: bool = False) -> str | None:
+    """Faststart MP4 + HLS ladder for one video; returns the master playlist path (None if skipped)."""
+    mp4 = input_file
+    if not mp4.lower().endswith(".mp4") or not is_faststart(mp4):
+        mp4 = to_faststart_mp4(input_file)
+
+    folder, name = os.path.split(mp4)
+    stem = os.path.splitext(name)[0]
+    base = os.path.join(folder, "hls", stem)
+    tag = source_tag(mp4)
+    master = os.path.join(base, MASTER_PLAYLIST)
+
+    if not force and os.path.isdir(os.path.join(base, tag)) and os.path.exists(master):
+        prune_old_tags(base, tag)
+        print(f"⚠️ Skipping: '{stem}' is up to date.")
+        return None
+
+    info = probe(mp4)
+    rungs = [r for r in LADDER if not info["height"] or r.height <= info["height"]] or [LADDER[-1]]
+    for r in rungs:
+        encode_rung(mp4, os.path.join(base, tag, f"{r.height}p"), r, info["fps"])
+    write_master(master, tag, rungs, info["width"], info["height"])
+    # older tags stay until the new master has outlived MASTER_MAX_AGE (next run)
+    print(f"✅ {stem}: {', '.join(f'{r.height}p' for r in rungs)}")
+    return master
+
+
+def transcode_folder(folder: str, files: list[str] | None = None, force: bool = False) -> list[str]:
+    """Transcode `files` (or every source video directly in `folder`). Returns master playlists written."""
+    names = files or sorted(
+        n for n in os.listdir(folder)
+        if n.lower().endswith(SOURCE_EXTS) and ".tmp." not in n
+    )
+    # an .mkv whose .mp4 twin exists is the same lesson
+    have_mp4 = {os.path.splitext(n)[0] for n in names if n.lower().endswith(".mp4")}
+    written = []
+    for n in names:
+        stem, ext = os.path.splitext(n)
+        if ext.lower() != ".mp4" and stem in have_mp4:
+            continue
+        path = n if os.path.isabs(n) else os.path.join(folder, n)
+        try:
+            master = transcode_video(path, force=force)
+        except subprocess.CalledProcessError as e:
+            print(f"❌ Error transcoding {n}: {e}")
+            continue
+        if master:
+            written.append(master)
+    return written
+
+
+def main() -> None:
+    here = os.path.dirname(os.path.abspath(__file__))
+    default_dir = os.path.normpath(os.path.join(here, "..", "..", "static", "reading_videos"))
+    parser = argparse.ArgumentParser(description="Build HLS renditions for reading lesson videos.")
+    parser.add_argument("files", nargs="*", help="Videos to transcode (default: every video in --dir).")
+    parser.add_argument("--dir", default=default_dir, help="Lesson video folder.")
+    parser.add_argument("--force", action="store_true", help="Re-encode even when renditions are current.")
+    args = parser.parse_args()
+    transcode_folder(args.dir, args.files, force=args.force)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,268 @@
+# app/services/fx_rates.py
+"""
+FX rates (local currency -> ZAR) for parity pricing.
+
+fx_rate_local_to_zar() used to call the exchange-rate API inside the request
+(5 s timeout) whenever a country's fx_to_zar was older than 24 h, one call
+per currency, and commit the result there - the first visitor per country
+after expiry waited on the network. Now:
+
+  refresh_fx_rates()   one provider call for every currency (base ZAR), one
+                       executemany UPDATE of ref_country_currency per
+                       currency - `flask fx-refresh`, meant for cron
+  fx_to_zar(cc)        a dict lookup in a per-process copy of the table
+                       (re-read every FX_CACHE_TTL seconds); never blocks
+
+Stale-while-revalidate: when the value a request reads is older than
+FX_MAX_AGE_HOURS it is still returned, and one background thread per
+process refreshes the table (at most once per FX_REVALIDATE_COOLDOWN
+seconds, so a failing API is not hammered). A country with no rate yet
+returns None; callers already treat that as "no FX".
+
+Providers are callables `provider(base) -> {currency: units per 1 base}`.
+FX_PROVIDER picks one from PROVIDERS ("exchangerate-api", "static") or a
+"module:attr" path; set_fx_provider() swaps it at runtime, e.g. a
+StaticRateProvider in tests.
+"""
+from __future__ import annotations
+
+import importlib
+import threading
+import time
+from datetime import datetime, timezone
+from decimal import Decimal
+from typing import Callable, Mapping
+
+from flask import current_app, has_app_context
+from sqlalchemy import inspect, text
+
+from app.extensions import db
+
+BASE = "ZAR"
+DEFAULT_MAX_AGE_HOURS = 24
+
+RateProvider = Callable[[str], Mapping[str, float]]
+
+
+# ---- providers ---------------------------------------------------------------
+class ExchangeRateApiProvider:
+    """exchangerate-api.com: GET {url}/{base} -> {"rates": {"USD": 0.055, ...}}."""
+
+    def __init__(self, url: str = "https://api.exchangerate-api.com/v4/latest", timeout: float = 5.0):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+
+    def __call__(self, base: str) -> Mapping[str, float]:
+        import requests
+        resp = requests.get(f"{self.url}/{base}", timeout=self.timeout)
+        resp.raise_for_status()
+        return (resp.json() or {}).get("rates") or {}
+
+
+class StaticRateProvider:
+    """Fixed rates (units per 1 base); for tests and offline development."""
+
+    def __init__(self, rates: Mapping[str, float] | None = None):
+        self.rates = dict(rates or {})
+
+    def __call__(self, base: str) -> Mapping[str, float]:
+        return {**self.rates, base: 1.0}
+
+
+PROVIDERS: dict[str, Callable[[], RateProvider]] = {
+    "exchangerate-api": ExchangeRateApiProvider,
+    "static": StaticRateProvider,
+}
+
+_provider: RateProvider | None = None
+
+
+def set_fx_provider(provider: RateProvider | None) -> None:
+    """Use `provider` for refreshes in this process (None: back to FX_PROVIDER)."""
+    global _provider
+    _provider = provider
+
+
+def get_fx_provider() -> RateProvider:
+    if _provider is not None:
+        return _provider
+    name = current_app.config.get("FX_PROVIDER", "exchangerate-api") if has_app_context() else "exchangerate-api"
+    if name in PROVIDERS:
+        return PROVIDERS[name]()
+    module, _, attr = name.partition(":")
+    obj = getattr(importlib.import_module(module), attr)
+    return obj() if isinstance(obj, type) else obj
+
+
+# ---- refresh -----------------------------------------------------------------
+_SQL_SET_FX = text("""
+    UPDATE ref_country_currency
+    SET fx_to_zar = :fx, updated_at = CURRENT_TIMESTAMP
+    WHERE UPPER(currency) = :cur
+""")
+
+
+def refresh_fx_rates(provider: RateProvider | None = None) -> dict:
+    """
+    Fetch every rate in one provider call and update ref_country_currency.
+    Returns {"currencies", "updated", "missing": [...]}.
+    """
+    provider = provider or get_fx_provider()
+    per_base = {str(k).upper(): v for k, v in (provider(BASE) or {}).items()}
+
+    currencies = [str(r[0]).upper() for r in db.session.execute(
+        text("SELECT DISTINCT currency FROM ref_country_currency WHERE currency IS NOT NULL")
+    ).all()]
+
+    params, missing = [], []
+    for cur in currencies:
+        if cur == BASE:
+            params.append({"cur": cur, "fx": 1.0})
+            continue
+        try:
+            rate = float(per_base.get(cur) or 0)
+        except (TypeError, ValueError):
+            rate = 0.0
+        if rate > 0:
+            # provider: units of `cur` per 1 ZAR  ->  stored: ZAR per 1 unit of `cur`
+            params.append({"cur": cur, "fx": round(1.0 / rate, 8)})
+        else:
+            missing.append(cur)
+
+    try:
+        if params:
+            db.session.execute(_SQL_SET_FX, params)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    reload_fx_cache()
+    return {"currencies": len(params), "updated": len(params), "missing": sorted(missing)}
+
+
+# ---- per-process cache -------------------------------------------------------
+_lock = threading.Lock()
+_rates: dict[str, tuple[str, float | None, datetime | None, bool]] = {}
+_loaded_at = 0.0
+_revalidating = False
+_last_revalidate = 0.0
+
+
+def _ts(v) -> datetime | None:
+    if v is None or v == "":
+        return None
+    if isinstance(v, str):
+        try:
+            v = datetime.fromisoformat(v.replace("Z", "+00:00"))
+        except ValueError:
+            return None
+    if v.tzinfo is not None:
+        v = v.astimezone(timezone.utc).replace(tzinfo=None)
+    return v
+
+
+def _cfg(name: str, default: float) -> float:
+    if has_app_context():
+        return float(current_app.config.get(name, default))
+    return float(default)
+
+
+def _load() -> dict:
+    cols = {c["name"] for c in inspect(db.engine).get_columns("ref_country_currency")}
+    fx = "fx_to_zar" if "fx_to_zar" in cols else "NULL"
+    active = "is_active" if "is_active" in cols else "1"
+    rows = db.session.execute(text(
+        f"SELECT alpha2, currency, {fx} AS fx, updated_at, {active} AS active FROM ref_country_currency"
+    )).mappings().all()
+    out = {}
+    for r in rows:
+        try:
+            val = float(r["fx"]) if r["fx"] is not None else None
+        except (TypeError, ValueError):
+            val = None
+        out[str(r["alpha2"]).upper()] = ((r["currency"] or "").upper(), val, _ts(r["updated_at"]),
+                                         r["active"] in (1, True, "1", "t", "true"))
+    return out
+
+
+def reload_fx_cache() -> None:
+    global _rates, _loaded_at
+    rates = _load()
+    with _lock:
+        _rates = rates
+        _loaded_at = time.monotonic()
+
+
+def _cached() -> dict:
+    if not _rates or time.monotonic() - _loaded_at >= _cfg("FX_CACHE_TTL", 300):
+        try:
+            reload_fx_cache()
+        except Exception as exc:
+            db.session.rollback()
+            current_app.logger.warning("FX cache reload failed: %s", exc)
+    return _rates
+
+
+def _revalidate(app) -> None:
+    global _revalidating
+    try:
+        with app.app_context():
+            try:
+                refresh_fx_rates()
+            except Exception as exc:
+                app.logger.warning("Background FX refresh failed: %s", exc)
+            finally:
+                db.session.remove()
+    finally:
+        _revalidating = False
+
+
+def _schedule_revalidate() -> None:
+    global _revalidating, _last_revalidate
+    if not has_app_context():
+        return
+    with _lock:
+        if _revalidating or time.monotonic() - _last_revalidate < _cfg("FX_REVALIDATE_COOLDOWN", 600):
+            return
+        _revalidating = True
+        _last_revalidate = time.monotonic()
+    app = current_app._get_current_object()
+    threading.Thread(target=_revalidate, args=(app,), name="fx-revalidate", daemon=True).start()
+
+
+def fx_to_zar(country_code: str, *, active_only: bool = False) -> float | None:
+    """
+    ZAR per 1 unit of the country's currency (1.0 for ZAR), from cache only.
+    A stale value is returned as-is and triggers a background refresh.
+    """
+    cc = (country_code or "").strip().upper()
+    entry = _cached().get(cc)
+    if entry is None:
+        return None
+    cur, fx, updated_at, active = entry
+    if active_only and not active:
+        return None
+    if cur == BASE:
+        return 1.0
+
+    max_age = _cfg("FX_MAX_AGE_HOURS", DEFAULT_MAX_AGE_HOURS) * 3600
+    if fx is None or updated_at is None or (datetime.utcnow() - updated_at).total_seconds() > max_age:
+        _schedule_revalidate()
+    return fx if fx and fx > 0 else None
+
+
+def fx_to_zar_decimal(country_code: str, *, active_only: bool = False) -> Decimal | None:
+    fx = fx_to_zar(country_code, active_only=active_only)
+    return Decimal(str(fx)) if fx else None
+
+
+def fx_info() -> dict:
+    now = datetime.utcnow()
+    ages = [(now - u).total_seconds() / 3600 for _, fx, u, _ in _rates.values() if fx and u]
+    return {
+        "countries": len(_rates),
+        "with_rate": len(ages),
+        "oldest_h": round(max(ages), 1) if ages else None,
+        "revalidating": _revalidating,
+        "cache_age_s": round(time.monotonic() - _loaded_at, 1) if _loaded_at else None,
+    }
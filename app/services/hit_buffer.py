@@ -0,0 +1,179 @@
+# app/services/hit_buffer.py
+"""
+Buffered site_hit / visit_log writer.
+
+The before_request hooks used to INSERT + COMMIT twice per page view. They now
+push a small dict into an in-process ring buffer and a daemon thread flushes
+the buffer with one executemany per table, either every HIT_BUFFER_INTERVAL
+seconds or as soon as HIT_BUFFER_BATCH rows are waiting.
+
+Memory is bounded by HIT_BUFFER_CAPACITY: when the buffer is full new rows are
+dropped and counted, never blocking the request.
+"""
+import atexit
+import os
+import threading
+from collections import deque
+
+from sqlalchemy import text
+
+from app.extensions import db
+
+
+_INSERTS = {
+    "site_hit": text("""
+        INSERT INTO site_hit (path, user_id, is_auth, user_agent)
+        VALUES (:path, :uid, :authd, :ua)
+    """),
+    "visit_log": text("""
+        INSERT INTO visit_log (path, user_id, ip_hash, ua)
+        VALUES (:path, :user_id, :ip_hash, :ua)
+    """),
+}
+
+
+class HitBuffer:
+    def __init__(self, capacity: int = 10000, batch_size: int = 500, interval: float = 2.0):
+        self.capacity = capacity
+        self.batch_size = batch_size
+        self.interval = interval
+        self.enabled = True
+
+        self._app = None
+        self._rows = deque()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._pid = None
+
+        self.queued = 0
+        self.flushed = 0
+        self.dropped = 0
+        self.failed = 0
+
+    # ---- setup ---------------------------------------------------------------
+    def init_app(self, app):
+        self._app = app
+        self.capacity = int(app.config.get("HIT_BUFFER_CAPACITY", self.capacity))
+        self.batch_size = int(app.config.get("HIT_BUFFER_BATCH", self.batch_size))
+        self.interval = float(app.config.get("HIT_BUFFER_INTERVAL", self.interval))
+        self.enabled = bool(app.config.get("HIT_BUFFER_ENABLED", True))
+        app.extensions["hit_buffer"] = self
+        atexit.register(self.shutdown)
+
+    def _ensure_started(self):
+        # gunicorn forks after create_app(); threads don't survive the fork,
+        # so start (or restart) the flusher lazily in the worker process.
+        pid = os.getpid()
+        if self._thread is not None and self._pid == pid and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == pid and self._thread.is_alive():
+                return
+            self._pid = pid
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="hit-buffer-flusher", daemon=True)
+            self._thread.start()
+
+    # ---- producer side -------------------------------------------------------
+    def enqueue(self, table: str, row: dict) -> bool:
+        """Queue one row for `table`. Returns False if it was dropped."""
+        if table not in _INSERTS:
+            raise ValueError(f"unknown hit table: {table}")
+
+        if not self.enabled:
+            # synchronous fallback (tests / debugging)
+            with self._lock:
+                self._rows.append((table, row))
+                self.queued += 1
+            self.flush()
+            return True
+
+        self._ensure_started()
+        with self._lock:
+            if len(self._rows) >= self.capacity:
+                self.dropped += 1
+                return False
+            self._rows.append((table, row))
+            self.queued += 1
+            pending = len(self._rows)
+
+        if pending >= self.batch_size:
+            self._wake.set()
+        return True
+
+    # ---- consumer side -------------------------------------------------------
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                # flush() already counted/logged; keep the thread alive
+                pass
+
+    def flush(self) -> int:
+        """Write everything currently buffered. Returns rows written."""
+        with self._flush_lock:
+            with self._lock:
+                if not self._rows:
+                    return 0
+                batch = list(self._rows)
+                self._rows.clear()
+
+            by_table: dict[str, list[dict]] = {}
+            for table, row in batch:
+                by_table.setdefault(table, []).append(row)
+
+            app = self._app
+            written = 0
+            for table, rows in by_table.items():
+                try:
+                    with app.app_context():
+                        with db.engine.begin() as conn:
+                            # list of params -> DBAPI executemany
+                            conn.execute(_INSERTS[table], rows)
+                    written += len(rows)
+                except Exception as e:
+                    self.failed += len(rows)
+                    try:
+                        app.logger.warning("[hit_buffer] flush of %d %s rows failed: %s", len(rows), table, e)
+                    except Exception:
+                        pass
+
+            self.flushed += written
+            return written
+
+    def shutdown(self):
+        self._stop.set()
+        self._wake.set()
+        t = self._thread
+        if t is not None and t.is_alive() and t is not threading.current_thread():
+            t.join(timeout=self.interval + 5)
+        if self._app is not None:
+            try:
+                self.flush()
+            except Exception:
+                pass
+
+    # ---- metrics -------------------------------------------------------------
+    def stats(self) -> dict:
+        with self._lock:
+            pending = len(self._rows)
+        return {
+            "enabled": self.enabled,
+            "capacity": self.capacity,
+            "batch_size": self.batch_size,
+            "interval": self.interval,
+            "pending": pending,
+            "queued": self.queued,
+            "flushed": self.flushed,
+            "dropped": self.dropped,
+            "failed": self.failed,
+        }
+
+
+hit_buffer = HitBuffer()
@@ -0,0 +1,321 @@
+# app/services/pdf_render_pool.py
+"""
+Out-of-request PDF rendering.
+
+Web requests only build the HTML (cheap, needs DB + templates) and drop a job
+file into <instance>/pdf_jobs/pending/. A dispatcher claims jobs with an atomic
+rename into running/ and hands them to a multiprocessing pool; each worker
+process imports WeasyPrint once and keeps a warm FontConfiguration and image
+cache. The PDF is written atomically to the job's "out" path (normally the
+loss_pdf_cache file), so the filesystem is the whole broker: no Redis/Celery
+needed.
+
+Modes (PDF_RENDER_POOL):
+  "inprocess" – each web process lazily starts its own dispatcher + pool, so
+                a server with N web workers runs N x PDF_RENDER_WORKERS
+                renderer processes (jobs are still claimed once each);
+                use "external" under multi-worker gunicorn
+  "external"  – web processes only enqueue; run `flask pdf-worker` once
+  "off"       – render inline on the request thread (old behaviour)
+
+PDF_RENDER_WORKERS sets the pool size, PDF_RENDER_TIMEOUT the per-job limit
+(a job over the limit is failed and the pool is recycled to kill it).
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import multiprocessing as mp
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+# ---- worker process side -----------------------------------------------------
+# globals below live in the pool's child processes only
+
+_W_HTML = None
+_W_FONTS = None
+_W_IMG_CACHE: dict = {}
+
+
+def _worker_init():
+    """Warm-load WeasyPrint and fonts once per process."""
+    global _W_HTML, _W_FONTS
+    import sys
+    if sys.platform == "win32":
+        for d in (os.environ.get("WEASYPRINT_DLL_DIRECTORIES") or "").split(os.pathsep) + [
+            r"C:\msys64\mingw64\bin", r"C:\Program Files\GTK3-Runtime Win64\bin",
+        ]:
+            if d and os.path.isdir(d):
+                try:
+                    os.add_dll_directory(d)
+                except Exception:
+                    os.environ["PATH"] = d + os.pathsep + os.environ.get("PATH", "")
+    from weasyprint import HTML
+    from weasyprint.text.fonts import FontConfiguration
+
+    _W_HTML = HTML
+    _W_FONTS = FontConfiguration()
+
+
+def _worker_render(job_path: str) -> int:
+    with open(job_path, encoding="utf-8") as fh:
+        job = json.load(fh)
+    pdf = _W_HTML(string=job["html"], base_url=job.get("base_url")).write_pdf(
+        font_config=_W_FONTS, cache=_W_IMG_CACHE,
+    )
+    out = Path(job["out"])
+    out.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=out.parent, suffix=".tmp")
+    with os.fdopen(fd, "wb") as fh:
+        fh.write(pdf)
+    os.replace(tmp, out)
+    return len(pdf)
+
+
+# ---- web / dispatcher side ---------------------------------------------------
+def _mtime(p: Path) -> float:
+    try:
+        return p.stat().st_mtime
+    except OSError:      # claimed by another dispatcher meanwhile
+        return 0.0
+
+
+class PdfRenderPool:
+    def __init__(self):
+        self.mode = "inprocess"
+        self.workers = 2
+        self.timeout = 60.0
+        self.wait = 20.0
+        self.root: Path | None = None
+        self._app = None
+
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._pool = None
+
+        self.submitted = 0
+        self.rendered = 0
+        self.failed = 0
+        self.timeouts = 0
+
+    def init_app(self, app):
+        self._app = app
+        self.mode = str(app.config.get("PDF_RENDER_POOL", self.mode)).lower()
+        self.workers = max(1, int(app.config.get("PDF_RENDER_WORKERS", self.workers)))
+        self.timeout = float(app.config.get("PDF_RENDER_TIMEOUT", self.timeout))
+        self.wait = float(app.config.get("PDF_RENDER_WAIT", self.wait))
+        self.root = Path(app.config.get("PDF_RENDER_QUEUE_DIR") or os.path.join(app.instance_path, "pdf_jobs"))
+        for sub in ("pending", "running", "failed", "out"):
+            (self.root / sub).mkdir(parents=True, exist_ok=True)
+        app.extensions["pdf_render_pool"] = self
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode in ("inprocess", "external") and self.root is not None
+
+    # ---- queue ---------------------------------------------------------------
+    def _job(self, state: str, key: str) -> Path:
+        return self.root / state / f"{key}.json"
+
+    def submit(self, key: str, html: str, out_path, base_url: str | None = None) -> str:
+        """Queue a render of `html` into `out_path`. Idempotent per key."""
+        out_path = Path(out_path)
+        st = self.status(key, out_path)
+        if st in ("done", "pending", "running"):
+            return st
+        self._job("failed", key).unlink(missing_ok=True)
+
+        job = {"key": key, "html": html, "base_url": base_url, "out": str(out_path),
+               "created": time.time()}
+        fd, tmp = tempfile.mkstemp(dir=self.root / "pending", suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as fh:
+            json.dump(job, fh)
+        os.replace(tmp, self._job("pending", key))
+        self.submitted += 1
+
+        if self.mode == "inprocess":
+            self.ensure_started()
+            self._wake.set()
+        return "pending"
+
+    def status(self, key: str, out_path) -> str:
+        if Path(out_path).exists():
+            return "done"
+        for state in ("running", "pending", "failed"):
+            if self._job(state, key).exists():
+                return state
+        return "missing"
+
+    def error(self, key: str) -> str | None:
+        try:
+            return json.loads(self._job("failed", key).read_text(encoding="utf-8")).get("error")
+        except Exception:
+            return None
+
+    def wait_for(self, key: str, out_path, timeout: float | None = None) -> bytes | None:
+        """Block (politely) until the job is done; None on failure/timeout."""
+        out_path = Path(out_path)
+        deadline = time.monotonic() + (self.wait if timeout is None else timeout)
+        delay = 0.05
+        while time.monotonic() < deadline:
+            if out_path.exists():
+                return out_path.read_bytes()
+            if self._job("failed", key).exists():
+                return None
+            time.sleep(delay)
+            delay = min(delay * 1.5, 0.5)
+        return out_path.read_bytes() if out_path.exists() else None
+
+    def render_html(self, html: str, base_url: str | None = None, timeout: float | None = None) -> bytes | None:
+        """Ad-hoc render through the pool (content-addressed by the HTML)."""
+        key = hashlib.sha256(f"{base_url}|{html}".encode("utf-8")).hexdigest()
+        out = self.root / "out" / f"{key}.pdf"
+        self.submit(key, html, out, base_url=base_url)
+        data = self.wait_for(key, out, timeout)
+        try:
+            out.unlink(missing_ok=True)
+        except OSError:
+            pass
+        return data
+
+    # ---- dispatcher ----------------------------------------------------------
+    def ensure_started(self):
+        pid = os.getpid()
+        if self._thread is not None and self._pid == pid and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == pid and self._thread.is_alive():
+                return
+            self._pid = pid
+            self._pool = None          # never reuse a pool inherited through fork
+            self._stop.clear()
+            self._thread = threading.Thread(target=self.run_forever, name="pdf-render-dispatch", daemon=True)
+            self._thread.start()
+
+    def _new_pool(self):
+        ctx = mp.get_context("spawn")
+        return ctx.Pool(processes=self.workers, initializer=_worker_init)
+
+    def _requeue_stale(self, older_than: float):
+        now = time.time()
+        for p in (self.root / "running").glob("*.json"):
+            try:
+                if now - p.stat().st_mtime > older_than:
+                    os.replace(p, self.root / "pending" / p.name)
+            except OSError:
+                pass
+
+    def _fail(self, running: Path, err: str):
+        try:
+            job = json.loads(running.read_text(encoding="utf-8"))
+        except Exception:
+            job = {}
+        job.pop("html", None)                      # keep failed/ small
+        job["error"] = err[:2000]
+        job["failed_at"] = time.time()
+        dst = self.root / "failed" / running.name
+        dst.write_text(json.dumps(job), encoding="utf-8")
+        running.unlink(missing_ok=True)
+        self.failed += 1
+
+    def run_forever(self):
+        """Dispatcher loop; used by the in-process thread and `flask pdf-worker`."""
+        self._requeue_stale(self.timeout * 2)
+        self._pool = self._new_pool()
+        inflight: dict[str, tuple[Path, object, float]] = {}
+        try:
+            while not self._stop.is_set():
+                # claim work up to pool size
+                if len(inflight) < self.workers:
+                    for p in sorted((self.root / "pending").glob("*.json"), key=_mtime):
+                        if len(inflight) >= self.workers:
+                            break
+                        dst = self.root / "running" / p.name
+                        try:
+                            os.rename(p, dst)      # atomic claim; losers get FileNotFoundError
+                            os.utime(dst, None)
+                        except OSError:
+                            continue
+                        res = self._pool.apply_async(_worker_render, (str(dst),))
+                        inflight[p.stem] = (dst, res, time.monotonic())
+
+                # collect results / enforce timeouts
+                recycle = False
+                for key, (path, res, started) in list(inflight.items()):
+                    if res.ready():
+                        inflight.pop(key)
+                        try:
+                            res.get(0)
+                            path.unlink(missing_ok=True)
+                            self.rendered += 1
+                            self._after_done()
+                        except Exception as e:
+                            self._fail(path, repr(e))
+                    elif time.monotonic() - started > self.timeout:
+                        inflight.pop(key)
+                        self.timeouts += 1
+                        self._fail(path, f"timeout after {self.timeout:.0f}s")
+                        recycle = True
+
+                if recycle:
+                    # the hung worker can only be killed with the pool; others are re-queued
+                    self._pool.terminate()
+                    for key, (path, _res, _st) in inflight.items():
+                        try:
+                            os.replace(path, self.root / "pending" / path.name)
+                        except OSError:
+                            pass
+                    inflight.clear()
+                    self._pool = self._new_pool()
+
+                self._wake.wait(0.1 if inflight else 1.0)
+                self._wake.clear()
+        finally:
+            try:
+                self._pool.terminate()
+            except Exception:
+                pass
+
+    def _after_done(self):
+        # pool writes bypass PdfCache.put(); keep the cache within its size bound
+        if self._app is None:
+            return
+        try:
+            from app.utils.pdf_cache import loss_pdf_cache
+            with self._app.app_context():
+                loss_pdf_cache._evict()
+        except Exception:
+            pass
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def stats(self) -> dict:
+        def _n(state):
+            try:
+                return sum(1 for _ in (self.root / state).glob("*.json"))
+            except Exception:
+                return 0
+        return {
+            "mode": self.mode,
+            "workers": self.workers,
+            "timeout": self.timeout,
+            "pending": _n("pending"),
+            "running": _n("running"),
+            "failed_jobs": _n("failed"),
+            "submitted": self.submitted,
+            "rendered": self.rendered,
+            "failed": self.failed,
+            "timeouts": self.timeouts,
+            "dispatcher_alive": bool(self._thread and self._thread.is_alive()),
+        }
+
+
+pdf_render_pool = PdfRenderPool()
@@ -0,0 +1,274 @@
+# app/subject_loss/answer_capture.py
+"""
+Batched answer capture for the LOSS question flow.
+
+The flow used to upsert one lca_response row (SELECT + INSERT/UPDATE) and
+commit the run pointer on every answer and every card view - ~70 small write
+transactions per run - and never wrote lca_result at all, so results depended
+on a later recompute.
+
+Now answers for a question range are kept in the session together with the
+position reached in that range, one buffer per run:
+
+    session["loss_capture"] = {"42": {"pos": 17, "answers": {"9": "yes", ...}}, ...}
+
+Keying by run means a second tab or a restart into a new run never replaces
+another run's unflushed answers; starting a new run flushes the others
+(flush_all) so the session only carries the range in progress.
+
+and written at the range boundary (the last question before the pause, the
+last question of the run) and when the run finishes. A flush is one
+transaction:
+
+    UPDATE lca_run SET current_pos        pointer + row lock for this run
+    SELECT previous answers for the range one query, for re-answered questions
+    INSERT .. ON CONFLICT (run_id, question_id) DO UPDATE   executemany
+    UPDATE lca_result += delta            incremental phase totals
+
+so replaying a flush (double-submit, back button) is harmless: the upsert is
+idempotent on (run_id, question_id) and only the score difference between
+the old and new answers is added to lca_result. A run whose lca_result row is
+missing (started before this existed) is scored once in full instead.
+
+The upsert needs the unique ux_lca_response_run_question index, which
+db.create_all() does not add to an existing lca_response. Until
+`flask loss-response-index` has built it, answers are written with a plain
+UPDATE of the rows the flush already read plus an INSERT of the rest (newest
+row per question wins where old duplicates exist), so the flow keeps working.
+"""
+from __future__ import annotations
+
+from flask import current_app, session
+from sqlalchemy import bindparam, inspect, text
+
+from app.admin.loss.scoring_engine import compute_run_result, get_scoring_map, normalize_answer
+from app.extensions import db
+
+SESSION_KEY = "loss_capture"
+
+_SQL_DEDUPE = text("""
+    DELETE FROM lca_response
+    WHERE id NOT IN (SELECT MAX(id) FROM lca_response GROUP BY run_id, question_id)
+""")
+_SQL_UNIQUE = text(
+    "CREATE UNIQUE INDEX IF NOT EXISTS ux_lca_response_run_question ON lca_response (run_id, question_id)"
+)
+
+_SQL_POINTER = text("UPDATE lca_run SET current_pos = :pos WHERE id = :rid")
+
+_SQL_PREVIOUS = text("""
+    SELECT question_id, answer FROM lca_response
+    WHERE run_id = :rid AND question_id IN :qids
+    ORDER BY id
+""").bindparams(bindparam("qids", expanding=True))
+
+_SQL_UPSERT = text("""
+    INSERT INTO lca_response (run_id, user_id, question_id, answer, created_at)
+    VALUES (:rid, :uid, :qid, :ans, CURRENT_TIMESTAMP)
+    ON CONFLICT (run_id, question_id) DO UPDATE SET
+        answer     = excluded.answer,
+        user_id    = excluded.user_id,
+        created_at = excluded.created_at
+""")
+
+# without the unique index (see module docstring)
+_SQL_UPDATE = text("""
+    UPDATE lca_response SET answer = :ans, user_id = :uid, created_at = CURRENT_TIMESTAMP
+    WHERE run_id = :rid AND question_id = :qid
+""")
+_SQL_INSERT = text("""
+    INSERT INTO lca_response (run_id, user_id, question_id, answer, created_at)
+    VALUES (:rid, :uid, :qid, :ans, CURRENT_TIMESTAMP)
+""")
+
+_SQL_ADD_DELTA = text("""
+    UPDATE lca_result SET
+        phase_1 = phase_1 + :d1,
+        phase_2 = phase_2 + :d2,
+        phase_3 = phase_3 + :d3,
+        phase_4 = phase_4 + :d4,
+        total   = total + :dt
+    WHERE run_id = :rid
+""")
+
+_SQL_INSERT_RESULT = text("""
+    INSERT INTO lca_result (run_id, user_id, subject, phase_1, phase_2, phase_3, phase_4, total, created_at)
+    VALUES (:run_id, :user_id, 'LOSS', :phase_1, :phase_2, :phase_3, :phase_4, :total, CURRENT_TIMESTAMP)
+""")
+
+
+_has_index: bool | None = None     # per process; None = not checked yet
+
+
+def has_response_index() -> bool:
+    global _has_index
+    names = {ix.get("name") for ix in inspect(db.session.connection()).get_indexes("lca_response")}
+    _has_index = "ux_lca_response_run_question" in names
+    return _has_index
+
+
+def ensure_response_schema() -> None:
+    """
+    Startup check only: the unique (run_id, question_id) index the answer
+    upserts need. Databases created before it was on the model get it from
+    `flask loss-response-index` (one-off: collapses duplicates, then builds
+    it); until then answers use the plain UPDATE / INSERT path.
+    """
+    if not has_response_index():
+        current_app.logger.warning(
+            "lca_response has no ux_lca_response_run_question index; LOSS answers use the slower "
+            "UPDATE/INSERT path until `flask loss-response-index` has been run"
+        )
+
+
+def build_response_index() -> int:
+    """Collapse duplicate (run_id, question_id) rows to the newest and build the index. Returns rows deleted."""
+    try:
+        deleted = db.session.execute(_SQL_DEDUPE).rowcount or 0
+        db.session.execute(_SQL_UNIQUE)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    has_response_index()
+    return deleted
+
+
+# ---- session buffer ----------------------------------------------------------
+def _buffers() -> dict:
+    bufs = session.get(SESSION_KEY) or {}
+    if "run_id" in bufs:
+        # single-run shape from sessions written before buffers were per run
+        bufs = {str(bufs["run_id"]): {"pos": bufs.get("pos"), "answers": bufs.get("answers") or {}}}
+    return bufs
+
+
+def _state(run_id: int) -> dict | None:
+    return _buffers().get(str(int(run_id)))
+
+
+def _save(run_id: int, st: dict) -> None:
+    bufs = _buffers()
+    bufs[str(int(run_id))] = st
+    session[SESSION_KEY] = bufs
+
+
+def tracked_pos(run) -> int:
+    """Position reached in the current range, else the stored run pointer."""
+    st = _state(run.id)
+    if st and st.get("pos"):
+        return int(st["pos"])
+    return int(run.current_pos or 1)
+
+
+def track_pos(run_id: int, pos: int) -> None:
+    st = _state(run_id) or {"answers": {}}
+    st["pos"] = int(pos)
+    _save(run_id, st)
+
+
+def buffer_answer(run_id: int, question_id: int, answer: str, next_pos: int) -> None:
+    st = _state(run_id) or {"answers": {}}
+    st["answers"][str(int(question_id))] = normalize_answer(answer)
+    st["pos"] = int(next_pos)
+    _save(run_id, st)
+
+
+def pending_answers(run_id: int) -> dict[int, str]:
+    st = _state(run_id)
+    return {int(q): a for q, a in st["answers"].items()} if st else {}
+
+
+def buffered_answer(run_id: int, question_id: int) -> str | None:
+    st = _state(run_id)
+    return st["answers"].get(str(int(question_id))) if st else None
+
+
+def clear_buffer(run_id: int | None = None) -> None:
+    if run_id is None:
+        session.pop(SESSION_KEY, None)
+        return
+    bufs = _buffers()
+    if bufs.pop(str(int(run_id)), None) is None:
+        return
+    if bufs:
+        session[SESSION_KEY] = bufs
+    else:
+        session.pop(SESSION_KEY, None)
+
+
+# ---- flush -------------------------------------------------------------------
+def write_answers(run_id: int, user_id: int, answers: dict[int, str], pos: int | None = None) -> tuple:
+    """
+    Upsert `answers` ({question_id: answer}) for one run and add their score
+    delta to lca_result, in the caller's transaction. `pos` also moves the
+    run pointer. Returns the phase delta that was applied.
+    """
+    rid = int(run_id)
+    if pos is not None:
+        db.session.execute(_SQL_POINTER, {"pos": int(pos), "rid": rid})
+    if not answers:
+        return (0, 0, 0, 0)
+
+    qids = sorted(int(q) for q in answers)
+    new = [normalize_answer(answers[q]) for q in qids]
+    # newest row per question (duplicates only exist on databases without the index)
+    old = dict(db.session.execute(_SQL_PREVIOUS, {"rid": rid, "qids": qids}).all())
+
+    smap = get_scoring_map()
+    after = smap.score(qids, new)
+    before = smap.score(list(old), list(old.values()))
+    delta = tuple(a - b for a, b in zip(after, before))
+
+    rows = [{"rid": rid, "uid": int(user_id), "qid": q, "ans": a} for q, a in zip(qids, new)]
+    if _has_index if _has_index is not None else has_response_index():
+        db.session.execute(_SQL_UPSERT, rows)
+    else:
+        updates = [r for r in rows if r["qid"] in old]
+        inserts = [r for r in rows if r["qid"] not in old]
+        if updates:
+            db.session.execute(_SQL_UPDATE, updates)
+        if inserts:
+            db.session.execute(_SQL_INSERT, inserts)
+
+    d1, d2, d3, d4 = delta
+    hit = db.session.execute(_SQL_ADD_DELTA, {"rid": rid, "d1": d1, "d2": d2, "d3": d3, "d4": d4,
+                                              "dt": d1 + d2 + d3 + d4}).rowcount
+    if not hit:
+        # no result row yet: score everything the run has so far, once
+        res = compute_run_result(rid)
+        if res is not None:
+            db.session.execute(_SQL_INSERT_RESULT, {**res, "user_id": res["user_id"] or int(user_id)})
+    return delta
+
+
+def flush_answers(run_id: int, user_id: int, pos: int | None = None) -> int:
+    """Write the session buffer for `run_id` (one transaction) and clear it. Returns answers written."""
+    answers = pending_answers(run_id)
+    try:
+        write_answers(run_id, user_id, answers, pos)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    clear_buffer(run_id)
+    return len(answers)
+
+
+_SQL_OWN_RUNS = text("SELECT id FROM lca_run WHERE user_id = :uid AND id IN :rids").bindparams(
+    bindparam("rids", expanding=True))
+
+
+def flush_all(user_id: int) -> int:
+    """Flush every buffered run of this user (each at its buffered position). Returns answers written."""
+    bufs = _buffers()
+    if not bufs:
+        return 0
+    own = {int(r[0]) for r in db.session.execute(
+        _SQL_OWN_RUNS, {"uid": int(user_id), "rids": [int(k) for k in bufs]})}
+    written = 0
+    for key, st in bufs.items():
+        if int(key) in own:
+            written += flush_answers(int(key), user_id, st.get("pos"))
+    clear_buffer()
+    return written
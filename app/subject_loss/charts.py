@@ -1,126 +1,102 @@
-# app/subject/loss/charts.py
+# app/subject_loss/charts.py
+"""
+LOSS phase-score bar chart (four phases, low / mid / high bands).
+
+phase_scores_bar() used to draw through matplotlib.pyplot (plt.subplots /
+plt.close): pyplot keeps global figure state, so concurrent requests on a
+threaded server could draw into each other's figures, and every report view
+and PDF download paid a full render. Now:
+
+    png   a matplotlib Figure on its own FigureCanvasAgg - no pyplot, no
+          shared state; matplotlib is imported on first PNG render only
+    svg   the same fixed layout written directly as SVG markup - vector, no
+          matplotlib at all, embeds in HTML inline or as a data URI (the PDF
+          routes use it)
+
+Results are memoised per (scores, thresholds, size, format) in a bounded
+LRU (CHART_CACHE_SIZE); a learner's chart is drawn once per worker however
+often the report or the PDF is opened.
+"""
 from __future__ import annotations
-import io, base64
-import matplotlib
-matplotlib.use("Agg")
-import matplotlib.pyplot as plt
 
-def phase_scores_bar(scores, thresholds=None, width=800, height=380):
-    """
-    scores: list of 4 ints (0..100) for phases 1..4
-    thresholds: {"low": 33, "mid": 66, "high": 85} by default
-    returns (data_uri, png_bytes)
-    """
-    thresholds = thresholds or {"low": 33, "mid": 66, "high": 85}
-    scores = [(int(s) if s is not None else 0) for s in scores]
+import base64
+import io
+from functools import lru_cache
+from html import escape
 
-    fig, ax = plt.subplots(figsize=(width/100.0, height/100.0), dpi=100)
-
-    # Background bands (light tints) to visually show low/mid/high zones
-    low, mid, high = thresholds["low"], thresholds["mid"], thresholds["high"]
-    ax.axhspan(0, low,  facecolor="#e5e7eb", alpha=0.5)   # light gray
-    ax.axhspan(low, mid, facecolor="#dbeafe", alpha=0.5)  # light blue
-    ax.axhspan(mid, 100, facecolor="#ffe4e6", alpha=0.5)  # light rose
-
-    x = [1, 2, 3, 4]
-    bars = ax.bar(x, scores, width=0.6, color=["#2563eb","#059669","#d97706","#dc2626"], edgecolor="#111827")
+CHART_CACHE_SIZE = 512
+FORMATS = ("png", "svg")
 
-    # Annotate each bar with its % just above the top
-    for i, (rect, y) in enumerate(zip(bars, scores), start=1):
-        ax.text(i, max(y + 2, 2), f"{y}%", ha="center", va="bottom", fontsize=9)
+DEFAULT_THRESHOLDS = {"low": 33, "mid": 66, "high": 85}
+BAR_COLORS = ("#2563eb", "#059669", "#d97706", "#dc2626")
+BANDS = ("#e5e7eb", "#dbeafe", "#ffe4e6")   # below low, low..mid, mid..100
 
-    # Reference lines + labels on the right
-    for label, y in thresholds.items():
-        ax.axhline(y, linestyle="--", linewidth=1, color="#1f2937")
-        ax.text(x[-1] + 0.2, y, f"{label.title()} ({y}%)", va="center", fontsize=9, color="#374151")
 
-    ax.set_ylim(0, 100)
-    ax.set_xlim(0.4, 4.8)
-    ax.set_xticks(x)
-    ax.set_xticklabels([str(i) for i in x])
-    ax.set_xlabel("Phases")
-    ax.set_ylabel("%")
-
-    # We already have an H3 in HTML, so keep the plot itself untitled
-    ax.set_title("")
-
-    # Cleaner frame
-    ax.spines["top"].set_visible(False)
-    ax.spines["right"].set_visible(False)
-    ax.grid(axis="y", linestyle=":", linewidth=0.7, alpha=0.6)
-
-    fig.tight_layout()
-    buf = io.BytesIO()
-    fig.savefig(buf, format="png", bbox_inches="tight")
-    plt.close(fig)
-
-    png = buf.getvalue()
-    data_uri = "data:image/png;base64," + base64.b64encode(png).decode("ascii")
-    return data_uri, png
+def _to_int(v):
+    try:
+        return int(v)
+    except (TypeError, ValueError):
+        try:
+            return int(float(v))
+        except Exception:
+            return None
 
 
-def phase_scores_bar(scores, thresholds=None, width=800, height=380):
+def normalize_scores(scores) -> tuple[int, int, int, int]:
     """
     Accepts scores as:
       - [22, 35, 18, 44]
-      - {'p1':22,'p2':35,'p3':18,'p4':44}  (or 'p1_score', etc.)
+      - {'p1':22,'p2':35,'p3':18,'p4':44}  (or 'P1', 'p1_score', etc.)
       - [('p1',22),('p2',35), ...] or [(1,22), (2,35), ...]
-    Normalizes to four integers (0..100) and draws the chart.
-    Returns (data_uri, png_bytes)
+    Returns four integers, padded with 0 / trimmed.
     """
-    thresholds = thresholds or {"low": 33, "mid": 66, "high": 85}
-
-    # ---- normalize input to 4 ints
-    def to_int(v):
-        try:
-            return int(v)
-        except (TypeError, ValueError):
-            try:
-                return int(float(v))
-            except Exception:
-                return None
-
     norm = []
-
     if isinstance(scores, dict):
-        # Try both key styles
+        lowered = {str(k).lower(): v for k, v in scores.items()}
         for k in ("p1", "p2", "p3", "p4", "p1_score", "p2_score", "p3_score", "p4_score"):
-            if k in scores:
-                v = to_int(scores.get(k))
+            if k in lowered:
+                v = _to_int(lowered[k])
                 if v is not None:
                     norm.append(v)
     else:
         for item in (scores or []):
             if isinstance(item, (list, tuple)) and len(item) >= 2:
-                v = to_int(item[1])  # use the value part
+                v = _to_int(item[1])  # use the value part
             else:
-                v = to_int(item)
+                v = _to_int(item)
             if v is not None:
                 norm.append(v)
+    return tuple((norm + [0, 0, 0, 0])[:4])
 
-    # pad/trim to exactly 4 values
-    scores = (norm + [0, 0, 0, 0])[:4]
 
-    # ---- plotting (unchanged from your version)
-    fig, ax = plt.subplots(figsize=(width/100.0, height/100.0), dpi=100)
+def _thresholds_key(thresholds) -> tuple[tuple[str, int], ...]:
+    thresholds = thresholds or DEFAULT_THRESHOLDS
+    return tuple((str(k), int(v)) for k, v in thresholds.items())
 
-    low, mid, high = thresholds["low"], thresholds["mid"], thresholds["high"]
-    ax.axhspan(0, low,  facecolor="#e5e7eb", alpha=0.5)
-    ax.axhspan(low, mid, facecolor="#dbeafe", alpha=0.5)
-    ax.axhspan(mid, 100, facecolor="#ffe4e6", alpha=0.5)
 
-    x = [1, 2, 3, 4]
-    bars = ax.bar(x, scores, width=0.6,
-                  color=["#2563eb", "#059669", "#d97706", "#dc2626"],
-                  edgecolor="#111827")
+# ---- renderers ---------------------------------------------------------------
+def _render_png(scores, thresholds, width: int, height: int) -> bytes:
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=(width / 100.0, height / 100.0), dpi=100)
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot(1, 1, 1)
 
-    for i, (rect, y) in enumerate(zip(bars, scores), start=1):
+    t = dict(thresholds)
+    low, mid = t["low"], t["mid"]
+    ax.axhspan(0, low, facecolor=BANDS[0], alpha=0.5)
+    ax.axhspan(low, mid, facecolor=BANDS[1], alpha=0.5)
+    ax.axhspan(mid, 100, facecolor=BANDS[2], alpha=0.5)
+
+    x = [1, 2, 3, 4]
+    ax.bar(x, scores, width=0.6, color=list(BAR_COLORS), edgecolor="#111827")
+    for i, y in zip(x, scores):
         ax.text(i, max(y + 2, 2), f"{y}%", ha="center", va="bottom", fontsize=9)
 
-    for label, y in thresholds.items():
+    for label, y in thresholds:
         ax.axhline(y, linestyle="--", linewidth=1, color="#1f2937")
-        ax.text(x[-1] + 0.2, y, f"{label.title()} ({y}%)", va="center",
-                fontsize=9, color="#374151")
+        ax.text(x[-1] + 0.2, y, f"{label.title()} ({y}%)", va="center", fontsize=9, color="#374151")
 
     ax.set_ylim(0, 100)
     ax.set_xlim(0.4, 4.8)
@@ -128,8 +104,6 @@ def phase_scores_bar(scores, thresholds=None, width=800, height=380):
     ax.set_xticklabels([str(i) for i in x])
     ax.set_xlabel("Phases")
     ax.set_ylabel("%")
-    ax.set_title("")
-
     ax.spines["top"].set_visible(False)
     ax.spines["right"].set_visible(False)
     ax.grid(axis="y", linestyle=":", linewidth=0.7, alpha=0.6)
@@ -137,8 +111,88 @@ def phase_scores_bar(scores, thresholds=None, width=800, height=380):
     fig.tight_layout()
     buf = io.BytesIO()
     fig.savefig(buf, format="png", bbox_inches="tight")
-    plt.close(fig)
+    return buf.getvalue()
+
+
+def _render_svg(scores, thresholds, width: int, height: int) -> str:
+    left, right, top, bottom = 48, 110, 14, 44
+    pw, ph = max(width - left - right, 10), max(height - top - bottom, 10)
+
+    def px(xv):     # data x (0.4 .. 4.8) -> pixels
+        return left + (xv - 0.4) / 4.4 * pw
+
+    def py(yv):     # data y (0 .. 100) -> pixels
+        return top + ph - max(0, min(100, yv)) / 100.0 * ph
+
+    t = dict(thresholds)
+    low, mid = t["low"], t["mid"]
+    out = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" '
+        f'viewBox="0 0 {width} {height}" font-family="DejaVu Sans, Arial, sans-serif" font-size="12">',
+        f'<rect width="{width}" height="{height}" fill="#ffffff"/>',
+    ]
+    for (y0, y1), color in zip(((0, low), (low, mid), (mid, 100)), BANDS):
+        out.append(f'<rect x="{left}" y="{py(y1):.1f}" width="{pw}" height="{py(y0) - py(y1):.1f}" '
+                   f'fill="{color}" fill-opacity="0.5"/>')
+    for g in range(0, 101, 20):
+        out.append(f'<line x1="{left}" x2="{left + pw}" y1="{py(g):.1f}" y2="{py(g):.1f}" '
+                   f'stroke="#b0b0b0" stroke-width="0.7" stroke-dasharray="1,2"/>')
+        out.append(f'<text x="{left - 6}" y="{py(g):.1f}" text-anchor="end" dominant-baseline="middle">{g}</text>')
+
+    bar_w = 0.6 / 4.4 * pw
+    for i, (y, color) in enumerate(zip(scores, BAR_COLORS), start=1):
+        x0 = px(i) - bar_w / 2
+        out.append(f'<rect x="{x0:.1f}" y="{py(y):.1f}" width="{bar_w:.1f}" height="{py(0) - py(y):.1f}" '
+                   f'fill="{color}" stroke="#111827"/>')
+        out.append(f'<text x="{px(i):.1f}" y="{py(max(y + 2, 2)) - 2:.1f}" text-anchor="middle">{y}%</text>')
+        out.append(f'<text x="{px(i):.1f}" y="{top + ph + 16}" text-anchor="middle">{i}</text>')
+
+    for label, y in thresholds:
+        out.append(f'<line x1="{left}" x2="{left + pw}" y1="{py(y):.1f}" y2="{py(y):.1f}" '
+                   f'stroke="#1f2937" stroke-width="1" stroke-dasharray="4,3"/>')
+        out.append(f'<text x="{px(4.2):.1f}" y="{py(y):.1f}" dominant-baseline="middle" fill="#374151">'
+                   f'{escape(label.title())} ({y}%)</text>')
+
+    out += [
+        f'<line x1="{left}" x2="{left}" y1="{top}" y2="{top + ph}" stroke="#000000"/>',
+        f'<line x1="{left}" x2="{left + pw}" y1="{top + ph}" y2="{top + ph}" stroke="#000000"/>',
+        f'<text x="{left + pw / 2:.1f}" y="{height - 8}" text-anchor="middle">Phases</text>',
+        f'<text x="14" y="{top + ph / 2:.1f}" text-anchor="middle" '
+        f'transform="rotate(-90 14 {top + ph / 2:.1f})">%</text>',
+        "</svg>",
+    ]
+    return "".join(out)
+
+
+@lru_cache(maxsize=CHART_CACHE_SIZE)
+def _chart(scores, thresholds, width: int, height: int, fmt: str) -> tuple[str, bytes]:
+    if fmt == "svg":
+        body = _render_svg(scores, thresholds, width, height).encode("utf-8")
+        mime = "image/svg+xml"
+    else:
+        body = _render_png(scores, thresholds, width, height)
+        mime = "image/png"
+    return f"data:{mime};base64," + base64.b64encode(body).decode("ascii"), body
+
+
+# ---- public ------------------------------------------------------------------
+def phase_scores_bar(scores, thresholds=None, width=800, height=380, fmt="png"):
+    """
+    scores: four phase percentages in any form normalize_scores() accepts
+    thresholds: {"low": 33, "mid": 66, "high": 85} by default
+    fmt: "png" or "svg"
+    returns (data_uri, image_bytes)
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"unknown chart format: {fmt!r}")
+    return _chart(normalize_scores(scores), _thresholds_key(thresholds), int(width), int(height), fmt)
+
+
+def phase_scores_svg(scores, thresholds=None, width=800, height=380) -> str:
+    """The chart as inline <svg> markup, for embedding in HTML / PDF templates (|safe)."""
+    return phase_scores_bar(scores, thresholds, width, height, fmt="svg")[1].decode("utf-8")
+
 
-    png = buf.getvalue()
-    data_uri = "data:image/png;base64," + base64.b64encode(png).decode("ascii")
-    return data_uri, png
+def chart_cache_info() -> dict:
+    info = _chart.cache_info()
+    return {"hits": info.hits, "misses": info.misses, "size": info.currsize, "max": info.maxsize}
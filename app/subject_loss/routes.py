@@ -29,17 +29,12 @@ from app.subject_loss.report_context_adapter import build_learner_report_ctx
 from app.utils.mailer import send_pdf_email
 from xhtml2pdf import pisa
 from datetime import datetime
-import matplotlib.dates as mdates
 from flask import render_template_string
 import base64
 from reportlab.platypus import Table, TableStyle
 from reportlab.lib import colors
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import letter
-import matplotlib.pyplot as plt
-import matplotlib
-matplotlib.use('Agg')  # ✅ prevents Tkinter errors
-from matplotlib import pyplot as plt
 from flask_login import login_required, current_user
 from app.diagnostics import trace_route
 import traceback
@@ -81,6 +76,16 @@ from app.utils.post_assessment import handle_exit_actions  # where your helper l
 from threading import Thread
 from sqlalchemy import func as SA_FUNC, text as SA_TEXT
 from app.payments.pricing import price_for_country, subject_id_for  # table-driven helper
+from app.utils.pdf_cache import loss_pdf_cache
+from app.subject_loss.sequence_store import (
+    FLOW, SEQUENCE, TOTAL_QUESTIONS, fragment_cache_enabled, get_compiled_sequence, sequence_steps,
+)
+from app.subject_loss.answer_capture import (
+    buffer_answer, buffered_answer, flush_all, flush_answers, track_pos, tracked_pos,
+)
+from markupsafe import Markup
+from app.services.pdf_render_pool import pdf_render_pool
+from flask import has_request_context, jsonify
 
 loss_bp = Blueprint("loss_bp", __name__, url_prefix="/loss")
 
@@ -247,9 +252,9 @@ def sequence_step(pos: int):
 
     session["current_run_id"] = run_id
 
-    # 2) sequence (unchanged)
-    seq = get_sequence()
-    total = len(seq)
+    # 2) compiled sequence (built once per content snapshot)
+    seq = get_compiled_sequence(SEQUENCE)
+    total = seq.total
     if total == 0:
         current_app.logger.warning("sequence_step: empty sequence; redirecting to start.")
         return redirect(url_for("loss_bp.course_start"))
@@ -260,22 +265,17 @@ def sequence_step(pos: int):
     if pos > total:
         return redirect(url_for("loss_bp.sequence_step", pos=total, run_id=run_id))
 
-    kind, ident = seq[pos - 1]
+    step = seq.step(pos)
+    kind, ident = step.kind, step.ident
     current_app.logger.info(f"sequence_step pos={pos} kind={kind} ident={ident} run_id={run_id}")
 
     # Default next — ALWAYS include run_id
-    next_pos = min(pos + 1, total)
-    next_url = url_for("loss_bp.sequence_step", pos=next_pos, run_id=run_id)
-
-    # Special: final explain card AFTER questions -> jump straight to result
-    if kind == "explain" and str(ident) == "after_questions":
-        session["last_loss_run_id"] = run_id
-        next_url = url_for("loss_bp.result_run", run_id=run_id)
-
-    # Final step → public result page (fallback if your sequence ends there)
-    if pos == total:
+    if step.to_result:
+        # Final step → public result page
         session["last_loss_run_id"] = run_id
         next_url = url_for("loss_bp.result_run", run_id=run_id)
+    else:
+        next_url = seq.next_url("loss_bp.sequence_step", pos, run_id)
 
     # POST → PRG
     if request.method == "POST":
@@ -283,16 +283,7 @@ def sequence_step(pos: int):
 
     # -------- QUESTION BRANCH --------
     if kind == "question":
-        q_range = None
-        if isinstance(ident, str) and "-" in ident:
-            left, right = ident.split("-", 1)
-            try:
-                q_range = (int(left.strip()), int(right.strip()))
-            except ValueError:
-                q_range = None
-        elif isinstance(ident, int) or (isinstance(ident, str) and ident.isdigit()):
-            n = int(ident)
-            q_range = (n, n)
+        q_range = step.q_range
 
         session["q_range"] = q_range
         session["q_seq_pos"] = pos
@@ -307,6 +298,10 @@ def sequence_step(pos: int):
         ))
 
     # -------- NON-QUESTION CARDS --------
+    if fragment_cache_enabled():
+        return render_template("subject/loss/cards/fragment.html",
+                               card_html=Markup(seq.card_html(pos, next_url)),
+                               kind=kind, ident=ident, pos=pos, total=total, run_id=run_id)
 
     template = {
         "instruction": "subject/loss/cards/instruction.html",
@@ -314,49 +309,6 @@ def sequence_step(pos: int):
         "explain":     "subject/loss/cards/explain.html",
     }.get(kind, "subject/loss/cards/instruction.html")
 
-    table_by_kind = {
-        "instruction": "lca_instruction",
-        "pause":       "lca_pause",
-        "explain":     "lca_explain",
-    }
-    table = table_by_kind.get(kind)
-
-    row_dict = None
-    if table:
-        sa_ext = current_app.extensions.get("sqlalchemy")
-        if sa_ext:
-            from sqlalchemy import text
-            stmt = text(f"SELECT id, title, caption, content FROM {table} WHERE id = :id")
-            result = sa_ext.session.execute(stmt, {"id": int(ident)})
-            row = result.mappings().first()
-            row_dict = dict(row) if row else None
-        else:
-            import sqlite3, os
-            db_path = current_app.config.get("DATABASE")
-            if not db_path:
-                uri = current_app.config.get("SQLALCHEMY_DATABASE_URI", "")
-                if uri.startswith("sqlite:///"):
-                    db_path = uri.replace("sqlite:///", "", 1)
-                elif uri.startswith("sqlite:////"):
-                    db_path = uri.replace("sqlite:////", "/", 1)
-            if not db_path or not os.path.exists(db_path):
-                current_app.logger.error("DB path not found; set DATABASE or use sqlite URI. table=%s", table)
-                row_dict = None
-            else:
-                conn = sqlite3.connect(db_path)
-                try:
-                    conn.row_factory = sqlite3.Row
-                    cur = conn.execute(
-                        f"SELECT id, title, caption, content FROM {table} WHERE id = ?",
-                        (int(ident),)
-                    )
-                    r = cur.fetchone()
-                    row_dict = dict(r) if r else None
-                finally:
-                    conn.close()
-
-    item = row_dict or {"title": f"{kind.title()} {ident}", "caption": "", "content": ""}
-
     buttons = [{"label": "Next", "href": next_url, "kind": "primary"}]
 
     return render_template(
@@ -366,34 +318,15 @@ def sequence_step(pos: int):
         pos=pos,
         total=total,
         next_url=next_url,
-        item=item,
+        item=step.payload,
         buttons=buttons,
         run_id=run_id,
     )
 
 # ===== Step 4 =======
-EXPLAIN_COUNT = 8  # or whatever you use
-
 def get_sequence():
-    seq = []
-
-    # 1) Instructions (IDs 1..6 in lca_instruction)
-    seq += [("instruction", i) for i in range(1, 7)]
-
-    # 2) Questions 1..25
-    seq += [("question", i) for i in range(1, 26)]
-
-    # — Single pause between Q25 and Q26 —
-    # Use a numeric ID that exists in your table (e.g., 6 = "Take a Break")
-    seq += [("pause", 6)]
-
-    # 3) Questions 26..50
-    seq += [("question", i) for i in range(26, 51)]
-
-    # 4) Explains (1..EXPLAIN_COUNT)
-    seq += [("explain", i) for i in range(1, EXPLAIN_COUNT + 1)]
-
-    return seq
+    # (kind, ident) steps; the compiled form is sequence_store.get_compiled_sequence(SEQUENCE)
+    return sequence_steps()
 
 # ===== Step 5 =======
 @loss_bp.route("/result/finalize", methods=["POST"])
@@ -408,6 +341,8 @@ def result_finalize():
 
 
 TEMPLATE_DIR_LEARNER = "subject/loss"   # learner page templates (report.html / report.pdf)
+# seconds a request waits on the render pool before answering "still rendering"
+PDF_SHORT_WAIT = 0.5
 TEMPLATE_PDF_LEARNER = "subject/loss/report.pdf"  # or "subject/loss/report_pdf.html" if that's your file
 TEMPLATE_RESULTS_HUB = "subject/loss/results_hub.html"
 
@@ -720,7 +655,8 @@ def phase_graph_pdf():
 
     # Derive P1..P4 for PDF without touching summary partials
     scores = _scores_from_blocks(blocks)
-    data_uri, _png_bytes = phase_scores_bar(scores)  # returns (data_uri, bytes)
+    # vector chart: both pdfkit and WeasyPrint render SVG data URIs
+    data_uri, _svg = phase_scores_bar(scores, fmt="svg")
 
     # Minimal HTML just for the graph
     html = render_template(
@@ -905,15 +841,31 @@ def _close_loss_enrollment(user_id: int | None) -> None:
     except Exception:
         db.session.rollback()  # don't block the finish flow if this fails
 
-def _build_pdf_bytes(run_id: int, user_id: int) -> bytes | None:
+def _build_pdf_bytes(run_id: int, user_id: int, timeout: float | None = PDF_SHORT_WAIT) -> bytes | None:
+    """
+    Report PDF bytes from the shared on-disk cache. With the render pool on, a
+    miss queues the render and waits `timeout` seconds - PDF_SHORT_WAIT by
+    default, so a request answers quickly and None means "still rendering";
+    background callers (mailer) pass None for the pool's full PDF_RENDER_WAIT.
+    """
+    def _get(base):
+        if pdf_render_pool.enabled:
+            key, data = loss_pdf_cache.lookup(run_id, user_id)
+            if data is not None:
+                return data
+            key, _st = _queue_report_pdf(run_id, user_id, base)
+            return pdf_render_pool.wait_for(key, loss_pdf_cache.path_for(key), timeout=timeout)
+        return loss_pdf_cache.get_or_render(
+            run_id, user_id, lambda: _render_report_pdf_bytes(run_id, user_id, base_url=base))
+
     try:
-        pdf_url = url_for("loss_bp.report_pdf", run_id=run_id, user_id=user_id, auto_print=0)
-        with current_app.test_request_context(pdf_url, method="GET"):
-            pdf_resp = current_app.ensure_sync(current_app.view_functions["loss_bp.report_pdf"])()
-        resp = pdf_resp[0] if isinstance(pdf_resp, tuple) else pdf_resp
-        if getattr(resp, "direct_passthrough", False):
-            resp.direct_passthrough = False
-        return resp.get_data()
+        if has_request_context():
+            return _get(request.host_url)
+
+        # background thread / CLI: templates still need a request for url_for()
+        base = current_app.config.get("APP_BASE_URL") or "http://localhost/"
+        with current_app.test_request_context("/", base_url=base):
+            return _get(base)
     except Exception:
         current_app.logger.error("PDF build failed for run_id=%s user_id=%s\n%s",
                                  run_id, user_id, traceback.format_exc())
@@ -1282,8 +1234,8 @@ def assessment_result():
 @loss_bp.route("/assessment_question_flow", methods=["GET", "POST"])
 @login_required
 def assessment_question_flow():
-    LOSS_ASSESSMENT_MAX_POS = 67   # total engine steps (cards)
-    TOTAL_QUESTIONS = 50           # for the "1/50" header
+    seq = get_compiled_sequence(FLOW)
+    LOSS_ASSESSMENT_MAX_POS = seq.total   # total engine steps (cards)
 
     # ---------- 1. Find or create run ----------
     run_id = (
@@ -1304,6 +1256,8 @@ def assessment_question_flow():
             status="in_progress",
             current_pos=1,
         )
+        # persist whatever another run still has buffered before starting this one
+        flush_all(current_user.id)
         db.session.add(run)
         db.session.commit()
 
@@ -1312,25 +1266,28 @@ def assessment_question_flow():
         return redirect(url_for("loss_bp.result_run", run_id=run.id))
 
     # ---------- 2. Engine position ----------
+    # Within a question range the pointer lives in the session (answer_capture)
+    # and is written to lca_run together with the range's answers.
+    current = tracked_pos(run)
     if request.method == "GET":
         # use from_pos in URL if present, else current_pos
-        pos = request.args.get("from_pos", type=int) or run.current_pos or 1
+        pos = request.args.get("from_pos", type=int) or current
     else:
         # POST: trust hidden field but guard against double-clicks
         posted_pos = request.form.get("from_pos", type=int)
 
-        # guard rail: if form says "I was on 9" but DB is already 10,
+        # guard rail: if form says "I was on 9" but we are already on 10,
         # treat as stale post and just send them to the current card
-        if posted_pos is not None and posted_pos != (run.current_pos or 1):
+        if posted_pos is not None and posted_pos != current:
             return redirect(
                 url_for(
                     "loss_bp.assessment_question_flow",
                     run_id=run.id,
-                    from_pos=run.current_pos or 1,
+                    from_pos=current,
                 )
             )
 
-        pos = posted_pos or run.current_pos or 1
+        pos = posted_pos or current
 
     # clamp to [1, MAX]
     if pos < 1:
@@ -1338,38 +1295,27 @@ def assessment_question_flow():
     if pos > LOSS_ASSESSMENT_MAX_POS:
         pos = LOSS_ASSESSMENT_MAX_POS
 
-    # For GET, update pointer immediately; for POST we update after saving
-    if request.method == "GET":
-        run.current_pos = pos
-        db.session.commit()
+    # For GET, track the pointer; for POST we update after saving
+    if request.method == "GET" and current != pos:
+        track_pos(run.id, pos)
 
-    step = get_step_for_pos(pos)
-    if step is None:
+    step = seq.step(pos)
+    if step is None or (pos >= LOSS_ASSESSMENT_MAX_POS and step.kind != "question"):
+        # at/beyond last non-question card → finish; lca_result is already
+        # incremental, only answers still in the buffer are written
         run.status = "completed"
         run.completed_at = db.func.now()
-        db.session.commit()
+        flush_answers(run.id, current_user.id, pos)
         return redirect(url_for("loss_bp.result_run", run_id=run.id))
 
-    kind = step["kind"]
+    kind = step.kind
+    next_pos = step.next_pos
+    next_url = seq.next_url("loss_bp.assessment_question_flow", pos, run.id)
 
-    # if at/beyond last non-question card → finish
-    if pos >= LOSS_ASSESSMENT_MAX_POS and kind != "question":
-        run.status = "completed"
-        run.completed_at = db.func.now()
-        db.session.commit()
-        return redirect(url_for("loss_bp.result_run", run_id=run.id))
-
-    next_pos = min(pos + 1, LOSS_ASSESSMENT_MAX_POS)
-    next_url = url_for(
-        "loss_bp.assessment_question_flow",
-        run_id=run.id,
-        from_pos=next_pos,
-    )
-
-    # ---------- 3. POST: save answer / advance ----------
+    # ---------- 3. POST: buffer answer / advance ----------
     if request.method == "POST":
         if kind == "question":
-            q_no = step["q_no"]
+            q_no = step.ident
             answer = request.form.get("answer")
 
             if answer not in ("yes", "no"):
@@ -1382,35 +1328,12 @@ def assessment_question_flow():
                     )
                 )
 
-            existing = LcaResponse.query.filter_by(
-                run_id=run.id,
-                question_id=q_no,
-                user_id=current_user.id,
-            ).first()
-
-            if existing:
-                existing.answer = answer
-            else:
-                db.session.add(
-                    LcaResponse(
-                        run_id=run.id,
-                        user_id=current_user.id,
-                        question_id=q_no,
-                        answer=answer,
-                    )
-                )
-
-        # advance engine pointer
-        run.current_pos = next_pos
-
-        if next_pos > LOSS_ASSESSMENT_MAX_POS:
-            run.status = "completed"
-            run.completed_at = db.func.now()
-
-        db.session.commit()
-
-        if run.status == "completed":
-            return redirect(url_for("loss_bp.result_run", run_id=run.id))
+            buffer_answer(run.id, q_no, answer, next_pos)
+            # last question of the range: one bulk write + pointer + score delta
+            if step.flush:
+                flush_answers(run.id, current_user.id, next_pos)
+        else:
+            track_pos(run.id, next_pos)
 
         return redirect(
             url_for(
@@ -1424,56 +1347,13 @@ def assessment_question_flow():
 
     # ----- Question cards -----
     if kind == "question":
-        q_no = step["q_no"]
+        q_no = step.ident
+        question = step.payload
 
-        sa_ext = current_app.extensions.get("sqlalchemy")
-        question = None
-        if sa_ext:
-            from sqlalchemy import text
-            stmt = text(
-                """
-                SELECT *
-                FROM lca_question
-                WHERE number = :num
-                LIMIT 1
-                """
-            )
-            row = sa_ext.session.execute(stmt, {"num": q_no}).mappings().first()
-            if row:
-                row = dict(row)
-                # normalise into a single "text" field
-                q_text = (
-                    row.get("content")
-                    or row.get("question_text")
-                    or row.get("text")
-                    or row.get("body")
-                    or row.get("body_text")
-                    or row.get("caption")  # last resort
-                    or ""
-                )
-                question = {
-                    "id": row.get("id", q_no),
-                    "number": row.get("number", q_no),
-                    "title": row.get("title") or f"Question {q_no}",
-                    "caption": row.get("caption") or "",
-                    "text": q_text,
-                }
-
-        if not question:
-            # fallback if DB row missing
-            question = {
-                "id": q_no,
-                "number": q_no,
-                "title": f"Question {q_no}",
-                "caption": "",
-                "text": "",
-            }
-
-        prev = LcaResponse.query.filter_by(
-            run_id=run.id,
-            question_id=q_no,
-            user_id=current_user.id,
-        ).first()
+        prev_answer = buffered_answer(run.id, q_no)
+        if prev_answer is None:
+            prev = LcaResponse.query.filter_by(run_id=run.id, question_id=q_no).first()
+            prev_answer = prev.answer if prev else None
 
         # simple progress string "1 / 50"
         progress = f"{q_no} / {TOTAL_QUESTIONS}"
@@ -1486,60 +1366,25 @@ def assessment_question_flow():
             display_idx=q_no,
             display_total=TOTAL_QUESTIONS,
             progress=progress,
-            prev_answer=(prev.answer if prev else None),
+            prev_answer=prev_answer,
         )
 
     # ----- Non-question cards: setup / instruction / pause / explain -----
-    ref = step.get("ref")
-    ident = None
-    if ref and "_" in ref:
-        try:
-            ident = int(ref.split("_", 1)[1])
-        except ValueError:
-            ident = None
-    if ident is None:
-        ident = pos
-
-    table_by_kind = {
-        "setup": "lca_instruction",
-        "instruction": "lca_instruction",
-        "pause": "lca_pause",
-        "explain": "lca_explain",
-    }
+    ident = step.ident
+    if fragment_cache_enabled():
+        return render_template("subject/loss/cards/fragment.html",
+                               card_html=Markup(seq.card_html(pos, next_url)),
+                               kind=kind, ident=ident, pos=pos, total=LOSS_ASSESSMENT_MAX_POS,
+                               run_id=run.id)
+
     template_by_kind = {
         "setup": "subject/loss/cards/instruction.html",
         "instruction": "subject/loss/cards/instruction.html",
         "pause": "subject/loss/cards/pause.html",
         "explain": "subject/loss/cards/explain.html",
     }
-
-    table = table_by_kind.get(kind)
     template = template_by_kind.get(kind, "subject/loss/cards/instruction.html")
 
-    item = None
-    sa_ext = current_app.extensions.get("sqlalchemy")
-    if table and sa_ext:
-        from sqlalchemy import text
-        stmt = text(
-            f"""
-            SELECT id, title, caption, content
-            FROM {table}
-            WHERE id = :id
-            LIMIT 1
-            """
-        )
-        row = sa_ext.session.execute(stmt, {"id": ident}).mappings().first()
-        if row:
-            item = dict(row)
-
-    if not item:
-        item = {
-            "id": ident,
-            "title": f"{kind.title()} {ident}",
-            "caption": "",
-            "content": "",
-        }
-
     buttons = [
         {"label": "Next", "href": next_url, "kind": "primary"},
     ]
@@ -1552,7 +1397,7 @@ def assessment_question_flow():
         total=LOSS_ASSESSMENT_MAX_POS,
         total_questions=TOTAL_QUESTIONS,
         next_url=next_url,
-        item=item,
+        item=step.payload,
         buttons=buttons,
         run_id=run.id,
     )
@@ -1572,18 +1417,20 @@ def email_report():  # endpoint: loss_bp.email_report
         flash("Please provide a recipient email.", "warning")
         return redirect(url_for("loss_bp.report_exit", run_id=run_id, user_id=user_id))
 
-    # --- call your existing PDF view to get the bytes, without JS auto-print ---
-    pdf_resp = current_app.ensure_sync(
-        current_app.view_functions["loss_bp.report_pdf"]
-    )(run_id=run_id, user_id=user_id, auto_print=0)
-
-    # Handle (response, status) or plain response
-    if isinstance(pdf_resp, tuple):
-        pdf_response = pdf_resp[0]
-    else:
-        pdf_response = pdf_resp
+    # same rule as report_pdf: a user can only send THEIR OWN report
+    user_id = user_id or getattr(current_user, "id", None)
+    if not run_id or not user_id or int(user_id) != int(getattr(current_user, "id", 0)):
+        flash("Report not available.", "warning")
+        return redirect(url_for("loss_bp.report_exit", run_id=run_id, user_id=user_id))
 
-    pdf_bytes = pdf_response.get_data()
+    # --- same cached artifact the download serves ---
+    pdf_bytes = _build_pdf_bytes(run_id, user_id)
+    if not pdf_bytes and _report_pdf_pending(run_id, user_id):
+        flash("Your PDF report is still being prepared. Please send it again in a few seconds.", "info")
+        return redirect(url_for("loss_bp.report_exit", run_id=run_id, user_id=user_id))
+    if not pdf_bytes:
+        flash("Could not build the PDF report. Please try again.", "danger")
+        return redirect(url_for("loss_bp.report_exit", run_id=run_id, user_id=user_id))
 
     # --- build email ---
     subject = f"LOSS Assessment Report (Run {run_id})"
@@ -1675,23 +1522,9 @@ def report_exit():
 
 from flask_login import login_required, current_user
 
-@loss_bp.route("/report.pdf")
-@login_required
-def report_pdf():
+def _render_report_pdf_html(rid: int, uid: int) -> str:
+    """HTML of the learner report PDF (no auth checks)."""
     from sqlalchemy import text
-    from io import BytesIO
-
-    rid = _get_int_arg("run_id")
-    if not rid:
-        return ("Missing run_id", 400)
-
-    # enforce: a user can only fetch THEIR OWN pdf
-    uid = _get_int_arg("user_id", required=False) or getattr(current_user, "id", None)
-    if not uid:
-        return ("Missing user_id", 400)
-
-    if int(uid) != int(getattr(current_user, "id", 0)):
-        return ("Forbidden", 403)
 
     ctx = build_learner_report_ctx(rid, uid) or {}
 
@@ -1728,16 +1561,101 @@ def report_pdf():
         current_app.logger.exception("phase_scores_bar failed")
         ctx["phase_scores_chart_src"] = None
 
-    html = render_template("subject/loss/report_pdf.html", **ctx)
+    return render_template("subject/loss/report_pdf.html", **ctx)
+
+
+def _render_report_pdf_bytes(rid: int, uid: int, base_url: str | None = None) -> bytes:
+    """Render the learner report PDF inline (no auth checks; callers go through loss_pdf_cache)."""
+    from io import BytesIO
+
+    html = _render_report_pdf_html(rid, uid)
 
     out = BytesIO()
     try:
         from weasyprint import HTML
-        HTML(string=html, base_url=request.host_url).write_pdf(target=out)
+        HTML(string=html, base_url=base_url).write_pdf(target=out)
     except Exception:
         from xhtml2pdf import pisa
         pisa.CreatePDF(html, dest=out, encoding="UTF-8")
 
+    return out.getvalue()
+
+
+def _queue_report_pdf(rid: int, uid: int, base_url: str | None) -> tuple[str, str]:
+    """Enqueue the report on the render pool. Returns (cache key, status)."""
+    key = loss_pdf_cache.key(rid, uid)
+    out = loss_pdf_cache.path_for(key)
+    st = pdf_render_pool.status(key, out)
+    if st in ("done", "pending", "running"):
+        return key, st
+    html = _render_report_pdf_html(rid, uid)
+    return key, pdf_render_pool.submit(key, html, out, base_url=base_url)
+
+
+def _report_pdf_pending(rid: int, uid: int) -> bool:
+    """True while the render pool still has this report queued or rendering."""
+    if not pdf_render_pool.enabled:
+        return False
+    key = loss_pdf_cache.key(rid, uid)
+    return pdf_render_pool.status(key, loss_pdf_cache.path_for(key)) in ("pending", "running")
+
+
+_PDF_WAIT_PAGE = """<!doctype html>
+<html><head><meta charset="utf-8"><title>Preparing your report…</title></head>
+<body style="font-family:sans-serif;text-align:center;padding-top:20vh">
+  <h2>Preparing your report…</h2>
+  <p id="msg">This usually takes a few seconds.</p>
+  <script>
+    (function poll(){
+      fetch({{ status_url|tojson }}, {credentials: "same-origin"})
+        .then(r => r.json())
+        .then(j => {
+          if (j.status === "done") { window.location = {{ pdf_url|tojson }}; }
+          else if (j.status === "failed") { document.getElementById("msg").textContent = "Sorry, the report could not be generated."; }
+          else { setTimeout(poll, 1000); }
+        })
+        .catch(() => setTimeout(poll, 2000));
+    })();
+  </script>
+</body></html>
+"""
+
+@loss_bp.route("/report.pdf")
+@login_required
+def report_pdf():
+    rid = _get_int_arg("run_id")
+    if not rid:
+        return ("Missing run_id", 400)
+
+    # enforce: a user can only fetch THEIR OWN pdf
+    uid = _get_int_arg("user_id", required=False) or getattr(current_user, "id", None)
+    if not uid:
+        return ("Missing user_id", 400)
+
+    if int(uid) != int(getattr(current_user, "id", 0)):
+        return ("Forbidden", 403)
+
+    if pdf_render_pool.enabled:
+        key, pdf_bytes = loss_pdf_cache.lookup(rid, uid)
+        if pdf_bytes is None:
+            # render off the request thread; the wait page polls report_pdf_status
+            key, _st = _queue_report_pdf(rid, uid, request.host_url)
+            pdf_bytes = pdf_render_pool.wait_for(key, loss_pdf_cache.path_for(key), timeout=PDF_SHORT_WAIT)
+            if pdf_bytes is None:
+                status_url = url_for("loss_bp.report_pdf_status", run_id=rid, user_id=uid)
+                if request.args.get("async") or request.headers.get("X-Requested-With") == "XMLHttpRequest":
+                    return jsonify({"status": "pending", "status_url": status_url}), 202
+                return render_template_string(
+                    _PDF_WAIT_PAGE,
+                    status_url=status_url,
+                    pdf_url=url_for("loss_bp.report_pdf", run_id=rid, user_id=uid),
+                ), 202
+    else:
+        pdf_bytes = loss_pdf_cache.get_or_render(
+            rid, uid, lambda: _render_report_pdf_bytes(rid, uid, base_url=request.host_url)
+        )
+    out = BytesIO(pdf_bytes or b"")
+
     out.seek(0)
     return send_file(
         out,
@@ -1746,3 +1664,20 @@ def report_pdf():
         download_name=f"loss-result-run-{rid}.pdf",
         max_age=0,
     )
+
+
+@loss_bp.get("/report.pdf/status")
+@login_required
+def report_pdf_status():
+    rid = _get_int_arg("run_id")
+    uid = _get_int_arg("user_id", required=False) or getattr(current_user, "id", None)
+    if not rid or not uid:
+        return jsonify({"status": "missing"}), 400
+    if int(uid) != int(getattr(current_user, "id", 0)):
+        return jsonify({"status": "forbidden"}), 403
+
+    key = loss_pdf_cache.key(rid, uid)
+    st = pdf_render_pool.status(key, loss_pdf_cache.path_for(key))
+    if st == "missing" and pdf_render_pool.enabled:
+        key, st = _queue_report_pdf(rid, uid, request.host_url)
+    return jsonify({"status": st, "error": pdf_render_pool.error(key) if st == "failed" else None})
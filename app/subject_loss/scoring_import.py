@@ -50,6 +50,8 @@ def load_scoring_map_from_csv(csv_path: str | None = None) -> int:
             })
             n += 1
         db.session.commit()
+        from app.admin.loss.scoring_engine import invalidate_scoring_map  # late import avoids circulars
+        invalidate_scoring_map()
         current_app.logger.info("Imported scoring map from %s (%s rows).", path, n)
         return n
 
@@ -0,0 +1,214 @@
+# app/subject_loss/sequence_store.py
+"""
+Precompiled LOSS assessment sequence.
+
+The step list never changes at runtime, so it is compiled once per process into
+parallel arrays indexed by position - 1:
+
+    kinds       step kind code (KINDS)
+    idents      card id (instruction / explain / pause) or question number
+    q_lo, q_hi  question range of a question step (0 for cards)
+    next_pos    position the "Next" button goes to
+    to_result   1 where the step finishes the assessment
+    flush       1 on the last question of a range (before a card / at the
+                end); buffered answers are written there (answer_capture)
+    payloads    card / question content from the LOSS content store
+
+Two scripts are compiled:
+  FLOW      the 67-step engine of /loss/assessment_question_flow
+            (school_loss.LOSS_ASSESSMENT_SCRIPT)
+  SEQUENCE  the /loss/sequence/<pos> walk (get_sequence())
+
+A compiled sequence is tied to one content snapshot (content_store) and is
+rebuilt when that snapshot's version changes, so stepping through the flow
+queries no content at all. next_url() formats a URL template built once per
+endpoint instead of calling url_for per step. With LOSS_CARD_FRAGMENT_CACHE
+on, the rendered card markup is kept per (position, language) and only the
+"Next" href is filled in per request.
+"""
+from __future__ import annotations
+
+import threading
+from array import array
+from types import MappingProxyType
+from typing import NamedTuple
+
+from flask import current_app, has_request_context, request, session, url_for
+from markupsafe import escape
+
+from app.admin.loss.content_store import get_loss_content
+
+KINDS = ("setup", "instruction", "question", "pause", "explain")
+_KIND_CODE = {k: i for i, k in enumerate(KINDS)}
+
+# which content store card set backs each card kind
+_CARD_KIND = {"setup": "instruction", "instruction": "instruction", "pause": "pause", "explain": "explain"}
+
+FLOW = "flow"
+SEQUENCE = "sequence"
+
+EXPLAIN_COUNT = 8
+TOTAL_QUESTIONS = 50
+
+_NEXT_HREF = "__loss_next_url__"
+_RUN_MARK, _POS_MARK = 918273645, 546372819
+
+
+class Step(NamedTuple):
+    pos: int
+    kind: str
+    ident: int | None
+    q_range: tuple[int, int] | None
+    payload: object               # MappingProxy card item or question dict
+    next_pos: int
+    to_result: bool
+    flush: bool
+
+
+def sequence_steps() -> list[tuple[str, int]]:
+    """(kind, ident) steps of the /loss/sequence walk."""
+    seq = [("instruction", i) for i in range(1, 7)]          # instructions 1..6
+    seq += [("question", i) for i in range(1, 26)]           # questions 1..25
+    seq += [("pause", 6)]                                    # single pause (6 = "Take a Break")
+    seq += [("question", i) for i in range(26, 51)]          # questions 26..50
+    seq += [("explain", i) for i in range(1, EXPLAIN_COUNT + 1)]
+    return seq
+
+
+def flow_steps() -> list[tuple[str, int | None]]:
+    """(kind, ident) steps of the assessment engine script."""
+    from app.school_loss.routes import LOSS_ASSESSMENT_SCRIPT  # late import: heavy module
+
+    out = []
+    for st in LOSS_ASSESSMENT_SCRIPT:
+        if st["kind"] == "question":
+            out.append(("question", int(st["q_no"])))
+            continue
+        ident = None
+        ref = st.get("ref") or ""
+        if "_" in ref:
+            try:
+                ident = int(ref.split("_", 1)[1])
+            except ValueError:
+                ident = None
+        out.append((st["kind"], ident if ident is not None else int(st["pos"])))
+    return out
+
+
+def _question_payload(content, n: int) -> MappingProxyType:
+    q = content.question(n)
+    if q is None:
+        return MappingProxyType({"id": n, "number": n, "title": f"Question {n}", "caption": "", "text": ""})
+    return MappingProxyType(q._asdict())
+
+
+def _card_payload(content, kind: str, ident) -> MappingProxyType:
+    c = content.card(_CARD_KIND.get(kind, "instruction"), ident)
+    if c is None:
+        return MappingProxyType({"id": ident, "title": f"{kind.title()} {ident}", "caption": "", "content": ""})
+    return MappingProxyType(c._asdict())
+
+
+class CompiledSequence:
+    """Array-backed step table; step(pos) is a constant-time index."""
+
+    __slots__ = ("name", "content_version", "total", "kinds", "idents", "q_lo", "q_hi",
+                 "next_pos", "to_result", "flush", "payloads", "_fragments")
+
+    def __init__(self, name: str, steps: list[tuple[str, int | None]], content):
+        self.name = name
+        self.content_version = content.version
+        n = self.total = len(steps)
+        self.kinds = array("b", (_KIND_CODE.get(k, _KIND_CODE["instruction"]) for k, _ in steps))
+        self.idents = array("i", (int(i or 0) for _, i in steps))
+        self.q_lo = array("i", (int(i) if k == "question" else 0 for k, i in steps))
+        self.q_hi = array("i", self.q_lo)
+        self.next_pos = array("i", (min(p + 1, n) for p in range(1, n + 1)))
+        # last position always finishes; the SEQUENCE walk also ends on its last explain
+        self.to_result = array("b", (1 if p == n else 0 for p in range(1, n + 1)))
+        q = _KIND_CODE["question"]
+        self.flush = array("b", (
+            1 if self.kinds[i] == q and (i == n - 1 or self.kinds[i + 1] != q) else 0 for i in range(n)
+        ))
+        self.payloads = tuple(
+            _question_payload(content, int(i)) if k == "question" else _card_payload(content, k, i)
+            for k, i in steps
+        )
+        self._fragments: dict[tuple[int, str], str] = {}
+
+    def step(self, pos: int) -> Step | None:
+        if pos < 1 or pos > self.total:
+            return None
+        i = pos - 1
+        kind = KINDS[self.kinds[i]]
+        q = (self.q_lo[i], self.q_hi[i]) if kind == "question" else None
+        return Step(pos, kind, self.idents[i], q, self.payloads[i], self.next_pos[i],
+                    bool(self.to_result[i]), bool(self.flush[i]))
+
+    def clamp(self, pos: int) -> int:
+        return max(1, min(int(pos or 1), self.total))
+
+    # ---- next URL ----
+    def next_url(self, endpoint: str, pos: int, run_id: int) -> str:
+        """url_for(endpoint, run_id=run_id, from_pos|pos=next_pos(pos)) from a cached template."""
+        return _url_template(endpoint).format(run_id=int(run_id), pos=self.next_pos[pos - 1])
+
+    # ---- card HTML ----
+    def card_html(self, pos: int, next_url: str, lang: str | None = None) -> str:
+        """Rendered loss_card markup for a card step, cached per (pos, language)."""
+        lang = lang or _lang()
+        key = (pos, lang)
+        html = self._fragments.get(key)
+        if html is None:
+            macro = current_app.jinja_env.get_template("shared/card_macros.html").module.loss_card
+            html = str(macro(item=self.payloads[pos - 1],
+                             buttons=[{"label": "Next", "href": _NEXT_HREF, "kind": "primary"}]))
+            self._fragments[key] = html
+        return html.replace(_NEXT_HREF, str(escape(next_url)))
+
+
+def _lang() -> str:
+    if has_request_context():
+        return str(session.get("lang") or request.accept_languages.best_match(["en"]) or "en")
+    return "en"
+
+
+# ---- URL templates -----------------------------------------------------------
+_url_cache: dict[tuple[str, str], str] = {}
+
+
+def _url_template(endpoint: str) -> str:
+    root = request.script_root if has_request_context() else ""
+    key = (endpoint, root)
+    tpl = _url_cache.get(key)
+    if tpl is None:
+        pos_arg = "from_pos" if endpoint.endswith("assessment_question_flow") else "pos"
+        raw = url_for(endpoint, run_id=_RUN_MARK, **{pos_arg: _POS_MARK})
+        tpl = (raw.replace("{", "{{").replace("}", "}}")
+                  .replace(str(_RUN_MARK), "{run_id}").replace(str(_POS_MARK), "{pos}"))
+        _url_cache[key] = tpl
+    return tpl
+
+
+# ---- process-wide cache ------------------------------------------------------
+_lock = threading.Lock()
+_compiled: dict[str, CompiledSequence] = {}
+_BUILDERS = {FLOW: flow_steps, SEQUENCE: sequence_steps}
+
+
+def get_compiled_sequence(name: str = FLOW) -> CompiledSequence:
+    """Compiled sequence for the current content snapshot (recompiled when it changes)."""
+    content = get_loss_content()
+    seq = _compiled.get(name)
+    if seq is not None and seq.content_version == content.version:
+        return seq
+    with _lock:
+        seq = _compiled.get(name)
+        if seq is None or seq.content_version != content.version:
+            seq = CompiledSequence(name, _BUILDERS[name](), content)
+            _compiled[name] = seq
+        return seq
+
+
+def fragment_cache_enabled() -> bool:
+    return bool(current_app.config.get("LOSS_CARD_FRAGMENT_CACHE", False))
@@ -0,0 +1,266 @@
+# app/subject_reading/lesson_state.py
+"""
+Lesson catalog + learner state for the reading course.
+
+Every lesson view used to fetch the lesson, every lesson in order, the
+learner's progress rows and then prev / next with two more queries; the
+dashboard, complete and defer routes each repeated part of that. Lessons only
+change when an admin edits them, so the ordered catalog is kept per process:
+
+    LessonCatalog.lessons      (LessonEntry, ...) by "order", id
+    LessonCatalog.by_id        {id: LessonEntry}
+    LessonCatalog.by_key       {order: LessonEntry}
+    LessonEntry.prev_id / next_id   neighbours in that order
+
+and a learner's state is resolved with a single rdp_lesson_progress query
+into a LessonState: per-lesson status / tries, completed count, the open
+lesson (first one not completed) and the view / try rules the routes enforce.
+
+The catalog is rebuilt after a commit that touched RdpLesson through the ORM,
+when invalidate_lesson_catalog() is called (bulk reorders), and when the
+rdp_lesson signature changes - checked at most every READING_CATALOG_TTL
+seconds, so other workers pick up edits too.
+"""
+from __future__ import annotations
+
+import threading
+import time
+from typing import NamedTuple
+
+from flask import current_app, has_app_context
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session
+
+from app.extensions import db
+
+MAX_TRIES = 3
+
+_SQL_LESSONS = text("""
+    SELECT id, "order", title, caption, video_filename
+    FROM rdp_lesson
+    ORDER BY "order" ASC, id ASC
+""")
+
+# count / ids / ordering / text lengths - changes on insert, delete, reorder and most edits
+_SQL_SIGNATURE = text("""
+    SELECT COUNT(*), COALESCE(MAX(id), 0), COALESCE(SUM(id * "order"), 0),
+           COALESCE(SUM(LENGTH(title) + LENGTH(COALESCE(caption, '')) + LENGTH(COALESCE(video_filename, ''))), 0)
+    FROM rdp_lesson
+""")
+
+_SQL_PROGRESS = text("""
+    SELECT lesson_key, status, tries_used
+    FROM rdp_lesson_progress
+    WHERE user_id = :uid
+""")
+
+
+class LessonEntry(NamedTuple):
+    id: int
+    order: int
+    title: str
+    caption: str | None
+    video_filename: str | None
+    index: int
+    prev_id: int | None
+    next_id: int | None
+
+    def row(self) -> dict:
+        """Template row in the shape of the old rdp_lesson mapping."""
+        return {"id": self.id, "order": self.order, "title": self.title,
+                "caption": self.caption, "video_filename": self.video_filename}
+
+
+class LessonCatalog:
+    """Ordered lessons with id / key lookups; immutable once built."""
+
+    __slots__ = ("version", "signature", "lessons", "by_id", "by_key", "keys")
+
+    def __init__(self, version: int, signature: tuple, rows):
+        self.version = version
+        self.signature = signature
+        rows = list(rows)
+        self.lessons = tuple(
+            LessonEntry(
+                id=int(r["id"]),
+                order=int(r["order"]),
+                title=r["title"],
+                caption=r["caption"],
+                video_filename=r["video_filename"],
+                index=i,
+                prev_id=int(rows[i - 1]["id"]) if i > 0 else None,
+                next_id=int(rows[i + 1]["id"]) if i + 1 < len(rows) else None,
+            )
+            for i, r in enumerate(rows)
+        )
+        self.by_id = {e.id: e for e in self.lessons}
+        self.by_key = {e.order: e for e in self.lessons}
+        self.keys = tuple(e.order for e in self.lessons)
+
+    @property
+    def total(self) -> int:
+        return len(self.lessons)
+
+    @property
+    def first_id(self) -> int | None:
+        return self.lessons[0].id if self.lessons else None
+
+
+class LessonState:
+    """One learner's progress over the catalog (from a single progress query)."""
+
+    __slots__ = ("catalog", "user_id", "progress", "completed", "open_key")
+
+    def __init__(self, catalog: LessonCatalog, user_id: int, progress: dict[int, tuple[str, int]]):
+        self.catalog = catalog
+        self.user_id = user_id
+        self.progress = progress
+        self.completed = sum(1 for k in catalog.keys if self.status(k) == "completed")
+        self.open_key = next((k for k in catalog.keys if self.status(k) != "completed"),
+                             catalog.keys[-1] if catalog.keys else 1)
+
+    def status(self, key: int) -> str:
+        p = self.progress.get(int(key))
+        return (p[0] if p else None) or "not_started"
+
+    def tries(self, key: int) -> int:
+        p = self.progress.get(int(key))
+        return int(p[1] or 0) if p else 0
+
+    def is_completed(self, key: int) -> bool:
+        return self.status(key) == "completed"
+
+    def is_open(self, key: int) -> bool:
+        return key == self.open_key and not self.is_completed(key) and self.tries(key) < MAX_TRIES
+
+    @property
+    def total(self) -> int:
+        return self.catalog.total
+
+    @property
+    def all_done(self) -> bool:
+        return self.completed >= self.total
+
+    @property
+    def percent(self) -> int:
+        return int(round(self.completed * 100 / max(self.total, 1)))
+
+    def open_lesson_id(self) -> int | None:
+        """Id of the first lesson not completed, None when all are."""
+        if self.all_done:
+            return None
+        entry = self.catalog.by_key.get(self.open_key)
+        return entry.id if entry else None
+
+    def can_view(self, entry: LessonEntry) -> bool:
+        """Completed lessons can be replayed; otherwise only the open one, within its tries."""
+        if self.is_completed(entry.order):
+            return True
+        return entry.order == self.open_key and self.tries(entry.order) < MAX_TRIES
+
+    def items(self) -> list[dict]:
+        """Dashboard rows: lesson fields plus status / tries / open / locked flags."""
+        out = []
+        for e in self.catalog.lessons:
+            done = self.is_completed(e.order)
+            is_open = self.is_open(e.order)
+            out.append({
+                **e.row(),
+                "lesson_key": e.order,
+                "status": self.status(e.order),
+                "tries_used": self.tries(e.order),
+                "is_completed": done,
+                "is_open": is_open,
+                "is_locked": not is_open and not done,
+            })
+        return out
+
+
+def resolve_state(user_id: int, catalog: LessonCatalog | None = None) -> LessonState:
+    catalog = catalog or get_lesson_catalog()
+    rows = db.session.execute(_SQL_PROGRESS, {"uid": int(user_id)}).all()
+    progress = {int(k): (status, tries) for k, status, tries in rows}
+    return LessonState(catalog, int(user_id), progress)
+
+
+# ---- process-wide catalog ----------------------------------------------------
+_lock = threading.Lock()
+_current: LessonCatalog | None = None
+_version = 0
+_checked_at = 0.0
+_stale = False
+
+
+def _ttl() -> float:
+    if has_app_context():
+        return float(current_app.config.get("READING_CATALOG_TTL", 60))
+    return 60.0
+
+
+def _signature() -> tuple:
+    row = db.session.execute(_SQL_SIGNATURE).first()
+    return tuple(row) if row else ()
+
+
+def _build() -> LessonCatalog:
+    global _version
+    sig = _signature()
+    rows = db.session.execute(_SQL_LESSONS).mappings().all()
+    _version += 1
+    return LessonCatalog(_version, sig, rows)
+
+
+def invalidate_lesson_catalog() -> None:
+    """Mark the catalog stale; the next reader rebuilds it."""
+    global _stale
+    _stale = True
+
+
+def get_lesson_catalog(force: bool = False) -> LessonCatalog:
+    global _current, _checked_at, _stale
+    cat = _current
+    if cat is not None and not force and not _stale and (time.monotonic() - _checked_at) < _ttl():
+        return cat
+
+    with _lock:
+        cat = _current
+        if cat is not None and not force and not _stale:
+            if (time.monotonic() - _checked_at) < _ttl():
+                return cat
+            sig = _signature()
+            _checked_at = time.monotonic()
+            if sig == cat.signature:
+                return cat
+        _stale = False
+        cat = _build()
+        _current = cat
+        _checked_at = time.monotonic()
+        return cat
+
+
+# ---- invalidation on ORM edits -----------------------------------------------
+def _mark_dirty(mapper, connection, target):
+    from sqlalchemy.orm import object_session
+    sess = object_session(target)
+    if sess is not None:
+        sess.info["reading_catalog_dirty"] = True
+
+
+def _after_commit(session):
+    if session.info.pop("reading_catalog_dirty", False):
+        invalidate_lesson_catalog()
+
+
+def _after_rollback(session):
+    session.info.pop("reading_catalog_dirty", None)
+
+
+def _register_listeners():
+    from app.models.reading import RdpLesson
+    for ev in ("after_insert", "after_update", "after_delete"):
+        event.listen(RdpLesson, ev, _mark_dirty)
+    event.listen(Session, "after_commit", _after_commit)
+    event.listen(Session, "after_soft_rollback", lambda s, prev: _after_rollback(s))
+
+
+_register_listeners()
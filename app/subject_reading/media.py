@@ -0,0 +1,117 @@
+# app/subject_reading/media.py
+"""
+Lesson media delivery for the reading course.
+
+Lesson videos used to go out through the static route as whole files. They
+are now served by reading_bp.lesson_media:
+
+    GET /reading/media/<relpath>?v=<tag>
+
+  - HTTP Range (206 / 416) and If-Range via werkzeug's conditional send_file,
+    so seeking fetches only the bytes it needs
+  - strong ETag (mtime / size / path) with If-None-Match -> 304
+  - media_url() puts a short tag of mtime + size in the query string, so the
+    URL changes whenever the file does and the response can be cached for
+    READING_MEDIA_MAX_AGE seconds as immutable. HLS master playlists are the
+    one exception (short max-age): the transcoder rewrites them in place,
+    while variant playlists and segments go to a new directory per source
+    version, so their URLs never change content
+
+Only files under MEDIA_DIRS with a MEDIA_TYPES extension are served.
+
+When app/scripts/transcode_hls.py has produced renditions for a video
+(<dir>/hls/<stem>/master.m3u8), hls_url() returns the master playlist; the
+lesson player lists it before the MP4 so players with HLS support pick a
+bitrate per network, and the rest fall back to the MP4.
+"""
+from __future__ import annotations
+
+import os
+
+from flask import abort, current_app, send_file, url_for
+from werkzeug.security import safe_join
+
+MEDIA_DIRS = ("reading_videos", "videos")
+
+MEDIA_TYPES = {
+    "mp4": "video/mp4",
+    "webm": "video/webm",
+    "ogg": "video/ogg",
+    "m3u8": "application/vnd.apple.mpegurl",
+    "ts": "video/mp2t",
+    "m4s": "video/iso.segment",
+    "vtt": "text/vtt",
+}
+
+MASTER_PLAYLIST = "master.m3u8"
+PLAYLIST_MAX_AGE = 60
+DEFAULT_MAX_AGE = 31536000
+
+
+def _ext(relpath: str) -> str:
+    return relpath.rsplit(".", 1)[-1].lower() if "." in relpath else ""
+
+
+def _max_age() -> int:
+    return int(current_app.config.get("READING_MEDIA_MAX_AGE", DEFAULT_MAX_AGE))
+
+
+def resolve_media(relpath: str) -> str | None:
+    """Absolute path of an allowed media file under the static folder, else None."""
+    relpath = (relpath or "").replace("\\", "/").lstrip("/")
+    top = relpath.split("/", 1)[0]
+    if top not in MEDIA_DIRS or _ext(relpath) not in MEDIA_TYPES:
+        return None
+    path = safe_join(current_app.static_folder, relpath)
+    if path is None or not os.path.isfile(path):
+        return None
+    return path
+
+
+def _tag(path: str) -> str:
+    st = os.stat(path)
+    return f"{int(st.st_mtime):x}{st.st_size:x}"
+
+
+def media_url(relpath: str) -> str:
+    """Versioned lesson_media URL; falls back to the static URL for files it won't serve."""
+    path = resolve_media(relpath)
+    if path is None:
+        return url_for("static", filename=relpath)
+    return url_for("reading_bp.lesson_media", relpath=relpath, v=_tag(path))
+
+
+def hls_relpath(relpath: str) -> str:
+    """<dir>/hls/<stem>/master.m3u8 for <dir>/<stem>.<ext>."""
+    folder, _, name = relpath.rpartition("/")
+    stem = name.rsplit(".", 1)[0]
+    return f"{folder}/hls/{stem}/{MASTER_PLAYLIST}" if folder else f"hls/{stem}/{MASTER_PLAYLIST}"
+
+
+def hls_url(relpath: str) -> str | None:
+    """Master playlist URL when renditions exist for this video, else None."""
+    if not relpath:
+        return None
+    master = hls_relpath(relpath)
+    return media_url(master) if resolve_media(master) else None
+
+
+def send_media(relpath: str):
+    path = resolve_media(relpath)
+    if path is None:
+        abort(404)
+
+    ext = _ext(relpath)
+    playlist = relpath.rsplit("/", 1)[-1] == MASTER_PLAYLIST
+    resp = send_file(
+        path,
+        mimetype=MEDIA_TYPES[ext],
+        conditional=True,
+        etag=True,
+        max_age=PLAYLIST_MAX_AGE if playlist else _max_age(),
+    )
+    resp.headers["Accept-Ranges"] = "bytes"
+    if not playlist:
+        resp.cache_control.public = True
+        resp.cache_control.immutable = True
+    return resp
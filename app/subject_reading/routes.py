@@ -10,6 +10,8 @@ from app.models.reading import RdpLearnerProgress, RdpLesson
 from app.utils import reading_utils
 from datetime import datetime, timedelta
 from app.utils.reading_utils import lesson_payload  # canonicalize lesson content
+from app.subject_reading.lesson_state import get_lesson_catalog, resolve_state
+from app.subject_reading.media import hls_url, media_url, send_media
 from app.extensions import db
 from sqlalchemy import text as sa_text
 import smtplib
@@ -50,19 +52,11 @@ def learner_dashboard():
         or "Learner"
     )
 
-    uid = int(current_user.id)
-
-    # 2) lessons list (ordered) - includes lesson key ("order")
-    lessons = db.session.execute(
-        sa_text("""
-            SELECT id, title, caption, "order"
-            FROM rdp_lesson
-            ORDER BY "order" ASC
-        """)
-    ).mappings().all()
+    # 2) lessons (cached catalog) + this learner's progress, one query
+    state = resolve_state(int(current_user.id))
 
     # Safe defaults when no lessons exist
-    if not lessons:
+    if not state.total:
         ui_lang = session.get("ui_lang", "en")
         return render_template(
             "subject_reading/learner_dashboard.html",
@@ -77,62 +71,13 @@ def learner_dashboard():
             progress_percent=0,
         )
 
-    total = len(lessons)
-
-    # 3) per-lesson progress map (status + tries)
-    prog_rows = db.session.execute(
-        sa_text("""
-            SELECT lesson_key, status, tries_used
-            FROM rdp_lesson_progress
-            WHERE user_id = :uid
-        """),
-        {"uid": uid},
-    ).mappings().all()
-
-    prog_map = {int(r["lesson_key"]): dict(r) for r in prog_rows}
-
-    # 4) compute completed + next open lesson (first not completed by lesson_key)
-    completed = 0
-    open_key = None
-
-    ordered_keys = [int(r["order"]) for r in lessons]
-
-    for k in ordered_keys:
-        st = (prog_map.get(k, {}).get("status") or "not_started")
-        if st == "completed":
-            completed += 1
-        elif open_key is None:
-            open_key = k
-
-    if open_key is None:
-        open_key = ordered_keys[-1]  # everything completed
-
-    progress_percent = int((completed * 100) / total) if total else 0
-
-    # 5) annotate lessons for template: open / locked / completed + tries
-    items = [dict(r) for r in lessons]
-
-    for row in items:
-        k = int(row["order"])
-        p = prog_map.get(k) or {}
-        status = (p.get("status") or "not_started")
-        tries_used = int(p.get("tries_used") or 0)
-
-        is_completed = (status == "completed")
-        is_open = (k == open_key) and (not is_completed) and (tries_used < 3)
-        is_locked = (not is_open) and (not is_completed)
+    # 3) annotate lessons for template: open / locked / completed + tries
+    items = state.items()
 
-        row["lesson_key"] = k
-        row["status"] = status
-        row["tries_used"] = tries_used
-        row["is_completed"] = is_completed
-        row["is_open"] = is_open
-        row["is_locked"] = is_locked
-
-    # 6) ui lang from session
+    # 4) ui lang from session
     ui_lang = session.get("ui_lang", "en")
 
-    # 7) CTA shows only if there is an open lesson available
+    # 5) CTA shows only if there is an open lesson available
     show_cta = any(r.get("is_open") for r in items)
 
     return render_template(
@@ -142,10 +87,10 @@ def learner_dashboard():
         ui_lang=ui_lang,
         t=_t,
         show_cta=show_cta,
-        open_key=int(open_key),
-        total=int(total),
-        completed=int(completed),
-        progress_percent=int(progress_percent),
+        open_key=int(state.open_key),
+        total=state.total,
+        completed=state.completed,
+        progress_percent=state.percent,
     )
 
 @reading_bp.get("/", endpoint="subject_home")
@@ -155,19 +100,8 @@ def subject_home():
     if not enr:
         return redirect(url_for("reading_bp.learner_dashboard"))
 
-    uid = int(current_user.id)
-
-    total = int(db.session.execute(sa_text("SELECT COUNT(*) FROM rdp_lesson")).scalar() or 0)
-
-    completed = int(db.session.execute(
-        sa_text("""
-            SELECT COUNT(*)
-              FROM rdp_lesson_progress
-             WHERE user_id = :uid
-               AND status = 'completed'
-        """),
-        {"uid": uid},
-    ).scalar() or 0)
+    state = resolve_state(int(current_user.id))
+    total, completed = state.total, state.completed
 
     progress_percent = int(round((completed / total) * 100)) if total else 0
 
@@ -262,13 +196,7 @@ def begin_course():
     _ensure_started_window()
 
     # jump them straight to first lesson
-    first_id = db.session.execute(
-        sa_text("""
-            SELECT id FROM rdp_lesson
-            ORDER BY "order" ASC
-            LIMIT 1
-        """)
-    ).scalar()
+    first_id = get_lesson_catalog().first_id
 
     if first_id is None:
         # no lessons? just go back to dashboard
@@ -285,71 +213,21 @@ def begin_course():
 def view_lesson(lesson_id: int):
     uid = int(current_user.id)
 
-    # fetch the lesson (includes its sequence key = "order")
-    lesson = db.session.execute(
-        sa_text("""
-            SELECT id, title, caption, video_filename, "order"
-            FROM rdp_lesson
-            WHERE id = :i
-            LIMIT 1
-        """),
-        {"i": int(lesson_id)},
-    ).mappings().first()
-    if not lesson:
+    # lesson + neighbours from the cached catalog; progress in one query
+    catalog = get_lesson_catalog()
+    entry = catalog.by_id.get(int(lesson_id))
+    if entry is None:
         abort(404)
 
-    lesson_key = int(lesson["order"])
-
-    # ordered lessons list (needed for locking logic)
-    items = db.session.execute(
-        sa_text("""
-            SELECT id, "order"
-            FROM rdp_lesson
-            ORDER BY "order" ASC
-        """)
-    ).mappings().all()
+    lesson_key = entry.order
+    state = resolve_state(uid, catalog)
 
-    # progress map: lesson_key -> row dict
-    rows = db.session.execute(
-        sa_text("""
-            SELECT lesson_key, status, tries_used
-            FROM rdp_lesson_progress
-            WHERE user_id = :uid
-        """),
-        {"uid": uid},
-    ).mappings().all()
-    prog = {int(r["lesson_key"]): r for r in rows}
-
-    # determine the only open lesson: first not completed
-    open_key = None
-    for r in items:
-        k = int(r["order"])
-        st = (prog.get(k, {}).get("status") or "not_started")
-        if st != "completed":
-            open_key = k
-            break
-
-    if open_key is None:
-        open_key = int(items[-1]["order"]) if items else 1
-
-    # enforce: only open_key can be viewed
-    cur = prog.get(lesson_key) or {}
-    status = (cur.get("status") or "not_started")
-
-    if lesson_key != open_key and status != "completed":
-        return redirect(url_for("reading_bp.learner_dashboard"))
-
-
-    # enforce: max 3 tries on the open lesson
-    cur = prog.get(lesson_key) or {}
-    tries_used = int(cur.get("tries_used") or 0)
-    status = (cur.get("status") or "not_started")
-
-    if status != "completed" and tries_used >= 3:
+    # enforce: only the open lesson (within MAX_TRIES tries) or a completed one
+    if not state.can_view(entry):
         return redirect(url_for("reading_bp.learner_dashboard"))
 
     # consume a try on open (only if not completed)
-    if status != "completed":
+    if not state.is_completed(lesson_key):
         db.session.execute(
             sa_text("""
                 INSERT INTO rdp_lesson_progress (user_id, lesson_key, status, tries_used, started_at)
@@ -372,30 +250,11 @@ def view_lesson(lesson_id: int):
         )
         db.session.commit()
 
-    # prev/next by order
-    prev_id = db.session.execute(
-        sa_text("""
-            SELECT id
-            FROM rdp_lesson
-            WHERE "order" < :ord
-            ORDER BY "order" DESC
-            LIMIT 1
-        """),
-        {"ord": lesson_key},
-    ).scalar()
-
-    next_id = db.session.execute(
-        sa_text("""
-            SELECT id
-            FROM rdp_lesson
-            WHERE "order" > :ord
-            ORDER BY "order" ASC
-            LIMIT 1
-        """),
-        {"ord": lesson_key},
-    ).scalar()
+    prev_id, next_id = entry.prev_id, entry.next_id
+    lesson = entry.row()
 
-    video_src = url_for("static", filename=f"reading_videos/{lesson['video_filename']}")
+    video_rel = f"reading_videos/{lesson['video_filename']}"
+    video_src = media_url(video_rel)
     ui_lang = session.get("ui_lang", "en")
 
     return render_template(
@@ -403,6 +262,7 @@ def view_lesson(lesson_id: int):
         lesson=lesson,
         lesson_key=lesson_key,
         video_src=video_src,
+        hls_src=hls_url(video_rel),
         prev_id=prev_id,
         next_id=next_id,
         last_one=(next_id is None),
@@ -410,6 +270,12 @@ def view_lesson(lesson_id: int):
         t=_t,
     )
 
+@reading_bp.get("/media/<path:relpath>", endpoint="lesson_media")
+@login_required
+def lesson_media(relpath: str):
+    # byte ranges + ETag + long-lived caching; see app/subject_reading/media.py
+    return send_media(relpath)
+
 # ─────────────────────────────────
 # 6. finish (after last lesson / Finish button)
 # ─────────────────────────────────
@@ -417,20 +283,9 @@ def view_lesson(lesson_id: int):
 @reading_bp.post("/finish", endpoint="finish_course")
 @login_required
 def finish_course():
-    uid = int(current_user.id)
-
-    total = int(db.session.execute(sa_text("SELECT COUNT(*) FROM rdp_lesson")).scalar() or 0)
-    completed = int(db.session.execute(
-        sa_text("""
-            SELECT COUNT(*)
-              FROM rdp_lesson_progress
-             WHERE user_id = :uid
-               AND status = 'completed'
-        """),
-        {"uid": uid},
-    ).scalar() or 0)
+    state = resolve_state(int(current_user.id))
 
-    if total and completed < total:
+    if state.total and not state.all_done:
         flash("Finish all lessons first to unlock your certificate.", "warning")
         return redirect(url_for("reading_bp.subject_home"))
 
@@ -504,7 +359,7 @@ def get_certificate():
 def complete_lesson():
     uid = int(current_user.id)
     lesson_key = int(request.form.get("lesson_key") or 0)
-    if lesson_key <= 0:
+    if lesson_key not in get_lesson_catalog().by_key:
         return redirect(url_for("reading_bp.learner_dashboard"))
 
     # Mark completed (do not touch tries_used)
@@ -521,26 +376,7 @@ def complete_lesson():
     db.session.commit()
 
     # Go to next open lesson (or dashboard if none)
-    next_id = db.session.execute(
-        sa_text("""
-            WITH ordered AS (
-              SELECT id, "order" AS k
-              FROM rdp_lesson
-              ORDER BY "order" ASC
-            ),
-            first_open AS (
-              SELECT o.id
-              FROM ordered o
-              LEFT JOIN rdp_lesson_progress p
-                ON p.user_id = :uid AND p.lesson_key = o.k
-              WHERE COALESCE(p.status, 'not_started') != 'completed'
-              ORDER BY o.k ASC
-              LIMIT 1
-            )
-            SELECT id FROM first_open
-        """),
-        {"uid": uid},
-    ).scalar()
+    next_id = resolve_state(uid).open_lesson_id()
 
     if next_id:
         return redirect(url_for("reading_bp.view_lesson", lesson_id=int(next_id)))
@@ -551,7 +387,7 @@ def complete_lesson():
 def defer_lesson():
     uid = int(current_user.id)
     lesson_key = int(request.form.get("lesson_key") or 0)
-    if lesson_key <= 0:
+    if lesson_key not in get_lesson_catalog().by_key:
         return redirect(url_for("reading_bp.learner_dashboard"))
 
     # Mark deferred (intro-only choice enforced in template; server stays safe anyway)
@@ -973,36 +809,8 @@ def _generate_certificate_pdf(certificate_id, learner_name, completed_at):
         current_app.logger.error(f"PDF generation failed for {certificate_id}: {e}")
         return None
 
-def _get_lesson_progress_map(user_id: int) -> dict[int, dict]:
-    rows = db.session.execute(
-        sa_text("""
-            SELECT lesson_key, status, tries_used
-            FROM rdp_lesson_progress
-            WHERE user_id = :uid
-        """),
-        {"uid": int(user_id)},
-    ).mappings().all()
-
-    return {int(r["lesson_key"]): dict(r) for r in rows}
-
-def _next_open_lesson_key(*, items_count: int, prog_map: dict[int, dict]) -> int:
-    for k in range(1, items_count + 1):
-        st = (prog_map.get(k, {}).get("status") or "not_started")
-        if st != "completed":
-            return k
-    return items_count  # fallback (shouldn’t happen)
-
-def _recalc_and_store_progress(*, user_id: int, items_count: int) -> int:
-    done = db.session.execute(
-        sa_text("""
-            SELECT COUNT(*) AS n
-            FROM rdp_lesson_progress
-            WHERE user_id = :uid AND status = 'completed'
-        """),
-        {"uid": int(user_id)},
-    ).mappings().first()["n"] or 0
-
-    pct = int(round((int(done) / max(int(items_count), 1)) * 100))
+def _recalc_and_store_progress(*, user_id: int) -> int:
+    pct = int(round(resolve_state(user_id).percent))
 
     db.session.execute(
         sa_text("""
@@ -1010,7 +818,6 @@ def _recalc_and_store_progress(*, user_id: int, items_count: int) -> int:
             SET progress_percent = :pct
             WHERE user_id = :uid
         """),
-        {"pct": int(pct), "uid": int(user_id)},
+        {"pct": pct, "uid": int(user_id)},
     )
     return pct
-
@@ -0,0 +1,332 @@
+# app/subject_sms/audit_engine.py
+"""
+Sequence audit of SMS receipt / voucher / EFT reference books.
+
+A book is a set of cashbook methods whose numeric bank_ref values should run
+up by one in capture order (date, id). Each captured number is compared with
+the previous one in the same book:
+
+    ref <= previous          reversal
+    ref >  previous + 1      gap (previous + 1 .. ref - 1 missing)
+
+The comparison runs in the database with LAG() over the book's numeric refs,
+and only rows after the book's checkpoint (sms_audit_checkpoint: last audited
+position and ref, running count / gaps / reversals) are read, so re-auditing
+costs as much as what was captured since the last check. Findings are kept in
+sms_audit_finding and paged from there; the book summaries come straight from
+the checkpoint rows.
+
+A checkpoint is dropped (next audit of that school starts over) when a
+transaction is edited or deleted, or captured with a date before an audited
+position - anything that changes the order already audited.
+"""
+from __future__ import annotations
+
+from datetime import date, datetime
+from typing import Iterable, NamedTuple
+
+from sqlalchemy import bindparam, event, inspect, text
+
+from app.extensions import db
+
+PAGE_SIZE = 50
+RECENT_REFS = 25
+
+
+class Book(NamedTuple):
+    key: str
+    methods: tuple[str, ...]
+    label: str
+
+
+DEFAULT_BOOKS = (
+    Book("cash", ("cash",), "Receipt"),
+    Book("petty_cash", ("petty_cash",), "Voucher"),
+    Book("eft", ("eft",), "EFT ref"),
+)
+
+_SQL_ENSURE = (
+    "CREATE INDEX IF NOT EXISTS ix_sms_fin_txn_book ON sms_fin_txn (school_id, method, date, id)",
+)
+
+# numeric refs only (what str.isdigit() accepted), short enough for BIGINT
+_NUMERIC = {
+    "postgresql": "TRIM(t.bank_ref) ~ '^[0-9]{1,18}$'",
+    "default": "TRIM(t.bank_ref) <> '' AND TRIM(t.bank_ref) NOT GLOB '*[^0-9]*' AND LENGTH(TRIM(t.bank_ref)) <= 18",
+}
+
+_BOOK_ROWS = """
+    SELECT t.id, t.date, CAST(TRIM(t.bank_ref) AS BIGINT) AS ref
+    FROM sms_fin_txn t
+    WHERE t.school_id = :sid
+      AND t.method IN :methods
+      AND {numeric}
+      {after}
+"""
+_AFTER = "AND (t.date > :ld OR (t.date = :ld AND t.id > :lid))"
+
+_SQL_FINDINGS = """
+    WITH seq AS ({rows}),
+    lagged AS (
+        SELECT id, date, ref,
+               LAG(ref) OVER (ORDER BY date, id) AS prev_ref,
+               LAG(id)  OVER (ORDER BY date, id) AS prev_id
+        FROM seq
+    ),
+    seeded AS (
+        SELECT id, date, ref,
+               COALESCE(prev_ref, :seed_ref) AS prev_ref,
+               COALESCE(prev_id, :seed_id)   AS prev_id
+        FROM lagged
+    )
+    SELECT id, date, ref, prev_ref, prev_id
+    FROM seeded
+    WHERE prev_ref IS NOT NULL AND (ref <= prev_ref OR ref > prev_ref + 1)
+    ORDER BY date, id
+"""
+
+_SQL_SUMMARY = "SELECT COUNT(*) AS n FROM ({rows}) s"
+_SQL_EDGE = "SELECT id, date, ref FROM ({rows}) s ORDER BY date {dir}, id {dir} LIMIT :lim"
+
+_SQL_ADD_FINDING = text("""
+    INSERT INTO sms_audit_finding (school_id, book, type, from_ref, to_ref, txn_id, prev_txn_id, date)
+    VALUES (:sid, :book, :type, :from_ref, :to_ref, :txn_id, :prev_txn_id, :date)
+    ON CONFLICT (school_id, book, txn_id) DO NOTHING
+""")
+
+_SQL_SAVE_CHECKPOINT = text("""
+    INSERT INTO sms_audit_checkpoint
+        (school_id, book, methods, last_date, last_txn_id, last_ref, count, first_ref, gaps, reversals, checked_at)
+    VALUES (:sid, :book, :methods, :last_date, :last_txn_id, :last_ref, :count, :first_ref, :gaps, :reversals,
+            CURRENT_TIMESTAMP)
+    ON CONFLICT (school_id, book) DO UPDATE SET
+        methods = excluded.methods, last_date = excluded.last_date, last_txn_id = excluded.last_txn_id,
+        last_ref = excluded.last_ref, count = excluded.count, first_ref = excluded.first_ref,
+        gaps = excluded.gaps, reversals = excluded.reversals, checked_at = excluded.checked_at
+""")
+
+
+def _as_date(v):
+    if v is None or isinstance(v, date):
+        return v.date() if isinstance(v, datetime) else v
+    return datetime.strptime(str(v)[:10], "%Y-%m-%d").date()
+
+
+def ensure_audit_schema() -> None:
+    """Book index on databases created before it was on the model."""
+    for stmt in _SQL_ENSURE:
+        db.session.execute(text(stmt))
+    db.session.commit()
+
+
+def _rows_sql(after: bool) -> str:
+    dialect = db.session.get_bind().dialect.name
+    return _BOOK_ROWS.format(numeric=_NUMERIC.get(dialect, _NUMERIC["default"]), after=_AFTER if after else "")
+
+
+def _stmt(sql: str):
+    return text(sql).bindparams(bindparam("methods", expanding=True))
+
+
+# ---- audit -------------------------------------------------------------------
+def _checkpoint(school_id: int, book: Book) -> dict | None:
+    row = db.session.execute(
+        text("SELECT * FROM sms_audit_checkpoint WHERE school_id = :sid AND book = :book"),
+        {"sid": school_id, "book": book.key},
+    ).mappings().first()
+    if row is None or row["methods"] != ",".join(sorted(book.methods)):
+        return None
+    return dict(row)
+
+
+def audit_book(school_id: int, book: Book, full: bool = False) -> dict:
+    """Audit one book from its checkpoint (or from the start); caller commits."""
+    sid = int(school_id)
+    cp = None if full else _checkpoint(sid, book)
+    if cp is None:
+        db.session.execute(text("DELETE FROM sms_audit_finding WHERE school_id = :sid AND book = :book"),
+                           {"sid": sid, "book": book.key})
+        cp = {"last_date": None, "last_txn_id": 0, "last_ref": None,
+              "count": 0, "first_ref": None, "gaps": 0, "reversals": 0}
+
+    after = cp["last_date"] is not None
+    rows_sql = _rows_sql(after)
+    params = {"sid": sid, "methods": list(book.methods)}
+    if after:
+        params.update(ld=_as_date(cp["last_date"]), lid=int(cp["last_txn_id"]))
+
+    flagged = db.session.execute(
+        _stmt(_SQL_FINDINGS.format(rows=rows_sql)),
+        {**params, "seed_ref": cp["last_ref"], "seed_id": cp["last_txn_id"] or None},
+    ).mappings().all()
+
+    findings = []
+    for r in flagged:
+        cur, prev = int(r["ref"]), int(r["prev_ref"])
+        rev = cur <= prev
+        findings.append({
+            "sid": sid, "book": book.key,
+            "type": "reversal" if rev else "gap",
+            "from_ref": prev if rev else prev + 1,
+            "to_ref": cur if rev else cur - 1,
+            "txn_id": r["id"], "prev_txn_id": r["prev_id"], "date": _as_date(r["date"]),
+        })
+    if findings:
+        db.session.execute(_SQL_ADD_FINDING, findings)
+
+    n = db.session.execute(_stmt(_SQL_SUMMARY.format(rows=rows_sql)), params).scalar() or 0
+    if n:
+        last = db.session.execute(_stmt(_SQL_EDGE.format(rows=rows_sql, dir="DESC")),
+                                  {**params, "lim": 1}).mappings().first()
+        if cp["first_ref"] is None:
+            first = db.session.execute(_stmt(_SQL_EDGE.format(rows=rows_sql, dir="ASC")),
+                                       {**params, "lim": 1}).mappings().first()
+            cp["first_ref"] = int(first["ref"])
+        cp.update(last_date=_as_date(last["date"]), last_txn_id=int(last["id"]), last_ref=int(last["ref"]))
+        cp["count"] += n
+        cp["gaps"] += sum(1 for f in findings if f["type"] == "gap")
+        cp["reversals"] += sum(1 for f in findings if f["type"] == "reversal")
+
+    db.session.execute(_SQL_SAVE_CHECKPOINT, {
+        "sid": sid, "book": book.key, "methods": ",".join(sorted(book.methods)),
+        "last_date": _as_date(cp["last_date"]), "last_txn_id": cp["last_txn_id"] or 0,
+        "last_ref": cp["last_ref"], "count": cp["count"], "first_ref": cp["first_ref"],
+        "gaps": cp["gaps"], "reversals": cp["reversals"],
+    })
+    return {"new_rows": n, "new_findings": len(findings)}
+
+
+def run_audit(school_id: int, books: Iterable[Book] = DEFAULT_BOOKS, full: bool = False) -> dict:
+    """Bring every book of a school up to date (one transaction). Returns {book: stats}."""
+    out = {}
+    try:
+        for book in books:
+            out[book.key] = audit_book(school_id, book, full=full)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return out
+
+
+# ---- reads -------------------------------------------------------------------
+def book_summaries(school_id: int, books: Iterable[Book] = DEFAULT_BOOKS) -> list[dict]:
+    """
+    Per book: the checkpoint totals, when they were taken ("checked_at") and
+    how far behind they are. "audited" is False when there is no checkpoint
+    (never audited, or dropped by an edit / delete / backdated capture) - the
+    totals are then unknown, not zero. "pending" counts entries captured after
+    the checkpoint; "stale" is either case. Read-only.
+    """
+    sid = int(school_id)
+    rows = {
+        r["book"]: r for r in db.session.execute(
+            text("SELECT * FROM sms_audit_checkpoint WHERE school_id = :sid"), {"sid": sid}
+        ).mappings()
+    }
+    out = []
+    for b in books:
+        r = rows.get(b.key)
+        if r is not None and r["methods"] != ",".join(sorted(b.methods)):
+            r = None
+        audited = r is not None
+        pending = None
+        if audited:
+            params = {"sid": sid, "methods": list(b.methods)}
+            after = r["last_date"] is not None
+            if after:
+                params.update(ld=_as_date(r["last_date"]), lid=int(r["last_txn_id"]))
+            pending = int(db.session.execute(_stmt(_SQL_SUMMARY.format(rows=_rows_sql(after))), params).scalar() or 0)
+        r = r or {}
+        out.append({
+            "key": b.key,
+            "label": b.label,
+            "audited": audited,
+            "checked_at": r.get("checked_at"),
+            "pending": pending,
+            "stale": not audited or bool(pending),
+            "count": int(r.get("count") or 0) if audited else None,
+            "first": r.get("first_ref"),
+            "last": r.get("last_ref"),
+            "gaps": int(r.get("gaps") or 0) if audited else None,
+            "reversals": int(r.get("reversals") or 0) if audited else None,
+        })
+    return out
+
+
+def _message(f: dict, label: str) -> str:
+    if f["type"] == "reversal":
+        return f"{label} number {f['to_ref']} is not higher than previous {f['from_ref']}."
+    prev, cur = f["from_ref"] - 1, f["to_ref"] + 1
+    return f"Missing {label}(s): {f['from_ref']}–{f['to_ref']} between {prev} and {cur}."
+
+
+def findings_page(school_id: int, page: int = 1, per_page: int = PAGE_SIZE,
+                  books: Iterable[Book] = DEFAULT_BOOKS) -> dict:
+    """Findings newest first, one page at a time (keyed on the (school, date, txn) index)."""
+    labels = {b.key: b.label for b in books}
+    page = max(int(page or 1), 1)
+    params = {"sid": int(school_id), "books": list(labels), "lim": per_page + 1,
+              "off": (page - 1) * per_page}
+    rows = db.session.execute(text("""
+        SELECT book, type, from_ref, to_ref, txn_id, prev_txn_id, date
+        FROM sms_audit_finding
+        WHERE school_id = :sid AND book IN :books
+        ORDER BY date DESC, txn_id DESC
+        LIMIT :lim OFFSET :off
+    """).bindparams(bindparam("books", expanding=True)), params).mappings().all()
+
+    items = []
+    for r in rows[:per_page]:
+        f = dict(r)
+        f["date"] = _as_date(f["date"])
+        f["label"] = labels.get(f["book"], f["book"])
+        f["message"] = _message(f, f["label"])
+        items.append(f)
+    return {"items": items, "page": page, "per_page": per_page,
+            "has_prev": page > 1, "has_next": len(rows) > per_page}
+
+
+def recent_refs(school_id: int, book: Book, limit: int = RECENT_REFS) -> list[dict]:
+    """Last `limit` numeric refs of a book, oldest first."""
+    rows = db.session.execute(
+        _stmt(_SQL_EDGE.format(rows=_rows_sql(False), dir="DESC")),
+        {"sid": int(school_id), "methods": list(book.methods), "lim": limit},
+    ).mappings().all()
+    return [{"txn_id": r["id"], "date": _as_date(r["date"]), "ref": int(r["ref"])} for r in reversed(rows)]
+
+
+# ---- drop checkpoints when audited order can change --------------------------
+_SQL_DROP = text("DELETE FROM sms_audit_checkpoint WHERE school_id = :sid")
+_ORDER_ATTRS = ("school_id", "date", "method", "bank_ref")
+_SQL_DROP_AFTER = text("DELETE FROM sms_audit_checkpoint WHERE school_id = :sid AND last_date > :d")
+
+
+def _after_insert(mapper, connection, target):
+    d = _as_date(target.date)
+    if target.school_id is not None and d is not None:
+        connection.execute(_SQL_DROP_AFTER, {"sid": target.school_id, "d": d})
+
+
+def _after_update(mapper, connection, target):
+    state = inspect(target)
+    if not any(state.attrs[name].history.has_changes() for name in _ORDER_ATTRS):
+        return
+    sids = {target.school_id, *state.attrs.school_id.history.deleted}
+    for sid in sids - {None}:
+        connection.execute(_SQL_DROP, {"sid": sid})
+
+
+def _after_delete(mapper, connection, target):
+    if target.school_id is not None:
+        connection.execute(_SQL_DROP, {"sid": target.school_id})
+
+
+def _register_listeners():
+    from app.models.sms import SmsFinTxn
+    event.listen(SmsFinTxn, "after_insert", _after_insert)
+    event.listen(SmsFinTxn, "after_update", _after_update)
+    event.listen(SmsFinTxn, "after_delete", _after_delete)
+
+
+_register_listeners()
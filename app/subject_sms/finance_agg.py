@@ -0,0 +1,181 @@
+# app/subject_sms/finance_agg.py
+"""
+Maintained finance totals for the SMS cashbook.
+
+sms_fin_agg holds one row per (school, year, month, category, direction) with
+the summed amount and transaction count. The finance summary and overview
+read these rows instead of loading every SmsFinTxn of the year, so their cost
+depends on the number of categories, not transactions.
+
+ORM inserts / updates / deletes of SmsFinTxn apply their delta to the
+matching row inside the same flush (so in the same transaction as the
+transaction itself); an edit moves the amount from the old key to the new
+one. rebuild_fin_agg() recomputes the table (or one school) from sms_fin_txn
+with one INSERT .. SELECT .. GROUP BY - `flask sms-fin-agg`.
+"""
+from __future__ import annotations
+
+from datetime import date, datetime
+
+from sqlalchemy import event, inspect, text
+
+from app.extensions import db
+
+_SQL_ADD = text("""
+    INSERT INTO sms_fin_agg (school_id, year, month, category_id, direction, amount_cents, txn_count)
+    VALUES (:sid, :y, :m, :cid, :dir, :amt, :n)
+    ON CONFLICT (school_id, year, month, category_id, direction) DO UPDATE SET
+        amount_cents = sms_fin_agg.amount_cents + excluded.amount_cents,
+        txn_count    = sms_fin_agg.txn_count + excluded.txn_count
+""")
+_SQL_PRUNE = text("""
+    DELETE FROM sms_fin_agg
+    WHERE school_id = :sid AND year = :y AND month = :m AND category_id = :cid AND direction = :dir
+      AND txn_count <= 0
+""")
+
+# year / month from the date column; same text form on SQLite and PostgreSQL
+_YEAR = "CAST(substr(CAST(t.date AS TEXT), 1, 4) AS INTEGER)"
+_MONTH = "CAST(substr(CAST(t.date AS TEXT), 6, 2) AS INTEGER)"
+
+_SQL_REBUILD = f"""
+    INSERT INTO sms_fin_agg (school_id, year, month, category_id, direction, amount_cents, txn_count)
+    SELECT t.school_id, {_YEAR}, {_MONTH}, t.category_id, t.direction,
+           COALESCE(SUM(t.amount_cents), 0), COUNT(*)
+    FROM sms_fin_txn t
+    {{where}}
+    GROUP BY t.school_id, {_YEAR}, {_MONTH}, t.category_id, t.direction
+"""
+
+_SQL_CATEGORY_TOTALS = text("""
+    SELECT a.category_id, c.name, c.kind, COALESCE(c.is_fee, FALSE) AS is_fee, a.direction,
+           SUM(a.amount_cents) AS amount_cents, SUM(a.txn_count) AS txn_count
+    FROM sms_fin_agg a
+    JOIN sms_fin_category c ON c.id = a.category_id
+    WHERE a.school_id = :sid AND a.year = :y
+    GROUP BY a.category_id, c.name, c.kind, c.is_fee, a.direction
+    ORDER BY c.kind, c.name
+""")
+
+_SQL_MONTH_TOTALS = text("""
+    SELECT month, direction, SUM(amount_cents) AS amount_cents
+    FROM sms_fin_agg
+    WHERE school_id = :sid AND year = :y
+    GROUP BY month, direction
+""")
+
+
+def _as_date(v):
+    if v is None or isinstance(v, date):
+        return v.date() if isinstance(v, datetime) else v
+    return datetime.strptime(str(v)[:10], "%Y-%m-%d").date()
+
+
+# ---- rebuild -----------------------------------------------------------------
+def rebuild_fin_agg(school_id: int | None = None) -> int:
+    """Recompute sms_fin_agg (all schools, or one) from sms_fin_txn. Returns rows written."""
+    params = {}
+    where = ""
+    if school_id is not None:
+        where = "WHERE t.school_id = :sid"
+        params["sid"] = int(school_id)
+    try:
+        db.session.execute(text("DELETE FROM sms_fin_agg" + (" WHERE school_id = :sid" if where else "")), params)
+        db.session.execute(text(_SQL_REBUILD.format(where=where)), params)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    sql = "SELECT COUNT(*) FROM sms_fin_agg" + (" WHERE school_id = :sid" if where else "")
+    return db.session.execute(text(sql), params).scalar() or 0
+
+
+def ensure_fin_agg() -> None:
+    """Fill sms_fin_agg on databases that had transactions before it existed."""
+    has_agg = db.session.execute(text("SELECT 1 FROM sms_fin_agg LIMIT 1")).first()
+    if not has_agg and db.session.execute(text("SELECT 1 FROM sms_fin_txn LIMIT 1")).first():
+        rebuild_fin_agg()
+
+
+# ---- reads -------------------------------------------------------------------
+def category_totals(school_id: int, year: int) -> list[dict]:
+    """Year totals per (category, direction) with the category's name / kind / is_fee."""
+    rows = db.session.execute(_SQL_CATEGORY_TOTALS, {"sid": int(school_id), "y": int(year)}).mappings()
+    return [{
+        "category_id": r["category_id"],
+        "name": r["name"],
+        "kind": r["kind"],
+        "is_fee": bool(r["is_fee"]),
+        "direction": r["direction"],
+        "amount_cents": int(r["amount_cents"] or 0),
+        "txn_count": int(r["txn_count"] or 0),
+    } for r in rows]
+
+
+def month_totals(school_id: int, year: int) -> list[dict]:
+    """Income / expense per month (1..12) of `year`."""
+    out = [{"month": m, "income_cents": 0, "expense_cents": 0} for m in range(1, 13)]
+    for r in db.session.execute(_SQL_MONTH_TOTALS, {"sid": int(school_id), "y": int(year)}).mappings():
+        m = int(r["month"])
+        if 1 <= m <= 12:
+            out[m - 1]["income_cents" if r["direction"] == "in" else "expense_cents"] += int(r["amount_cents"] or 0)
+    return out
+
+
+# ---- keep sms_fin_agg current on ORM edits -----------------------------------
+def _apply(connection, school_id, d, category_id, direction, amount, n):
+    d = _as_date(d)
+    if school_id is None or d is None or category_id is None or not direction:
+        return
+    params = {"sid": int(school_id), "y": d.year, "m": d.month, "cid": int(category_id), "dir": direction}
+    connection.execute(_SQL_ADD, {**params, "amt": int(amount or 0) * n, "n": n})
+    if n < 0:
+        connection.execute(_SQL_PRUNE, params)
+
+
+_KEY_ATTRS = ("school_id", "date", "category_id", "direction", "amount_cents")
+
+
+def _old_values(target) -> tuple:
+    state = inspect(target)
+    out = []
+    for name in _KEY_ATTRS:
+        hist = state.attrs[name].history
+        out.append(hist.deleted[0] if hist.deleted else getattr(target, name))
+    return tuple(out)
+
+
+def _after_insert(mapper, connection, target):
+    _apply(connection, target.school_id, target.date, target.category_id, target.direction,
+           target.amount_cents, 1)
+
+
+def _after_update(mapper, connection, target):
+    old = _old_values(target)
+    new = tuple(getattr(target, name) for name in _KEY_ATTRS)
+    if old == new:
+        return
+    _apply(connection, *old, -1)
+    _apply(connection, *new, 1)
+
+
+def _after_delete(mapper, connection, target):
+    _apply(connection, *_old_values(target), -1)
+
+
+def _keep_old_value(target, value, oldvalue, initiator):
+    return value
+
+
+def _register_listeners():
+    from app.models.sms import SmsFinTxn
+    # load the previous value when a key column is set on an expired instance,
+    # so after_update can take the amount off the old row
+    for name in _KEY_ATTRS:
+        event.listen(getattr(SmsFinTxn, name), "set", _keep_old_value, active_history=True, retval=True)
+    event.listen(SmsFinTxn, "after_insert", _after_insert)
+    event.listen(SmsFinTxn, "after_update", _after_update)
+    event.listen(SmsFinTxn, "after_delete", _after_delete)
+
+
+_register_listeners()
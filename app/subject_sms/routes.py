@@ -13,6 +13,8 @@ from app.models.sms import (
 )
 from datetime import datetime
 from sqlalchemy import func
+from app.subject_sms.finance_agg import category_totals, month_totals
+from app.subject_sms.audit_engine import DEFAULT_BOOKS, book_summaries, findings_page, recent_refs, run_audit
 from app.subject_sms.helpers import (
     _current_sms_school,
     _require_sms_auditor_school,
@@ -858,9 +860,14 @@ def finance_home():
 
 
     # Stub for now – we’ll add real fee / asset data later
+    year = datetime.now().year
+    months = month_totals(school.id, year)
     fee_summary = {
-        "year": None,
+        "year": year,
         "terms": [],
+        "months": months,
+        "income_cents": sum(m["income_cents"] for m in months),
+        "expense_cents": sum(m["expense_cents"] for m in months),
     }
     asset_summary = {
         "categories": [],
@@ -937,36 +944,32 @@ def finance_summary():
 
     year = int(request.args.get("year") or datetime.now().year)
 
-    start = date(year, 1, 1)
-    end = date(year, 12, 31)
-
-    txns = (
-        SmsFinTxn.query
-        .filter(
-            SmsFinTxn.school_id == school.id,
-            SmsFinTxn.date >= start,
-            SmsFinTxn.date <= end,
-        )
-        .join(SmsFinCategory, SmsFinCategory.id == SmsFinTxn.category_id)
-        .add_entity(SmsFinCategory)
-        .all()
-    )
+    # per-category year totals from the maintained aggregate (finance_agg)
+    totals = category_totals(school.id, year)
 
     income_total = 0
     expense_total = 0
     by_category = {}
+    fee_income_cents = 0
+    non_fee_income_cents = 0
 
-    for txn, cat in txns:
-        signed = txn.amount_cents if txn.direction == "in" else -txn.amount_cents
+    for row in totals:
+        amount = row["amount_cents"]
+        signed = amount if row["direction"] == "in" else -amount
 
-        key = cat.name
+        key = row["name"]
         by_category.setdefault(key, 0)
         by_category[key] += signed
 
-        if txn.direction == "in":
-            income_total += txn.amount_cents
+        if row["direction"] == "in":
+            income_total += amount
+            # fee vs non-fee income (hall hire, subsidy, etc.)
+            if row["is_fee"] and row["kind"] == "income":
+                fee_income_cents += amount
+            else:
+                non_fee_income_cents += amount
         else:
-            expense_total += txn.amount_cents
+            expense_total += amount
 
     surplus_cents = income_total - expense_total
 
@@ -976,24 +979,6 @@ def finance_summary():
         is_active=True
     ).count()
 
-    # Non-fee income (hall hire, subsidy, etc.)
-    fee_cats = SmsFinCategory.query.filter_by(
-        school_id=school.id,
-        is_fee=True,
-        kind="income",
-    ).all()
-    fee_cat_ids = {c.id for c in fee_cats}
-
-    fee_income_cents = 0
-    non_fee_income_cents = 0
-    for txn, cat in txns:
-        if txn.direction != "in":
-            continue
-        if txn.category_id in fee_cat_ids:
-            fee_income_cents += txn.amount_cents
-        else:
-            non_fee_income_cents += txn.amount_cents
-
     required_fee_per_learner_cents = None
     if expected_learners > 0:
         # target: cover expenses entirely from fee income + non-fee income
@@ -1230,91 +1215,51 @@ def _sms_nav_ctx():
     return {"has_sms_audit_nav_access": has_sms_audit_access}
 
 
+def _render_audit(school):
+    """
+    Findings page shared by the auditor routes. Read-only: it shows the stored
+    checkpoints and findings, with when each book was checked and whether it
+    is stale / not yet audited; audit_refresh (POST) and `flask sms-audit`
+    bring them up to date.
+    """
+    summaries = book_summaries(school.id)
+    page = findings_page(school.id, request.args.get("page", type=int) or 1)
+    recent = [{"summary": s, "recent": recent_refs(school.id, b)} for s, b in zip(summaries, DEFAULT_BOOKS)]
+
+    return render_template(
+        "subject/sms/audit/findings.html",
+        school=school,
+        summaries=summaries,
+        findings=page["items"],
+        page=page,
+        recent_refs=recent,
+    )
+
+
 @sms_bp.get("/audit/findings")
 @login_required
 def audit_findings():
     # auditor-only (no owner)
     school = _require_sms_auditor_school()
+    return _render_audit(school)
 
-    def _audit_for_methods(methods, label):
-        txns = (
-            SmsFinTxn.query
-            .filter(SmsFinTxn.school_id == school.id)
-            .filter(SmsFinTxn.method.in_(methods))
-            .order_by(SmsFinTxn.date.asc(), SmsFinTxn.id.asc())
-            .all()
-        )
-
-        items = []
-        for t in txns:
-            ref = (t.bank_ref or "").strip()
-            if not ref.isdigit():
-                continue
-            items.append({"txn_id": t.id, "date": t.date, "ref": int(ref)})
-
-        findings = []
-        last_ref = None
-        last_txn_id = None
-
-        for it in items:
-            cur = it["ref"]
-
-            if last_ref is not None:
-                if cur <= last_ref:
-                    findings.append({
-                        "type": "reversal",
-                        "label": label,
-                        "message": f"{label} number {cur} is not higher than previous {last_ref}.",
-                        "from_ref": last_ref,
-                        "to_ref": cur,
-                        "txn_id": it["txn_id"],
-                        "prev_txn_id": last_txn_id,
-                        "date": it["date"],
-                    })
-                elif cur > last_ref + 1:
-                    findings.append({
-                        "type": "gap",
-                        "label": label,
-                        "message": f"Missing {label}(s): {last_ref+1}–{cur-1} between {last_ref} and {cur}.",
-                        "from_ref": last_ref + 1,
-                        "to_ref": cur - 1,
-                        "txn_id": it["txn_id"],
-                        "prev_txn_id": last_txn_id,
-                        "date": it["date"],
-                    })
-
-            last_ref = cur
-            last_txn_id = it["txn_id"]
-
-        summary = {
-            "label": label,
-            "count": len(items),
-            "first": items[0]["ref"] if items else None,
-            "last": items[-1]["ref"] if items else None,
-            "gaps": sum(1 for f in findings if f["type"] == "gap"),
-            "reversals": sum(1 for f in findings if f["type"] == "reversal"),
-        }
-
-        return summary, findings, items[-25:]
-
-    books = [
-        _audit_for_methods(["cash"], "Receipt"),
-        _audit_for_methods(["petty_cash"], "Voucher"),
-        _audit_for_methods(["eft"], "EFT ref"),
-    ]
 
-    summaries = [b[0] for b in books]
-    findings = [f for b in books for f in b[1]]
-    findings.sort(key=lambda x: (x["date"], x["txn_id"]), reverse=True)
-    recent_refs = [{"summary": b[0], "recent": b[2]} for b in books]
+@sms_bp.post("/audit/refresh")
+@login_required
+def audit_refresh():
+    # auditor-only (no owner); audits what was captured since the checkpoints
+    school = _require_sms_auditor_school()
+    full = request.form.get("full") == "1"
+    stats = run_audit(school.id, full=full)
+    rows = sum(s["new_rows"] for s in stats.values())
+    found = sum(s["new_findings"] for s in stats.values())
+    flash(f"Audit {'rebuilt from the start' if full else 'brought up to date'}: "
+          f"{rows} entries checked, {found} new findings.", "success")
 
-    return render_template(
-        "subject/sms/audit/findings.html",
-        school=school,
-        summaries=summaries,
-        findings=findings,
-        recent_refs=recent_refs,
-    )
+    back = request.form.get("back")
+    if back not in ("sms_bp.audit_findings", "sms_bp.finance_audit"):
+        back = "sms_bp.audit_findings"
+    return redirect(url_for(back))
 
 
 @sms_bp.route("/finance/audit/access", methods=["GET", "POST"])
@@ -1437,84 +1382,7 @@ def finance_audit():
     if not school:
         abort(403)
 
-    def _audit_for_methods(methods, label):
-        txns = (
-            SmsFinTxn.query
-            .filter(SmsFinTxn.school_id == school.id)
-            .filter(SmsFinTxn.method.in_(methods))
-            .order_by(SmsFinTxn.date.asc(), SmsFinTxn.id.asc())
-            .all()
-        )
-
-        items = []
-        for t in txns:
-            ref = (t.bank_ref or "").strip()
-            if not ref.isdigit():
-                continue
-            items.append({"txn_id": t.id, "date": t.date, "ref": int(ref)})
-
-        findings = []
-        last_ref = None
-        last_txn_id = None
-
-        for it in items:
-            cur = it["ref"]
-
-            if last_ref is not None:
-                if cur <= last_ref:
-                    findings.append({
-                        "type": "reversal",
-                        "label": label,
-                        "message": f"{label} number {cur} is not higher than previous {last_ref}.",
-                        "from_ref": last_ref,
-                        "to_ref": cur,
-                        "txn_id": it["txn_id"],
-                        "prev_txn_id": last_txn_id,
-                        "date": it["date"],
-                    })
-                elif cur > last_ref + 1:
-                    findings.append({
-                        "type": "gap",
-                        "label": label,
-                        "message": f"Missing {label}(s): {last_ref+1}–{cur-1} between {last_ref} and {cur}.",
-                        "from_ref": last_ref + 1,
-                        "to_ref": cur - 1,
-                        "txn_id": it["txn_id"],
-                        "prev_txn_id": last_txn_id,
-                        "date": it["date"],
-                    })
-
-            last_ref = cur
-            last_txn_id = it["txn_id"]
-
-        summary = {
-            "label": label,
-            "count": len(items),
-            "first": items[0]["ref"] if items else None,
-            "last": items[-1]["ref"] if items else None,
-            "gaps": sum(1 for f in findings if f["type"] == "gap"),
-            "reversals": sum(1 for f in findings if f["type"] == "reversal"),
-        }
-        return summary, findings, items[-25:]
-
-    books = [
-        _audit_for_methods(["cash"], "Receipt"),
-        _audit_for_methods(["petty_cash"], "Voucher"),
-        _audit_for_methods(["eft"], "EFT ref"),
-    ]
-
-    summaries = [b[0] for b in books]
-    findings = [f for b in books for f in b[1]]
-    findings.sort(key=lambda x: (x["date"], x["txn_id"]), reverse=True)
-    recent_refs = [{"summary": b[0], "recent": b[2]} for b in books]
-
-    return render_template(
-        "subject/sms/audit/findings.html",   # NEW location
-        school=school,
-        summaries=summaries,
-        findings=findings,
-        recent_refs=recent_refs,
-    )
+    return _render_audit(school)
 
 @sms_bp.get("/audit")
 @login_required
@@ -82,20 +82,28 @@ def store_response(user_id: int, question_id: int, answer: str) -> None:
     db.session.commit()
 
 
-def capture_and_store_response(user_id: int, question_id: int, answer: str) -> dict:
+def capture_and_store_response(user_id: int, question_id: int, answer: str, run_id: int | None = None) -> dict:
     """
-    Read-only lookup from lca_question_phase_map for the given answer,
-    write the user's response via store_response, and return the phase scores.
+    Phase scores for the given answer from the in-memory scoring map (no
+    per-answer query), then write the response. With a run_id the write goes
+    through the batched capture path (idempotent per run/question, lca_result
+    updated incrementally); otherwise via store_response.
     """
-    pm = (LcaQuestionPhaseMap.query
-          .filter_by(question_id=question_id, answer_type=answer)
-          .first())
-    if not pm:
+    from app.admin.loss.scoring_engine import get_scoring_map, normalize_answer
+    from app.subject_loss.answer_capture import write_answers
+
+    smap = get_scoring_map()
+    if (int(question_id), normalize_answer(answer)) not in smap.index:
         raise ValueError(f"No phase map row for Q{question_id} / '{answer}'")
+    p1, p2, p3, p4 = smap.score([question_id], [answer])
 
-    store_response(user_id, question_id, answer)
+    if run_id is not None:
+        write_answers(run_id, user_id, {int(question_id): answer})
+        db.session.commit()
+    else:
+        store_response(user_id, question_id, answer)
 
-    return {"p1": pm.phase_1, "p2": pm.phase_2, "p3": pm.phase_3, "p4": pm.phase_4}
+    return {"p1": p1, "p2": p2, "p3": p3, "p4": p4}
 
 
 def compute_phase_totals_for_user(user_id:int):
@@ -128,20 +136,16 @@ def compute_phase_max_possible():
 def to_percent(x, m): 
     return round((x / m * 100), 1) if m else 0.0
 
-def get_phase_column_for_question(question_id, cursor):
-    """Returns the phase column name for a given question_id from lca_questions"""
-    cursor.execute("""
-        SELECT phase_1, phase_2, phase_3, phase_4
-        FROM lca_questions
-        WHERE question_id = ?
-        LIMIT 1
-    """, (question_id,))
-    row = cursor.fetchone()
-
-    if row:
-        for i, val in enumerate(row):
-            if val == 1:
-                return f"phase_{i+1}"
+def get_phase_column_for_question(question_id, cursor=None):
+    """
+    Phase column a question scores into on a 'yes' answer, from the in-memory
+    scoring map. `cursor` is accepted for older callers and no longer used.
+    """
+    from app.admin.loss.scoring_engine import get_scoring_map
+
+    for i, val in enumerate(get_scoring_map().score([question_id], ["yes"])):
+        if val:
+            return f"phase_{i+1}"
     return None
 
 from sqlalchemy import func, and_
@@ -171,23 +175,16 @@ def finalize_results_for_user(user_id: int):
 
 
 def record_user_response(user_id, question_id, answer_type):
-    import sqlite3
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    from app.admin.loss.scoring_engine import get_scoring_map, normalize_answer
 
-
-
-    # ✅ FIX: Query from lca_sequence, not lca_scorecard
-    cursor.execute("""
-        SELECT phase_1, phase_2, phase_3, phase_4
-        FROM lca_sequence
-        WHERE question_id = ? AND answer_type = ?
-        LIMIT 1
-    """, (question_id, answer_type))
-    row = cursor.fetchone()
-
-    if not row:
+    # phase weights from the in-memory scoring map, not a query per answer
+    smap = get_scoring_map()
+    if (int(question_id), normalize_answer(answer_type)) not in smap.index:
         raise ValueError(f"No matching question found for question_id={question_id} and answer_type='{answer_type}'")
+    row = smap.score([question_id], [answer_type])
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
 
     # ✅ Insert into lca_scorecard
     cursor.execute("""
@@ -1,12 +1,13 @@
 # app/utils/billing_helpers.py
 # (No imports; all pure-Python helpers you can call from admin/billing)
-import calendar 
 from app.admin.billing.water import get_consumption_rows_for_month
 from app.models.billing import (
     BilConsumption,  BilTenant, BilMeter,
     BilTariff )
 from datetime import datetime, date, timedelta
 from app.extensions import db
+from app.utils.tariff_index import get_tariff_index, month_first, month_last
+from app.utils.tier_kernel import TierTable, allocate, money
 from sqlalchemy import func, and_, text
 
 from decimal import Decimal, ROUND_HALF_UP
@@ -186,30 +187,22 @@ def summarize_ws_sd_for_page1(meter_label, ws_total, sd_total, water_total):
     ]
 
 def get_effective_tariff_rate(utility_type, month, code=None):
-    qs = BilTariff.query.filter(BilTariff.utility_type == utility_type)
+    # latest version <= month start
+    tariffs = get_tariff_index()
     if code:
-        qs = qs.filter(BilTariff.code == code)
-    eff_on = _month_start(month)
-    # effective_date stored as string 'YYYY-MM-DD'
-    # keep <= month start, pick latest
-    rec = (qs.filter(BilTariff.effective_date <= eff_on.isoformat())
-             .order_by(BilTariff.effective_date.desc())
-             .first())
-    return float(rec.rate) if rec else None
+        return tariffs.rate(code, month_first(month), utility=utility_type)
+    rows = tariffs.tiers(utility_type, month_first(month), prefix=None)
+    rec = max(rows, key=lambda t: (t["effective_date"], t["id"] or 0), default=None)
+    return rec["rate"] if rec else None
 
 def _get_tiers(utility_type, month):
-    eff_on = _month_start(month)
-    tiers = (BilTariff.query
-             .filter(BilTariff.utility_type == utility_type,
-                     BilTariff.effective_date <= eff_on.isoformat())
-             .order_by(BilTariff.block_start.asc())
-             .all())
+    tiers = get_tariff_index().tiers(utility_type, month_first(month), prefix=None)
     # Expect rows with block_start/end and rate
     return [{
         "label": f"T{idx+1}",
-        "start": float(t.block_start or 0.0),
-        "end": float(t.block_end or 0.0) if t.block_end not in (None, 0) else None,
-        "rate": float(t.rate)
+        "start": float(t["block_start"] or 0.0),
+        "end": float(t["block_end"]) if t["block_end"] not in (None, 0) else None,
+        "rate": float(t["rate"])
     } for idx, t in enumerate(tiers)]
 
 def _split_by_tiers_kL(cons_kL, tiers, reductions=None):
@@ -246,14 +239,7 @@ def _month_start(month_str):
     return date(y, m, 1)
 
 def get_effective_rate(utility_type, code, month):
-    eff_on = _month_start(month)
-    rec = (BilTariff.query
-           .filter(BilTariff.utility_type == utility_type,
-                   BilTariff.code == code,
-                   BilTariff.effective_date <= eff_on.isoformat())
-           .order_by(BilTariff.effective_date.desc())
-           .first())
-    return float(rec.rate) if rec else None
+    return get_tariff_index().rate(code, month_first(month), utility=utility_type)
 
 def build_electricity_rows(cons_rows, month):
     elec_rate = get_effective_rate("electricity", "ElecRate", month)
@@ -270,24 +256,19 @@ def build_electricity_rows(cons_rows, month):
     return out, round(total_due, 2), elec_rate
 
 def _tiers_for_period_from_tariffs(utility_type, month, days):
-    eff_on = _month_start(month)
-    trows = (BilTariff.query
-             .filter(BilTariff.utility_type == utility_type,
-                     BilTariff.effective_date <= eff_on.isoformat())
-             .order_by(BilTariff.block_start.asc())
-             .all())
+    trows = get_tariff_index().tiers(utility_type, month_first(month), prefix=None)
     tiers = []
     for idx, t in enumerate(trows, start=1):
-        start_ld = float(t.block_start or 0.0)     # L/day
-        end_ld = float(t.block_end or 0.0)         # L/day
+        start_ld = float(t["block_start"] or 0.0)  # L/day
+        end_ld = float(t["block_end"] or 0.0)      # L/day
         start_kl = (start_ld * days) / 1000.0      # kL over period
         end_kl = (end_ld * days) / 1000.0 if end_ld not in (0.0, None) else None
         tiers.append({
             "idx": idx,
-            "label": t.code or f"T{idx}",
+            "label": t["code"] or f"T{idx}",
             "start_kl": start_kl,
             "end_kl": end_kl,                      # None = open-ended
-            "rate": float(t.rate),
+            "rate": float(t["rate"]),
         })
     return tiers
 
@@ -467,17 +448,7 @@ def _first_day(month_str: str) -> datetime:
 
 def get_electricity_rate_for_month(month_str: str) -> float | None:
     """Return the electricity flat rate (float) effective for the given month, or None."""
-    month_start = _first_day(month_str).date()
-    row = (
-        db.session.query(BilTariff)
-        .filter(
-            BilTariff.utility_type == "electricity",
-            BilTariff.effective_date <= month_start.isoformat(),
-        )
-        .order_by(BilTariff.effective_date.desc())
-        .first()
-    )
-    return float(row.rate) if row else None
+    return get_effective_tariff_rate("electricity", month_str)
 
 def get_metsoa_consumption_split(tenant_id, month_str):
     """
@@ -721,28 +692,12 @@ def _first_of_month(month_str):
 
 def get_electricity_rate_for_month(month_str):
     """Flat electricity rate effective for that month (latest <= month-start)."""
-    eff = _first_of_month(month_str).isoformat()
-    q = (
-        db.session.query(BilTariff)
-        .filter(BilTariff.utility_type == "electricity")
-        .filter(BilTariff.effective_date <= eff)
-        .order_by(BilTariff.effective_date.desc(), BilTariff.id.desc())
-    )
-    row = q.first()
-    return float(row.rate) if row else None
+    return get_effective_tariff_rate("electricity", month_str)
 
 
 def _get_fixed_amount(code, month_str):
     """Fixed tariff by code (MgmtFee, WaterLossLevy, WSSurcharge, SDSurcharge, RefuseBin, etc.)."""
-    eff = _first_of_month(month_str).isoformat()
-    t = (
-        db.session.query(BilTariff)
-        .filter(BilTariff.code == code)
-        .filter(BilTariff.effective_date <= eff)
-        .order_by(BilTariff.effective_date.desc(), BilTariff.id.desc())
-        .first()
-    )
-    return float(t.rate) if t else 0.0
+    return get_tariff_index().rate(code, month_first(month_str), default=0.0)
 
 
 def _get_tier_bands(utility_type, month_str):
@@ -754,20 +709,14 @@ def _get_tier_bands(utility_type, month_str):
     Returns list of dicts in order:
     [{"start":0, "end":200, "rate":...}, ...]
     """
-    eff = _first_of_month(month_str).isoformat()
-    q = (
-        db.session.query(BilTariff)
-        .filter(BilTariff.utility_type == utility_type)
-        .filter(BilTariff.block_end > 0)    # tiers only
-        .filter(BilTariff.effective_date <= eff)
-        .order_by(BilTariff.block_start.asc())
-    )
     bands = []
-    for t in q:
+    for t in get_tariff_index().tiers(utility_type, month_first(month_str), prefix=None):
+        if not (t["block_end"] or 0) > 0:   # tiers only
+            continue
         bands.append({
-            "start": int(t.block_start),    # L/day
-            "end": int(t.block_end),        # L/day
-            "rate": float(t.rate),          # per kL
+            "start": int(t["block_start"] or 0),  # L/day
+            "end": int(t["block_end"]),           # L/day
+            "rate": float(t["rate"]),             # per kL
         })
     return bands
 
@@ -966,19 +915,13 @@ def _default_sd_reduction(code):
 
 def _fetch_tariff_rate(db, BilTariff, utility_type, code, month_str):
     """Return dict(rate, reduction_factor, unit) for the latest tariff <= month_end."""
-    _, month_end = _month_bounds(month_str)
-    q = (db.session.query(BilTariff)
-         .filter(BilTariff.utility_type == utility_type)
-         .filter(BilTariff.code == code)
-         .filter(BilTariff.effective_date <= month_end)
-         .order_by(BilTariff.effective_date.desc()))
-    t = q.first()
+    t = get_tariff_index().resolve(code, month_last(month_str), utility=utility_type)
     if not t:
         return {"rate": None, "reduction_factor": None, "unit": None}
     return {
-        "rate": _money_or_none(t.rate),
-        "reduction_factor": _money_or_none(getattr(t, "reduction_factor", None)),
-        "unit": getattr(t, "unit", None),
+        "rate": _money_or_none(t["rate"]),
+        "reduction_factor": _money_or_none(t["reduction_factor_raw"]),
+        "unit": t["unit"],
     }
 
 
@@ -1032,25 +975,18 @@ def _cons_rows_for_tenant_month(db, BilConsumption, meters, month_str):
 # ──────────────────────────────────────────────────────────────────────────────
 
 def _load_tiers(db, BilTariff, utility_type, month_str):
-    """Load all rows for utility_type ('water' or 'sanitation') that look like tiers, sorted by block_start."""
-    _, month_end = _month_bounds(month_str)
-    q = (db.session.query(BilTariff)
-         .filter(BilTariff.utility_type == utility_type)
-         .filter(BilTariff.effective_date <= month_end)
-         .order_by(BilTariff.block_start.asc(), BilTariff.block_end.asc()))
+    """Effective rows for utility_type ('water' or 'sanitation') that look like tiers, sorted by block_start."""
     tiers = []
-    for t in q.all():
-        # Only keep tier-like rows (codes starting with Tier*)
-        if not (t.code or "").lower().startswith("tier"):
-            continue
+    # Only tier-like rows (codes starting with Tier*)
+    for t in get_tariff_index().tiers(utility_type, month_last(month_str), prefix="tier"):
         tiers.append({
-            "code": t.code,
-            "rate": _money_or_none(t.rate),
-            "unit": getattr(t, "unit", None),
+            "code": t["code"],
+            "rate": _money_or_none(t["rate"]),
+            "unit": t["unit"],
             # interpret block_* as liters/day thresholds if they are large numbers; otherwise treat as kL/day
-            "block_start": float(getattr(t, "block_start", 0.0) or 0.0),
-            "block_end": float(getattr(t, "block_end", 0.0) or 0.0),
-            "reduction_factor": _money_or_none(getattr(t, "reduction_factor", None)),
+            "block_start": float(t["block_start"] or 0.0),
+            "block_end": float(t["block_end"] or 0.0),
+            "reduction_factor": _money_or_none(t["reduction_factor_raw"]),
         })
     return tiers
 
@@ -1063,52 +999,27 @@ def _alloc_by_tiers(cons_kl, days, tiers, is_sd=False):
     Returns: (alloc_rows, subtotal)
       alloc_rows: [{tier_code, vol_kl, rate, due, reduction_applied}]
     """
-    remaining = max(0.0, float(cons_kl or 0))
-    rows = []
-    subtotal = 0.0
-
-    for t in tiers:
-        # compute tier cap in kL for the period
-        cap_kl = 0.0
-        if t["block_end"] and t["block_end"] > t["block_start"]:
-            cap_kl = ((t["block_end"] - t["block_start"]) / 1000.0) * float(days or 0)
-        else:
-            # last/open tier → no finite cap (use all remaining)
-            cap_kl = remaining
-
-        take = min(remaining, cap_kl)
-        if take <= 0.0:
-            # nothing left to allocate
-            # still append a zero row so breakdown shows all tiers if you like; optional
-            rows.append({
-                "tier_code": t["code"],
-                "vol_kl": 0.0,
-                "rate": _money_or_none(t["rate"]),
-                "due": 0.0,
-                "reduction_applied": 1.0 if not is_sd else (t["reduction_factor"] or _default_sd_reduction(t["code"])),
-            })
-            continue
-
-        rate = _money_or_none(t["rate"]) or 0.0
-        if is_sd:
-            rf = t["reduction_factor"] or _default_sd_reduction(t["code"])
-            bill_kl = take * rf
-        else:
-            rf = 1.0
-            bill_kl = take
+    rfs = [(t["reduction_factor"] or _default_sd_reduction(t["code"])) if is_sd else 1.0 for t in tiers]
+    table = TierTable(
+        # last/open tier → no finite cap (uses all remaining)
+        widths=[(t["block_end"] - t["block_start"]) if t["block_end"] and t["block_end"] > t["block_start"] else None
+                for t in tiers],
+        rates=[t["rate"] for t in tiers],
+        reductions=rfs,
+    )
+    alloc = allocate(cons_kl, days, table, reduce=is_sd)
 
-        due = bill_kl * rate
-        subtotal += due
+    rows = []
+    for ln, t in zip(alloc.lines(0, overflow=False), tiers):
+        took = ln.qty > 0
         rows.append({
             "tier_code": t["code"],
-            "vol_kl": round(take, 3),
-            "rate": rate,
-            "due": round(due, 2),
-            "reduction_applied": rf,
+            "vol_kl": float(ln.qty),
+            "rate": ln.rate if took else _money_or_none(t["rate"]),
+            "due": float(ln.amount),
+            "reduction_applied": ln.reduction,
         })
-        remaining -= take
-
-    return rows, round(subtotal, 2)
+    return rows, float(money(alloc.totals(overflow=False)[0]))
 
 
 # ──────────────────────────────────────────────────────────────────────────────
@@ -1444,21 +1355,21 @@ def _mapped_totals_for_meter(meter_id, month_str, cons_kl):
     - Otherwise treat as fixed monthly.
     Returns (ws_total, sd_total).
     """
-    rows = db.session.execute(text("""
-        SELECT t.utility_type,
-               t.code,
-               t.rate,
-               lower(coalesce(t.unit,'')) AS unit
+    codes = db.session.execute(text("""
+        SELECT mm.charge_code
         FROM bil_meter_charge_map mm
-        JOIN bil_tariff t
-          ON t.code = mm.charge_code
-         AND t.effective_date <= :cut
         WHERE mm.is_enabled = 1
           AND mm.meter_id   = :mid
           AND (mm.effective_start IS NULL OR mm.effective_start <= :d0)
           AND (mm.effective_end   IS NULL OR mm.effective_end   >= :d0)
         ORDER BY mm.id
-    """), {"mid": meter_id, "cut": f"{month_str}-28", "d0": f"{month_str}-01"}).mappings().all()
+    """), {"mid": meter_id, "d0": f"{month_str}-01"}).scalars().all()
+    tariffs = get_tariff_index()
+    rows = []
+    for code in codes:
+        t = tariffs.resolve(code, f"{month_str}-28")
+        if t:
+            rows.append({**t, "unit": (t["unit"] or "").lower()})
 
     ws_total = 0.0
     sd_total = 0.0
@@ -1488,79 +1399,46 @@ def _mapped_totals_for_meter(meter_id, month_str, cons_kl):
 # ───────────────────────────────────────────────────────────────────────────────
 
 def _latest_electric_rate():
-    row = db.session.execute(text("""
-        SELECT t.rate
-        FROM bil_tariff t
-        WHERE lower(t.utility_type)='electricity' AND t.code='ElecRate'
-        ORDER BY date(t.effective_date) DESC
-        LIMIT 1
-    """)).fetchone()
-    return float(row.rate) if row and row.rate is not None else 0.0
+    return float(get_tariff_index().rate("ElecRate", utility="electricity") or 0.0)
 
 
 def _latest_tiers(utility_type: str):
-    rows = db.session.execute(text("""
-        SELECT
-          COALESCE(block_start,0)          AS block_start,
-          NULLIF(block_end,0)              AS block_end,
-          rate,
-          COALESCE(reduction_factor,1.0)   AS rf
-        FROM bil_tariff
-        WHERE lower(utility_type)=:u AND code LIKE 'Tier%%'
-        ORDER BY block_start ASC
-    """), {"u": utility_type.lower()}).mappings().all()
-
     out = []
-    for r in rows:
+    for r in get_tariff_index().tiers(utility_type, prefix="tier"):
         out.append({
             "block_start": float(r["block_start"] or 0.0),
-            "block_end":   float(r["block_end"]) if r["block_end"] is not None else None,
+            "block_end":   float(r["block_end"]) if r["block_end"] else None,
             "rate":        float(r["rate"] or 0.0),
-            "rf":          float(r["rf"] or 1.0),
+            "rf":          float(r["reduction_factor"] or 1.0),
         })
     return out
 
 
 def _apply_tiers(cons_kl: float, tiers, apply_reduction: bool):
-    remaining = float(cons_kl or 0.0)
-    total_due = 0.0
-    lines = []
+    # block_* are used as kL bands here (no per-day proration); overflow past the
+    # last finite tier is billed as "Tier N+"
+    table = TierTable(
+        widths=[(t["block_end"] - float(t["block_start"] or 0.0)) if t["block_end"] is not None else None
+                for t in tiers],
+        rates=[t["rate"] for t in tiers],
+        reductions=[t["rf"] for t in tiers],
+    )
+    alloc = allocate(cons_kl, 1, table, per_day=False, reduce=apply_reduction)
 
-    for i, t in enumerate(tiers, start=1):
-        if remaining <= 0:
-            break
-        lower = float(t["block_start"] or 0.0)
-        upper = t["block_end"]  # may be None
-        width = (upper - lower) if (upper is not None) else remaining
-        if width <= 0:
+    lines = []
+    for ln in alloc.lines(0):
+        if ln.qty <= 0:
             continue
-
-        take = min(remaining, width)
-        qty = take * (t["rf"] if apply_reduction else 1.0)
-        due = qty * float(t["rate"] or 0.0)
-        total_due += due
-
-        lines.append({
-            "label": f"Tier {i}" if upper is not None else f"Tier {i}+",
-            "qty": round(qty, 3),
-            "rate": float(t["rate"] or 0.0),
-            "due":  round(due, 2),
-        })
-        remaining -= take
-
-    if remaining > 0 and tiers:
-        last = tiers[-1]
-        qty = remaining * (last["rf"] if apply_reduction else 1.0)
-        due = qty * float(last["rate"] or 0.0)
-        total_due += due
+        open_ = ln.tier >= len(tiers) or tiers[ln.tier]["block_end"] is None
+        n = min(ln.tier + 1, len(tiers))
         lines.append({
-            "label": f"Tier {len(tiers)}+",
-            "qty": round(qty, 3),
-            "rate": float(last["rate"] or 0.0),
-            "due":  round(due, 2),
+            "label": f"Tier {n}+" if open_ else f"Tier {n}",
+            "qty": float(ln.billed),
+            "rate": ln.rate,
+            "due":  float(ln.amount),
         })
 
-    return round(total_due, 2), lines
+    return float(money(alloc.totals()[0])), lines
 
 
 def _mapped_extras_for_meter(meter_id: int, cons_kl: float):
@@ -1588,20 +1466,12 @@ def _mapped_extras_for_meter(meter_id: int, cons_kl: float):
         if not util or not code:
             continue
 
-        t = db.session.execute(text("""
-            SELECT rate,
-                   COALESCE(reduction_factor,1.0) AS rf,
-                   LOWER(COALESCE(unit,''))        AS unit
-            FROM bil_tariff
-            WHERE utility_type=:util AND code=:code
-            ORDER BY date(effective_date) DESC
-            LIMIT 1
-        """), {"util": util, "code": code}).mappings().first()
+        t = get_tariff_index().resolve(code, utility=util)
         if not t:
             continue
 
         rate = float(t["rate"] or 0.0)
-        rf   = float(t["rf"] or 1.0)
+        rf   = float(t["reduction_factor"] or 1.0)
         unit = (t["unit"] or "").lower()
 
         if unit in ("kl","per_kl") or code.lower().endswith("surcharge"):
@@ -1854,32 +1724,17 @@ def _fetch_consumption_rows(tenant_id, month_str):
     return [dict(r) for r in rows]
 
 def _elec_rate_for_month(month_str):
-    first, _, _ = _month_bounds(month_str)
-    row = db.session.execute(text("""
-        SELECT rate
-        FROM bil_tariff
-        WHERE utility_type='electricity' AND date(effective_date) <= :d
-        ORDER BY date(effective_date) DESC
-        LIMIT 1
-    """), {"d": first}).fetchone()
-    return float(row[0]) if row else 0.0
+    return get_effective_tariff_rate("electricity", month_str) or 0.0
 
 def _tariffs_for(utility_type, month_str):
-    first, _, _ = _month_bounds(month_str)
-    rows = db.session.execute(text("""
-        SELECT code, rate, block_start, block_end, COALESCE(reduction_factor, NULL) AS rf
-        FROM bil_tariff
-        WHERE utility_type = :ut AND date(effective_date) <= :d
-        ORDER BY block_start ASC, block_end ASC
-    """), {"ut": utility_type, "d": first}).mappings().all()
     out = []
-    for r in rows:
+    for r in get_tariff_index().tiers(utility_type, month_first(month_str), prefix=None):
         out.append({
             "code": r["code"],
             "rate": float(r["rate"]),
             "start": float(r["block_start"] or 0.0),  # liters per day
             "end": float(r["block_end"] or 0.0),
-            "rf": None if r["rf"] is None else float(r["rf"]),
+            "rf": r["reduction_factor_raw"],
         })
     return out
 
@@ -1900,34 +1755,18 @@ def _alloc_kl_by_tier(cons_kl, days, tiers):
     """
     tiers: list with .start and .end in L/day, .rate per kL
     Convert daily bands to monthly kL capacity and allocate.
-    Returns list of (code, used_kl, rate, rf)
+    Returns list of (code, used_kl, rate, rf); overflow past a finite last
+    tier is added to that tier.
     """
-    if not cons_kl or cons_kl <= 0:
-        return [(t["code"], 0.0, t["rate"], t["rf"]) for t in tiers]
-
-    left = float(cons_kl)
-    out = []
-    for t in tiers:
-        # band size (kL) for the period
-        daily_from = (t["start"] or 0.0) / 1000.0
-        daily_to   = (t["end"]   or 0.0) / 1000.0
-        if daily_to <= 0:  # open-ended last tier
-            cap = max(left, 0.0)
-        else:
-            cap = max((daily_to - daily_from) * float(days), 0.0)
-
-        used = min(left, cap)
-        out.append((t["code"], used, t["rate"], t["rf"]))
-        left -= used
-        if left <= 1e-9:
-            # still need to append remaining tiers with 0 to keep shape stable
-            pass
-    # If consumption exceeded provided caps and last tier has finite end,
-    # treat overflow at last tier’s rate:
-    if left > 1e-9 and tiers:
-        last = tiers[-1]
-        out[-1] = (last["code"], out[-1][1] + left, last["rate"], last["rf"])
-    return out
+    table = TierTable(
+        widths=[(t["end"] - (t["start"] or 0.0)) if (t["end"] or 0.0) > 0 else None for t in tiers],  # end 0 = open
+        rates=[t["rate"] for t in tiers],
+    )
+    alloc = allocate(cons_kl or 0.0, days, table)
+    used = alloc.qty[0].tolist()
+    if tiers:
+        used[-1] += float(alloc.over_qty[0])
+    return [(t["code"], u, t["rate"], t["rf"]) for t, u in zip(tiers, used)]
 
 def _sum_ws(cons_kl, days, month_str):
     tiers = _tariffs_for("water", month_str)
@@ -2010,51 +1849,28 @@ def build_metsoa_rows(tenant_id, month_str):
             # Per-kL surcharge (only if mapped). If cons = 0 → 0
             ws_surcharge = 0.0
             if ("WSSurcharge", "water") in map_codes or ("WSSurcharge", "") in map_codes:
-                row = db.session.execute(text("""
-                    SELECT rate FROM bil_tariff
-                    WHERE code='WSSurcharge'
-                    ORDER BY date(effective_date) DESC LIMIT 1
-                """)).fetchone()
-                if row:
-                    ws_surcharge = cons * float(row[0])
+                rate = get_tariff_index().rate("WSSurcharge")
+                if rate is not None:
+                    ws_surcharge = cons * rate
 
             sd_surcharge = 0.0
             if ("SDSurcharge", "sanitation") in map_codes or ("SDSurcharge", "") in map_codes:
-                row = db.session.execute(text("""
-                    SELECT rate FROM bil_tariff
-                    WHERE code='SDSurcharge'
-                    ORDER BY date(effective_date) DESC LIMIT 1
-                """)).fetchone()
-                if row:
-                    sd_surcharge = cons * float(row[0])
+                rate = get_tariff_index().rate("SDSurcharge")
+                if rate is not None:
+                    sd_surcharge = cons * rate
 
             # Fixed charges (only if mapped)
             wll = 0.0
             if ("WaterLossLevy", "water") in map_codes or ("WaterLossLevy", "") in map_codes:
-                row = db.session.execute(text("""
-                    SELECT rate FROM bil_tariff WHERE code='WaterLossLevy'
-                    ORDER BY date(effective_date) DESC LIMIT 1
-                """)).fetchone()
-                if row:
-                    wll = float(row[0])
+                wll = get_tariff_index().rate("WaterLossLevy", default=0.0)
 
             refuse = 0.0
             if ("RefuseBin", "sanitation") in map_codes or ("RefuseBin", "") in map_codes:
-                row = db.session.execute(text("""
-                    SELECT rate FROM bil_tariff WHERE code='RefuseBin'
-                    ORDER BY date(effective_date) DESC LIMIT 1
-                """)).fetchone()
-                if row:
-                    refuse = float(row[0])
+                refuse = get_tariff_index().rate("RefuseBin", default=0.0)
 
             mgmt = 0.0
             if ("MgmtFee", "management") in map_codes or ("MgmtFee", "") in map_codes:
-                row = db.session.execute(text("""
-                    SELECT rate FROM bil_tariff WHERE code='MgmtFee'
-                    ORDER BY date(effective_date) DESC LIMIT 1
-                """)).fetchone()
-                if row:
-                    mgmt = float(row[0])
+                mgmt = get_tariff_index().rate("MgmtFee", default=0.0)
 
             ws_total_full = ws_total + ws_surcharge + wll + mgmt
             sd_total_full = sd_total + sd_surcharge + refuse
@@ -2160,23 +1976,11 @@ def _month_end(month_str: str) -> str:
 
 def _latest_tariff_row(code: str, utility: str, month_str: str):
     """
-    Returns a single mapping row from bil_tariff for (utility, code)
-    with effective_date <= month_end, most recent first.
-    Fields expected: rate, reduction_factor (nullable), block_start, block_end, unit
+    Returns a single row of bil_tariff for (utility, code) in effect during
+    the month (effective_date <= month end), from the cached tariff index.
+    Fields: rate, reduction_factor (defaults to 1.0), block_start, block_end, unit
     """
-    end_key = _month_end(month_str)
-    row = db.session.execute(text("""
-        SELECT id, utility_type, code, rate,
-               COALESCE(reduction_factor, 1.0) AS reduction_factor,
-               block_start, block_end, unit, effective_date
-        FROM bil_tariff
-        WHERE utility_type = :ut
-          AND code = :code
-          AND effective_date <= :end_key
-        ORDER BY effective_date DESC
-        LIMIT 1
-    """), {"ut": utility, "code": code, "end_key": end_key}).mappings().first()
-    return row
+    return get_tariff_index().resolve(code, month_last(month_str), utility=utility)
 
 
 def _tier_tariffs_for_utility(utility: str, month_str: str):
@@ -2184,18 +1988,7 @@ def _tier_tariffs_for_utility(utility: str, month_str: str):
     Collect tiered tariff rows (ordered by block_end asc) for 'water' or 'sanitation'.
     Expects rows for codes like Tier1_W&S ... or Tier1_SD ...
     """
-    end_key = _month_end(month_str)
-    rows = db.session.execute(text("""
-        SELECT code, rate,
-               COALESCE(reduction_factor, 1.0) AS reduction_factor,
-               block_start, block_end, unit
-        FROM bil_tariff
-        WHERE utility_type = :ut
-          AND code LIKE 'Tier%_%'
-          AND effective_date <= :end_key
-        ORDER BY block_end ASC
-    """), {"ut": utility, "end_key": end_key}).mappings().all()
-    return rows
+    return get_tariff_index().tiers(utility, month_last(month_str), prefix="tier", order="block_end")
 
 def _map_rows_for_meter(meter_id: int, month_str: str, utility_type: str):
     """
@@ -2243,54 +2036,37 @@ def _map_rows_for_meter(meter_id: int, month_str: str, utility_type: str):
 def _alloc_tiers(cons_kl: float, days: int, tier_rows):
     """
     Allocate 'cons_kl' into progressive tiers where each tier cap is:
-       ((block_end - block_start) liters/day) * days / 1000
+       ((block_end - max(previous block_end, block_start)) liters/day) * days / 1000
     Returns (total_amount, breakdown_list)
       breakdown_list items: { "code", "cons_kl", "rate", "amount" }
     """
-    days = max(1, int(days or 0))
-    remaining = float(cons_kl or 0.0)
-    total = 0.0
-    breakdown = []
-
-    prev_end_lday = 0.0
+    # liters/day bounds → incremental width per tier; tiers that don't extend
+    # past the previous block_end get no allowance
+    widths, prev_end_lday = [], 0.0
     for tr in tier_rows:
-        # liters/day bounds → per-period kL cap for THIS tier (incremental)
-        bs = float(tr.get("block_start") or 0.0)   # liters/day
-        be = float(tr.get("block_end")   or 0.0)   # liters/day
-        if be <= prev_end_lday:
-            continue
-        span_lday = be - max(prev_end_lday, bs)    # liters/day in this tier
-        cap_kl = (span_lday * days) / 1000.0       # kL allowance for this tier
-        take = min(remaining, max(0.0, cap_kl))
-        if take > 0:
-            rate = float(tr.get("rate") or 0.0)
-            amt = round(take * rate, 2)
-            total += amt
-            breakdown.append({
-                "code": tr.get("code"),
-                "cons_kl": round(take, 3),
-                "rate": rate,
-                "amount": amt,
-            })
-            remaining -= take
-        prev_end_lday = be
-        if remaining <= 0.000001:
-            break
+        bs = float(tr.get("block_start") or 0.0)
+        be = float(tr.get("block_end") or 0.0)
+        widths.append(be - max(prev_end_lday, bs) if be > prev_end_lday else 0.0)
+        prev_end_lday = max(prev_end_lday, be)
+    table = TierTable(widths=widths, rates=[tr.get("rate") for tr in tier_rows])
+    alloc = allocate(cons_kl, days, table)
 
-    # If consumption exceeds highest tier cap, treat excess at last tier rate.
-    if remaining > 0 and tier_rows:
-        last = tier_rows[-1]
-        rate = float(last.get("rate") or 0.0)
-        amt = round(remaining * rate, 2)
-        total += amt
+    breakdown = []
+    total = Decimal("0")
+    for ln in alloc.lines(0):
+        if ln.qty <= 0:
+            continue
+        code = tier_rows[min(ln.tier, len(tier_rows) - 1)].get("code")
+        total += ln.amount
         breakdown.append({
-            "code": f"{last.get('code')}+",
-            "cons_kl": round(remaining, 3),
-            "rate": rate,
-            "amount": amt,
+            # excess over the highest tier cap is billed at the last tier rate
+            "code": code if ln.tier < len(tier_rows) else f"{code}+",
+            "cons_kl": float(ln.qty),
+            "rate": ln.rate,
+            "amount": float(ln.amount),
         })
 
-    return round(total, 2), breakdown
+    return float(total), breakdown
 
 
 def get_electricity_rate_for_month(month_str: str):
@@ -2405,15 +2181,14 @@ def get_base_rows_from_copy():
     """
     return db.session.execute(text(q)).mappings().all()
 
-def _tariff_map():
+def _tariff_map(month_str: str | None = None):
     """
-    Returns { code: {rate: float, reduction_factor: float|None} } from bil_tariff.
+    Returns { code: {rate: float, rf: float} } - the version of each code
+    effective by the 1st of month_str (None: the latest), rf 0 when unset.
     """
-    rows = db.session.execute(text("""
-        SELECT code, rate, COALESCE(reduction_factor, 0) AS rf
-        FROM bil_tariff
-    """)).mappings().all()
-    return {r["code"]: {"rate": float(r["rate"]), "rf": float(r["rf"] or 0)} for r in rows}
+    rows = get_tariff_index().by_code(month_first(month_str) if month_str else None)
+    return {code: {"rate": float(r["rate"] or 0), "rf": float(r["reduction_factor_raw"] or 0)}
+            for code, r in rows.items()}
 
 
 
@@ -2522,18 +2297,9 @@ def calc_ws_sd_totals(
             return Decimal("0"), Decimal("1")
         if code in _cache:
             return _cache[code]
-        row = db.session.execute(
-            text("""
-                SELECT rate, COALESCE(reduction_factor,1.0) AS rf
-                FROM bil_tariff
-                WHERE code = :c
-                ORDER BY date(effective_date) DESC
-                LIMIT 1
-            """),
-            {"c": code},
-        ).mappings().first()
+        row = get_tariff_index().resolve(code)
         rate = _D(row["rate"]) if row else Decimal("0")
-        rf   = _D(row["rf"])   if row else Decimal("1")
+        rf   = _D(row["reduction_factor"]) if row else Decimal("1")
         _cache[code] = (rate, rf)
         return rate, rf
 
@@ -2660,380 +2426,24 @@ def calc_ws_sd_totals(
         "sd_lines": sd_lines if want_breakdown else [],
     }
 
-    # ---- helpers -------------------------------------------------------------
-    def _tariff(code: str):
-        row = db.session.execute(text("""
-            SELECT rate, COALESCE(reduction_factor,1.0) AS rf
-            FROM bil_tariff
-            WHERE code = :c
-            ORDER BY date(effective_date) DESC
-            LIMIT 1
-        """), {"c": code}).mappings().first()
-        if not row:
-            return 0.0, 1.0
-        return float(row["rate"] or 0.0), float(row["rf"] or 1.0)
-
-    def _chunk(cons: float, low: float, high: float) -> float:
-        # amount of cons that falls in [low, high)
-        if cons <= low:
-            return 0.0
-        return max(0.0, min(cons, high) - low)
-
-    # ---- inputs --------------------------------------------------------------
-    cons = float(int(consumption_kl or 0))  # force integer kL
-    ws_lines, sd_lines = [], []
-
-    # Map rows for this meter (enabled only). Dates are already normalized.
-    map_rows = db.session.execute(text("""
-        SELECT charge_code, utility_type, COALESCE(is_enabled,1) AS is_enabled
-        FROM bil_meter_charge_map
-        WHERE meter_id = :mid AND COALESCE(is_enabled,1) = 1
-        ORDER BY
-          CASE charge_code
-            WHEN 'WSSurcharge'   THEN 1
-            WHEN 'SDSurcharge'   THEN 2
-            WHEN 'WaterLossLevy' THEN 3
-            WHEN 'RefuseBin'     THEN 4
-            WHEN 'MgmtFee'       THEN 5
-            WHEN 'WS_Tiered'     THEN 10
-            WHEN 'SD_Tiered'     THEN 11
-            ELSE 99
-          END
-    """), {"mid": meter_id}).mappings().all()
-
-    # Quick lookup so we can ask "does this meter have X?"
-    has = {r["charge_code"]: True for r in map_rows}
-
-    ws_total = 0.0
-    sd_total = 0.0
-
-    # ---- tiered WATER (W&S) --------------------------------------------------
-    if has.get("WS_Tiered"):
-        tiers = [
-            (0.0,   200.0,  "Tier1_W&S"),
-            (200.0, 833.0,  "Tier2_W&S"),
-            (833.0, 1000.0, "Tier3_W&S"),
-            (1000.0,1500.0, "Tier4_W&S"),
-        ]
-        for low, high, code in tiers:
-            vol = _chunk(cons, low, high)
-            if vol <= 0:
-                continue
-            rate, _rf = _tariff(code)
-            due = round(vol * rate, 2)
-            ws_total += due
-            if want_breakdown:
-                ws_lines.append({"line": code, "cons": vol, "rate": rate, "due": due})
-
-    # ---- tiered SANITATION (reduced %) --------------------------------------
-    if has.get("SD_Tiered"):
-        tiers_sd = [
-            (0.0,   200.0,  "Tier1_SD"),
-            (200.0, 833.0,  "Tier2_SD"),
-            (833.0, 1000.0, "Tier3_SD"),
-            (1000.0,1500.0, "Tier4_SD"),
-        ]
-        for low, high, code in tiers_sd:
-            vol = _chunk(cons, low, high)
-            if vol <= 0:
-                continue
-            rate, rf = _tariff(code)  # rf is the reduction fraction (e.g., 0.95, 0.75, 0.65)
-            red_vol = vol * rf
-            due = round(red_vol * rate, 2)
-            sd_total += due
-            if want_breakdown:
-                sd_lines.append({"line": f"{code} @ {rf:.2f}", "cons": red_vol, "rate": rate, "due": due})
-
-    # ---- fixed/linear extras -------------------------------------------------
-    if include_fixed:
-        # Surcharges scale with consumption (0 → 0)
-        if has.get("WSSurcharge"):
-            rate, _ = _tariff("WSSurcharge")
-            due = round(cons * rate, 2)
-            ws_total += due
-            if want_breakdown:
-                ws_lines.append({"line": "Surcharge", "cons": cons, "rate": rate, "due": due})
-
-        if has.get("SDSurcharge"):
-            rate, _ = _tariff("SDSurcharge")
-            due = round(cons * rate, 2)
-            sd_total += due
-            if want_breakdown:
-                sd_lines.append({"line": "Surcharge", "cons": cons, "rate": rate, "due": due})
-
-        # Fixed monthly items
-        if has.get("WaterLossLevy"):
-            rate, _ = _tariff("WaterLossLevy")
-            due = round(rate, 2)
-            ws_total += due
-            if want_breakdown:
-                ws_lines.append({"line": "Water Loss Levy", "cons": 0, "rate": rate, "due": due})
-
-        if has.get("MgmtFee"):
-            rate, _ = _tariff("MgmtFee")
-            due = round(rate, 2)
-            ws_total += due
-            if want_breakdown:
-                ws_lines.append({"line": "Monthly Management Fee", "cons": 0, "rate": rate, "due": due})
-
-        if has.get("RefuseBin"):
-            rate, _ = _tariff("RefuseBin")
-            due = round(rate, 2)
-            sd_total += due
-            if want_breakdown:
-                sd_lines.append({"line": "Refuse Bins", "cons": 0, "rate": rate, "due": due})
-
-    result = {
-        "ws_amount": round(ws_total, 2),
-        "sd_amount": round(sd_total, 2),
-        "water_cost": round(ws_total + sd_total, 2),
-    }
-    if want_breakdown:
-        result["ws_lines"] = ws_lines
-        result["sd_lines"] = sd_lines
-    return result
-
-# app/admin/billing/helpers_recurring.py
-
-#from app.models import BilTenantLedger, BilRecurringItem  # adjust import paths
-
-def _first_valid_post_date(year: int, month: int, day_of_month: int) -> date:
-    last_day = calendar.monthrange(year, month)[1]
-    dom = min(max(1, day_of_month), last_day)  # clamp
-    return date(year, month, dom)
-'''
-def ensure_recurring_materialized(tenant_id: int, period_month: str):
-    """
-    Ensure all active recurring items for tenant are posted into the ledger for period_month (YYYY-MM).
-    Rent will be locked and non-editable.
-    """
-    # Parse period
-    y, m = [int(x) for x in period_month.split("-")]
-
-    # Load active recurring items that fall within the month
-    recurs = (
-        db.session.query(BilRecurringItem)
-        .filter(
-            BilRecurringItem.tenant_id == tenant_id,
-            BilRecurringItem.is_active == 1,
-        )
-        .all()
-    )
-
-    for r in recurs:
-        # Check if r applies to this month
-        start_ym = tuple(map(int, r.start_month.split("-")))
-        end_ym = tuple(map(int, r.end_month.split("-"))) if r.end_month else None
-        this_ym = (y, m)
-
-        if this_ym < start_ym:
-            continue
-        if end_ym and this_ym > end_ym:
-            continue
-
-        # Compose a unique source key
-        source_key = f"recurring:{(r.name or 'item').lower()}:{r.id}:{period_month}"
-
-        # Already posted?
-        existing = (
-            db.session.query(BilTenantLedger)
-            .filter(
-                BilTenantLedger.tenant_id == tenant_id,
-                BilTenantLedger.period_month == period_month,
-                BilTenantLedger.source_key == source_key,
-            )
-            .first()
-        )
-        if existing:
-            continue
-
-        # Compute posting date in this month
-        post_date = _first_valid_post_date(y, m, r.day_of_month)
-
-        # Insert locked ledger row
-        row = BilTenantLedger(
-            tenant_id=tenant_id,
-            item_date=post_date,
-            description=r.name,
-            kind=r.kind,                        # 'charge'
-            charge_amount=r.amount if r.kind == 'charge' else None,
-            payment_amount=r.amount if r.kind == 'credit' else None,
-            ref=r.source_code,
-            period_month=period_month,
-            source="recurring",
-            source_key=source_key,
-            locked=1,                           # <- cannot be edited
-        )
-        db.session.add(row)
+# --- recurring materializer: per-tenant entry points of app/jobs/month_posting.py ---
 
-    db.session.commit()
-'''
 def materialize_recurring_for_month_sql(tenant_id: int, month_ym: str):
     """
     Ensure recurring rows are inserted into bil_tenant_ledger for this month.
-    No ORM, only SQL.
+    No ORM, only SQL (one INSERT .. SELECT).
     """
-    from datetime import date
-    import calendar
-
-    y, m = [int(x) for x in month_ym.split("-")]
-    start = date(y, m, 1)
-    last_day = calendar.monthrange(y, m)[1]
-    end = date(y, m, last_day)
-
-    recurs = db.session.execute(
-        text("""
-            SELECT id, description, kind, amount, day_of_month
-            FROM bil_tenant_recurring
-            WHERE tenant_id=:tid AND is_active=1
-        """),
-        {"tid": tenant_id},
-    ).mappings().all()
-
-    for r in recurs:
-        auto_ref = f"AUTO:REC:{r['id']}:{month_ym}"
-
-        exists = db.session.execute(
-            text("""
-                SELECT id FROM bil_tenant_ledger
-                WHERE tenant_id=:tid AND ref=:ref
-                  AND date(txn_date) BETWEEN date(:start) AND date(:end)
-                LIMIT 1
-            """),
-            {"tid": tenant_id, "ref": auto_ref,
-             "start": start.isoformat(), "end": end.isoformat()},
-        ).first()
-        if exists:
-            continue
-
-        dom = min(max(1, r["day_of_month"]), last_day)
-        post_date = date(y, m, dom).isoformat()
-        amt = float(r["amount"] or 0.0)
-        signed_amt = amt if r["kind"] == "charge" else -amt
-
-        db.session.execute(
-            text("""
-                INSERT INTO bil_tenant_ledger
-                    (tenant_id, txn_date, description, kind, ref, amount)
-                VALUES (:tid, :txn_date, :desc, :kind, :ref, :amount)
-            """),
-            {
-                "tid": tenant_id,
-                "txn_date": post_date,
-                "desc": r["description"],
-                "kind": r["kind"],
-                "ref": auto_ref,
-                "amount": signed_amt,
-            },
-        )
-
-    db.session.commit()
-
-##
-# --- begin: SQL-only recurring materializer (no ORM models) ---
-
-
-
-def _bh_month_bounds(ym: str):
-    """Return (start_date_str, end_date_str) for 'YYYY-MM'."""
-    y, m = [int(x) for x in ym.split("-")]
-    start = date(y, m, 1).isoformat()
-    end = date(y, m, calendar.monthrange(y, m)[1]).isoformat()
-    return start, end
+    from app.jobs.month_posting import post_month
+    return post_month(month_ym, tenant_ids=[tenant_id], sources=("recurring",))
 
-def _bh_clamp_day(y: int, m: int, d: int) -> str:
-    """Clamp day-of-month into the month and return ISO date."""
-    last = calendar.monthrange(y, m)[1]
-    dom = min(max(1, int(d or 1)), last)
-    return date(y, m, dom).isoformat()
 
 def ensure_recurring_materialized(tenant_id: int, period_month: str) -> None:
     """
-    Pure-SQL.
     Ensures each ACTIVE recurring item is posted exactly once into bil_tenant_ledger
     for the given month (YYYY-MM). Uses deterministic ref 'AUTO:REC:<rec_id>:YYYY-MM'
     to prevent duplicates. Charges are +amount; credits/payments are -amount.
     """
-    y, m = [int(x) for x in period_month.split("-")]
-    month_start, month_end = _bh_month_bounds(period_month)
-
-    # Load active recurring item definitions (Rent etc.)
-    recurs = db.session.execute(
-        text("""
-            SELECT
-              id,
-              description,           -- e.g., 'Rent'
-              kind,                  -- 'charge' or 'credit'/'payment'
-              amount,
-              day_of_month,
-              is_active,
-              COALESCE(start_month, '') AS start_month, -- optional 'YYYY-MM'
-              COALESCE(end_month,   '') AS end_month    -- optional 'YYYY-MM'
-            FROM bil_tenant_recurring
-            WHERE tenant_id = :tid AND is_active = 1
-        """),
-        {"tid": tenant_id},
-    ).mappings().all()
-
-    for r in recurs:
-        # Honor optional start/end month windows
-        this_ym = (y, m)
-        if r["start_month"]:
-            sy, sm = [int(x) for x in r["start_month"].split("-")]
-            if this_ym < (sy, sm):
-                continue
-        if r["end_month"]:
-            ey, em = [int(x) for x in r["end_month"].split("-")]
-            if this_ym > (ey, em):
-                continue
-
-        rec_id   = r["id"]
-        desc     = r["description"]
-        kind     = r["kind"]                      # 'charge' or 'credit'/'payment'
-        amt      = float(r["amount"] or 0.0)
-        post_dt  = _bh_clamp_day(y, m, r["day_of_month"])
-        auto_ref = f"AUTO:REC:{rec_id}:{period_month}"
-
-        # Already posted for this month?
-        exists = db.session.execute(
-            text("""
-                SELECT id
-                FROM bil_tenant_ledger
-                WHERE tenant_id = :tid
-                  AND ref = :ref
-                  AND date(txn_date) BETWEEN date(:start_d) AND date(:end_d)
-                LIMIT 1
-            """),
-            {
-                "tid": tenant_id, "ref": auto_ref,
-                "start_d": month_start, "end_d": month_end
-            },
-        ).first()
-        if exists:
-            continue
-
-        # Signed amount: charges positive; credits/payments negative
-        signed_amt = amt if kind == "charge" else -abs(amt)
-
-        # Insert actual ledger row
-        db.session.execute(
-            text("""
-                INSERT INTO bil_tenant_ledger
-                    (tenant_id, txn_date, description, kind, ref, amount)
-                VALUES
-                    (:tid, :txn_date, :desc, :kind, :ref, :amount)
-            """),
-            {
-                "tid": tenant_id,
-                "txn_date": post_dt,
-                "desc": desc,
-                "kind": kind,
-                "ref": auto_ref,  # marker used by UI to show "Locked"
-                "amount": signed_amt,
-            },
-        )
-
-    db.session.commit()
+    materialize_recurring_for_month_sql(tenant_id, period_month)
 
 # --- end: SQL-only recurring materializer ---
 
@@ -3,6 +3,8 @@
 # Month helpers
 from sqlalchemy import text
 from app.extensions import db
+from app.utils.tariff_index import get_tariff_index, month_last
+from app.utils.tier_kernel import TierTable, allocate, money
 
 def _month_bounds(month_str):
     # month_str: 'YYYY-MM'
@@ -14,20 +16,12 @@ def _month_bounds(month_str):
         end = f"{y:04d}-{m+1:02d}-01"
     return start, end
 
-# Tariff lookup by code & month (latest <= month)
+# Tariff lookup by code & month (latest version effective during the month)
 def _tariff_for_code_month(code, month_str):
-    start, end = _month_bounds(month_str)
-    row = db.session.execute(text("""
-        SELECT id, utility_type, code, description, rate, block_start, block_end,
-               effective_date, COALESCE(reduction_factor,1.0) AS reduction_factor,
-               COALESCE(unit,'') AS unit
-        FROM bil_tariff
-        WHERE code = :code
-          AND date(effective_date) < :end
-        ORDER BY date(effective_date) DESC
-        LIMIT 1
-    """), {"code": code, "end": end}).mappings().first()
-    return row
+    t = get_tariff_index().resolve(code, month_last(month_str))
+    if t is not None:
+        t["unit"] = t["unit"] or ""
+    return t
 
 # Pull SD reduction from your table (preferred), else from bil_tariff.reduction_factor, else 1.0
 def _sd_reduction_for_code(code, month_str):
@@ -179,92 +173,62 @@ def build_metsoa_rows(tenant_id, month_str):
     def _month_end(s):  # 'YYYY-MM' -> 'YYYY-MM-31' (safe for <= comparisons on 'YYYY-MM-DD')
         return f"{s}-31"
 
+    tariffs = get_tariff_index()
+
     def _tariff_by_code(code, utility_type, month_end):
-        row = db.session.execute(text("""
-            SELECT code, utility_type, description, rate, block_start, block_end, effective_date,
-                   COALESCE(reduction_factor, 1.0) AS reduction_factor,
-                   COALESCE(unit, '') AS unit
-            FROM bil_tariff
-            WHERE code = :code
-              AND utility_type = :ut
-              AND effective_date <= :me
-            ORDER BY effective_date DESC
-            LIMIT 1
-        """), {"code": code, "ut": utility_type, "me": month_end}).mappings().first()
+        row = tariffs.resolve(code, month_end, utility=utility_type)
+        if row is not None:
+            row["unit"] = row["unit"] or ""
         return row
 
     def _elec_rate(month_end):
-        r = db.session.execute(text("""
-            SELECT rate
-            FROM bil_tariff
-            WHERE utility_type='electricity' AND code='ElecRate'
-              AND effective_date <= :me
-            ORDER BY effective_date DESC
-            LIMIT 1
-        """), {"me": month_end}).scalar()
-        return float(r or 0)
+        return float(tariffs.rate("ElecRate", month_end, utility="electricity") or 0)
 
     def _water_tiers(utility_type, month_end):
-        # Pull all Tier* rows for the utility (water or sanitation), ordered by block_end (per-day liters)
-        tiers = db.session.execute(text("""
-            SELECT code, rate, block_start, block_end,
-                   COALESCE(reduction_factor,1.0) AS reduction_factor
-            FROM bil_tariff
-            WHERE utility_type = :ut
-              AND code LIKE 'Tier%_%'
-              AND effective_date <= :me
-            ORDER BY block_end ASC
-        """), {"ut": utility_type, "me": month_end}).mappings().all()
-        return tiers
+        # Tier* rows for the utility (water or sanitation), ordered by block_end (per-day liters)
+        return tariffs.tiers(utility_type, month_end, prefix="tier", order="block_end")
 
     def _alloc_tiers(cons_kl, days, tiers, apply_reduction=False):
         """Allocate a monthly consumption (kL) across per-day tier bands.
            tier band capacity for period = (block_end - prev_block_end) liters/day * days / 1000
         """
-        remaining = float(cons_kl or 0)
-        prev_end = 0.0
-        splits = []
+        widths, prev_end = [], 0.0
         for t in tiers:
-            band_lpd = max(0.0, float(t["block_end"] or 0) - float(prev_end))
-            cap_kl = (band_lpd * float(days or 0)) / 1000.0
-            take = min(remaining, cap_kl)
-            rem_before = remaining
-            remaining -= take
-            amt = float(t["rate"] or 0)
-            red = float(t["reduction_factor"] or 1.0) if apply_reduction else 1.0
-            # SD uses reduced volume for billing
-            bill_kl = take * red
-            due = bill_kl * amt
+            widths.append(max(0.0, float(t["block_end"] or 0) - prev_end))
+            prev_end = float(t["block_end"] or prev_end)
+        table = TierTable(
+            widths=widths,
+            rates=[t["rate"] for t in tiers],
+            reductions=[t["reduction_factor"] or 1.0 for t in tiers],
+        )
+        alloc = allocate(cons_kl, days, table, reduce=apply_reduction)
+        scale = max(1, int(days or 0)) / 1000.0
+
+        splits = []
+        for j, t in enumerate(tiers):
+            if not alloc.qty[0, j]:
+                continue
             splits.append({
                 "code": t["code"],
-                "band_cap_kl": cap_kl,
-                "take_kl": take,
-                "bill_kl": bill_kl,
-                "rate": amt,
-                "reduction": red,
-                "due": due,
+                "band_cap_kl": widths[j] * scale,
+                "take_kl": float(alloc.qty[0, j]),
+                "bill_kl": float(alloc.billed[0, j]),
+                "rate": float(table.rates[j]),
+                "reduction": float(table.reductions[j]) if apply_reduction else 1.0,
+                "due": float(alloc.amount[0, j]),
             })
-            prev_end = float(t["block_end"] or prev_end)
-            if remaining <= 1e-9:
-                break
         # If consumption exceeds last tier cap, bill the overflow at last tier rate (and reduction if SD)
-        if remaining > 1e-9 and tiers:
-            t = tiers[-1]
-            amt = float(t["rate"] or 0)
-            red = float(t["reduction_factor"] or 1.0) if apply_reduction else 1.0
-            bill_kl = remaining * red
-            due = bill_kl * amt
+        if alloc.over_qty[0] > 0 and tiers:
             splits.append({
-                "code": t["code"] + "_OVR",
+                "code": tiers[-1]["code"] + "_OVR",
                 "band_cap_kl": 0.0,
-                "take_kl": remaining,
-                "bill_kl": bill_kl,
-                "rate": amt,
-                "reduction": red,
-                "due": due,
+                "take_kl": float(alloc.over_qty[0]),
+                "bill_kl": float(alloc.over_billed[0]),
+                "rate": float(table.rates[-1]),
+                "reduction": float(table.reductions[-1]) if apply_reduction else 1.0,
+                "due": float(alloc.over_amount[0]),
             })
-            remaining = 0.0
-        total_due = sum(x["due"] for x in splits)
+        total_due = float(money(alloc.totals()[0]))
         return splits, total_due
 
     def _mapped_extras(meter_id, cons_kl, month_end):
@@ -281,15 +245,7 @@ def build_metsoa_rows(tenant_id, month_str):
 
         extras = []
         for mrow in mm:
-            t = db.session.execute(text("""
-                SELECT code, description, rate, COALESCE(unit,'') AS unit
-                FROM bil_tariff
-                WHERE code = :code
-                  AND utility_type = :ut
-                  AND effective_date <= :me
-                ORDER BY effective_date DESC
-                LIMIT 1
-            """), {"code": mrow["charge_code"], "ut": mrow["utility_type"], "me": month_end}).mappings().first()
+            t = _tariff_by_code(mrow["charge_code"], mrow["utility_type"], month_end)
             if not t:
                 continue
             unit = (t["unit"] or "").lower()
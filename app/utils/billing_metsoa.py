@@ -3,6 +3,8 @@
 
 from sqlalchemy import text
 from app.extensions import db
+from app.utils.tariff_index import get_tariff_index, month_first
+from app.utils.tier_kernel import WINDOW, TierTable, allocate, money
 
 def _row_to_dict(r):
     return {k: getattr(r, k) if hasattr(r, k) else r[k] for k in r.keys()}
@@ -10,33 +12,15 @@ def _row_to_dict(r):
 def _get_tariffs(utility_type: str, month_str: str):
     """
     Returns tariff rows for a utility, effective for month_str (YYYY-MM),
-    ordered by block_start (for tiered pricing).
-    Columns expected on bil_tariff:
-      utility_type, code, description, rate, block_start, block_end, effective_date, reduction_factor (nullable), unit
+    ordered by block_start (for tiered pricing). One row (the latest version)
+    per code, resolved from the cached tariff index.
+    Keys: utility_type, code, description, rate, block_start, block_end,
+          effective_date, reduction_factor (defaults to 1.0), unit
     """
-    sql = text("""
-        SELECT utility_type, code, description, rate, block_start, block_end,
-               effective_date, COALESCE(reduction_factor, 1.0) AS reduction_factor, unit
-        FROM bil_tariff
-        WHERE utility_type = :u
-          AND date(substr(:m,1,4) || '-' || substr(:m,6,2) || '-01') >= date(effective_date)
-        ORDER BY CASE WHEN block_start IS NULL THEN 999999 ELSE block_start END
-    """)
-    rows = db.session.execute(sql, {"u": utility_type, "m": month_str}).fetchall()
-    return [ _row_to_dict(r) for r in rows ]
+    return get_tariff_index().tiers(utility_type, month_first(month_str), prefix=None)
 
 def _get_tariff_by_code(code: str, month_str: str):
-    sql = text("""
-        SELECT utility_type, code, description, rate, block_start, block_end,
-               effective_date, COALESCE(reduction_factor, 1.0) AS reduction_factor, unit
-        FROM bil_tariff
-        WHERE code = :c
-          AND date(substr(:m,1,4) || '-' || substr(:m,6,2) || '-01') >= date(effective_date)
-        ORDER BY date(effective_date) DESC
-        LIMIT 1
-    """)
-    r = db.session.execute(sql, {"c": code, "m": month_str}).fetchone()
-    return None if not r else _row_to_dict(r)
+    return get_tariff_index().resolve(code, month_first(month_str))
 
 def get_electricity_rate_for_month(month_str: str):
     # Prefer explicit ElecRate by code; fallback to first electricity row.
@@ -71,24 +55,34 @@ def fetch_consumption_for_month(month_str: str):
     rows = db.session.execute(sql, {"m": month_str}).fetchall()
     return [ _row_to_dict(r) for r in rows ]
 
-def _daily_liters(cons_kL: float, days: int) -> float:
-    if not days or days <= 0:
-        return 0.0
-    return (cons_kL * 1000.0) / float(days)
-
-def _tier_kL_for_daily_window(daily_L: float, days: int, start_L: float, end_L: float|None) -> float:
+def _window_lines(cons_kL: float, days: int, tiers, reduce: bool):
     """
-    Allocate kL to a [start_L, end_L] liters/day window for the given daily_L and days.
-    If end_L is None => open-ended upper tier.
+    Tier lines for one meter: each tier gets the part of the daily use that
+    falls in its [block_start, block_end] L/day window (block_end None/0 = open).
     """
-    if daily_L <= start_L:
-        return 0.0
-    upper = daily_L if (end_L is None or daily_L < end_L) else end_L
-    span_L = max(0.0, upper - start_L)
-    if span_L <= 0.0:
-        return 0.0
-    total_L = span_L * max(0, days)
-    return total_L / 1000.0  # to kL
+    starts = [float(t["block_start"]) if t["block_start"] is not None else 0.0 for t in tiers]
+    ends = [float(t["block_end"]) if t["block_end"] not in (None, 0) else None for t in tiers]
+    table = TierTable(
+        widths=[None if e is None else e - s0 for s0, e in zip(starts, ends)],
+        rates=[t["rate"] for t in tiers],
+        reductions=[float(t.get("reduction_factor", 1.0)) or 1.0 for t in tiers],
+        starts=starts,
+    )
+    # no daily use without a reading period
+    alloc = allocate(cons_kL if days and days > 0 else 0.0, days, table, mode=WINDOW, reduce=reduce)
+
+    lines = []
+    for ln in alloc.lines(0, qty_places=2, overflow=False):
+        if alloc.qty[0, ln.tier] <= 0:
+            continue
+        s0, e = starts[ln.tier], ends[ln.tier]
+        lines.append({
+            "label": f"{int(s0)}L–{('∞' if e is None else int(e))}L / {days} Days",
+            "cons": float(ln.billed),   # SD side shows the reduced kL
+            "rate": ln.rate,
+            "amount": float(ln.amount),
+        })
+    return lines, float(money(alloc.totals(overflow=False)[0]))
 
 def _price_ws_sd_tiers(cons_kL: float, days: int, month_str: str):
     """
@@ -98,49 +92,9 @@ def _price_ws_sd_tiers(cons_kL: float, days: int, month_str: str):
     Uses bil_tariff blocks (water & sanitation) with block_start/end in L/day
     and reduction_factor for SD tiers (defaults to 1.0).
     """
-    daily_L = _daily_liters(cons_kL, days)
-
-    # WATER (WS)
-    ws_tiers = _get_tariffs("water", month_str)
-    ws_lines, ws_total = [], 0.0
-    for t in ws_tiers:
-        start_L = float(t["block_start"]) if t["block_start"] is not None else 0.0
-        end_L   = float(t["block_end"]) if t["block_end"] not in (None, 0) else None
-        kL = _tier_kL_for_daily_window(daily_L, days, start_L, end_L)
-        if kL <= 0:
-            continue
-        rate = float(t["rate"])
-        amt  = kL * rate
-        ws_lines.append({
-            "label": f"{int(start_L)}L–{('∞' if end_L is None else int(end_L))}L / {days} Days",
-            "cons": round(kL, 2),
-            "rate": rate,
-            "amount": round(amt, 2),
-        })
-        ws_total += amt
-
-    # SANITATION (SD) — apply reduction_factor per tier
-    sd_tiers = _get_tariffs("sanitation", month_str)
-    sd_lines, sd_total = [], 0.0
-    for t in sd_tiers:
-        start_L = float(t["block_start"]) if t["block_start"] is not None else 0.0
-        end_L   = float(t["block_end"]) if t["block_end"] not in (None, 0) else None
-        kL = _tier_kL_for_daily_window(daily_L, days, start_L, end_L)
-        if kL <= 0:
-            continue
-        red = float(t.get("reduction_factor", 1.0)) or 1.0
-        red_kL = kL * red
-        rate = float(t["rate"])
-        amt  = red_kL * rate
-        sd_lines.append({
-            "label": f"{int(start_L)}L–{('∞' if end_L is None else int(end_L))}L / {days} Days",
-            "cons": round(red_kL, 2),  # show reduced kL on SD side
-            "rate": rate,
-            "amount": round(amt, 2),
-        })
-        sd_total += amt
-
-    return ws_lines, round(ws_total, 2), sd_lines, round(sd_total, 2)
+    ws_lines, ws_total = _window_lines(cons_kL, days, _get_tariffs("water", month_str), reduce=False)
+    sd_lines, sd_total = _window_lines(cons_kL, days, _get_tariffs("sanitation", month_str), reduce=True)
+    return ws_lines, ws_total, sd_lines, sd_total
 
 def _get_meter_charge_map(meter_id: int, month_str: str):
     """
@@ -2,6 +2,10 @@
 
 from sqlalchemy import text
 from app.extensions import db
+from decimal import Decimal
+
+from app.utils.tariff_index import get_tariff_index
+from app.utils.tier_kernel import TierTable, allocate
 
 ZERO_WS_SD = {
     "ws_amount": 0.0,
@@ -18,70 +22,87 @@ def _first_of_month(month_str):
     return f"{month_str}-01"
 
 def _tariffs_by_code(month_str):
-    month_day = _first_of_month(month_str)
-    rows = db.session.execute(text("""
-        SELECT t1.*
-        FROM bil_tariff t1
-        JOIN (
-            SELECT code, MAX(effective_date) AS max_eff
-            FROM bil_tariff
-            WHERE effective_date <= :md
-            GROUP BY code
-        ) t2 ON t2.code = t1.code AND t2.max_eff = t1.effective_date
-    """), {"md": month_day}).mappings().all()
-    out = {}
-    for r in rows:
-        out[r["code"]] = r
-    return out
+    """{code: latest tariff row effective on the 1st of the month}."""
+    return get_tariff_index().by_code(_first_of_month(month_str))
+
+_MAP_ROWS_SQL = """
+    SELECT meter_id, charge_code, utility_type, effective_start, effective_end, is_enabled,
+           COALESCE(tariff_code_override, '') AS tariff_code_override
+    FROM bil_meter_charge_map
+    WHERE is_enabled = 1
+      AND (effective_start IS NULL OR effective_start = '' OR effective_start <= :md)
+      AND (effective_end   IS NULL OR effective_end   = '' OR effective_end   >= :md)
+"""
 
 def _map_rows_for_meter(meter_id, month_str):
     month_day = _first_of_month(month_str)
-    return db.session.execute(text("""
-        SELECT charge_code, utility_type, effective_start, effective_end, is_enabled,
-               COALESCE(tariff_code_override, '') AS tariff_code_override
-        FROM bil_meter_charge_map
-        WHERE meter_id = :mid
-          AND is_enabled = 1
-          AND (effective_start IS NULL OR effective_start = '' OR effective_start <= :md)
-          AND (effective_end   IS NULL OR effective_end   = '' OR effective_end   >= :md)
+    return db.session.execute(text(_MAP_ROWS_SQL + """
+          AND meter_id = :mid
         ORDER BY charge_code
     """), {"mid": meter_id, "md": month_day}).mappings().all()
 
-def _split_kl_over_tiers(cons_kl, days, blocks):
+def _blocks_table(blocks):
+    """blocks: (block_start_l_per_day, block_end_l_per_day, rate_per_kl, label[, reduction])"""
+    return TierTable(
+        widths=[(b[1] - b[0]) if b[1] else None for b in blocks],   # block_end 0 = open
+        rates=[b[2] for b in blocks],
+        reductions=[b[4] if len(b) > 4 else 1.0 for b in blocks],
+        labels=[b[3] for b in blocks],
+    )
+
+def _tier_rows(alloc, i, billed=False):
+    """Page-2 tier lines for meter i of an Allocation; consumption past the last
+    finite block is not billed here (same as before)."""
+    tiers, total = [], Decimal("0")
+    for ln in alloc.lines(i, overflow=False):
+        due = ln.amount
+        total += due
+        tiers.append({
+            "label": alloc.table.labels[ln.tier],
+            "cons_kl": float(ln.billed if billed else ln.qty),
+            "rate": ln.rate,
+            "due": float(due),
+        })
+    return tiers, float(total)
+
+_WS_TIER_CODES = [
+    ("Tier1_W&S", "Tier 1 (0–200 L/day)"),
+    ("Tier2_W&S", "Tier 2 (201–833 L/day)"),
+    ("Tier3_W&S", "Tier 3 (834–1000 L/day)"),
+    ("Tier4_W&S", "Tier 4 (1001–1500 L/day)"),
+]
+_SD_TIER_CODES = [
+    ("Tier1_SD", "Tier 1 (0–200 L/day @ reduction)"),
+    ("Tier2_SD", "Tier 2 (201–833 L/day @ reduction)"),
+    ("Tier3_SD", "Tier 3 (834–1000 L/day @ reduction)"),
+    ("Tier4_SD", "Tier 4 (1001–1500 L/day @ reduction)"),
+]
+
+def _tier_blocks(tariffs, codes):
+    blocks = []
+    for code, label in codes:
+        t = tariffs.get(code)
+        if not t:
+            continue
+        blocks.append((
+            float(t["block_start"] or 0.0),
+            float(t["block_end"] or 0.0),
+            float(t["rate"]),
+            label,
+            float(t.get("reduction_factor") or 1.0),
+        ))
+    return blocks
+
+def ws_sd_tier_lines(tariffs, cons_kl, days):
     """
-    blocks: list of (block_start_l_per_day, block_end_l_per_day, rate_per_kl, label)
-    Returns: (tiers_list, total_amount)
+    WS and SD tier lines for many meters at once (one kernel call per side).
+    Returns [{"ws": (tiers, total), "sd": (tiers, total)}] in input order.
     """
-    days = max(1, int(days or 0))
-    rem_l = float(cons_kl or 0) * 1000.0
-    tiers = []
-    total = 0.0
-
-    for bstart, bend, rate, label in blocks:
-        # expand daily limits to this reading period
-        if bend == 0:
-            cap = float("inf")
-        else:
-            cap = bend * days
-        floor = bstart * days
-
-        # capacity for THIS tier
-        tier_cap = max(cap - floor, 0.0)
-
-        take_l = min(rem_l, tier_cap)
-        if take_l < 1e-9:
-            tiers.append({"label": label, "cons_kl": 0.0, "rate": rate, "due": 0.0})
-            continue
-
-        cons_kl_tier = take_l / 1000.0
-        amt = round(cons_kl_tier * rate, 2)
-        total += amt
-        tiers.append({"label": label, "cons_kl": round(cons_kl_tier, 3), "rate": rate, "due": amt})
-        rem_l -= take_l
+    ws = allocate(cons_kl, days, _blocks_table(_tier_blocks(tariffs, _WS_TIER_CODES)))
+    sd = allocate(cons_kl, days, _blocks_table(_tier_blocks(tariffs, _SD_TIER_CODES)), reduce=True)
+    return [{"ws": _tier_rows(ws, i), "sd": _tier_rows(sd, i, billed=True)} for i in range(len(ws))]
 
-    return tiers, round(total, 2)
-
-def _calc_ws_sd_for_meter(meter_id, month_str, cons_kl, days, tariffs, map_rows):
+def _calc_ws_sd_for_meter(meter_id, month_str, cons_kl, days, tariffs, map_rows, tier_lines=None):
     """
     Use the map to decide which charges apply.
     Returns dict like ZERO_WS_SD (ws_amount, sd_amount, water_cost, and tier/fixed breakdowns)
@@ -116,63 +137,16 @@ def _calc_ws_sd_for_meter(meter_id, month_str, cons_kl, days, tariffs, map_rows)
     ws_tiers, sd_tiers = [], []
     ws_total, sd_total = 0.0, 0.0
 
+    if tier_lines is None:
+        tier_lines = ws_sd_tier_lines(tariffs, [cons_kl], [days])[0]
+
     # WS (water & sanitation supply side) tiers
     if include_ws_tier:
-        ws_blocks = []
-        for code, label in [
-            ("Tier1_W&S", "Tier 1 (0–200 L/day)"),
-            ("Tier2_W&S", "Tier 2 (201–833 L/day)"),
-            ("Tier3_W&S", "Tier 3 (834–1000 L/day)"),
-            ("Tier4_W&S", "Tier 4 (1001–1500 L/day)"),
-        ]:
-            t = tariffs.get(code)
-            if not t:
-                continue
-            bstart = float(t["block_start"] or 0.0)
-            bend   = float(t["block_end"] or 0.0)
-            rate   = float(t["rate"])
-            ws_blocks.append((bstart, bend, rate, label))
-
-        ws_tiers, ws_total = _split_kl_over_tiers(cons_kl, days, ws_blocks)
-
-    # SD (sewer disposal) tiers with reductions
+        ws_tiers, ws_total = tier_lines["ws"]
+
+    # SD (sewer disposal) tiers; reduction applied to the displayed kL too
     if include_sd_tier:
-        sd_blocks = []
-        for code, label in [
-            ("Tier1_SD", "Tier 1 (0–200 L/day @ reduction)"),
-            ("Tier2_SD", "Tier 2 (201–833 L/day @ reduction)"),
-            ("Tier3_SD", "Tier 3 (834–1000 L/day @ reduction)"),
-            ("Tier4_SD", "Tier 4 (1001–1500 L/day @ reduction)"),
-        ]:
-            t = tariffs.get(code)
-            if not t:
-                continue
-            bstart = float(t["block_start"] or 0.0)
-            bend   = float(t["block_end"] or 0.0)
-            rate   = float(t["rate"])
-            red    = float(t.get("reduction_factor") or 1.0)
-            # Implement reduction by scaling the rate effectively
-            rate_eff = rate
-            # We'll write the *reduced consumption* in the display rows too:
-            sd_blocks.append((bstart, bend, rate_eff, label, red))
-
-        # convert sd_blocks to generic blocks and then post-apply reduction on each tier line
-        generic_blocks = [(b[0], b[1], b[2], b[3]) for b in sd_blocks]
-        sd_tiers_raw, sd_total_raw = _split_kl_over_tiers(cons_kl, days, generic_blocks)
-
-        sd_tiers = []
-        sd_total = 0.0
-        for raw, meta in zip(sd_tiers_raw, sd_blocks):
-            red = meta[4]
-            reduced_kl = round((raw["cons_kl"] or 0.0) * red, 3)
-            amt = round(reduced_kl * (raw["rate"] or 0.0), 2)
-            sd_tiers.append({
-                "label":   raw["label"],
-                "cons_kl": reduced_kl,
-                "rate":    raw["rate"],
-                "due":     amt,
-            })
-            sd_total += amt
+        sd_tiers, sd_total = tier_lines["sd"]
 
     # Fixed/surcharge items via map (per-kL or per-month)
     ws_fixed, sd_fixed = [], []
@@ -219,6 +193,7 @@ def _calc_ws_sd_for_meter(meter_id, month_str, cons_kl, days, tariffs, map_rows)
 def _get_consumption_rows(tenant_id, month_str):
     return db.session.execute(text("""
       SELECT
+        t.id                               AS tenant_id,
         c.meter_id                         AS meter_id,
         COALESCE(m.meter_number, CAST(m.id AS TEXT)) AS meter_label,
         LOWER(m.utility_type)              AS utility_type,
@@ -251,13 +226,35 @@ def build_metsoa_payload(tenant_id, month_str):
     tariffs = _tariffs_by_code(month_str)
     base = _get_consumption_rows(tenant_id, month_str)
     map_cache = {}  # meter_id -> map rows
+    for r in base:
+        if r["meter_id"] not in map_cache and not (r["utility_type"] or "").strip().lower().startswith("elec"):
+            map_cache[r["meter_id"]] = _map_rows_for_meter(r["meter_id"], month_str)
+    return assemble_metsoa_payload(month_str, base, tariffs, map_cache)
 
+def assemble_metsoa_payload(month_str, base, tariffs, map_rows_by_meter):
+    """
+    Pure part of build_metsoa_payload: no queries, so the month-end batch
+    (app/jobs/metsoa_batch.py) can feed it preloaded rows for many tenants.
+      base              consumption rows for ONE tenant (shape of _get_consumption_rows)
+      tariffs           {code: tariff row} as from _tariffs_by_code
+      map_rows_by_meter {meter_id: [charge map rows]}
+    Returns: (page1_dict, page2_dict)
+    """
     elec_rows, elec_total = [], 0.0
     water_rows, water_total = [], 0.0
     sections = []   # page 2
 
     e_rate = _get_electric_rate(tariffs)
 
+    # tier split for all water meters of the tenant in one kernel call
+    water = [r for r in base if not (r["utility_type"] or "").strip().lower().startswith("elec")]
+    tier_lines = dict(zip(
+        (r["meter_id"] for r in water),
+        ws_sd_tier_lines(tariffs,
+                         [int(r["consumption"] or 0) for r in water],
+                         [int(r["days"] or 0) for r in water]) if water else [],
+    ))
+
     for r in base:
         util = (r["utility_type"] or "").strip().lower()
         cons = int(r["consumption"] or 0)
@@ -266,6 +263,7 @@ def build_metsoa_payload(tenant_id, month_str):
         if util.startswith("elec"):
             due = round((e_rate or 0.0) * cons, 2)
             elec_rows.append({
+                "meter_id":    r["meter_id"],
                 "meter":       r["meter_label"],
                 "prev_date":   r["prev_date"],
                 "prev_value":  r["prev_value"],
@@ -293,11 +291,7 @@ def build_metsoa_payload(tenant_id, month_str):
             "due":         None,
         })
 
-        # Map rows (cache per meter)
-        mr = map_cache.get(r["meter_id"])
-        if mr is None:
-            mr = _map_rows_for_meter(r["meter_id"], month_str)
-            map_cache[r["meter_id"]] = mr
+        mr = map_rows_by_meter.get(r["meter_id"]) or []
 
         totals = _calc_ws_sd_for_meter(
             meter_id=r["meter_id"],
@@ -305,7 +299,8 @@ def build_metsoa_payload(tenant_id, month_str):
             cons_kl=cons,         # consumption is stored as whole numbers of kL
             days=days,
             tariffs=tariffs,
-            map_rows=mr
+            map_rows=mr,
+            tier_lines=tier_lines.get(r["meter_id"]),
         ) or dict(ZERO_WS_SD)
 
         ws_amt = totals.get("ws_amount", 0.0)
@@ -321,6 +316,7 @@ def build_metsoa_payload(tenant_id, month_str):
 
         # Page 2 section for this meter
         sections.append({
+            "meter_id":  r["meter_id"],
             "meter":     r["meter_label"],
             "cons_kl":   cons,
             "days":      days,
@@ -356,37 +352,35 @@ def _month_first(month_str: str) -> str:
     # '2025-06' -> '2025-06-01'
     return f"{month_str}-01"
 
-def get_tariffs_by_prefix(prefix: str) -> list[dict]:
+def _cutoff(month_str: str | None) -> str | None:
+    # same convention as _tariffs_by_code: versions effective by the 1st; None = latest
+    return _month_first(month_str) if month_str else None
+
+def get_tariffs_by_prefix(prefix: str, month_str: str | None = None) -> list[dict]:
     """
     Returns tiered tariffs ordered by block_start, e.g.
     prefix='Tier' with utility filters done by caller.
     Each row has: code, rate, block_start, block_end, reduction_factor
     """
-    rows = db.session.execute(text("""
-        SELECT code, rate, block_start, block_end, COALESCE(reduction_factor, 1.0) AS reduction_factor
-        FROM bil_tariff
-        WHERE code LIKE :pfx || '%'
-        ORDER BY block_start ASC
-    """), {"pfx": prefix}).mappings().all()
+    pfx = (prefix or "").lower()
+    rows = [r for code, r in get_tariff_index().by_code(_cutoff(month_str)).items()
+            if code.lower().startswith(pfx)]
+    rows.sort(key=lambda r: (r["block_start"] is None, r["block_start"] or 0.0, r["code"]))
     return rows
 
-def get_tariffs_for_ws() -> list[dict]:
+def _tier_tariffs(utility: str, suffix: str, month_str: str | None) -> list[dict]:
+    # code LIKE 'Tier%_<suffix>', one effective version per code
+    sfx = suffix.lower()
+    return [r for r in get_tariff_index().tiers(utility, _cutoff(month_str))
+            if r["code"].lower().endswith(sfx) and len(r["code"]) > 4 + len(sfx)]
+
+def get_tariffs_for_ws(month_str: str | None = None) -> list[dict]:
     # Tier1_W&S ... Tier4_W&S
-    return db.session.execute(text("""
-        SELECT code, rate, block_start, block_end
-        FROM bil_tariff
-        WHERE utility_type='water' AND code LIKE 'Tier%_W&S'
-        ORDER BY block_start ASC
-    """)).mappings().all()
+    return _tier_tariffs("water", "W&S", month_str)
 
-def get_tariffs_for_sd() -> list[dict]:
+def get_tariffs_for_sd(month_str: str | None = None) -> list[dict]:
     # Tier1_SD ... Tier4_SD (with reduction_factor)
-    return db.session.execute(text("""
-        SELECT code, rate, block_start, block_end, COALESCE(reduction_factor,1.0) AS reduction_factor
-        FROM bil_tariff
-        WHERE utility_type='sanitation' AND code LIKE 'Tier%_SD'
-        ORDER BY block_start ASC
-    """)).mappings().all()
+    return _tier_tariffs("sanitation", "SD", month_str)
 
 def get_meter_map_for_month(meter_id: int, month_str: str) -> list[dict]:
     """
@@ -408,45 +402,32 @@ def get_meter_map_for_month(meter_id: int, month_str: str) -> list[dict]:
     return rows
 
 # ── tier math ─────────────────────────────────────────────────────────────────
-def _split_by_blocks(cons_kl: int, days: int, blocks: list[dict]) -> list[dict]:
+def _split_by_blocks(cons_kl: int, days: int, blocks: list[dict], reduce: bool = False) -> list[dict]:
     """
     Johannesburg-style blocks are specified in L/DAY ranges (0–200, 201–833, ...).
-    We prorate the allowance by 'days', then allocate 'cons_kl' across those caps.
+    We prorate the allowance by 'days', then allocate 'cons_kl' across those caps;
+    anything beyond the last band is billed at the last band's rate.
 
-    Returns list[ {code, cons_kl, rate, reduction_factor(optional), due} ] 
-    with due not calculated here (caller applies rate×cons×reduction as needed).
+    Returns list[ {code, cons_kl, billed_kl, rate, reduction_factor, due} ]
+    (billed_kl = cons_kl × reduction_factor when reduce=True).
     """
-    # Convert L/day cap to kL for the period
+    table = TierTable(
+        widths=[max(0.0, float(b["block_end"]) - float(b["block_start"])) for b in blocks],
+        rates=[b["rate"] for b in blocks],
+        reductions=[b.get("reduction_factor", 1.0) for b in blocks],
+    )
+    alloc = allocate(cons_kl, days, table, reduce=reduce)
     out = []
-    remaining = float(cons_kl)
-
-    for b in blocks:
-        # Convert the L/day band to kL for 'days'
-        lo = float(b["block_start"])
-        hi = float(b["block_end"])
-        band_kl = max(0.0, (hi - lo) * days / 1000.0)
-
-        take = min(remaining, band_kl) if band_kl > 0 else 0.0
+    for ln in alloc.lines(0, qty_places=2):
+        b = blocks[min(ln.tier, len(blocks) - 1)]
         out.append({
             "code": b["code"],
-            "cons_kl": round(take, 2),
-            "rate": float(b["rate"]),
-            "reduction_factor": float(b.get("reduction_factor", 1.0)),
+            "cons_kl": float(ln.qty),
+            "billed_kl": float(ln.billed),
+            "rate": ln.rate,
+            "reduction_factor": ln.reduction,
+            "due": float(ln.amount),
         })
-        remaining -= take
-        if remaining <= 1e-6:
-            break
-
-    # If there’s still consumption beyond last band, treat it as final band rate
-    if remaining > 1e-6 and blocks:
-        last = blocks[-1]
-        out.append({
-            "code": last["code"],
-            "cons_kl": round(remaining, 2),
-            "rate": float(last["rate"]),
-            "reduction_factor": float(last.get("reduction_factor", 1.0)),
-        })
-
     return out
 
 # ── master calculator used by Page 1 + Page 2 ─────────────────────────────────
@@ -492,10 +473,10 @@ def calc_ws_sd_totals(
 
     # ── Tiers: WS
     if has_ws_tier:
-        ws_blocks = get_tariffs_for_ws()  # Tier1_W&S..Tier4_W&S
+        ws_blocks = get_tariffs_for_ws(month_str)  # Tier1_W&S..Tier4_W&S
         ws_alloc = _split_by_blocks(cons, days, ws_blocks)
         for row in ws_alloc:
-            due = round(row["cons_kl"] * row["rate"], 2)
+            due = row["due"]
             ws_total += due
             if want_breakdown and row["cons_kl"] > 0:
                 ws_lines.append({
@@ -505,11 +486,11 @@ def calc_ws_sd_totals(
 
     # ── Tiers: SD (with reduction)
     if has_sd_tier:
-        sd_blocks = get_tariffs_for_sd()  # Tier1_SD..Tier4_SD
-        sd_alloc = _split_by_blocks(cons, days, sd_blocks)
+        sd_blocks = get_tariffs_for_sd(month_str)  # Tier1_SD..Tier4_SD
+        sd_alloc = _split_by_blocks(cons, days, sd_blocks, reduce=True)
         for row in sd_alloc:
-            eff_cons = round(row["cons_kl"] * row["reduction_factor"], 2)
-            due = round(eff_cons * row["rate"], 2)
+            eff_cons = row["billed_kl"]
+            due = row["due"]
             sd_total += due
             if want_breakdown and row["cons_kl"] > 0:
                 sd_lines.append({
@@ -518,11 +499,10 @@ def calc_ws_sd_totals(
                 })
 
     # ── Fixed charges from the map
+    tariffs = get_tariff_index()
+
     def _tariff_rate(code: str) -> float:
-        r = db.session.execute(text("""
-            SELECT rate FROM bil_tariff WHERE code=:c LIMIT 1
-        """), {"c": code}).scalar()
-        return float(r or 0.0)
+        return float(tariffs.rate(code, _cutoff(month_str)) or 0.0)
 
     have_ws_surcharge = any(r["charge_code"] == "WSSurcharge" for r in mm)
     have_sd_surcharge = any(r["charge_code"] == "SDSurcharge" for r in mm)
@@ -0,0 +1,453 @@
+# app/utils/consumption_engine.py
+"""
+Meter consumption for a month from bil_meter_reading, in one query.
+
+For every meter: the latest reading in the month (curr) and the latest reading
+in the previous month (prev), picked with ROW_NUMBER() over
+(meter_id, which-month) on the (meter_id, reading_date) index, then
+
+    days        = curr_date - prev_date
+    consumption = curr_value - prev_value   (only when both exist)
+
+The same rows feed the readings consumption view (one tenant), the month-end
+bil_consumption rebuild (all meters) and anything else that used to call
+"latest reading in range" per meter.
+
+bil_reading_month holds the distinct months that have readings so month
+dropdowns don't scan the whole readings table. ORM inserts/updates/deletes of
+BilMeterReading keep it current; refresh_reading_months() rebuilds it.
+
+build_consumption() is the reading-pair variant for any set of months: LAG()
+over each meter's readings in (reading_date, id) order pairs every reading
+with the one before it, the first paired reading of each month is kept, and the
+result is upserted into bil_consumption on (meter_id, month) in one
+executemany - a multi-month backfill is one query and one write. Meters with
+no reading in a month, no earlier reading to pair with, negative usage or a
+zero-day gap are returned as anomalies.
+
+The upsert needs the unique (meter_id, month) index. Databases that predate it
+get it from `flask consumption-index`, which removes the older rows of any
+duplicate pair (bil_consumption is derived data) and lists what it removed;
+app start only warns. Until then build_consumption() replaces the rows it
+writes with a DELETE + plain INSERT instead.
+"""
+from __future__ import annotations
+
+from datetime import date, datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import bindparam, event, inspect, text
+
+from app.extensions import db
+
+_SQL_WINDOW = """
+    WITH ranked AS (
+        SELECT r.meter_id, r.reading_date, r.reading_value,
+               CASE WHEN r.reading_date >= :curr_first THEN 1 ELSE 0 END AS is_curr,
+               ROW_NUMBER() OVER (
+                   PARTITION BY r.meter_id, CASE WHEN r.reading_date >= :curr_first THEN 1 ELSE 0 END
+                   ORDER BY r.reading_date DESC, r.id DESC
+               ) AS rn
+        FROM bil_meter_reading r
+        WHERE r.reading_date >= :prev_first AND r.reading_date <= :curr_last
+    )
+    SELECT {tenant_col}
+           m.id            AS meter_id,
+           m.meter_number  AS meter_number,
+           LOWER(m.utility_type) AS utility_type,
+           p.reading_date  AS prev_date,
+           p.reading_value AS prev_value,
+           c.reading_date  AS curr_date,
+           c.reading_value AS curr_value
+    FROM bil_meter m
+    {tenant_join}
+    LEFT JOIN ranked p ON p.meter_id = m.id AND p.is_curr = 0 AND p.rn = 1
+    LEFT JOIN ranked c ON c.meter_id = m.id AND c.is_curr = 1 AND c.rn = 1
+    {where}
+    ORDER BY {order}
+"""
+
+_SQL_LAGGED = """
+    WITH lagged AS (
+        SELECT r.id, r.meter_id, r.reading_date, r.reading_value,
+               LAG(r.reading_date)  OVER (PARTITION BY r.meter_id ORDER BY r.reading_date, r.id) AS prev_date,
+               LAG(r.reading_value) OVER (PARTITION BY r.meter_id ORDER BY r.reading_date, r.id) AS prev_value
+        FROM bil_meter_reading r
+        WHERE r.reading_date <= :last {meters}
+    ),
+    firsts AS (
+        SELECT l.*, substr(CAST(l.reading_date AS TEXT), 1, 7) AS month,
+               ROW_NUMBER() OVER (
+                   PARTITION BY l.meter_id, substr(CAST(l.reading_date AS TEXT), 1, 7)
+                   ORDER BY CASE WHEN l.prev_date IS NULL THEN 1 ELSE 0 END, l.reading_date, l.id
+               ) AS rn
+        FROM lagged l
+        WHERE l.reading_date >= :first
+    )
+    SELECT f.month, f.meter_id, m.meter_number,
+           f.prev_date, f.prev_value, f.reading_date AS curr_date, f.reading_value AS curr_value
+    FROM firsts f
+    JOIN bil_meter m ON m.id = f.meter_id
+    WHERE f.rn = 1 AND f.month IN :months
+    ORDER BY f.month, f.meter_id
+"""
+
+_SQL_UPSERT_CONSUMPTION = text("""
+    INSERT INTO bil_consumption
+        (meter_id, meter_number, last_date, new_date, last_read, new_read, days, consumption, month)
+    VALUES (:meter_id, :meter_number, :last_date, :new_date, :last_read, :new_read, :days, :consumption, :month)
+    ON CONFLICT (meter_id, month) DO UPDATE SET
+        meter_number = excluded.meter_number,
+        last_date    = excluded.last_date,
+        new_date     = excluded.new_date,
+        last_read    = excluded.last_read,
+        new_read     = excluded.new_read,
+        days         = excluded.days,
+        consumption  = excluded.consumption
+""")
+
+_SQL_MONTHS = text("SELECT month FROM bil_reading_month ORDER BY month DESC")
+
+_SQL_ENSURE = (
+    "CREATE INDEX IF NOT EXISTS ix_bil_meter_reading_meter_date ON bil_meter_reading (meter_id, reading_date)",
+    "CREATE TABLE IF NOT EXISTS bil_reading_month (month VARCHAR(7) PRIMARY KEY)",
+)
+
+# fallback while uq_bil_consumption_meter_month is missing
+_SQL_DELETE_CONSUMPTION = text("DELETE FROM bil_consumption WHERE meter_id = :meter_id AND month = :month")
+_SQL_INSERT_CONSUMPTION = text("""
+    INSERT INTO bil_consumption
+        (meter_id, meter_number, last_date, new_date, last_read, new_read, days, consumption, month)
+    VALUES (:meter_id, :meter_number, :last_date, :new_date, :last_read, :new_read, :days, :consumption, :month)
+""")
+
+# one-off index build (`flask consumption-index`): keep the newest row of any (meter, month) duplicate
+_SQL_CONSUMPTION_DUPES = text("""
+    SELECT meter_id, month, COUNT(*) AS n, MAX(id) AS keep_id
+    FROM bil_consumption
+    GROUP BY meter_id, month
+    HAVING COUNT(*) > 1
+    ORDER BY month, meter_id
+""")
+_SQL_CONSUMPTION_DEDUPE = text("""
+    DELETE FROM bil_consumption WHERE id NOT IN (
+        SELECT MAX(id) FROM bil_consumption GROUP BY meter_id, month)
+""")
+_SQL_CONSUMPTION_UNIQUE = text(
+    "CREATE UNIQUE INDEX IF NOT EXISTS uq_bil_consumption_meter_month ON bil_consumption (meter_id, month)"
+)
+
+_SQL_ADD_MONTH = text(
+    "INSERT INTO bil_reading_month (month) VALUES (:m) ON CONFLICT (month) DO NOTHING"
+)
+_SQL_DROP_MONTH = text("""
+    DELETE FROM bil_reading_month
+    WHERE month = :m
+      AND NOT EXISTS (SELECT 1 FROM bil_meter_reading
+                      WHERE reading_date >= :d1 AND reading_date <= :d2)
+""")
+
+
+def month_range(ym: str) -> tuple[date, date]:
+    """'YYYY-MM' -> (first day, last day)."""
+    y, m = int(ym[:4]), int(ym[5:7])
+    first = date(y, m, 1)
+    next_first = date(y + (m == 12), (m % 12) + 1, 1)
+    return first, next_first - timedelta(days=1)
+
+
+def _as_date(v):
+    if v is None or isinstance(v, date):
+        return v.date() if isinstance(v, datetime) else v
+    return datetime.strptime(str(v)[:10], "%Y-%m-%d").date()
+
+
+def ensure_consumption_schema() -> None:
+    """
+    Reading index + month list on databases created before they were added to
+    the models. The bil_consumption unique index is only checked: building it
+    deletes rows, so that is left to `flask consumption-index`.
+    """
+    for stmt in _SQL_ENSURE:
+        db.session.execute(text(stmt))
+    db.session.commit()
+    if inspect(db.session.connection()).has_table("bil_consumption") and not has_consumption_index():
+        current_app.logger.warning(
+            "bil_consumption has no uq_bil_consumption_meter_month index; consumption rebuilds use "
+            "DELETE + INSERT until `flask consumption-index` has been run"
+        )
+
+
+def has_consumption_index() -> bool:
+    names = {ix.get("name") for ix in inspect(db.session.connection()).get_indexes("bil_consumption")}
+    return "uq_bil_consumption_meter_month" in names
+
+
+def build_consumption_index(dry_run: bool = False) -> list[dict]:
+    """
+    Collapse duplicate (meter_id, month) rows to the newest and build the
+    unique index (neither when dry_run). Returns the duplicate groups as
+    {"meter_id", "month", "n", "keep_id"}; n - 1 rows go per group.
+    """
+    dupes = [dict(r) for r in db.session.execute(_SQL_CONSUMPTION_DUPES).mappings()]
+    if dry_run:
+        return dupes
+    try:
+        db.session.execute(_SQL_CONSUMPTION_DEDUPE)
+        db.session.execute(_SQL_CONSUMPTION_UNIQUE)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return dupes
+
+
+# ---- month list --------------------------------------------------------------
+def refresh_reading_months() -> int:
+    """Rebuild bil_reading_month from the readings (one INSERT .. SELECT DISTINCT)."""
+    db.session.execute(text("DELETE FROM bil_reading_month"))
+    db.session.execute(text("""
+        INSERT INTO bil_reading_month (month)
+        SELECT DISTINCT substr(CAST(reading_date AS TEXT), 1, 7)
+        FROM bil_meter_reading
+        WHERE reading_date IS NOT NULL
+    """))
+    db.session.commit()
+    return db.session.execute(text("SELECT COUNT(*) FROM bil_reading_month")).scalar() or 0
+
+
+def reading_months() -> list[str]:
+    """'YYYY-MM' months with readings, newest first."""
+    months = list(db.session.execute(_SQL_MONTHS).scalars())
+    if not months and db.session.execute(text("SELECT 1 FROM bil_meter_reading LIMIT 1")).first():
+        refresh_reading_months()
+        months = list(db.session.execute(_SQL_MONTHS).scalars())
+    return months
+
+
+# ---- consumption -------------------------------------------------------------
+def month_consumption(month: str, tenant_id: int | None = None, by_tenant: bool = True) -> list[dict]:
+    """
+    Prev/curr reading, days and consumption for every meter in `month`.
+      by_tenant=True   meters joined to their tenant (tenant_id in each row),
+                       optionally only `tenant_id`; ordered by tenant, meter
+      by_tenant=False  every meter, no tenant join (bil_consumption rebuild)
+    """
+    curr_first, curr_last = month_range(month)
+    prev_first = (curr_first - timedelta(days=1)).replace(day=1)
+    params = {
+        "curr_first": curr_first.isoformat(),
+        "curr_last": curr_last.isoformat(),
+        "prev_first": prev_first.isoformat(),
+    }
+    if by_tenant:
+        sql = _SQL_WINDOW.format(
+            tenant_col="t.id AS tenant_id,",
+            tenant_join="JOIN bil_tenant t ON t.sectional_unit_id = m.sectional_unit_id",
+            where="WHERE t.id = :tid" if tenant_id else "",
+            order="t.id, m.id",
+        )
+        if tenant_id:
+            params["tid"] = int(tenant_id)
+    else:
+        sql = _SQL_WINDOW.format(tenant_col="", tenant_join="", where="", order="m.id")
+
+    out = []
+    for r in db.session.execute(text(sql), params).mappings():
+        prev_date, curr_date = _as_date(r["prev_date"]), _as_date(r["curr_date"])
+        has_both = prev_date is not None and curr_date is not None
+        out.append({
+            "tenant_id": r.get("tenant_id"),
+            "meter_id": r["meter_id"],
+            "meter_number": r["meter_number"],
+            "meter_label": r["meter_number"] or f"Meter #{r['meter_id']}",
+            "utility_type": r["utility_type"],
+            "prev_date": prev_date,
+            "prev_value": int(r["prev_value"]) if r["prev_value"] is not None else None,
+            "prev_read": r["prev_value"],
+            "curr_date": curr_date,
+            "curr_value": int(r["curr_value"]) if r["curr_value"] is not None else None,
+            "curr_read": r["curr_value"],
+            "days": (curr_date - prev_date).days if has_both else None,
+            "consumption": int(r["curr_value"]) - int(r["prev_value"]) if has_both else None,
+        })
+    return out
+
+
+def populate_consumption(month: str, meter_ids=None) -> int:
+    """
+    Rewrite bil_consumption for `month` from month_consumption(): one DELETE
+    and one executemany INSERT in a single transaction. Meters without both a
+    previous and a current reading are skipped. Returns rows written.
+    """
+    rows = [r for r in month_consumption(month, by_tenant=False) if r["days"] is not None]
+    if meter_ids is not None:
+        keep = {int(m) for m in meter_ids}
+        rows = [r for r in rows if r["meter_id"] in keep]
+    try:
+        if meter_ids is None:
+            db.session.execute(text("DELETE FROM bil_consumption WHERE month = :m"), {"m": month})
+        elif rows:
+            db.session.execute(
+                text("DELETE FROM bil_consumption WHERE month = :m AND meter_id IN :ids")
+                .bindparams(bindparam("ids", expanding=True)),
+                {"m": month, "ids": [r["meter_id"] for r in rows]},
+            )
+        if rows:
+            db.session.execute(text("""
+                INSERT INTO bil_consumption
+                    (meter_id, meter_number, last_date, new_date, last_read, new_read, days, consumption, month)
+                VALUES (:meter_id, :meter_number, :last_date, :new_date, :last_read, :new_read, :days, :consumption, :month)
+            """), [{
+                "meter_id": r["meter_id"],
+                "meter_number": r["meter_number"],
+                "last_date": r["prev_date"].isoformat(),
+                "new_date": r["curr_date"].isoformat(),
+                "last_read": r["prev_read"],
+                "new_read": r["curr_read"],
+                "days": r["days"],
+                "consumption": int(round(r["curr_read"] - r["prev_read"])),
+                "month": month,
+            } for r in rows])
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return len(rows)
+
+
+# ---- reading pairs (LAG) -----------------------------------------------------
+def month_span(start: str, end: str) -> list[str]:
+    """'YYYY-MM' months from start to end inclusive."""
+    out, y, m = [], int(start[:4]), int(start[5:7])
+    while f"{y:04d}-{m:02d}" <= end[:7]:
+        out.append(f"{y:04d}-{m:02d}")
+        y, m = y + (m == 12), (m % 12) + 1
+    return out
+
+
+def _expanding(sql: str, params: dict, *names: str):
+    stmt = text(sql)
+    for name in names:
+        if name in params:
+            stmt = stmt.bindparams(bindparam(name, expanding=True))
+    return stmt
+
+
+def build_consumption(months, meter_ids=None, dry_run: bool = False) -> dict:
+    """
+    (prev, curr, days, usage) for every meter and each of `months` from one LAG()
+    query; upserted into bil_consumption unless dry_run. Rows of those months
+    for meters that no longer have a pair are removed, as the old per-month
+    regenerate did. Returns
+        {"months", "rows": [...], "written": {month: n}, "anomalies": [...]}
+    where anomalies are {"month", "meter_id", "meter_number", "type", ...} with
+    type no_reading / no_prior / negative / zero_days. Negative and zero-day
+    pairs are still written, as before.
+    """
+    months = sorted({str(m)[:7] for m in months})
+    if not months:
+        return {"months": [], "rows": [], "written": {}, "anomalies": []}
+    first, _ = month_range(months[0])
+    _, last = month_range(months[-1])
+    params = {"first": first.isoformat(), "last": last.isoformat(), "months": months}
+    if meter_ids is not None:
+        params["ids"] = [int(m) for m in meter_ids]
+    meters = "AND r.meter_id IN :ids" if meter_ids is not None else ""
+
+    rows, anomalies = [], []
+    paired: dict[str, set] = {m: set() for m in months}
+    seen: dict[str, set] = {m: set() for m in months}
+    for r in db.session.execute(_expanding(_SQL_LAGGED.format(meters=meters), params, "months", "ids"),
+                                params).mappings():
+        seen[r["month"]].add(r["meter_id"])
+        base = {"month": r["month"], "meter_id": r["meter_id"], "meter_number": r["meter_number"]}
+        curr_date = _as_date(r["curr_date"])
+        if r["prev_date"] is None:
+            anomalies.append({**base, "type": "no_prior", "curr_date": curr_date, "curr_read": r["curr_value"]})
+            continue
+        prev_date = _as_date(r["prev_date"])
+        days = (curr_date - prev_date).days
+        usage = int(round(r["curr_value"] - r["prev_value"]))
+        rows.append({**base, "last_date": prev_date.isoformat(), "new_date": curr_date.isoformat(),
+                     "last_read": r["prev_value"], "new_read": r["curr_value"], "days": days, "consumption": usage})
+        paired[r["month"]].add(r["meter_id"])
+        if usage < 0:
+            anomalies.append({**base, "type": "negative", "consumption": usage,
+                              "last_read": r["prev_value"], "new_read": r["curr_value"]})
+        if days <= 0:
+            anomalies.append({**base, "type": "zero_days", "last_date": prev_date, "new_date": curr_date})
+
+    sql = "SELECT id, meter_number FROM bil_meter" + (" WHERE id IN :ids" if meter_ids is not None else "")
+    all_meters = db.session.execute(_expanding(sql, params, "ids"), params).all()
+    for m in months:
+        anomalies.extend({"month": m, "meter_id": mid, "meter_number": num, "type": "no_reading"}
+                         for mid, num in all_meters if mid not in seen[m])
+
+    if not dry_run:
+        try:
+            if rows and has_consumption_index():
+                db.session.execute(_SQL_UPSERT_CONSUMPTION, rows)
+            elif rows:
+                db.session.execute(_SQL_DELETE_CONSUMPTION, [{"meter_id": r["meter_id"], "month": r["month"]}
+                                                             for r in rows])
+                db.session.execute(_SQL_INSERT_CONSUMPTION, rows)
+            for m in months:
+                p = {"m": m, **({"ids": params["ids"]} if meter_ids is not None else {})}
+                sql = "DELETE FROM bil_consumption WHERE month = :m" + (" AND meter_id IN :ids" if "ids" in p else "")
+                if paired[m]:
+                    p["keep"] = sorted(paired[m])
+                    sql += " AND meter_id NOT IN :keep"
+                db.session.execute(_expanding(sql, p, "ids", "keep"), p)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+    return {"months": months, "rows": rows, "written": {m: len(paired[m]) for m in months},
+            "anomalies": anomalies}
+
+
+# ---- keep bil_reading_month current on ORM edits -----------------------------
+def _month_of(target):
+    d = _as_date(target.reading_date)
+    return d.strftime("%Y-%m") if d else None
+
+
+def _after_upsert(mapper, connection, target):
+    m = _month_of(target)
+    if m:
+        connection.execute(_SQL_ADD_MONTH, {"m": m})
+
+
+def _drop_month(connection, m):
+    d1, d2 = month_range(m)
+    connection.execute(_SQL_DROP_MONTH, {"m": m, "d1": d1.isoformat(), "d2": d2.isoformat()})
+
+
+def _after_update(mapper, connection, target):
+    _after_upsert(mapper, connection, target)
+    # a reading moved to another month may have been the old month's last one
+    new = _month_of(target)
+    for old in inspect(target).attrs.reading_date.history.deleted:
+        d = _as_date(old)
+        if d and d.strftime("%Y-%m") != new:
+            _drop_month(connection, d.strftime("%Y-%m"))
+
+
+def _after_delete(mapper, connection, target):
+    m = _month_of(target)
+    if m:
+        _drop_month(connection, m)
+
+
+def _register_listeners():
+    from app.models.billing import BilMeterReading
+    event.listen(BilMeterReading, "after_insert", _after_upsert)
+    event.listen(BilMeterReading, "after_update", _after_update)
+    event.listen(BilMeterReading, "after_delete", _after_delete)
+    # load the old reading_date on assignment even when it was expired (after a
+    # commit), so _after_update sees it in history.deleted
+    event.listen(BilMeterReading.reading_date, "set", lambda *args: None, active_history=True)
+
+
+_register_listeners()
@@ -0,0 +1,114 @@
+# app/utils/export_stream.py
+"""
+Streaming CSV / ZIP exports.
+
+Exports used to materialise every row (.all()), render the whole CSV into a
+StringIO and, for bundles, the whole ZIP into a BytesIO before sending the
+first byte. These helpers keep memory flat instead:
+
+  iter_query(sql, params)     rows from a server-side cursor, fetched in chunks
+  iter_csv(rows, headers)     CSV text in ~64 KB chunks
+  iter_zip(entries)           ZIP bytes as each entry is deflated; entries are
+                              (name, chunks) pairs consumed lazily, one at a time
+  csv_response / zip_response wrap a generator in a streamed flask Response
+
+Streamed responses run after the view returns, so they are wrapped in
+stream_with_context to keep the app context (and db.session) alive.
+"""
+from __future__ import annotations
+
+import csv
+import io
+import zipfile
+from typing import Iterable, Iterator
+
+from flask import Response, stream_with_context
+from sqlalchemy import text
+
+from app.extensions import db
+
+CHUNK_ROWS = 1000
+CHUNK_BYTES = 64 * 1024
+
+
+def iter_query(sql: str, params: dict | None = None, chunk: int = CHUNK_ROWS) -> Iterator:
+    """Mappings from a server-side cursor (psycopg2 named cursor; plain cursor on SQLite)."""
+    stmt = text(sql).execution_options(stream_results=True, yield_per=chunk)
+    result = db.session.execute(stmt, params or {})
+    try:
+        for part in result.mappings().partitions(chunk):
+            yield from part
+    finally:
+        result.close()
+
+
+def iter_csv(rows: Iterable, headers: list[str]) -> Iterator[str]:
+    """CSV text for `rows` (mappings, dicts or sequences in header order), in chunks."""
+    buf = io.StringIO()
+    w = csv.writer(buf)
+    w.writerow(headers)
+    for r in rows:
+        if hasattr(r, "keys"):
+            w.writerow([r.get(h) for h in headers])
+        else:
+            w.writerow(r)
+        if buf.tell() >= CHUNK_BYTES:
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+    if buf.tell():
+        yield buf.getvalue()
+
+
+class _Pipe:
+    """Write-only, non-seekable sink for ZipFile; drain() hands back what was written."""
+
+    def __init__(self):
+        self._parts: list[bytes] = []
+
+    def write(self, b) -> int:
+        self._parts.append(bytes(b))
+        return len(b)
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        out = b"".join(self._parts)
+        self._parts.clear()
+        return out
+
+
+def iter_zip(entries: Iterable[tuple[str, Iterable]]) -> Iterator[bytes]:
+    """
+    ZIP archive bytes for (name, chunks) entries; chunks are str (UTF-8 encoded)
+    or bytes. Written with data descriptors, so no seeking is needed.
+    """
+    pipe = _Pipe()
+    with zipfile.ZipFile(pipe, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        for name, chunks in entries:
+            with zf.open(name, "w", force_zip64=True) as fh:
+                for c in chunks:
+                    fh.write(c.encode("utf-8") if isinstance(c, str) else c)
+                    out = pipe.drain()
+                    if out:
+                        yield out
+            out = pipe.drain()
+            if out:
+                yield out
+    out = pipe.drain()          # central directory
+    if out:
+        yield out
+
+
+def _attachment(filename: str) -> dict:
+    return {"Content-Disposition": f"attachment; filename={filename}", "X-Accel-Buffering": "no"}
+
+
+def csv_response(chunks: Iterable[str], filename: str) -> Response:
+    return Response(stream_with_context(chunks), mimetype="text/csv", headers=_attachment(filename))
+
+
+def zip_response(entries: Iterable[tuple[str, Iterable]], filename: str) -> Response:
+    return Response(stream_with_context(iter_zip(entries)), mimetype="application/zip",
+                    headers=_attachment(filename))
@@ -0,0 +1,387 @@
+# app/utils/ledger_engine.py
+"""
+Tenant ledger balances from monthly checkpoints, paged by (txn_date, id).
+
+The ledger screen and the SOA used to read a tenant's whole bil_tenant_ledger
+history ordered by date(txn_date) (no index) and add the amounts up in
+floats on every view. Now:
+
+    bil_ledger_checkpoint   (tenant_id, month) -> balance at the end of that
+                            month in cents, plus the running row count
+    ledger_page()           one keyset page of rows over the
+                            (tenant_id, txn_date, id) index, newest or oldest
+                            first, optionally limited to a date range
+    balance_before(key)     last checkpoint before key's month + SUM of that
+                            month's rows before key
+
+so a page costs its own rows plus at most one month of rows, whatever the
+length of the history. Amounts are summed as integer cents in SQL and carried
+as Decimal in Python.
+
+Checkpoints are written lazily (the first balance needed after a month fills
+every missing month before it in one INSERT .. SELECT, on its own connection)
+and dropped by triggers on bil_tenant_ledger: any insert / update / delete
+removes the tenant's checkpoints from the row's month on. On PostgreSQL the
+trigger and the fill share a per-tenant advisory lock, so a fill cannot save
+sums a concurrent write has already invalidated. The ledger is written with raw SQL from
+several modules, so the triggers - not the callers - keep them honest.
+Triggers exist for SQLite and PostgreSQL; on other databases no checkpoints
+are kept and balances are a single SUM over the index.
+
+Rows need a txn_date (every writer sets one); rows without are not listed.
+
+    flask ledger-checkpoints [--tenant-id N]   drop and rebuild checkpoints
+"""
+from __future__ import annotations
+
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from typing import NamedTuple
+
+from sqlalchemy import inspect, text
+
+from app.extensions import db
+
+PAGE_SIZE = 100
+SOA_PAGE_SIZE = 200
+
+_CENTS = Decimal("0.01")
+
+_SQL_ENSURE = (
+    "CREATE INDEX IF NOT EXISTS ix_bil_tenant_ledger_tenant_date ON bil_tenant_ledger (tenant_id, txn_date, id)",
+    """CREATE TABLE IF NOT EXISTS bil_ledger_checkpoint (
+        tenant_id INTEGER NOT NULL,
+        month VARCHAR(7) NOT NULL,
+        balance_cents BIGINT NOT NULL,
+        row_count INTEGER NOT NULL,
+        PRIMARY KEY (tenant_id, month)
+    )""",
+)
+
+_MONTH_OF = "substr(CAST({col} AS TEXT), 1, 7)"
+_DROP_FROM = ("DELETE FROM bil_ledger_checkpoint "
+              "WHERE tenant_id = {row}.tenant_id AND month >= " + _MONTH_OF.format(col="{row}.txn_date"))
+
+# pg advisory lock class for (class, tenant_id): held by the PostgreSQL trigger
+# for the writing transaction and tried by the checkpoint fill, so a fill never
+# interleaves with a committing ledger write of the same tenant
+_LOCK_CLASS = 19524
+_LOCK_ROW = "PERFORM pg_advisory_xact_lock(" + str(_LOCK_CLASS) + ", {row}.tenant_id)"
+
+_SQL_TRIGGERS = {
+    "sqlite": (
+        "CREATE TRIGGER IF NOT EXISTS trg_bil_ledger_cp_ins AFTER INSERT ON bil_tenant_ledger "
+        f"BEGIN {_DROP_FROM.format(row='NEW')}; END",
+        "CREATE TRIGGER IF NOT EXISTS trg_bil_ledger_cp_upd AFTER UPDATE OF tenant_id, txn_date, amount "
+        f"ON bil_tenant_ledger BEGIN {_DROP_FROM.format(row='OLD')}; {_DROP_FROM.format(row='NEW')}; END",
+        "CREATE TRIGGER IF NOT EXISTS trg_bil_ledger_cp_del AFTER DELETE ON bil_tenant_ledger "
+        f"BEGIN {_DROP_FROM.format(row='OLD')}; END",
+    ),
+    "postgresql": (
+        f"""CREATE OR REPLACE FUNCTION bil_ledger_cp_invalidate() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP <> 'INSERT' THEN
+                {_LOCK_ROW.format(row='OLD')};
+                {_DROP_FROM.format(row='OLD')};
+            END IF;
+            IF TG_OP <> 'DELETE' THEN
+                {_LOCK_ROW.format(row='NEW')};
+                {_DROP_FROM.format(row='NEW')};
+            END IF;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql""",
+        "DROP TRIGGER IF EXISTS trg_bil_ledger_cp ON bil_tenant_ledger",
+        "CREATE TRIGGER trg_bil_ledger_cp AFTER INSERT OR UPDATE OR DELETE ON bil_tenant_ledger "
+        "FOR EACH ROW EXECUTE PROCEDURE bil_ledger_cp_invalidate()",
+    ),
+}
+
+_CENTS_SUM = "COALESCE(SUM(CAST(ROUND(COALESCE(amount, 0) * 100) AS BIGINT)), 0)"
+
+_SQL_LAST_CHECKPOINT = text("""
+    SELECT month, balance_cents, row_count
+    FROM bil_ledger_checkpoint
+    WHERE tenant_id = :tid AND month < :m
+    ORDER BY month DESC
+    LIMIT 1
+""")
+
+# months after the last checkpoint before :m, summed and saved in one statement
+# so no ledger write can land between reading the sums and saving them
+_SQL_FILL = text(f"""
+    WITH last AS (
+        SELECT month, balance_cents, row_count
+        FROM bil_ledger_checkpoint
+        WHERE tenant_id = :tid AND month < :m
+        ORDER BY month DESC
+        LIMIT 1
+    ), totals AS (
+        SELECT {_MONTH_OF.format(col="txn_date")} AS mon, {_CENTS_SUM} AS cents, COUNT(*) AS n
+        FROM bil_tenant_ledger
+        WHERE tenant_id = :tid AND txn_date IS NOT NULL AND txn_date < :upto
+          AND {_MONTH_OF.format(col="txn_date")} > COALESCE((SELECT month FROM last), '')
+        GROUP BY {_MONTH_OF.format(col="txn_date")}
+    )
+    INSERT INTO bil_ledger_checkpoint (tenant_id, month, balance_cents, row_count)
+    SELECT :tid, mon,
+           COALESCE((SELECT balance_cents FROM last), 0) + SUM(cents) OVER (ORDER BY mon),
+           COALESCE((SELECT row_count FROM last), 0) + SUM(n) OVER (ORDER BY mon)
+    FROM totals
+    WHERE 1 = 1
+    ON CONFLICT (tenant_id, month) DO NOTHING
+""")
+
+_SQL_TRY_LOCK = text(f"SELECT pg_try_advisory_xact_lock({_LOCK_CLASS}, :tid)")
+
+_SQL_SUM_BEFORE = f"""
+    SELECT {_CENTS_SUM}
+    FROM bil_tenant_ledger
+    WHERE tenant_id = :tid AND txn_date IS NOT NULL {{since}} {{before}}
+"""
+
+_SQL_LAST_KEY = text("""
+    SELECT txn_date, id FROM bil_tenant_ledger
+    WHERE tenant_id = :tid AND txn_date IS NOT NULL
+    ORDER BY txn_date DESC, id DESC
+    LIMIT 1
+""")
+
+_SQL_PAGE = """
+    SELECT id, txn_date, month, description, kind, amount, ref
+    FROM bil_tenant_ledger
+    WHERE tenant_id = :tid AND txn_date IS NOT NULL {where}
+    ORDER BY txn_date {dir}, id {dir}
+    LIMIT :lim
+"""
+
+_SQL_EXISTS = """
+    SELECT 1 FROM bil_tenant_ledger
+    WHERE tenant_id = :tid AND txn_date IS NOT NULL {where}
+    LIMIT 1
+"""
+
+_AFTER = "AND (txn_date > :kd OR (txn_date = :kd AND id > :kid))"
+_BEFORE = "AND (txn_date < :kd OR (txn_date = :kd AND id < :kid))"
+
+
+class LedgerPage(NamedTuple):
+    rows: list[dict]
+    opening: Decimal           # balance before the first row (range start when empty)
+    closing: Decimal           # balance after the last row
+    prev_cursor: str | None    # pass as before= for the previous page
+    next_cursor: str | None    # pass as after= for the next page
+
+
+# ---- helpers -----------------------------------------------------------------
+def _iso(v) -> str:
+    if isinstance(v, datetime):
+        return v.isoformat(sep=" ")
+    if isinstance(v, date):
+        return v.isoformat()
+    return str(v)
+
+
+def _next_day(d) -> str:
+    return (datetime.strptime(_iso(d)[:10], "%Y-%m-%d").date() + timedelta(days=1)).isoformat()
+
+
+def _first_of(month: str) -> str:
+    return f"{month}-01"
+
+
+def _next_month(month: str) -> str:
+    y, m = int(month[:4]), int(month[5:7])
+    return f"{y + (m == 12):04d}-{(m % 12) + 1:02d}"
+
+
+def _money(cents: int) -> Decimal:
+    return (Decimal(int(cents or 0)) * _CENTS).quantize(_CENTS)
+
+
+def _amount(v) -> Decimal:
+    return Decimal(str(v or 0)).quantize(_CENTS)
+
+
+def encode_cursor(key: tuple) -> str:
+    return f"{_iso(key[0])}|{int(key[1])}"
+
+
+def decode_cursor(cursor: str | None) -> tuple[str, int] | None:
+    """'<txn_date>|<id>' -> (txn_date, id); None for a missing / malformed cursor."""
+    d, sep, rid = (cursor or "").rpartition("|")
+    if not sep or not d or not rid.isdigit():
+        return None
+    return d, int(rid)
+
+
+_triggers_installed = False
+
+
+def _enabled() -> bool:
+    """Checkpoints are only used once ensure_ledger_schema() put the triggers in place."""
+    return _triggers_installed
+
+
+# ---- schema ------------------------------------------------------------------
+def ensure_ledger_schema() -> None:
+    """Ledger index, checkpoint table and invalidation triggers (idempotent)."""
+    global _triggers_installed
+    if not inspect(db.engine).has_table("bil_tenant_ledger"):
+        return
+    triggers = _SQL_TRIGGERS.get(db.engine.dialect.name, ())
+    for stmt in _SQL_ENSURE + triggers:
+        db.session.execute(text(stmt))
+    db.session.commit()
+    _triggers_installed = bool(triggers)
+
+
+def rebuild_checkpoints(tenant_id: int | None = None) -> int:
+    """Drop checkpoints (one tenant or all) and fill them again up to each tenant's last month."""
+    if not _enabled():
+        return 0
+    where, params = ("WHERE tenant_id = :tid", {"tid": int(tenant_id)}) if tenant_id else ("", {})
+    db.session.execute(text(f"DELETE FROM bil_ledger_checkpoint {where}"), params)
+    db.session.commit()
+    tids = [int(tenant_id)] if tenant_id else list(db.session.execute(
+        text("SELECT DISTINCT tenant_id FROM bil_tenant_ledger WHERE tenant_id IS NOT NULL")
+    ).scalars())
+    for tid in tids:
+        last = db.session.execute(_SQL_LAST_KEY, {"tid": tid}).first()
+        if last:
+            _fill_checkpoints(tid, _iso(last[0])[:7])
+    return db.session.execute(text(f"SELECT COUNT(*) FROM bil_ledger_checkpoint {where}"), params).scalar() or 0
+
+
+# ---- balances ----------------------------------------------------------------
+def _fill_checkpoints(tenant_id: int, month: str) -> tuple[str, int] | None:
+    """
+    Checkpoint every month before `month` that has rows and none yet; returns the
+    last one as (month, balance_cents), None when the tenant has no checkpoint
+    before it. Runs on its own connection and transaction - the caller's session
+    is left alone - and never waits: when a ledger write of the tenant is in
+    flight (PostgreSQL lock held, SQLite database busy) only the existing
+    checkpoints are used.
+    """
+    params = {"tid": tenant_id, "m": month, "upto": _first_of(month)}
+    with db.engine.connect() as conn:
+        sqlite = conn.dialect.name == "sqlite"
+        busy = conn.exec_driver_sql("PRAGMA busy_timeout").scalar() if sqlite else None
+        try:
+            if sqlite:
+                conn.exec_driver_sql("PRAGMA busy_timeout = 0")
+            if conn.dialect.name != "postgresql" or conn.execute(_SQL_TRY_LOCK, params).scalar():
+                conn.execute(_SQL_FILL, params)
+            last = conn.execute(_SQL_LAST_CHECKPOINT, params).first()
+            conn.commit()
+        except Exception:
+            conn.rollback()  # read-only database / busy: fall back to what is saved
+            last = conn.execute(_SQL_LAST_CHECKPOINT, params).first()
+            conn.rollback()
+        finally:
+            if sqlite:
+                conn.exec_driver_sql(f"PRAGMA busy_timeout = {int(busy or 0)}")
+    return (last[0], int(last[1])) if last else None
+
+
+def balance_before(tenant_id: int, key: tuple | None = None) -> Decimal:
+    """Balance of every row ordered before key=(txn_date, id); key=None: the closing balance."""
+    tid = int(tenant_id)
+    if key is None:
+        last = db.session.execute(_SQL_LAST_KEY, {"tid": tid}).first()
+        if not last:
+            return _money(0)
+        key = (last[0], int(last[1]) + 1)
+    kd = _iso(key[0])
+    params = {"tid": tid, "kd": kd, "kid": int(key[1])}
+
+    base, since = 0, ""
+    if _enabled():
+        cp = _fill_checkpoints(tid, kd[:7])
+        if cp:
+            base = cp[1]
+            since = "AND txn_date >= :since"
+            params["since"] = _first_of(_next_month(cp[0]))
+    sql = _SQL_SUM_BEFORE.format(since=since, before=_BEFORE)
+    return _money(base + int(db.session.execute(text(sql), params).scalar() or 0))
+
+
+def closing_balance(tenant_id: int) -> Decimal:
+    return balance_before(tenant_id)
+
+
+# ---- pages -------------------------------------------------------------------
+def _exists(where: str, params: dict, key: tuple) -> bool:
+    q = {**params, "kd": _iso(key[0]), "kid": int(key[1])}
+    return db.session.execute(text(_SQL_EXISTS.format(where=where)), q).first() is not None
+
+
+def ledger_page(tenant_id: int, *, start: str | None = None, end: str | None = None,
+                after: str | None = None, before: str | None = None, newest: bool = False,
+                limit: int = PAGE_SIZE) -> LedgerPage:
+    """
+    One page of a tenant's ledger in (txn_date, id) order with running balances.
+      start / end      inclusive 'YYYY-MM-DD' range (either may be None)
+      after / before   cursors from a previous page (next / previous page)
+      newest           with no cursor: the last page instead of the first
+    """
+    tid = int(tenant_id)
+    limit = max(1, int(limit))
+    rng, params = "", {"tid": tid}
+    if start:
+        rng += " AND txn_date >= :s"
+        params["s"] = start
+    if end:
+        rng += " AND txn_date < :e"
+        params["e"] = _next_day(end)
+
+    a, b = decode_cursor(after), decode_cursor(before)
+    if a:
+        where, order, key = rng + " " + _AFTER, "ASC", a
+    elif b:
+        where, order, key = rng + " " + _BEFORE, "DESC", b
+    else:
+        where, order, key = rng, "DESC" if newest else "ASC", None
+    q = {**params, "lim": limit + 1}
+    if key:
+        q.update(kd=key[0], kid=key[1])
+    rows = db.session.execute(text(_SQL_PAGE.format(where=where, dir=order)), q).mappings().all()
+    more = len(rows) > limit
+    rows = list(rows[:limit])
+    if order == "DESC":
+        rows.reverse()
+
+    if rows:
+        first, last = (rows[0]["txn_date"], rows[0]["id"]), (rows[-1]["txn_date"], rows[-1]["id"])
+        opening = balance_before(tid, first)
+    elif a:
+        opening = balance_before(tid, (a[0], a[1] + 1))
+    elif b:
+        opening = balance_before(tid, b)
+    elif start:
+        opening = balance_before(tid, (start, 0))
+    else:
+        opening = _money(0)
+
+    out, bal = [], opening
+    for r in rows:
+        amt = _amount(r["amount"])
+        bal += amt
+        out.append({
+            "id": r["id"],
+            "txn_date": r["txn_date"],
+            "month": r["month"],
+            "description": r["description"],
+            "kind": r["kind"],
+            "amount": amt,
+            "ref": r["ref"],
+            "balance": bal,
+        })
+
+    prev_cursor = next_cursor = None
+    if rows:
+        if more if order == "DESC" else _exists(rng + " " + _BEFORE, params, first):
+            prev_cursor = encode_cursor(first)
+        if more if order == "ASC" else _exists(rng + " " + _AFTER, params, last):
+            next_cursor = encode_cursor(last)
+    return LedgerPage(out, opening, bal, prev_cursor, next_cursor)
@@ -93,18 +93,27 @@ def send_loss_report_email(*, to: str, run_id: int, user_id: int, pdf_url: str,
 
     msg = Message(subject=subject, recipients=[to], body=body)
 
-    # Attach PDF bytes (fetch from our own absolute URL)
+    # Attach PDF bytes: prefer the cached artifact the download serves
     pdf_bytes = None
     try:
-        with urlopen(pdf_url, timeout=20) as resp:
-            if resp.status == 200:
-                pdf_bytes = resp.read()
-            else:
-                current_app.logger.warning("PDF fetch returned status %s for %s", resp.status, pdf_url)
-    except (HTTPError, URLError) as e:
-        current_app.logger.exception("Failed to fetch PDF for attachment: %s", e)
+        from app.subject_loss.routes import _build_pdf_bytes  # late import avoids circulars
+        # not a request: wait the pool's full PDF_RENDER_WAIT rather than the short one
+        pdf_bytes = _build_pdf_bytes(run_id, user_id, timeout=None)
     except Exception as e:
-        current_app.logger.exception("Unexpected error fetching PDF: %s", e)
+        current_app.logger.warning("Cached PDF build failed for run=%s: %s", run_id, e)
+
+    # ...else fetch from our own absolute URL
+    if not pdf_bytes:
+        try:
+            with urlopen(pdf_url, timeout=20) as resp:
+                if resp.status == 200:
+                    pdf_bytes = resp.read()
+                else:
+                    current_app.logger.warning("PDF fetch returned status %s for %s", resp.status, pdf_url)
+        except (HTTPError, URLError) as e:
+            current_app.logger.exception("Failed to fetch PDF for attachment: %s", e)
+        except Exception as e:
+            current_app.logger.exception("Unexpected error fetching PDF: %s", e)
 
     if pdf_bytes:
         filename = f"LOSS-Report-Run-{run_id}.pdf"
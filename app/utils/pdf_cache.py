@@ -0,0 +1,245 @@
+# app/utils/pdf_cache.py
+"""
+Content-addressed on-disk cache for rendered LOSS report PDFs.
+
+Key = sha256(run_id, user_id, hash of the lca_result row, hash of the user's
+printed details, content version, template version) where the content
+version is the LOSS content store's signature (changes on every re-seed, the
+same in every worker - its per-process counter is not) and the template
+version is a fingerprint (path, size, mtime) of the report templates + PDF
+CSS, plus the optional LOSS_PDF_TEMPLATE_VERSION config string. The "user"
+table has no updated_at, so the user part hashes the name and email the
+report prints instead.
+
+Files live in <instance>/pdf_cache/<key>.pdf. The directory is bounded by
+LOSS_PDF_CACHE_MAX_MB; least-recently-used files (mtime is touched on every
+hit) are evicted first. Download, email and archive paths all read the same
+artifact, so a report is rendered once per (run, result, template) state.
+"""
+from __future__ import annotations
+
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Callable
+
+from flask import current_app
+from sqlalchemy import text
+
+from app.extensions import db
+
+# files whose changes must invalidate cached PDFs (relative to app.root_path/..)
+FINGERPRINT_GLOBS = (
+    "templates/subject/loss/**/*.html",
+    "templates/shared/**/*.html",
+    "static/pdf/*.css",
+)
+
+
+class PdfCache:
+    def __init__(self, subdir: str = "pdf_cache"):
+        self.subdir = subdir
+        self._lock = threading.Lock()
+        self._fp: tuple[float, str] | None = None   # (computed_at, fingerprint)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.errors = 0
+
+    # ---- locations / keys ----------------------------------------------------
+    def directory(self) -> Path:
+        base = current_app.config.get("LOSS_PDF_CACHE_DIR") or os.path.join(current_app.instance_path, self.subdir)
+        p = Path(base)
+        p.mkdir(parents=True, exist_ok=True)
+        return p
+
+    def _max_bytes(self) -> int:
+        return int(float(current_app.config.get("LOSS_PDF_CACHE_MAX_MB", 200)) * 1024 * 1024)
+
+    def template_version(self) -> str:
+        """Fingerprint of report templates + CSS; re-stat at most every 10 s."""
+        now = time.monotonic()
+        fp = self._fp
+        if fp and now - fp[0] < 10:
+            return fp[1]
+        root = Path(current_app.root_path).parent
+        h = hashlib.sha256()
+        h.update(str(current_app.config.get("LOSS_PDF_TEMPLATE_VERSION", "")).encode())
+        seen = set()
+        for pattern in FINGERPRINT_GLOBS:
+            for f in sorted(root.glob(pattern)):
+                if f in seen or not f.is_file():
+                    continue
+                seen.add(f)
+                st = f.stat()
+                h.update(f"{f.relative_to(root)}|{st.st_size}|{st.st_mtime_ns}\n".encode())
+        ver = h.hexdigest()[:16]
+        self._fp = (now, ver)
+        return ver
+
+    @staticmethod
+    def result_hash(run_id: int) -> str:
+        row = db.session.execute(text("""
+            SELECT phase_1, phase_2, phase_3, phase_4, total, created_at
+            FROM lca_result
+            WHERE run_id = :rid
+            ORDER BY id DESC
+            LIMIT 1
+        """), {"rid": run_id}).first()
+        raw = "none" if row is None else "|".join("" if v is None else str(v) for v in row)
+        return hashlib.sha256(raw.encode()).hexdigest()[:16]
+
+    @staticmethod
+    def user_hash(user_id: int | None) -> str:
+        if not user_id:
+            return ""
+        row = db.session.execute(text('SELECT name, email FROM "user" WHERE id = :uid'),
+                                 {"uid": int(user_id)}).first()
+        raw = "none" if row is None else "|".join("" if v is None else str(v) for v in row)
+        return hashlib.sha256(raw.encode()).hexdigest()[:16]
+
+    @staticmethod
+    def content_version() -> str:
+        from app.admin.loss.content_store import get_loss_content
+
+        sig = get_loss_content().signature
+        return hashlib.sha256(repr(sig).encode()).hexdigest()[:16]
+
+    def key(self, run_id: int, user_id: int | None) -> str:
+        parts = (f"loss|{int(run_id)}|{user_id or ''}|{self.result_hash(run_id)}|{self.user_hash(user_id)}"
+                 f"|{self.content_version()}|{self.template_version()}")
+        return hashlib.sha256(parts.encode()).hexdigest()
+
+    def path_for(self, key: str) -> Path:
+        return self.directory() / f"{key}.pdf"
+
+    # ---- read / write --------------------------------------------------------
+    def get(self, key: str) -> bytes | None:
+        p = self.path_for(key)
+        try:
+            data = p.read_bytes()
+        except FileNotFoundError:
+            return None
+        except OSError:
+            self.errors += 1
+            return None
+        try:
+            os.utime(p, None)   # LRU: mark as recently used
+        except OSError:
+            pass
+        return data
+
+    def put(self, key: str, data: bytes) -> Path:
+        d = self.directory()
+        fd, tmp = tempfile.mkstemp(dir=d, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as fh:
+                fh.write(data)
+            dst = self.path_for(key)
+            os.replace(tmp, dst)    # atomic; concurrent writers of the same key are harmless
+        except Exception:
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+            raise
+        self._evict()
+        return dst
+
+    def _evict(self) -> None:
+        limit = self._max_bytes()
+        with self._lock:
+            files = []
+            total = 0
+            for f in self.directory().glob("*.pdf"):
+                try:
+                    st = f.stat()
+                except OSError:
+                    continue
+                files.append((st.st_mtime, st.st_size, f))
+                total += st.st_size
+            if total <= limit:
+                return
+            files.sort()   # oldest use first
+            for _, size, f in files:
+                if total <= limit:
+                    break
+                try:
+                    f.unlink()
+                    total -= size
+                    self.evictions += 1
+                except OSError:
+                    pass
+
+    def lookup(self, run_id: int, user_id: int | None) -> tuple[str, bytes | None]:
+        """(key, cached bytes or None) for this run's current state; counts hit/miss."""
+        key = self.key(run_id, user_id)
+        data = self.get(key)
+        if data is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return key, data
+
+    def get_or_render(self, run_id: int, user_id: int | None, render: Callable[[], bytes | None]) -> bytes | None:
+        """Return cached bytes for this run's current state, rendering once on a miss."""
+        key, data = self.lookup(run_id, user_id)
+        if data is not None:
+            return data
+        data = render()
+        if data:
+            try:
+                self.put(key, data)
+            except Exception as e:
+                self.errors += 1
+                current_app.logger.warning("[pdf_cache] write failed for run %s: %s", run_id, e)
+        return data
+
+    def copy_to(self, run_id: int, user_id: int | None, dest_dir: str, filename: str) -> str | None:
+        """Archive path: copy the cached artifact instead of re-rendering."""
+        src = self.path_for(self.key(run_id, user_id))
+        if not src.exists():
+            return None
+        os.makedirs(dest_dir, exist_ok=True)
+        dst = os.path.join(dest_dir, filename)
+        shutil.copyfile(src, dst)
+        return dst
+
+    def clear(self) -> int:
+        n = 0
+        for f in self.directory().glob("*.pdf"):
+            try:
+                f.unlink()
+                n += 1
+            except OSError:
+                pass
+        return n
+
+    def stats(self) -> dict:
+        files = list(self.directory().glob("*.pdf"))
+        size = 0
+        for f in files:
+            try:
+                size += f.stat().st_size
+            except OSError:
+                pass
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 3) if lookups else None,
+            "evictions": self.evictions,
+            "errors": self.errors,
+            "files": len(files),
+            "bytes": size,
+            "max_bytes": self._max_bytes(),
+            "template_version": self.template_version(),
+            "content_version": self.content_version(),
+        }
+
+
+loss_pdf_cache = PdfCache()
@@ -363,7 +363,8 @@ def static_media_url(filename: str) -> str:
 
 def dashboard_context(email: str):
     """Builds the dashboard view-model once for both learner/admin."""
-    lessons = _lessons()                 # you already have this
+    from app.subject_reading.lesson_state import get_lesson_catalog
+    lessons = get_lesson_catalog().lessons   # cached, ordered
     prog_map = _progress_map(email)      # you already have this
 
     items = []
@@ -0,0 +1,484 @@
+# app/utils/recon_engine.py
+"""
+Municipal reconciliation: v_recon_left (bank) against v_recon_right (receipts).
+
+muni_recon_auto used to bucket one month's unmatched rows by rounded amount,
+scan each bucket linearly for a right row within 3 days (parsing both dates
+on every comparison), fall back to the first row of the bucket, and run one
+INSERT per pair; the recon page ran the two NOT EXISTS unmatched queries on
+every view. Now:
+
+    load_pool()        both sides of a date range in one query each (matched
+                       ids excluded by one uncorrelated NOT IN), dates parsed
+                       once to day numbers, amounts held as integer cents;
+                       per side a date-sorted list and per amount a
+                       date-sorted bucket, searched with bisect
+    rules              run in order over what is still unmatched:
+                         ExactRef          same reference and amount
+                         AmountDateWindow  same amount, nearest date within
+                                           +-days (days=None: any date - the
+                                           old fallback)
+                         SplitRule         2..max_parts rows on one side that
+                                           add up to one row on the other,
+                                           within +-days
+    reconcile()        every rule over the range, then one executemany into
+                       muni_recon_match; the pairs that actually landed are
+                       read back, and the unmatched index is rebuilt from
+                       the database, not from the in-memory pool
+
+The unique constraint on muni_recon_match lives outside this repo and is not
+assumed here: the insert is ON CONFLICT DO NOTHING, so a pair the table
+refuses (e.g. a split part reusing the "one" side's id under a one-row-per-id
+constraint) is reported as "dropped", stays unmatched, and takes the rest of
+its split with it - a split is stored whole or not at all.
+
+So a multi-year statement reconciles in one pass: rows are assigned to the
+month session (muni_recon_session, label YYYY-MM) of their txn_date, and a
+pair may cross a month end. A row matched in any session counts as matched.
+
+muni_recon_unmatched is the persisted unmatched set per session, read by the
+recon page. Each session stores a signature of its inputs (row count / max
+id / amount total of both views in its month, muni_recon_match count / max
+id, its exclusions); unmatched() rebuilds the set when it no longer agrees,
+so manual matches, unmatches and newly imported statements show up without
+the routes having to invalidate anything.
+
+    flask muni-recon --from YYYY-MM [--to YYYY-MM] [--days 3] [--rule ...] [--dry-run]
+"""
+from __future__ import annotations
+
+import calendar
+from bisect import bisect_left, bisect_right
+from datetime import date
+from itertools import combinations
+from typing import NamedTuple
+
+from sqlalchemy import bindparam, inspect, text
+
+from app.extensions import db
+from app.utils.consumption_engine import month_span
+
+LEFT, RIGHT = "v_recon_left", "v_recon_right"
+SIDES = {"left": LEFT, "right": RIGHT}
+DEFAULT_DAYS = 3
+REF_COLUMNS = ("ref", "reference")
+
+_SQL_ENSURE = (
+    """CREATE TABLE IF NOT EXISTS muni_recon_unmatched (
+        session_id INTEGER NOT NULL,
+        side VARCHAR(5) NOT NULL,
+        src_id INTEGER NOT NULL,
+        txn_date VARCHAR(10),
+        description TEXT,
+        amount NUMERIC(14, 2),
+        amount_cents BIGINT NOT NULL,
+        PRIMARY KEY (session_id, side, src_id)
+    )""",
+    """CREATE TABLE IF NOT EXISTS muni_recon_unmatched_state (
+        session_id INTEGER PRIMARY KEY,
+        signature TEXT NOT NULL
+    )""",
+)
+
+_DAY = "substr(CAST({col} AS TEXT), 1, 10)"
+
+_SQL_SIDE = f"""
+    SELECT s.id, s.txn_date, s.description, s.amount {{ref}}
+    FROM {{view}} s
+    WHERE {_DAY.format(col="s.txn_date")} BETWEEN :d1 AND :d2
+      AND s.id NOT IN (
+          SELECT m.{{side}}_id FROM muni_recon_match m
+          WHERE m.{{side}}_src = :src AND m.{{side}}_id IS NOT NULL
+      )
+"""
+
+_SQL_EXCLUSIONS = text("""
+    SELECT session_id, side, src_id FROM muni_recon_exclusion
+    WHERE session_id IN :sids AND src IN :srcs
+""").bindparams(bindparam("sids", expanding=True), bindparam("srcs", expanding=True))
+
+_SQL_SIGNATURE = text(f"""
+    SELECT
+        (SELECT COUNT(*) FROM {LEFT} WHERE {_DAY.format(col="txn_date")} BETWEEN :d1 AND :d2),
+        (SELECT MAX(id) FROM {LEFT} WHERE {_DAY.format(col="txn_date")} BETWEEN :d1 AND :d2),
+        (SELECT SUM(amount) FROM {LEFT} WHERE {_DAY.format(col="txn_date")} BETWEEN :d1 AND :d2),
+        (SELECT COUNT(*) FROM {RIGHT} WHERE {_DAY.format(col="txn_date")} BETWEEN :d1 AND :d2),
+        (SELECT MAX(id) FROM {RIGHT} WHERE {_DAY.format(col="txn_date")} BETWEEN :d1 AND :d2),
+        (SELECT SUM(amount) FROM {RIGHT} WHERE {_DAY.format(col="txn_date")} BETWEEN :d1 AND :d2),
+        (SELECT COUNT(*) FROM muni_recon_match),
+        (SELECT MAX(id) FROM muni_recon_match),
+        (SELECT COUNT(*) FROM muni_recon_exclusion WHERE session_id = :sid)
+""")
+
+_SQL_INSERT_MATCH = text(f"""
+    INSERT INTO muni_recon_match (session_id, left_src, left_id, right_src, right_id, amount, rule)
+    VALUES (:sid, '{LEFT}', :lid, '{RIGHT}', :rid, :amt, :rule)
+    ON CONFLICT DO NOTHING
+""")
+
+_SQL_STORED_MATCHES = text(f"""
+    SELECT left_id, right_id FROM muni_recon_match
+    WHERE left_src = '{LEFT}' AND right_src = '{RIGHT}' AND left_id IN :lids
+""").bindparams(bindparam("lids", expanding=True))
+
+_SQL_DELETE_MATCH = text(f"""
+    DELETE FROM muni_recon_match
+    WHERE session_id = :sid AND left_src = '{LEFT}' AND left_id = :lid
+      AND right_src = '{RIGHT}' AND right_id = :rid AND rule = :rule
+""")
+
+_SQL_INSERT_UNMATCHED = text("""
+    INSERT INTO muni_recon_unmatched (session_id, side, src_id, txn_date, description, amount, amount_cents)
+    VALUES (:sid, :side, :id, :txn_date, :description, :amount, :cents)
+""")
+
+_SQL_SAVE_STATE = text("""
+    INSERT INTO muni_recon_unmatched_state (session_id, signature) VALUES (:sid, :sig)
+    ON CONFLICT (session_id) DO UPDATE SET signature = excluded.signature
+""")
+
+_SQL_READ_UNMATCHED = text("""
+    SELECT src_id AS id, txn_date, description, amount
+    FROM muni_recon_unmatched
+    WHERE session_id = :sid AND side = :side
+    ORDER BY txn_date, src_id
+""")
+
+
+def ensure_recon_schema() -> None:
+    """Unmatched-set index tables (the muni_recon_* tables themselves predate this)."""
+    for stmt in _SQL_ENSURE:
+        db.session.execute(text(stmt))
+    db.session.commit()
+
+
+def month_bounds(label: str) -> tuple[str, str]:
+    y, m = int(label[:4]), int(label[5:7])
+    return f"{label[:7]}-01", f"{label[:7]}-{calendar.monthrange(y, m)[1]:02d}"
+
+
+def session_ids(labels) -> dict[str, int]:
+    """Session id per month label, creating the missing sessions in one statement."""
+    labels = sorted(set(labels))
+    if not labels:
+        return {}
+    db.session.execute(
+        text("INSERT INTO muni_recon_session (label) SELECT :lbl "
+             "WHERE NOT EXISTS (SELECT 1 FROM muni_recon_session WHERE label = :lbl)"),
+        [{"lbl": lbl} for lbl in labels],
+    )
+    rows = db.session.execute(
+        text("SELECT label, id FROM muni_recon_session WHERE label IN :lbls")
+        .bindparams(bindparam("lbls", expanding=True)),
+        {"lbls": labels},
+    ).all()
+    return {r[0]: int(r[1]) for r in rows}
+
+
+# ---- pool --------------------------------------------------------------------
+class Item(NamedTuple):
+    side: str
+    id: int
+    day: int            # date.toordinal()
+    cents: int          # abs(amount) in cents
+    txn_date: str
+    description: str | None
+    amount: float
+    ref: str | None
+    session_id: int
+
+
+class Match(NamedTuple):
+    left: Item
+    right: Item
+    cents: int
+    rule: str
+    session_id: int
+    group: tuple[str, int] | None = None    # SplitRule: the "one" side's (side, id)
+
+
+def _cents(v) -> int:
+    return abs(int(round(float(v or 0) * 100)))
+
+
+def _norm_ref(v) -> str | None:
+    s = "".join(str(v).split()).upper() if v is not None else ""
+    return s or None
+
+
+class Pool:
+    """Unmatched rows of both sides, date-sorted per side and per amount; take() removes."""
+
+    def __init__(self, items):
+        self.taken: set[tuple[str, int]] = set()
+        self.items: dict[str, list[Item]] = {"left": [], "right": []}
+        for it in items:
+            self.items[it.side].append(it)
+        self.days: dict[str, list[int]] = {}
+        self.buckets: dict[str, dict[int, tuple[list[int], list[Item]]]] = {}
+        for side, rows in self.items.items():
+            rows.sort(key=lambda it: (it.day, it.id))
+            self.days[side] = [it.day for it in rows]
+            by_amount: dict[int, list[Item]] = {}
+            for it in rows:
+                by_amount.setdefault(it.cents, []).append(it)
+            self.buckets[side] = {c: ([it.day for it in v], v) for c, v in by_amount.items()}
+
+    def free(self, it: Item) -> bool:
+        return (it.side, it.id) not in self.taken
+
+    def take(self, *items: Item) -> None:
+        self.taken.update((it.side, it.id) for it in items)
+
+    def window(self, side: str, lo: int | None, hi: int | None, cents: int | None = None) -> list[Item]:
+        """Free rows of `side` dated lo..hi (None: open), of one amount when `cents` is given."""
+        if cents is None:
+            days, rows = self.days[side], self.items[side]
+        else:
+            days, rows = self.buckets[side].get(cents, ((), ()))
+        i = 0 if lo is None else bisect_left(days, lo)
+        j = len(days) if hi is None else bisect_right(days, hi)
+        return [it for it in rows[i:j] if self.free(it)]
+
+    def remaining(self, side: str) -> list[Item]:
+        return [it for it in self.items[side] if self.free(it)]
+
+
+# ---- rules -------------------------------------------------------------------
+class ExactRef:
+    """Same reference (case / whitespace ignored) and amount; nearest date wins."""
+
+    name = "auto:ref"
+
+    def __call__(self, pool: Pool) -> list[Match]:
+        by_ref: dict[tuple[str, int], list[Item]] = {}
+        for r in pool.remaining("right"):
+            if r.ref:
+                by_ref.setdefault((r.ref, r.cents), []).append(r)
+        out = []
+        for left in pool.remaining("left"):
+            cands = [r for r in by_ref.get((left.ref, left.cents), ()) if pool.free(r)] if left.ref else ()
+            if cands:
+                pick = min(cands, key=lambda r: (abs(r.day - left.day), r.day, r.id))
+                pool.take(left, pick)
+                out.append(Match(left, pick, left.cents, self.name, left.session_id))
+        return out
+
+
+class AmountDateWindow:
+    """
+    Same amount, nearest date within +-days (days=None: any date). Left rows
+    are taken in date order; when the earliest candidate is out of reach of
+    the next left row of the bucket it is taken instead of the nearest, so a
+    bucket pairs as many rows as the window allows.
+    """
+
+    def __init__(self, days: int | None = DEFAULT_DAYS):
+        self.days = days
+        self.name = "auto:amount" if days is None else f"auto:amount+date±{days}d"
+
+    def __call__(self, pool: Pool) -> list[Match]:
+        d = self.days
+        out = []
+        for cents, (_, lefts) in pool.buckets["left"].items():
+            if cents not in pool.buckets["right"]:
+                continue
+            live = [it for it in lefts if pool.free(it)]
+            for i, left in enumerate(live):
+                cands = pool.window("right", None if d is None else left.day - d,
+                                    None if d is None else left.day + d, cents)
+                if not cands:
+                    continue
+                pick = min(cands, key=lambda r: (abs(r.day - left.day), r.day, r.id))
+                if d is not None and i + 1 < len(live):
+                    reach = live[i + 1].day - d
+                    if cands[0].day < reach <= pick.day:
+                        pick = cands[0]
+                pool.take(left, pick)
+                out.append(Match(left, pick, cents, self.name, left.session_id))
+        return out
+
+
+class SplitRule:
+    """
+    2..max_parts rows on one side adding up exactly to one row on the other,
+    all within +-days of it. Candidates are the max_candidates nearest free
+    rows; the fewest parts win, then the smallest spread of dates. Each part
+    is stored as its own muni_recon_match row with the part's amount.
+    """
+
+    def __init__(self, days: int = DEFAULT_DAYS, max_parts: int = 3, max_candidates: int = 16):
+        self.days = days
+        self.max_parts = max_parts
+        self.max_candidates = max_candidates
+        self.name = f"auto:split±{days}d"
+
+    def _parts(self, one: Item, cands: list[Item]) -> tuple[Item, ...] | None:
+        cands = sorted((c for c in cands if 0 < c.cents < one.cents),
+                       key=lambda c: (abs(c.day - one.day), c.day, c.id))[: self.max_candidates]
+        for k in range(2, self.max_parts + 1):
+            best, best_key = None, None
+            for combo in combinations(cands, k):
+                if sum(c.cents for c in combo) != one.cents:
+                    continue
+                key = (max(abs(c.day - one.day) for c in combo), sum(abs(c.day - one.day) for c in combo))
+                if best_key is None or key < best_key:
+                    best, best_key = combo, key
+            if best:
+                return best
+        return None
+
+    def __call__(self, pool: Pool) -> list[Match]:
+        out = []
+        for one_side, many_side in (("right", "left"), ("left", "right")):
+            for one in pool.remaining(one_side):
+                parts = self._parts(one, pool.window(many_side, one.day - self.days, one.day + self.days))
+                if not parts:
+                    continue
+                pool.take(one, *parts)
+                for p in parts:
+                    left, right = (p, one) if one_side == "right" else (one, p)
+                    out.append(Match(left, right, p.cents, self.name, one.session_id, (one.side, one.id)))
+        return out
+
+
+RULES = {
+    "ref": lambda days: ExactRef(),
+    "window": lambda days: AmountDateWindow(days),
+    "split": lambda days: SplitRule(days),
+    "amount": lambda days: AmountDateWindow(None),
+}
+DEFAULT_RULES = ("ref", "window", "split", "amount")
+
+
+def make_rules(names=DEFAULT_RULES, days: int = DEFAULT_DAYS) -> list:
+    return [RULES[n](days) for n in names]
+
+
+# ---- loading -----------------------------------------------------------------
+def _ref_column(view: str) -> str | None:
+    cols = {c["name"] for c in inspect(db.session.connection()).get_columns(view)}
+    return next((c for c in REF_COLUMNS if c in cols), None)
+
+
+def load_pool(date_from: str, date_to: str, sessions: dict[str, int]) -> Pool:
+    """Unmatched, non-excluded rows of both views dated date_from..date_to."""
+    excluded = {(int(r[0]), r[1], int(r[2])) for r in db.session.execute(
+        _SQL_EXCLUSIONS, {"sids": list(sessions.values()) or [0], "srcs": [LEFT, RIGHT]})}
+    items = []
+    for side, view in SIDES.items():
+        ref = _ref_column(view)
+        sql = _SQL_SIDE.format(view=view, side=side, ref=f", s.{ref} AS ref" if ref else "")
+        for r in db.session.execute(text(sql), {"d1": date_from, "d2": date_to, "src": view}).mappings():
+            day = str(r["txn_date"])[:10]
+            sid = sessions.get(day[:7])
+            if sid is None or (sid, side, int(r["id"])) in excluded:
+                continue
+            items.append(Item(side, int(r["id"]), date.fromisoformat(day).toordinal(), _cents(r["amount"]),
+                              day, r["description"], float(r["amount"] or 0),
+                              _norm_ref(r["ref"]) if ref else None, sid))
+    return Pool(items)
+
+
+def _signature(session_id: int, date_from: str, date_to: str) -> str:
+    row = db.session.execute(_SQL_SIGNATURE, {"sid": session_id, "d1": date_from, "d2": date_to}).first()
+    return "|".join(str(v) for v in row)
+
+
+def _write_unmatched(pool: Pool, sessions: dict[str, int]) -> None:
+    sids = list(sessions.values())
+    for table in ("muni_recon_unmatched", "muni_recon_unmatched_state"):
+        db.session.execute(text(f"DELETE FROM {table} WHERE session_id IN :sids")
+                           .bindparams(bindparam("sids", expanding=True)), {"sids": sids})
+    rows = [{"sid": it.session_id, "side": it.side, "id": it.id, "txn_date": it.txn_date,
+             "description": it.description, "amount": it.amount, "cents": it.cents}
+            for side in SIDES for it in pool.remaining(side)]
+    if rows:
+        db.session.execute(_SQL_INSERT_UNMATCHED, rows)
+    db.session.execute(_SQL_SAVE_STATE, [{"sid": sid, "sig": _signature(sid, *month_bounds(label))}
+                                         for label, sid in sessions.items()])
+
+
+def _store_matches(matches: list[Match]) -> list[Match]:
+    """Insert `matches`; returns the ones actually stored (whole splits only)."""
+    if not matches:
+        return []
+    params = [{"sid": m.session_id, "lid": m.left.id, "rid": m.right.id,
+               "amt": round(m.cents / 100, 2), "rule": m.rule} for m in matches]
+    db.session.execute(_SQL_INSERT_MATCH, params)
+    # load_pool() excluded every already-matched left id, so any stored pair
+    # with one of these left ids was written just now
+    stored = {(int(r[0]), int(r[1])) for r in db.session.execute(
+        _SQL_STORED_MATCHES, {"lids": sorted({m.left.id for m in matches})})}
+    broken = {m.group for m in matches if m.group and (m.left.id, m.right.id) not in stored}
+    if broken:
+        db.session.execute(_SQL_DELETE_MATCH, [p for m, p in zip(matches, params)
+                                               if m.group in broken and (m.left.id, m.right.id) in stored])
+    return [m for m in matches if (m.left.id, m.right.id) in stored and m.group not in broken]
+
+
+# ---- entry points ------------------------------------------------------------
+def reconcile(date_from: str, date_to: str, *, rules=None, days: int = DEFAULT_DAYS,
+              dry_run: bool = False) -> dict:
+    """
+    Run `rules` (default make_rules(days=days)) over everything unmatched in
+    date_from..date_to ('YYYY-MM-DD') and store the matches. Returns
+    {"from", "to", "sessions", "left", "right", "matched", "dropped",
+    "by_rule": {rule: rows}, "unmatched_left", "unmatched_right"}; "matched"
+    counts the rows muni_recon_match accepted, "dropped" the ones it refused.
+    With dry_run=True nothing is written and "matches" lists the pairs.
+    """
+    try:
+        sessions = session_ids(month_span(date_from[:7], date_to[:7]))
+        pool = load_pool(date_from, date_to, sessions)
+        matches: list[Match] = []
+        for rule in rules if rules is not None else make_rules(days=days):
+            matches.extend(rule(pool))
+
+        report = {
+            "from": date_from, "to": date_to, "sessions": len(sessions),
+            "left": len(pool.items["left"]), "right": len(pool.items["right"]), "dropped": 0,
+        }
+        if not dry_run:
+            stored = _store_matches(matches)
+            report["dropped"] = len(matches) - len(stored)
+            matches = stored
+            pool = load_pool(date_from, date_to, sessions)
+            _write_unmatched(pool, sessions)
+        report["matched"] = len(matches)
+        report["by_rule"] = {}
+        for m in matches:
+            report["by_rule"][m.rule] = report["by_rule"].get(m.rule, 0) + 1
+        report["unmatched_left"] = len(pool.remaining("left"))
+        report["unmatched_right"] = len(pool.remaining("right"))
+        if dry_run:
+            report["matches"] = matches
+            db.session.rollback()
+            return report
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return report
+
+
+def unmatched(label: str) -> tuple[int, list, list]:
+    """(session id, left rows, right rows) still unmatched for a month, from the index."""
+    date_from, date_to = month_bounds(label)
+    sessions = session_ids([label[:7]])
+    sid = sessions[label[:7]]
+    stored = db.session.execute(
+        text("SELECT signature FROM muni_recon_unmatched_state WHERE session_id = :sid"), {"sid": sid}
+    ).scalar()
+    if stored != _signature(sid, date_from, date_to):
+        try:
+            _write_unmatched(load_pool(date_from, date_to, sessions), sessions)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+    else:
+        db.session.commit()  # the session insert, if any
+    left = db.session.execute(_SQL_READ_UNMATCHED, {"sid": sid, "side": "left"}).mappings().all()
+    right = db.session.execute(_SQL_READ_UNMATCHED, {"sid": sid, "side": "right"}).mappings().all()
+    return sid, left, right
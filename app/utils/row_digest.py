@@ -0,0 +1,23 @@
+# app/utils/row_digest.py
+"""
+Change signatures for the per-process snapshots of small, rarely edited tables.
+
+Aggregates such as SUM(rate) or SUM(LENGTH(body)) miss edits that cancel out
+(two swapped amounts, a same-length text change) and every column left out of
+the sum, and these tables carry no updated_at / version column. rows_digest()
+hashes every row instead: any change to any column of any row changes it.
+The tables are small, so streaming them once per TTL is cheap.
+"""
+from __future__ import annotations
+
+import hashlib
+from typing import Iterable
+
+
+def rows_digest(rows: Iterable) -> str:
+    """sha256 over the rows in the order given (ORDER BY a key in the query)."""
+    h = hashlib.sha256()
+    for row in rows:
+        h.update(repr(tuple(row)).encode("utf-8"))
+        h.update(b"\n")
+    return h.hexdigest()
@@ -0,0 +1,278 @@
+# app/utils/tariff_index.py
+"""
+Tariff resolution for billing.
+
+bil_tariff is small and changes rarely, but it was queried per meter, per
+tier, per statement with `date(effective_date) <= ...` filters that can't use
+an index. Instead we load the table once into an immutable snapshot:
+
+    (utility_type, code) -> effective dates (sorted) + rows
+
+and answer "which version of this code applies on date D" with bisect, and
+"effective tiers for utility U in month M" by resolving each code of U.
+
+Caching:
+  - per process: one snapshot, plus a memo of resolved tier lists keyed on
+    (utility, cutoff, prefix, order) that lives and dies with the snapshot
+  - per request: the snapshot is pinned on flask.g so a statement is priced
+    against one consistent tariff set
+  - invalidation: ORM edits of BilTariff drop the snapshot on commit; edits
+    made through raw SQL or by another process are caught by re-reading the
+    table at most every TARIFF_INDEX_TTL seconds and comparing a hash of
+    every row (unit, reduction_factor and older versions included) with the
+    snapshot's
+
+Cutoffs are ISO 'YYYY-MM-DD' strings. month_first()/month_last() give the two
+conventions the callers use ("effective by the 1st" vs "effective during the
+month").
+"""
+from __future__ import annotations
+
+import calendar
+import threading
+import time
+from bisect import bisect_right
+from datetime import date, datetime
+
+from flask import current_app, g, has_app_context, has_request_context
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session
+
+from app.extensions import db
+from app.utils.row_digest import rows_digest
+
+_SQL_ALL = text("SELECT * FROM bil_tariff ORDER BY id")
+
+_NO_END = float("inf")
+
+
+def month_first(month_str: str) -> str:
+    """'YYYY-MM' -> 'YYYY-MM-01'."""
+    return f"{month_str[:7]}-01"
+
+
+def month_last(month_str: str) -> str:
+    """'YYYY-MM' -> last calendar day of that month."""
+    y, m = int(month_str[:4]), int(month_str[5:7])
+    return f"{y:04d}-{m:02d}-{calendar.monthrange(y, m)[1]:02d}"
+
+
+def _iso(v) -> str | None:
+    if v is None:
+        return None
+    if isinstance(v, (date, datetime)):
+        return v.strftime("%Y-%m-%d")
+    s = str(v).strip()[:10]
+    return s if len(s) == 10 and s[4] == "-" else None
+
+
+def _float(v):
+    try:
+        return None if v is None else float(v)
+    except (TypeError, ValueError):
+        return None
+
+
+class TariffIndex:
+    """Immutable snapshot of bil_tariff with per-(utility, code) date index."""
+
+    def __init__(self, rows, version: int, signature: str):
+        by_uc: dict[tuple[str, str], list[tuple[str, int, dict]]] = {}
+        by_code: dict[str, list[tuple[str, int, dict]]] = {}
+        for r in rows:
+            eff = _iso(r.get("effective_date"))
+            if eff is None:
+                continue
+            rf = _float(r.get("reduction_factor"))
+            row = {
+                "id": r.get("id"),
+                "utility_type": r.get("utility_type"),
+                "code": r.get("code"),
+                "description": r.get("description"),
+                "rate": _float(r.get("rate")),
+                "block_start": _float(r.get("block_start")),
+                "block_end": _float(r.get("block_end")),
+                "effective_date": eff,
+                "reduction_factor": 1.0 if rf is None else rf,
+                "reduction_factor_raw": rf,
+                "unit": r.get("unit"),
+            }
+            util = (row["utility_type"] or "").strip().lower()
+            code = (row["code"] or "").strip()
+            # id breaks ties between rows with the same effective date (newest wins)
+            item = (eff, int(row["id"] or 0), row)
+            by_uc.setdefault((util, code), []).append(item)
+            by_code.setdefault(code, []).append(item)
+
+        def _freeze(groups):
+            out = {}
+            for k, items in groups.items():
+                items.sort(key=lambda t: (t[0], t[1]))
+                out[k] = ([t[0] for t in items], [t[2] for t in items])
+            return out
+
+        self._by_uc = _freeze(by_uc)
+        self._by_code = _freeze(by_code)
+        self._codes: dict[str, list[str]] = {}
+        for util, code in self._by_uc:
+            self._codes.setdefault(util, []).append(code)
+        self._memo: dict[tuple, object] = {}
+        self.rows = sum(len(v[0]) for v in self._by_uc.values())
+        self.version = version
+        self.signature = signature
+        self.loaded_at = time.monotonic()
+
+    @staticmethod
+    def _pick(entry, cutoff: str | None) -> dict | None:
+        if entry is None:
+            return None
+        dates, rows = entry
+        i = len(dates) if cutoff is None else bisect_right(dates, cutoff)
+        return rows[i - 1] if i else None
+
+    def resolve(self, code: str, cutoff: str | None = None, utility: str | None = None) -> dict | None:
+        """Latest version of `code` effective on or before `cutoff` (None = latest ever)."""
+        code = (code or "").strip()
+        if utility is None:
+            hit = self._pick(self._by_code.get(code), cutoff)
+        else:
+            hit = self._pick(self._by_uc.get(((utility or "").strip().lower(), code)), cutoff)
+        return dict(hit) if hit else None
+
+    def tiers(self, utility: str, cutoff: str | None = None, prefix: str | None = "tier",
+              order: str = "block_start") -> list[dict]:
+        """
+        Effective rows of `utility` on `cutoff`: one (latest) version per code,
+        optionally only codes starting with `prefix` (case-insensitive), ordered
+        by block_start or block_end (missing/zero ends sort last).
+        """
+        util = (utility or "").strip().lower()
+        key = (util, cutoff, (prefix or "").lower(), order)
+        hit = self._memo.get(key)
+        if hit is None:
+            pfx = (prefix or "").lower()
+            hit = []
+            for code in self._codes.get(util, ()):
+                if pfx and not code.lower().startswith(pfx):
+                    continue
+                r = self._pick(self._by_uc[(util, code)], cutoff)
+                if r is not None:
+                    hit.append(r)
+            if order == "block_end":
+                hit.sort(key=lambda r: (r["block_end"] or _NO_END, r["block_start"] or 0.0, r["code"]))
+            else:
+                hit.sort(key=lambda r: (_NO_END if r["block_start"] is None else r["block_start"],
+                                        r["block_end"] or _NO_END, r["code"]))
+            self._memo[key] = hit
+        return [dict(r) for r in hit]
+
+    def by_code(self, cutoff: str | None = None) -> dict[str, dict]:
+        """{code: latest version effective on `cutoff`} across all utilities."""
+        key = ("*by_code", cutoff)
+        hit = self._memo.get(key)
+        if hit is None:
+            hit = {}
+            for code, entry in self._by_code.items():
+                r = self._pick(entry, cutoff)
+                if r is not None:
+                    hit[code] = r
+            self._memo[key] = hit
+        return {c: dict(r) for c, r in hit.items()}
+
+    def rate(self, code: str, cutoff: str | None = None, utility: str | None = None, default=None):
+        r = self.resolve(code, cutoff, utility)
+        return r["rate"] if r and r["rate"] is not None else default
+
+
+# ---- process-wide cache ------------------------------------------------------
+_lock = threading.Lock()
+_current: TariffIndex | None = None
+_version = 0
+_checked_at = 0.0
+
+
+def _ttl() -> float:
+    if has_app_context():
+        return float(current_app.config.get("TARIFF_INDEX_TTL", 30))
+    return 30.0
+
+
+def invalidate_tariffs() -> None:
+    """Drop the cached snapshot; the next caller reloads bil_tariff."""
+    global _current
+    with _lock:
+        _current = None
+    if has_request_context():
+        g.pop("_tariff_index", None)
+
+
+def _load(force: bool) -> TariffIndex:
+    global _current, _version, _checked_at
+    snap = _current
+    if snap is not None and not force and (time.monotonic() - _checked_at) < _ttl():
+        return snap
+    with _lock:
+        snap = _current
+        rows = [dict(r) for r in db.session.execute(_SQL_ALL).mappings()]
+        sig = rows_digest(r.items() for r in rows)
+        _checked_at = time.monotonic()
+        if snap is not None and not force and snap.signature == sig:
+            return snap
+        _version += 1
+        snap = TariffIndex(rows, _version, sig)
+        _current = snap
+        return snap
+
+
+def get_tariff_index(force: bool = False) -> TariffIndex:
+    """Snapshot for this request (pinned on g) or, outside requests, the process snapshot."""
+    if has_request_context() and not force:
+        snap = g.get("_tariff_index")
+        if snap is None:
+            snap = g._tariff_index = _load(False)
+        return snap
+    snap = _load(force)
+    if has_request_context():
+        g._tariff_index = snap
+    return snap
+
+
+def tariff_index_info() -> dict:
+    snap = _current
+    if snap is None:
+        return {"loaded": False}
+    return {
+        "loaded": True,
+        "version": snap.version,
+        "rows": snap.rows,
+        "memoized": len(snap._memo),
+        "age_s": round(time.monotonic() - snap.loaded_at, 1),
+    }
+
+
+# ---- invalidation on ORM edits -----------------------------------------------
+def _mark_dirty(mapper, connection, target):
+    from sqlalchemy.orm import object_session
+    sess = object_session(target)
+    if sess is not None:
+        sess.info["tariffs_dirty"] = True
+
+
+def _after_commit(session):
+    if session.info.pop("tariffs_dirty", False):
+        invalidate_tariffs()
+
+
+def _after_rollback(session):
+    session.info.pop("tariffs_dirty", None)
+
+
+def _register_listeners():
+    from app.models.billing import BilTariff
+    for ev in ("after_insert", "after_update", "after_delete"):
+        event.listen(BilTariff, ev, _mark_dirty)
+    event.listen(Session, "after_commit", _after_commit)
+    event.listen(Session, "after_soft_rollback", lambda s, prev: _after_rollback(s))
+
+
+_register_listeners()
@@ -0,0 +1,217 @@
+# app/utils/tier_kernel.py
+"""
+Vectorized block-tariff allocation for water (W&S) and sanitation (SD).
+
+Every tier table the billing code uses has the same shape: k blocks with a
+width (L/day, or kL for the few callers that bill per period), a rate per kL
+and, on the sanitation side, a reduction factor. allocate() takes arrays of
+(consumption_kl, days) for n meters and returns (n, k) arrays of allocated kL,
+billed kL (after reduction) and amounts in one pass:
+
+    stacked:  tier j gets what is left after tiers < j, up to its width
+              lower_j = sum(width_<j) * scale,  take = clip(cons - lower, 0, width*scale)
+    window:   tier j gets the part of the daily use that falls in [start_j, end_j)
+              lower_j = start_j * scale
+
+with scale = days / 1000 for L/day tables and 1 for kL tables. An open tier
+has width inf. Consumption past the last finite tier is returned as a separate
+overflow column (billed at the last tier's rate and reduction); callers that
+drop it simply ignore it.
+
+Arithmetic is float64; money and quantities cross back into the billing code
+through dec()/money(), which round the shortest float repr with ROUND_HALF_UP,
+so 2.675 -> 2.68 as on the printed statement, not 2.67 as round() gives.
+
+`flask tier-bench` compares allocate() against the per-meter loop it replaced.
+"""
+from __future__ import annotations
+
+import time
+from decimal import ROUND_HALF_UP, Decimal
+from typing import NamedTuple
+
+import numpy as np
+
+STACKED = "stacked"
+WINDOW = "window"
+
+_EPS = 1e-9
+_QUANT = {p: Decimal(1).scaleb(-p) for p in range(0, 7)}
+
+
+def dec(x, places: int = 2) -> Decimal:
+    """float -> Decimal rounded half-up at `places` (None/NaN -> 0)."""
+    if x is None:
+        return _QUANT[places] * 0
+    f = float(x)
+    if f != f:
+        f = 0.0
+    return Decimal(repr(f)).quantize(_QUANT[places], rounding=ROUND_HALF_UP)
+
+
+def money(x) -> Decimal:
+    return dec(x, 2)
+
+
+class TierTable:
+    """k tiers: start/width per unit of scale (inf width = open), rate, reduction."""
+
+    __slots__ = ("starts", "widths", "rates", "reductions", "labels", "k")
+
+    def __init__(self, widths, rates, reductions=None, starts=None, labels=None):
+        self.widths = np.asarray([np.inf if w is None else float(w) for w in widths], dtype=np.float64)
+        self.k = len(self.widths)
+        self.rates = np.asarray([float(r or 0.0) for r in rates], dtype=np.float64)
+        if reductions is None:
+            self.reductions = np.ones(self.k)
+        else:
+            self.reductions = np.asarray([1.0 if f is None else float(f) for f in reductions], dtype=np.float64)
+        if starts is None:
+            self.starts = np.zeros(self.k)
+        else:
+            self.starts = np.asarray([float(s or 0.0) for s in starts], dtype=np.float64)
+        self.labels = list(labels) if labels is not None else [None] * self.k
+        # negative widths (end < start) allocate nothing
+        np.maximum(self.widths, 0.0, out=self.widths)
+
+
+class TierLine(NamedTuple):
+    tier: int            # 0..k-1, or k for the overflow line
+    qty: Decimal         # allocated kL
+    billed: Decimal      # qty x reduction
+    rate: float
+    reduction: float
+    amount: Decimal
+
+
+class Allocation:
+    """Result of allocate(): (n, k) float arrays plus an (n,) overflow column."""
+
+    __slots__ = ("table", "qty", "billed", "amount", "over_qty", "over_billed", "over_amount")
+
+    def __init__(self, table, qty, billed, amount, over_qty, over_billed, over_amount):
+        self.table = table
+        self.qty, self.billed, self.amount = qty, billed, amount
+        self.over_qty, self.over_billed, self.over_amount = over_qty, over_billed, over_amount
+
+    def __len__(self):
+        return self.qty.shape[0]
+
+    def totals(self, overflow: bool = True) -> np.ndarray:
+        """Unrounded amount per meter."""
+        t = self.amount.sum(axis=1)
+        return t + self.over_amount if overflow else t
+
+    def lines(self, i: int, qty_places: int = 3, money_places: int = 2,
+              overflow: bool = True) -> list[TierLine]:
+        """All k tier lines of meter i (zeros included), plus the overflow line if any."""
+        tb = self.table
+        out = [
+            TierLine(j, dec(self.qty[i, j], qty_places), dec(self.billed[i, j], qty_places),
+                     float(tb.rates[j]), float(tb.reductions[j]), dec(self.amount[i, j], money_places))
+            for j in range(tb.k)
+        ]
+        if overflow and tb.k and self.over_qty[i] > _EPS:
+            j = tb.k - 1
+            out.append(TierLine(tb.k, dec(self.over_qty[i], qty_places), dec(self.over_billed[i], qty_places),
+                                float(tb.rates[j]), float(tb.reductions[j]),
+                                dec(self.over_amount[i], money_places)))
+        return out
+
+
+def allocate(cons_kl, days, table: TierTable, *, mode: str = STACKED, per_day: bool = True,
+             reduce: bool = False) -> Allocation:
+    """
+    Allocate consumption of n meters over `table`.
+
+    cons_kl, days: scalars or length-n sequences (days < 1 count as 1 for L/day tables).
+    reduce: apply the table's reduction factors to billed kL (sanitation).
+    """
+    cons = np.atleast_1d(np.asarray(cons_kl, dtype=np.float64))
+    cons = np.nan_to_num(np.maximum(cons, 0.0))
+    n = cons.shape[0]
+    if per_day:
+        d = np.broadcast_to(np.atleast_1d(np.asarray(days, dtype=np.float64)), (n,))
+        scale = np.maximum(np.nan_to_num(d), 1.0) / 1000.0
+    else:
+        scale = np.ones(n)
+
+    k = table.k
+    if k == 0:
+        z = np.zeros((n, 0))
+        return Allocation(table, z, z, z, cons.copy(), cons.copy(), np.zeros(n))
+
+    open_ = np.isinf(table.widths)
+    width = np.where(open_, np.inf, table.widths[None, :] * scale[:, None])
+    if mode == WINDOW:
+        lower = table.starts[None, :] * scale[:, None]
+    else:
+        finite = np.where(open_, 0.0, width)
+        lower = np.cumsum(finite, axis=1) - finite
+        # nothing reaches tiers after an open one
+        after_open = np.cumsum(open_) - open_ > 0
+        lower = np.where(after_open[None, :], np.inf, lower)
+
+    qty = np.minimum(np.maximum(cons[:, None] - lower, 0.0), width)
+    qty[qty < _EPS] = 0.0
+
+    if mode == WINDOW or open_.any():
+        over = np.zeros(n)
+    else:
+        over = np.maximum(cons - qty.sum(axis=1), 0.0)
+        over[over < _EPS] = 0.0
+
+    red = table.reductions if reduce else np.ones(k)
+    billed = qty * red[None, :]
+    amount = billed * table.rates[None, :]
+    over_billed = over * red[-1]
+    over_amount = over_billed * table.rates[-1]
+    return Allocation(table, qty, billed, amount, over, over_billed, over_amount)
+
+
+# ---- benchmark ---------------------------------------------------------------
+def _loop_reference(cons_kl, days, blocks):
+    """The per-meter loop allocate() replaced (builder's _split_kl_over_tiers)."""
+    days = max(1, int(days or 0))
+    rem_l = float(cons_kl or 0) * 1000.0
+    tiers, total = [], 0.0
+    for bstart, bend, rate in blocks:
+        cap = float("inf") if bend == 0 else bend * days
+        tier_cap = max(cap - bstart * days, 0.0)
+        take_l = min(rem_l, tier_cap)
+        if take_l < 1e-9:
+            tiers.append((0.0, 0.0))
+            continue
+        amt = take_l / 1000.0 * rate
+        total += amt
+        tiers.append((take_l / 1000.0, amt))
+        rem_l -= take_l
+    return tiers, total
+
+
+def benchmark(n: int = 10000, repeat: int = 5, seed: int = 7) -> dict:
+    """Time allocate() against the scalar loop on n random meters; checks they agree."""
+    rng = np.random.default_rng(seed)
+    cons = rng.integers(0, 120, size=n).astype(np.float64)
+    days = rng.integers(26, 35, size=n).astype(np.float64)
+    blocks = [(0.0, 200.0, 28.4), (200.0, 833.0, 41.7), (833.0, 1000.0, 66.1), (1000.0, 0.0, 89.9)]
+    table = TierTable([(b - a) if b else None for a, b, _ in blocks], [r for _, _, r in blocks])
+
+    best_loop = best_vec = float("inf")
+    for _ in range(max(1, repeat)):
+        t0 = time.perf_counter()
+        ref = [_loop_reference(c, d, blocks)[1] for c, d in zip(cons.tolist(), days.tolist())]
+        best_loop = min(best_loop, time.perf_counter() - t0)
+
+        t0 = time.perf_counter()
+        alloc = allocate(cons, days, table)
+        tot = alloc.totals()
+        best_vec = min(best_vec, time.perf_counter() - t0)
+
+    return {
+        "meters": n,
+        "loop_ms": round(best_loop * 1000, 3),
+        "kernel_ms": round(best_vec * 1000, 3),
+        "speedup": round(best_loop / best_vec, 1) if best_vec else None,
+        "max_abs_diff": float(np.max(np.abs(np.asarray(ref) - tot))) if n else 0.0,
+    }
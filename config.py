@@ -152,10 +152,54 @@ class Config:
 
     # ------------ Seeds ------------
     SEEDS_DIR = os.getenv("SEEDS_DIR")  # if set, overrides default
+    # rows per executemany / staging insert in bulk seed imports (app/admin/seed_bulk.py)
+    SEED_IMPORT_CHUNK = int(os.getenv("SEED_IMPORT_CHUNK", "1000"))
 
     # ------------ LOSS seed controls ------------
     LOSS_CSV = os.getenv("LOSS_CSV")
     LOSS_IMPORT_ON_BOOT = _to_bool(os.getenv("LOSS_IMPORT_ON_BOOT"), default=False)
+    # seconds between lca_scoring_map change checks (app/admin/loss/scoring_engine.py)
+    LOSS_SCORING_MAP_TTL = float(os.getenv("LOSS_SCORING_MAP_TTL", "60"))
+    # seconds between LOSS report content change checks (app/admin/loss/content_store.py)
+    LOSS_CONTENT_TTL = float(os.getenv("LOSS_CONTENT_TTL", "60"))
+    # keep rendered instruction/pause/explain card markup per card + language (app/subject_loss/sequence_store.py)
+    LOSS_CARD_FRAGMENT_CACHE = _to_bool(os.getenv("LOSS_CARD_FRAGMENT_CACHE"), default=False)
+    # seconds between reading lesson catalog change checks (app/subject_reading/lesson_state.py)
+    READING_CATALOG_TTL = float(os.getenv("READING_CATALOG_TTL", "60"))
+    # Cache-Control max-age for versioned lesson media URLs (app/subject_reading/media.py)
+    READING_MEDIA_MAX_AGE = int(os.getenv("READING_MEDIA_MAX_AGE", "31536000"))
+
+    # ------------ LOSS report PDF cache (app/utils/pdf_cache.py) ------------
+    LOSS_PDF_CACHE_DIR = os.getenv("LOSS_PDF_CACHE_DIR")            # default: <instance>/pdf_cache
+    LOSS_PDF_CACHE_MAX_MB = float(os.getenv("LOSS_PDF_CACHE_MAX_MB", "200"))
+    LOSS_PDF_TEMPLATE_VERSION = os.getenv("LOSS_PDF_TEMPLATE_VERSION", "")  # bump to invalidate
+
+    # ------------ PDF render pool (app/services/pdf_render_pool.py) ------------
+    PDF_RENDER_POOL = os.getenv("PDF_RENDER_POOL", "inprocess")     # inprocess | external | off
+    PDF_RENDER_WORKERS = int(os.getenv("PDF_RENDER_WORKERS", "2"))
+    PDF_RENDER_TIMEOUT = float(os.getenv("PDF_RENDER_TIMEOUT", "60"))  # seconds per job
+    PDF_RENDER_WAIT = float(os.getenv("PDF_RENDER_WAIT", "20"))        # admin email / PDF helpers (one wait, no inline retry)
+    PDF_RENDER_QUEUE_DIR = os.getenv("PDF_RENDER_QUEUE_DIR")        # default: <instance>/pdf_jobs
+
+    # ------------ Billing tariff index (app/utils/tariff_index.py) ------------
+    # seconds between bil_tariff change checks; ORM edits invalidate immediately
+    TARIFF_INDEX_TTL = float(os.getenv("TARIFF_INDEX_TTL", "30"))
+
+    # ------------ Site hit / visit logging (app/services/hit_buffer.py) ------------
+    HIT_BUFFER_ENABLED = _to_bool(os.getenv("HIT_BUFFER_ENABLED", "1"), default=True)
+    HIT_BUFFER_CAPACITY = int(os.getenv("HIT_BUFFER_CAPACITY", "10000"))
+    HIT_BUFFER_BATCH = int(os.getenv("HIT_BUFFER_BATCH", "500"))
+    HIT_BUFFER_INTERVAL = float(os.getenv("HIT_BUFFER_INTERVAL", "2.0"))
+
+    # ------------ Pricing snapshot (app/payments/price_snapshot.py) ------------
+    # seconds between pricing table change checks
+    PRICING_SNAPSHOT_TTL = float(os.getenv("PRICING_SNAPSHOT_TTL", "60"))
+
+    # ------------ FX rates (app/services/fx_rates.py) ------------
+    FX_PROVIDER = os.getenv("FX_PROVIDER", "exchangerate-api")          # or "static", or "module:attr"
+    FX_MAX_AGE_HOURS = float(os.getenv("FX_MAX_AGE_HOURS", "24"))       # older: served, refreshed in background
+    FX_CACHE_TTL = float(os.getenv("FX_CACHE_TTL", "300"))              # seconds between table re-reads
+    FX_REVALIDATE_COOLDOWN = float(os.getenv("FX_REVALIDATE_COOLDOWN", "600"))
 
     # ------------ Contact form / Mail (Zoho) ------------
     SMTP_HOST = os.getenv("SMTP_HOST", "smtp.zoho.com")
@@ -0,0 +1,141 @@
+"""
+seed_bulk against SQLite (the executemany upsert path) and PostgreSQL (the
+staged merge path).
+
+The PostgreSQL tests need a disposable database:
+    SEED_TEST_PG_URL=postgresql://... pytest tests/test_seed_bulk.py
+"""
+import io
+import os
+
+import pytest
+
+PG_URL = os.environ.get("SEED_TEST_PG_URL")
+
+needs_pg = pytest.mark.skipif(not PG_URL, reason="SEED_TEST_PG_URL not set")
+
+
+def _app(uri):
+    from flask import Flask
+
+    from app.extensions import db
+
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = uri
+    db.init_app(app)
+    return app
+
+
+@pytest.fixture()
+def sqlite_db():
+    from sqlalchemy import text
+
+    from app.extensions import db
+
+    with _app("sqlite://").app_context():
+        db.session.execute(text("CREATE TABLE seed_bulk_t (id INTEGER PRIMARY KEY, name TEXT)"))
+        db.session.execute(text("INSERT INTO seed_bulk_t (id, name) VALUES (1, 'a'), (2, 'b'), (3, 'c')"))
+        db.session.commit()
+        yield db
+        db.session.rollback()
+
+
+@pytest.fixture()
+def pg_db():
+    from sqlalchemy import text
+
+    from app.extensions import db
+
+    with _app(PG_URL).app_context():
+        db.session.execute(text("DROP TABLE IF EXISTS seed_bulk_t"))
+        db.session.execute(text("CREATE TABLE seed_bulk_t (id SERIAL PRIMARY KEY, name TEXT)"))
+        db.session.execute(text("INSERT INTO seed_bulk_t (id, name) VALUES (1, 'a'), (2, 'b'), (3, 'c')"))
+        db.session.execute(text("SELECT setval('seed_bulk_t_id_seq', 3)"))
+        db.session.commit()
+        yield db
+        db.session.rollback()
+        db.session.execute(text("DROP TABLE IF EXISTS seed_bulk_t"))
+        db.session.commit()
+
+
+def _spec():
+    from app.admin.seed_bulk import SeedSpec
+
+    return SeedSpec("seed_bulk_t", ("id", "name"), types={"id": "int"})
+
+
+def _names(db):
+    from sqlalchemy import text
+
+    return [tuple(r) for r in db.session.execute(text("SELECT id, name FROM seed_bulk_t ORDER BY id"))]
+
+
+def test_sqlite_dry_run_writes_nothing(sqlite_db):
+    from app.admin.seed_bulk import import_csv
+
+    stats = import_csv(_spec(), io.StringIO("id,name\n1,a2\n2,b\n4,d\n"), replace=True, dry_run=True)
+
+    assert (stats["inserted"], stats["updated"], stats["unchanged"], stats["deleted"]) == (1, 1, 1, 1)
+    assert _names(sqlite_db) == [(1, "a"), (2, "b"), (3, "c")]
+
+
+def test_sqlite_replace(sqlite_db):
+    from app.admin.seed_bulk import import_csv
+
+    stats = import_csv(_spec(), io.StringIO("id,name\n1,a2\n2,b\n4,d\n"), replace=True)
+
+    assert (stats["inserted"], stats["updated"], stats["unchanged"], stats["deleted"]) == (1, 1, 1, 1)
+    assert _names(sqlite_db) == [(1, "a2"), (2, "b"), (4, "d")]
+
+
+def test_sqlite_unchanged_rows_not_rewritten(sqlite_db):
+    from app.admin.seed_bulk import import_csv
+
+    stats = import_csv(_spec(), io.StringIO("id,name\n1,a\n2,b\n3,c\n"), replace=True)
+
+    assert stats["rows"] == stats["unchanged"] == 3
+    assert stats["inserted"] == stats["updated"] == stats["deleted"] == 0
+    assert _names(sqlite_db) == [(1, "a"), (2, "b"), (3, "c")]
+
+
+def test_sqlite_duplicate_keys_last_row_wins(sqlite_db):
+    from app.admin.seed_bulk import import_csv
+
+    # 1 repeats within a chunk, 4 across chunks; 2 ends up back at its stored value
+    csv_text = "id,name\n1,x\n1,a3\n2,b2\n4,d\n2,b\n4,d2\n"
+    stats = import_csv(_spec(), io.StringIO(csv_text), replace=True, chunk=3)
+
+    assert stats["rows"] == 6
+    assert stats["duplicates"] == 3
+    assert (stats["inserted"], stats["updated"], stats["unchanged"], stats["deleted"]) == (1, 1, 1, 1)
+    assert _names(sqlite_db) == [(1, "a3"), (2, "b"), (4, "d2")]
+
+
+@needs_pg
+def test_replace_keeps_unkeyed_rows(pg_db):
+    from sqlalchemy import text
+
+    from app.admin.seed_bulk import import_csv
+
+    csv_text = "id,name\n1,a2\n2,b\n,new1\n,new2\n"
+
+    stats = import_csv(_spec(), io.StringIO(csv_text), replace=True)
+
+    assert stats["inserted"] == 2
+    assert stats["updated"] == 1
+    assert stats["unchanged"] == 1
+    assert stats["deleted"] == 1
+    rows = pg_db.session.execute(text("SELECT id, name FROM seed_bulk_t ORDER BY id")).all()
+    assert [r.name for r in rows] == ["a2", "b", "new1", "new2"]
+    assert 3 not in [r.id for r in rows]
+
+
+@needs_pg
+def test_duplicate_keys_staged_once(pg_db):
+    from app.admin.seed_bulk import import_csv
+
+    csv_text = "id,name\n1,x\n1,a3\n2,b2\n4,d\n2,b\n4,d2\n"
+    stats = import_csv(_spec(), io.StringIO(csv_text), replace=True, chunk=3)
+
+    assert stats["duplicates"] == 3
+    assert _names(pg_db) == [(1, "a3"), (2, "b"), (4, "d2")]